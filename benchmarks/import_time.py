@@ -0,0 +1,101 @@
+"""
+Cold-import budget for the Function entry points.
+
+Each module is imported in a fresh interpreter with ``python -X importtime``. The check fails when the
+median cumulative import time exceeds the module's budget, or when a module pulls in a package that
+should only be loaded on another code path:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 9 --top 15 --scale 1.5
+
+Budgets are wall-clock and depend on the machine; --scale loosens or tightens all of them at once.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median cumulative import time allowed per module, in milliseconds
+BUDGETS_MS = {
+    "main": 300,
+    "workflow.azure_workflow": 580,
+}
+
+# Packages a module must not load at import time
+FORBIDDEN_IMPORTS = {
+    "main": [
+        "workflow.azure_workflow", "workflow.async_azure_workflow", "azure.storage.blob", "azure.identity",
+        "azure.mgmt.resource", "azure.mgmt.resourcegraph", "transitions",
+    ],
+    "workflow.azure_workflow": [
+        "utils.async_azure_blob_client", "azure.storage.blob.aio", "azure.storage.queue", "azure.identity",
+        "azure.mgmt.resource", "transitions.extensions.asyncio", "pyarrow", "zstandard",
+    ],
+}
+
+
+def measure(module):
+    """
+    Import module in a fresh interpreter.
+    :return: (cumulative microseconds per imported module, in import order).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def check(module, runs, top, scale):
+    """
+    :return: List of failure messages for the module.
+    """
+    samples = [measure(module) for _ in range(runs)]
+    median_ms = statistics.median(sample[module] for sample in samples) / 1000
+    budget_ms = BUDGETS_MS[module] * scale
+    print(f"{module}: median {median_ms:.1f} ms over {runs} runs (budget {budget_ms:.0f} ms)")
+
+    slowest = sorted(samples[-1].items(), key=lambda item: item[1], reverse=True)
+    for name, cumulative in slowest[1:top + 1]:
+        print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if median_ms > budget_ms:
+        failures.append(f"{module} takes {median_ms:.1f} ms to import, over its {budget_ms:.0f} ms budget")
+    loaded = [name for name in FORBIDDEN_IMPORTS.get(module, []) if name in samples[-1]]
+    if loaded:
+        failures.append(f"{module} imports {', '.join(loaded)} at import time")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS_MS), help="Modules to check (default: all budgeted)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per module")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier applied to every budget")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        if module not in BUDGETS_MS:
+            parser.error(f"No import budget for {module}")
+        failures.extend(check(module, args.runs, args.top, args.scale))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,561 @@
+"""
+In-memory stand-ins for the Azure SDK clients used by the workflow, for offline benchmarks.
+
+SimulatedTenant holds N subscriptions of M synthetic resources and a resourcechanges log.
+SimulatedResourceGraphClient, SimulatedSubscriptionClient and SimulatedBlobServiceClient expose the
+subset of the SDK surface the workflow calls, with configurable latency, throttling and a
+service-side request quota. The AsyncSimulated* adapters expose the same state through the aio
+surface AsyncAzureWorkflow calls.
+"""
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+RESOURCE_TYPES = [
+    "microsoft.compute/virtualmachines",
+    "microsoft.network/networkinterfaces",
+    "microsoft.network/virtualnetworks",
+    "microsoft.storage/storageaccounts",
+    "microsoft.keyvault/vaults",
+    "microsoft.web/sites",
+]
+LOCATIONS = ["eastus", "westeurope", "southeastasia", "uksouth"]
+
+
+def _simulated_latency(mean_ms, rng):
+    """
+    Lognormal service time with the given mean, so a few requests take much longer than the rest.
+    """
+    if mean_ms <= 0:
+        return 0
+    sigma = 0.5
+    return rng.lognormvariate(math.log(mean_ms / 1000) - sigma ** 2 / 2, sigma)
+
+
+class SimulatedTenant:
+    """
+    Synthetic estate of subscription_count subscriptions with resources_per_subscription resources each.
+    """
+    def __init__(self, subscription_count=10, resources_per_subscription=1000, seed=0):
+        self.rng = random.Random(seed)
+        self.subscription_ids = [str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+                                 for _ in range(subscription_count)]
+        self.resources = {}
+        self.changes = []
+        # Bumped on every mutation so query results can be cached per version
+        self.version = 0
+        self._by_subscription = {subscription_id: {} for subscription_id in self.subscription_ids}
+        self._lock = threading.Lock()
+        for subscription_id in self.subscription_ids:
+            for _ in range(resources_per_subscription):
+                self._add(self._new_resource(subscription_id))
+
+    def _add(self, resource):
+        key = resource["id"].lower()
+        self.resources[key] = resource
+        self._by_subscription[resource["subscriptionId"]][key] = resource
+
+    def _remove(self, key):
+        resource = self.resources.pop(key)
+        del self._by_subscription[resource["subscriptionId"]][key]
+        return resource
+
+    def _new_resource(self, subscription_id):
+        resource_type = self.rng.choice(RESOURCE_TYPES)
+        resource_group = f"rg-{self.rng.randrange(20):02d}"
+        name = f"{resource_type.rsplit('/', 1)[1][:-1]}-{uuid.UUID(int=self.rng.getrandbits(128)).hex[:12]}"
+        provider, kind = resource_type.split("/")
+        return {
+            "id": f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/{provider}/{kind}/{name}",
+            "name": name,
+            "type": resource_type,
+            "tenantId": "00000000-0000-0000-0000-000000000000",
+            "kind": "",
+            "location": self.rng.choice(LOCATIONS),
+            "resourceGroup": resource_group,
+            "subscriptionId": subscription_id,
+            "managedBy": "",
+            "sku": {"name": self.rng.choice(["Standard", "Premium", "Basic"])},
+            "tags": {"env": self.rng.choice(["dev", "test", "prod"]), "owner": f"team-{self.rng.randrange(8)}"},
+            "properties": {
+                "provisioningState": "Succeeded",
+                "createdTime": datetime.utcnow().isoformat(),
+                "settings": {f"setting{i}": self.rng.randrange(1000) for i in range(8)},
+                "ipConfigurations": [{"name": f"ipconfig{i}", "privateIPAddress": f"10.0.{i}.{self.rng.randrange(255)}"}
+                                     for i in range(2)],
+            },
+        }
+
+    def subscription_resources(self, subscription_ids):
+        return [resource for subscription_id in subscription_ids
+                for resource in self._by_subscription.get(subscription_id, {}).values()]
+
+    def mutate(self, fraction, update_share=0.8, delete_share=0.1):
+        """
+        Change roughly fraction of the estate: mostly property updates, some deletes and as many creates.
+        :return: Number of change records added.
+        """
+        with self._lock:
+            count = int(len(self.resources) * fraction)
+            targets = self.rng.sample(sorted(self.resources), min(count, len(self.resources)))
+            timestamp = datetime.utcnow().isoformat() + "Z"
+            self.version += 1
+            added = 0
+            for key in targets:
+                resource = self.resources[key]
+                roll = self.rng.random()
+                if roll < update_share:
+                    setting = f"setting{self.rng.randrange(8)}"
+                    value = self.rng.randrange(1000)
+                    resource["properties"]["settings"][setting] = value
+                    self._record(resource, "Update", timestamp,
+                                 {f"properties.settings.{setting}": {"propertyChangeType": "Update", "newValue": value}})
+                elif roll < update_share + delete_share:
+                    self._record(self._remove(key), "Delete", timestamp)
+                else:
+                    created = self._new_resource(resource["subscriptionId"])
+                    self._add(created)
+                    self._record(created, "Create", timestamp)
+                added += 1
+            return added
+
+    def _record(self, resource, change_type, timestamp, changes=None):
+        self.changes.append({
+            "id": f"{resource['id']}/providers/Microsoft.Resources/changes/{uuid.uuid4()}",
+            "name": str(uuid.uuid4()),
+            "type": "microsoft.resources/changes",
+            "subscriptionId": resource["subscriptionId"],
+            "resourceGroup": resource["resourceGroup"],
+            "properties": {
+                "targetResourceId": resource["id"],
+                "targetResourceType": resource["type"],
+                "changeType": change_type,
+                "changeAttributes": {"timestamp": timestamp},
+                "changes": changes or {},
+            },
+        })
+
+    def subscription_changes(self, subscription_ids, since):
+        wanted = set(subscription_ids)
+        since = since.isoformat()
+        return [change for change in self.changes
+                if change["subscriptionId"] in wanted and change["properties"]["changeAttributes"]["timestamp"] > since]
+
+
+class SimulatedResourceGraphClient:
+    """
+    Answers the resources, resourcechanges and `resources | where id in~ (...)` queries sent by
+    AzureSubscriptionClient. Requests pass through the pipeline policies the real client would be built
+    with (the shared rate limiter), then wait for a simulated service time. A request fails with 429 when
+    the service quota for the window is used up, or at random with throttle_rate.
+    failing_subscriptions maps subscription ids to the number of requests still answered for them; once
+    it reaches zero, every request that includes the subscription fails with 403 Forbidden.
+    """
+    def __init__(self, tenant, latency_ms=150, throttle_rate=0.0, retry_after_seconds=1,
+                 quota_per_window=None, quota_window_seconds=5, per_retry_policies=None, seed=0, **kwargs):
+        self.tenant = tenant
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.quota_per_window = quota_per_window
+        self.quota_window_seconds = quota_window_seconds
+        self.policies = per_retry_policies or []
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "throttled": 0}
+        self.failing_subscriptions = {}
+        self._results = {}
+        self._window_started = time.monotonic()
+        self._window_requests = 0
+        self._lock = threading.Lock()
+
+    def resources(self, query_request):
+        for policy in self.policies:
+            policy.on_request(None)
+        with self._lock:
+            self.stats["requests"] += 1
+            status, headers = self._admit()
+            delay = _simulated_latency(self.latency_ms, self.rng)
+        time.sleep(delay)
+        response = SimpleNamespace(status_code=status, reason="Too Many Requests" if status == 429 else "OK",
+                                   headers=headers)
+        for policy in self.policies:
+            policy.on_response(None, SimpleNamespace(http_response=response))
+        if status == 429:
+            raise HttpResponseError(message="Too Many Requests", response=response)
+        self._check_failing(query_request.subscriptions)
+        return self._execute(query_request)
+
+    def _check_failing(self, subscription_ids):
+        with self._lock:
+            for subscription_id in subscription_ids:
+                if subscription_id not in self.failing_subscriptions:
+                    continue
+                if self.failing_subscriptions[subscription_id] <= 0:
+                    response = SimpleNamespace(status_code=403, reason="Forbidden", headers={})
+                    raise HttpResponseError(message=f"Subscription {subscription_id} is not accessible",
+                                            response=response)
+                self.failing_subscriptions[subscription_id] -= 1
+
+    def _admit(self):
+        """
+        Apply the simulated service quota and random throttling.
+        :return: (status code, response headers).
+        """
+        now = time.monotonic()
+        if now - self._window_started >= self.quota_window_seconds:
+            self._window_started, self._window_requests = now, 0
+        resets_after = self.quota_window_seconds - (now - self._window_started)
+        headers = {}
+        if self.quota_per_window is not None:
+            if self._window_requests >= self.quota_per_window:
+                self.stats["throttled"] += 1
+                return 429, {"Retry-After": str(math.ceil(resets_after))}
+            self._window_requests += 1
+            headers = {
+                "x-ms-user-quota-remaining": str(self.quota_per_window - self._window_requests),
+                "x-ms-user-quota-resets-after": time.strftime("%H:%M:%S", time.gmtime(resets_after)),
+            }
+        if self.rng.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return 429, {"Retry-After": str(self.retry_after_seconds)}
+        return 200, headers
+
+    def _execute(self, query_request):
+        options = query_request.options or {}
+        if "$skipToken" in options:
+            position = json.loads(base64.b64decode(options["$skipToken"]))
+            offset, top = position["offset"], position["top"]
+        else:
+            offset, top = 0, options.get("$top", 1000)
+
+        # The service pages through a consistent result set; compute it once per query and tenant version
+        key = (query_request.query, tuple(query_request.subscriptions), self.tenant.version)
+        with self._lock:
+            rows = self._results.get(key)
+        if rows is None:
+            rows = self._rows(query_request.query, query_request.subscriptions)
+            with self._lock:
+                self._results[key] = rows
+        page = rows[offset:offset + top]
+        skip_token = None
+        if offset + top < len(rows):
+            skip_token = base64.b64encode(json.dumps({"offset": offset + top, "top": top}).encode()).decode()
+        return SimpleNamespace(data=page, skip_token=skip_token, total_records=len(rows), count=len(page))
+
+    def _rows(self, query, subscription_ids):
+        if query == "resources":
+            return self.tenant.subscription_resources(subscription_ids)
+        if query.startswith("resources |") and "id in~" not in query:
+            return self._snapshot_rows(query, self.tenant.subscription_resources(subscription_ids))
+        match = re.search(r"ago\((\d+(?:\.\d+)?)h\)", query)
+        if query.startswith("resourcechanges") and match:
+            since = datetime.utcnow() - timedelta(hours=float(match.group(1)))
+            return self.tenant.subscription_changes(subscription_ids, since)
+        match = re.search(r"id in~ \((.*)\)", query)
+        if match:
+            ids = json.loads(f"[{match.group(1)}]")
+            return [self.tenant.resources[resource_id.lower()] for resource_id in ids
+                    if resource_id.lower() in self.tenant.resources]
+        raise HttpResponseError(message=f"Unsupported simulated query: {query[:80]}")
+
+    @staticmethod
+    def _snapshot_rows(query, resources):
+        """
+        Partition and summarize queries of AzureSubscriptionClient.get_resources_snapshot_partitioned.
+        hash() is simulated with CRC-32, which is stable like the service's hash but not the same values.
+        """
+        match = re.fullmatch(r"resources \| summarize records = count\(\) by (\w+)", query)
+        if match:
+            counts = {}
+            for resource in resources:
+                counts[resource[match.group(1)]] = counts.get(resource[match.group(1)], 0) + 1
+            return [{match.group(1): group, "records": count} for group, count in counts.items()]
+        match = re.fullmatch(r"resources \| where hash\(tolower\(id\), (\d+)\) == (\d+)", query)
+        if match:
+            partitions, partition = int(match.group(1)), int(match.group(2))
+            return [resource for resource in resources
+                    if zlib.crc32(resource["id"].lower().encode("utf-8")) % partitions == partition]
+        match = re.fullmatch(r"resources \| where (\w+) (!?in~) \((.*)\)", query)
+        if match:
+            column, operator = match.group(1), match.group(2)
+            groups = {group.lower() for group in json.loads(f"[{match.group(3)}]")}
+            return [resource for resource in resources if (resource[column].lower() in groups) == (operator == "in~")]
+        raise HttpResponseError(message=f"Unsupported simulated query: {query[:80]}")
+
+
+class SimulatedSubscriptionClient:
+    def __init__(self, tenant):
+        self.subscriptions = SimpleNamespace(list=lambda: [
+            SimpleNamespace(as_dict=lambda subscription_id=subscription_id: {
+                "id": f"/subscriptions/{subscription_id}",
+                "subscription_id": subscription_id,
+                "display_name": f"Subscription {subscription_id[:8]}",
+                "state": "Enabled",
+            })
+            for subscription_id in tenant.subscription_ids
+        ])
+
+
+class _SimulatedDownloader:
+    def __init__(self, data, blob):
+        self.data = data
+        self.size = len(data)
+        self.properties = SimpleNamespace(etag=blob["etag"], size=len(data), metadata=dict(blob["metadata"]),
+                                          content_settings=blob["content_settings"], last_modified=blob["last_modified"])
+
+    def readall(self):
+        return self.data
+
+    def chunks(self, chunk_size=4 * 1024 * 1024):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+class SimulatedBlobClient:
+    def __init__(self, service, path):
+        self.service = service
+        self.path = path
+        self.blob_name = path.rsplit("/", 1)[-1]
+
+    def exists(self):
+        return self.path in self.service.blobs
+
+    def download_blob(self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        blob = self.service.request("download", self.path)
+        if blob is None:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {self.path}")
+        if match_condition == MatchConditions.IfModified and etag == blob["etag"]:
+            error = HttpResponseError(message="Not Modified")
+            error.status_code = 304
+            raise error
+        data = blob["data"]
+        if offset is not None:
+            data = data[offset:offset + length if length is not None else None]
+        return _SimulatedDownloader(data, blob)
+
+    def get_blob_properties(self, **kwargs):
+        blob = self.service.request("properties", self.path)
+        if blob is None:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {self.path}")
+        return _SimulatedDownloader(blob["data"], blob).properties
+
+    def upload_blob(self, data, overwrite=False, etag=None, match_condition=None, metadata=None,
+                    content_settings=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif hasattr(data, "read"):
+            data = data.read()
+        elif not isinstance(data, (bytes, bytearray)):
+            data = b"".join(data)
+        blob = {"data": bytes(data), "etag": f'"{uuid.uuid4().hex}"', "metadata": dict(metadata or {}),
+                "content_settings": content_settings or SimpleNamespace(content_type=None, content_encoding=None),
+                "last_modified": datetime.utcnow()}
+        with self.service.lock:
+            current = self.service.blobs.get(self.path)
+            if match_condition == MatchConditions.IfNotModified and (current is None or current["etag"] != etag):
+                raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+            if current is not None and (match_condition == MatchConditions.IfMissing or
+                                        (not overwrite and match_condition is None)):
+                raise ResourceExistsError("The specified blob already exists.")
+            self.service.blobs[self.path] = blob
+        self.service.request("upload", self.path, len(blob["data"]))
+        return {"etag": blob["etag"], "last_modified": blob["last_modified"]}
+
+    def set_blob_metadata(self, metadata=None, **kwargs):
+        with self.service.lock:
+            blob = self.service.blobs.get(self.path)
+            if blob is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.path}")
+            blob["metadata"] = dict(metadata or {})
+        self.service.request("metadata", self.path)
+        return {"etag": blob["etag"]}
+
+    def delete_blob(self, etag=None, match_condition=None, **kwargs):
+        with self.service.lock:
+            current = self.service.blobs.get(self.path)
+            if current is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.path}")
+            if match_condition == MatchConditions.IfNotModified and current["etag"] != etag:
+                raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+            del self.service.blobs[self.path]
+        self.service.request("delete", self.path)
+
+
+def _check_container_name(container_name):
+    # Blob operations accept "container/folder" paths, as the blob name then carries the folder; container
+    # operations do not, and the service rejects them
+    if "/" in container_name:
+        error = HttpResponseError(message=f"The specified resource name contains invalid characters: {container_name}")
+        error.status_code = 400
+        raise error
+
+
+class SimulatedContainerClient:
+    def __init__(self, service, container_name):
+        self.service = service
+        self.container_name = container_name
+
+    def exists(self):
+        _check_container_name(self.container_name)
+        return True
+
+    def get_blob_client(self, blob):
+        return SimulatedBlobClient(self.service, f"{self.container_name}/{blob}")
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        _check_container_name(self.container_name)
+        self.service.request("list", self.container_name)
+        prefix = f"{self.container_name}/{name_starts_with or ''}"
+        with self.service.lock:
+            matches = sorted((path, blob) for path, blob in self.service.blobs.items() if path.startswith(prefix))
+        for path, blob in matches:
+            yield SimpleNamespace(name=path[len(self.container_name) + 1:], size=len(blob["data"]), etag=blob["etag"],
+                                  metadata=dict(blob["metadata"]), last_modified=blob["last_modified"])
+
+    def delete_blob(self, blob, **kwargs):
+        self.get_blob_client(blob).delete_blob(**kwargs)
+
+
+class SimulatedBlobServiceClient:
+    """
+    Blob storage kept in a dictionary of "container/path" to blob. Blob operations accept containers
+    followed by virtual folders, as the workflow's container names are; container operations such as
+    listing reject them, like the service. Every operation waits latency_ms, plus the transfer
+    time at throughput_mb_per_sec for uploads and downloads when set.
+    """
+    def __init__(self, latency_ms=10, throughput_mb_per_sec=None, seed=0):
+        self.latency_ms = latency_ms
+        self.throughput_mb_per_sec = throughput_mb_per_sec
+        self.blobs = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "bytes_uploaded": 0}
+
+    def request(self, operation, path, uploaded_bytes=0):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_uploaded"] += uploaded_bytes
+            self.stats[operation] = self.stats.get(operation, 0) + 1
+            delay = _simulated_latency(self.latency_ms, self.rng)
+            blob = self.blobs.get(path)
+        transferred = uploaded_bytes or (len(blob["data"]) if operation == "download" and blob else 0)
+        if self.throughput_mb_per_sec and transferred:
+            delay += transferred / (self.throughput_mb_per_sec * 1024 * 1024)
+        time.sleep(delay)
+        return blob
+
+    def get_container_client(self, container):
+        return SimulatedContainerClient(self, container)
+
+    def get_blob_client(self, container, blob):
+        return SimulatedBlobClient(self, f"{container}/{blob}")
+
+    def create_container(self, container, **kwargs):
+        _check_container_name(container)
+        return self.get_container_client(container)
+
+    def stored_bytes(self):
+        with self.lock:
+            return sum(len(blob["data"]) for blob in self.blobs.values())
+
+
+class AsyncSimulatedResourceGraphClient:
+    """
+    aio surface over a SimulatedResourceGraphClient. Simulated latency blocks the event loop, so use latency_ms=0.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    async def resources(self, query_request):
+        return self.client.resources(query_request)
+
+    async def close(self):
+        pass
+
+
+class AsyncSimulatedSubscriptionClient:
+    def __init__(self, tenant):
+        subscriptions = SimulatedSubscriptionClient(tenant).subscriptions
+
+        async def list_subscriptions():
+            for subscription in subscriptions.list():
+                yield subscription
+
+        self.subscriptions = SimpleNamespace(list=list_subscriptions)
+
+    async def close(self):
+        pass
+
+
+class _AsyncSimulatedDownloader:
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.size = downloader.size
+        self.properties = downloader.properties
+
+    async def readall(self):
+        return self.downloader.readall()
+
+
+class _AsyncSimulatedBlobClient:
+    def __init__(self, blob_client):
+        self.blob_client = blob_client
+
+    async def exists(self):
+        return self.blob_client.exists()
+
+    async def download_blob(self, **kwargs):
+        return _AsyncSimulatedDownloader(self.blob_client.download_blob(**kwargs))
+
+    async def get_blob_properties(self, **kwargs):
+        return self.blob_client.get_blob_properties(**kwargs)
+
+    async def upload_blob(self, data, **kwargs):
+        return self.blob_client.upload_blob(data, **kwargs)
+
+    async def delete_blob(self, **kwargs):
+        self.blob_client.delete_blob(**kwargs)
+
+
+class _AsyncSimulatedContainerClient:
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self.container_name = container_client.container_name
+
+    async def exists(self):
+        return self.container_client.exists()
+
+    def get_blob_client(self, blob):
+        return _AsyncSimulatedBlobClient(self.container_client.get_blob_client(blob))
+
+
+class AsyncSimulatedBlobServiceClient:
+    """
+    aio surface over a SimulatedBlobServiceClient, sharing its blobs with the sync clients of the same service.
+    Simulated latency blocks the event loop, so use latency_ms=0.
+    """
+    def __init__(self, service):
+        self.service = service
+
+    def get_container_client(self, container):
+        return _AsyncSimulatedContainerClient(self.service.get_container_client(container))
+
+    def get_blob_client(self, container, blob):
+        return _AsyncSimulatedBlobClient(self.service.get_blob_client(container, blob))
+
+    async def create_container(self, container, **kwargs):
+        return self.get_container_client(self.service.create_container(container).container_name)
+
+    async def close(self):
+        pass
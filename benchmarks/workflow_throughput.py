@@ -0,0 +1,251 @@
+"""
+Offline throughput benchmark for AzureWorkflow.
+
+Runs a full scan of a synthetic tenant, changes part of the estate, then runs incremental passes, all
+against the simulated clients in benchmarks/simulated_azure.py. Reports pages/sec, resources/sec,
+p50/p99 latency of Resource Graph calls (including rate limiting and retries) and of page writes
+(merge and upload), and the peak RSS of the process after each phase:
+
+    python benchmarks/workflow_throughput.py
+    python benchmarks/workflow_throughput.py --subscriptions 50 --resources 2000 --rg-latency-ms 200 \\
+        --throttle-rate 0.02 --change-fraction 0.05 --set storage_layout='"indexed"' --json results.json
+    python benchmarks/workflow_throughput.py --compare results.json --tolerance 0.2
+
+Settings from config/settings.json apply unless overridden with --set key=<json value>. The client-side
+rate limiter is off by default; --set rate_limit='{"enabled": true}' makes it pace the simulated Resource
+Graph like the real one.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile; None for no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Recorder:
+    """
+    Wraps the query and page-write methods of the workflow to time them and count pages and rows.
+    """
+    def __init__(self):
+        self.query_seconds = []
+        self.write_seconds = []
+        self.pages = 0
+        self.rows = 0
+
+    def reset(self):
+        self.__init__()
+
+    def install(self, subscription_client_class, workflow_class):
+        recorder = self
+        query = subscription_client_class._query_resources
+        write = workflow_class._write_resource_page
+
+        def timed_query(client, query_request):
+            started = time.perf_counter()
+            result = query(client, query_request)
+            recorder.query_seconds.append(time.perf_counter() - started)
+            recorder.pages += 1
+            recorder.rows += len(result.data)
+            return result
+
+        def timed_write(workflow, *args, **kwargs):
+            started = time.perf_counter()
+            write(workflow, *args, **kwargs)
+            recorder.write_seconds.append(time.perf_counter() - started)
+
+        subscription_client_class._query_resources = timed_query
+        workflow_class._write_resource_page = timed_write
+
+
+def run_phase(name, workflow_class, recorder, resource_graph_client, blob_service):
+    recorder.reset()
+    graph_requests, throttled = resource_graph_client.stats["requests"], resource_graph_client.stats["throttled"]
+    blob_requests, uploaded = blob_service.stats["requests"], blob_service.stats["bytes_uploaded"]
+
+    started = time.perf_counter()
+    error = None
+    workflow = None
+    try:
+        workflow = workflow_class()
+        workflow.on_start()
+    except Exception as e:
+        error = str(e)
+    elapsed = time.perf_counter() - started
+
+    def latency(seconds):
+        return {"p50": _ms(percentile(seconds, 50)), "p99": _ms(percentile(seconds, 99))}
+
+    return {
+        "phase": name,
+        "error": error,
+        "wall_seconds": round(elapsed, 3),
+        "pages": recorder.pages,
+        "resources": recorder.rows,
+        "pages_per_second": round(recorder.pages / elapsed, 2),
+        "resources_per_second": round(recorder.rows / elapsed, 2),
+        "query_latency_ms": latency(recorder.query_seconds),
+        "page_write_latency_ms": latency(recorder.write_seconds),
+        "graph_requests": resource_graph_client.stats["requests"] - graph_requests,
+        "throttled_requests": resource_graph_client.stats["throttled"] - throttled,
+        "blob_requests": blob_service.stats["requests"] - blob_requests,
+        "bytes_uploaded": blob_service.stats["bytes_uploaded"] - uploaded,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        # Per-stage spans and counters from shared.metrics, when metrics are enabled
+        "metrics": workflow.run_summary if workflow is not None else {},
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _latency_pair(latency):
+    return f"{latency['p50']}/{latency['p99']}"
+
+
+def print_report(results):
+    print(f"{'phase':<14}{'wall s':>9}{'pages':>8}{'pages/s':>10}{'res/s':>11}{'query p50/p99 ms':>20}"
+          f"{'write p50/p99 ms':>20}{'429s':>7}{'blob ops':>10}{'RSS MB':>9}")
+    for result in results:
+        query = _latency_pair(result["query_latency_ms"])
+        write = _latency_pair(result["page_write_latency_ms"])
+        print(f"{result['phase']:<14}{result['wall_seconds']:>9.2f}{result['pages']:>8}{result['pages_per_second']:>10.1f}"
+              f"{result['resources_per_second']:>11.1f}{query:>20}{write:>20}"
+              f"{result['throttled_requests']:>7}{result['blob_requests']:>10}{result['peak_rss_mb']:>9.1f}")
+        if result["error"]:
+            print(f"    failed: {result['error']}")
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    :return: Failure messages for phases whose resources/sec dropped by more than tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = {result["phase"]: result for result in json.load(f)["results"]}
+    failures = []
+    for result in results:
+        previous = baseline.get(result["phase"])
+        if previous is None or not previous["resources_per_second"]:
+            continue
+        ratio = result["resources_per_second"] / previous["resources_per_second"]
+        print(f"{result['phase']}: {ratio:.2f}x baseline resources/sec")
+        if ratio < 1 - tolerance:
+            failures.append(f"{result['phase']} throughput dropped to {ratio:.2f}x of {baseline_path}")
+    return failures
+
+
+def parse_setting(value):
+    key, _, raw = value.partition("=")
+    if not key or not raw:
+        raise argparse.ArgumentTypeError(f"Expected key=<json value>, got {value}")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        # Bare strings are accepted without JSON quotes
+        return key, raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=20)
+    parser.add_argument("--resources", type=int, default=2000, help="Resources per subscription")
+    parser.add_argument("--page-size", type=int, default=1000, help="records_per_page for the run")
+    parser.add_argument("--rg-latency-ms", type=float, default=150, help="Mean Resource Graph service time")
+    parser.add_argument("--blob-latency-ms", type=float, default=10, help="Mean blob request time")
+    parser.add_argument("--blob-throughput-mb", type=float, default=None, help="Blob transfer rate per request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of Resource Graph calls failing with 429")
+    parser.add_argument("--quota", type=int, default=None, help="Service-side Resource Graph requests per quota window")
+    parser.add_argument("--quota-window", type=float, default=5, help="Quota window in seconds")
+    parser.add_argument("--change-fraction", type=float, default=0.02, help="Share of resources changed before each incremental run")
+    parser.add_argument("--incremental-runs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", dest="settings", type=parse_setting, action="append", default=[],
+                        help="Override a settings.json key, e.g. --set max_concurrent_subscriptions=8")
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file")
+    parser.add_argument("--compare", help="Fail when resources/sec drops below a saved --json result")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative drop for --compare")
+    args = parser.parse_args()
+
+    # The loggers read their level when the modules are imported
+    os.environ["LOGGING_LEVEL"] = args.log_level
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(REPO_ROOT)
+
+    from benchmarks.simulated_azure import (SimulatedBlobServiceClient, SimulatedResourceGraphClient,
+                                            SimulatedSubscriptionClient, SimulatedTenant)
+    from config.config import AzureConfig
+    from shared.rate_limiter import rate_limited_client_kwargs
+    from shared.resource_registry import ResourceRegistry
+    from utils.azure_blob_service import AzureBlobService
+    from utils.azure_subscription_client import AzureSubscriptionClient
+    from workflow.azure_workflow import AzureWorkflow
+
+    config = AzureConfig().get_config()
+    config.update({"records_per_page": args.page_size, "distributed": {"enabled": False}})
+    config.update(dict(args.settings))
+
+    tenant = SimulatedTenant(args.subscriptions, args.resources, seed=args.seed)
+    resource_graph_client = SimulatedResourceGraphClient(
+        tenant, latency_ms=args.rg_latency_ms, throttle_rate=args.throttle_rate, quota_per_window=args.quota,
+        quota_window_seconds=args.quota_window, seed=args.seed, **rate_limited_client_kwargs())
+    blob_service = SimulatedBlobServiceClient(latency_ms=args.blob_latency_ms,
+                                              throughput_mb_per_sec=args.blob_throughput_mb, seed=args.seed)
+
+    registry = ResourceRegistry.get_instance()
+    registry.get_or_create("credential", lambda: SimpleNamespace())
+    registry.get_or_create("subscription_client", lambda: SimulatedSubscriptionClient(tenant))
+    registry.get_or_create("resource_graph_client", lambda: resource_graph_client)
+    AzureBlobService._instance = blob_service
+
+    recorder = Recorder()
+    recorder.install(AzureSubscriptionClient, AzureWorkflow)
+
+    print(f"Tenant: {args.subscriptions} subscriptions x {args.resources} resources, "
+          f"page size {config['records_per_page']}, layout {config.get('storage_layout', 'pages')}, "
+          f"{config.get('max_concurrent_subscriptions', 1)} workers")
+    results = [run_phase("full", AzureWorkflow, recorder, resource_graph_client, blob_service)]
+    for run in range(1, args.incremental_runs + 1):
+        changes = tenant.mutate(args.change_fraction)
+        print(f"Incremental run {run}: {changes} changes")
+        results.append(run_phase(f"incremental-{run}", AzureWorkflow, recorder, resource_graph_client, blob_service))
+
+    print_report(results)
+    print(f"Stored {len(blob_service.blobs)} blobs, {blob_service.stored_bytes() / (1024 * 1024):.1f} MB")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=4)
+
+    failures = [f"{result['phase']} failed: {result['error']}" for result in results if result["error"]]
+    if args.compare:
+        failures.extend(compare(results, args.compare, args.tolerance))
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
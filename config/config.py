@@ -1,9 +1,24 @@
 import json
+import os
+import threading
+
+CONFIG_PATH = "config/settings.json"
+
 
 class AzureConfig:
+    # Parsed settings shared by every instance; re-read only when the file's modification time changes
+    _cache = None
+    _cache_mtime = None
+    _cache_lock = threading.Lock()
+
     def __init__(self):
-        with open("config/settings.json") as f:
-            self.config = json.load(f)
+        mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        with AzureConfig._cache_lock:
+            if AzureConfig._cache is None or AzureConfig._cache_mtime != mtime:
+                with open(CONFIG_PATH) as f:
+                    AzureConfig._cache = json.load(f)
+                AzureConfig._cache_mtime = mtime
+            self.config = AzureConfig._cache
 
         # getter method
     def get_config(self):
@@ -1,11 +1,17 @@
+import json
+
 import azure.functions as func
 
 from utils.logger_setup import setup_logger
-from workflow.azure_workflow import AzureWorkflow
 
 logger = setup_logger(name="main")
 
+# Workflows are imported inside each entry point so a cold start only loads the SDK stack of the
+# function being invoked; benchmarks/import_time.py keeps an eye on the import budget
+
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    from workflow.azure_workflow import AzureWorkflow
+
     logger.info("Workflow completed successfully")
     workflow = AzureWorkflow()
     try:
@@ -18,3 +24,41 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         logger.error(f"An error occurred: {str(e)}")
         # Return HTTP 500 with the error message
         return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+
+
+async def main_async(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    asyncio entry point; runs the workflow on the aio Azure SDK clients so page fetches and
+    blob uploads overlap. Select it with "entryPoint": "main_async" in function.json.
+    """
+    from workflow.async_azure_workflow import AsyncAzureWorkflow
+
+    logger.info("Async workflow started")
+    workflow = AsyncAzureWorkflow()
+    try:
+        await workflow.on_start()
+        logger.info("Workflow completed successfully")
+        return func.HttpResponse("Workflow completed successfully.", status_code=200)
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        return func.HttpResponse(f"Internal Server Error: {str(e)}", status_code=500)
+    finally:
+        await workflow.close()
+
+
+def main_worker(msg: func.QueueMessage) -> None:
+    """
+    Queue-triggered worker for distributed mode (see worker/function.json); processes one batch of
+    subscriptions queued by main. Errors are re-raised so the message is retried.
+    """
+    from workflow.azure_workflow import AzureWorkflow
+
+    work_item = json.loads(msg.get_body().decode("utf-8"))
+    logger.info(f"Worker started for {len(work_item['subscription_ids'])} subscriptions of run {work_item['run_id']}")
+    workflow = AzureWorkflow()
+    try:
+        workflow.process_queued_work_item(work_item)
+        logger.info("Work item completed successfully")
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        raise
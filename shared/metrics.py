@@ -0,0 +1,317 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from config.config import AzureConfig
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="Metrics")
+
+# Durations kept per span name for percentiles
+MAX_SAMPLES = 10000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation. self_seconds excludes time spent in child spans on the same thread or task,
+    which matters for state callbacks: each one triggers the next state from inside its own body.
+    """
+    __slots__ = ("name", "attributes", "start_time", "seconds", "child_seconds", "error")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.seconds = 0.0
+        self.child_seconds = 0.0
+        self.error = None
+
+    @property
+    def self_seconds(self):
+        return max(0.0, self.seconds - self.child_seconds)
+
+
+class InMemoryExporter:
+    """
+    Keeps every finished span and counter increment, for tests and local analysis.
+    """
+    def __init__(self):
+        self.spans = []
+        self.counters = []
+        self.summaries = []
+        self._lock = threading.Lock()
+
+    def export_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export_counter(self, name, value, attributes):
+        with self._lock:
+            self.counters.append((name, value, attributes))
+
+    def export_summary(self, summary):
+        with self._lock:
+            self.summaries.append(summary)
+
+
+class ConsoleExporter:
+    """
+    Logs spans at DEBUG level and the run summary as one JSON line at INFO level.
+    """
+    def export_span(self, span):
+        logger.debug(f"span {span.name} {span.seconds * 1000:.1f} ms (self {span.self_seconds * 1000:.1f} ms) "
+                     f"{span.attributes}{' error: ' + span.error if span.error else ''}")
+
+    def export_counter(self, name, value, attributes):
+        pass
+
+    def export_summary(self, summary):
+        logger.info(f"Run metrics: {json.dumps(summary, sort_keys=True)}")
+
+
+class OpenTelemetryExporter:
+    """
+    Forwards spans and counters to the globally configured OpenTelemetry tracer and meter providers.
+    Requires opentelemetry-api; without an SDK configured the calls are no-ops.
+    """
+    def __init__(self, instrumentation_name="azure_workflow"):
+        try:
+            from opentelemetry import metrics, trace
+        except ImportError as e:
+            raise ValueError("The opentelemetry metrics exporter requires the 'opentelemetry-api' package.") from e
+        self._trace = trace
+        self.tracer = trace.get_tracer(instrumentation_name)
+        self.meter = metrics.get_meter(instrumentation_name)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def export_span(self, span):
+        start_ns = int(span.start_time * 1e9)
+        otel_span = self.tracer.start_span(span.name, start_time=start_ns, attributes=_otel_attributes(span.attributes))
+        if span.error:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=start_ns + int(span.seconds * 1e9))
+
+    def export_counter(self, name, value, attributes):
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = self.meter.create_counter(name)
+        counter.add(value, attributes=_otel_attributes(attributes))
+
+    def export_summary(self, summary):
+        pass
+
+
+def _otel_attributes(attributes):
+    # OpenTelemetry attribute values must be primitives
+    return {key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in attributes.items() if value is not None}
+
+
+_EXPORTERS = {
+    "memory": InMemoryExporter,
+    "console": ConsoleExporter,
+    "opentelemetry": OpenTelemetryExporter,
+}
+
+
+class Metrics:
+    """
+    Process-wide collector of spans and counters. Totals accumulate for the life of the process;
+    snapshot() and summary(since=...) scope them to one run. Finished spans and increments are handed
+    to the configured exporters as they happen.
+    """
+    _instance = None
+    _initialized = False
+    _instance_lock = threading.Lock()
+
+    def __init__(self, exporters=None):
+        self.exporters = list(exporters or [])
+        self._spans = {}
+        self._counters = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Return the process-wide collector configured from the "metrics" section of settings.json,
+        or None when metrics are disabled.
+        """
+        if cls._initialized:
+            return cls._instance
+        with cls._instance_lock:
+            if not cls._initialized:
+                metrics_config = AzureConfig().get_config().get("metrics", {})
+                if metrics_config.get("enabled", False):
+                    exporters = []
+                    for exporter_name in metrics_config.get("exporters", ["console"]):
+                        try:
+                            exporters.append(_EXPORTERS[exporter_name]())
+                        except KeyError:
+                            raise ValueError(f"Unsupported metrics exporter: {exporter_name}") from None
+                    cls._instance = cls(exporters)
+                    logger.info("Metrics initialized successfully.")
+                # Set last: the unlocked check above must never see a half-initialized collector
+                cls._initialized = True
+            return cls._instance
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, attributes)
+        parent = _current_span.get()
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.seconds = time.perf_counter() - started
+            _current_span.reset(token)
+            if parent is not None:
+                parent.child_seconds += span.seconds
+            self._record_span(span)
+
+    def _record_span(self, span):
+        with self._lock:
+            self._sequence += 1
+            stats = self._spans.get(span.name)
+            if stats is None:
+                stats = self._spans[span.name] = {"count": 0, "errors": 0, "seconds": 0.0, "self_seconds": 0.0,
+                                                  "samples": deque(maxlen=MAX_SAMPLES)}
+            stats["count"] += 1
+            stats["errors"] += span.error is not None
+            stats["seconds"] += span.seconds
+            stats["self_seconds"] += span.self_seconds
+            stats["samples"].append((self._sequence, span.seconds))
+        for exporter in self.exporters:
+            exporter.export_span(span)
+
+    def increment(self, name, value=1, **attributes):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for exporter in self.exporters:
+            exporter.export_counter(name, value, attributes)
+
+    def snapshot(self):
+        """
+        :return: Opaque marker for summary(since=...).
+        """
+        with self._lock:
+            return {
+                "sequence": self._sequence,
+                "spans": {name: (stats["count"], stats["errors"], stats["seconds"], stats["self_seconds"])
+                          for name, stats in self._spans.items()},
+                "counters": dict(self._counters),
+            }
+
+    def summary(self, since=None):
+        """
+        Totals per span name (count, errors, seconds, self seconds, p50/p99/max milliseconds) and counter
+        values, for everything recorded after the since snapshot or since the process started.
+        Concurrent runs in the same process are included in each other's summaries.
+        """
+        since = since or {"sequence": 0, "spans": {}, "counters": {}}
+        with self._lock:
+            spans = {}
+            for name, stats in self._spans.items():
+                count, errors, seconds, self_seconds = since["spans"].get(name, (0, 0, 0.0, 0.0))
+                if stats["count"] == count:
+                    continue
+                durations = sorted(duration for sequence, duration in stats["samples"] if sequence > since["sequence"])
+                spans[name] = {
+                    "count": stats["count"] - count,
+                    "errors": stats["errors"] - errors,
+                    "seconds": round(stats["seconds"] - seconds, 4),
+                    "self_seconds": round(stats["self_seconds"] - self_seconds, 4),
+                    "p50_ms": _percentile_ms(durations, 50),
+                    "p99_ms": _percentile_ms(durations, 99),
+                    "max_ms": round(durations[-1] * 1000, 2) if durations else None,
+                }
+            counters = {name: value - since["counters"].get(name, 0) for name, value in self._counters.items()
+                        if value != since["counters"].get(name, 0)}
+        return {"spans": spans, "counters": counters}
+
+    def export_summary(self, summary):
+        for exporter in self.exporters:
+            exporter.export_summary(summary)
+
+
+def _percentile_ms(ordered, percent):
+    if not ordered:
+        return None
+    index = max(0, -(-percent * len(ordered) // 100) - 1)
+    return round(ordered[index] * 1000, 2)
+
+
+def span(name, **attributes):
+    """
+    Time a block: `with span("blob.read", blob=name): ...`. Does nothing when metrics are disabled.
+    """
+    metrics = Metrics.get_instance()
+    if metrics is None:
+        return nullcontext()
+    return metrics.span(name, **attributes)
+
+
+def increment(name, value=1, **attributes):
+    """
+    Add to a counter such as bytes, records or retries. Does nothing when metrics are disabled.
+    """
+    metrics = Metrics.get_instance()
+    if metrics is not None:
+        metrics.increment(name, value, **attributes)
+
+
+@contextmanager
+def measure_run(name, **attributes):
+    """
+    Time a whole run and hand the summary of everything recorded during it to the exporters.
+    :return: Context manager yielding a dict that holds the summary once the block exits;
+             it stays empty when metrics are disabled.
+    """
+    metrics = Metrics.get_instance()
+    run_summary = {}
+    if metrics is None:
+        yield run_summary
+        return
+    since = metrics.snapshot()
+    try:
+        with metrics.span(name, **attributes):
+            yield run_summary
+    finally:
+        run_summary.update(metrics.summary(since=since))
+        metrics.export_summary(run_summary)
+
+
+def timed(name=None):
+    """
+    Decorator running a function or coroutine inside a span named after it.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,119 @@
+import queue
+import threading
+
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="prefetch")
+
+_END = object()
+
+
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, max_buffered, name="prefetch"):
+    """
+    Iterate over `iterable` on a background producer thread, handing items over through a bounded queue.
+    The producer runs at most `max_buffered` items ahead of the consumer and blocks when the queue is full,
+    so memory stays bounded. Exceptions raised by the producer are re-raised in the consumer.
+    :param iterable: Source iterable, typically a paginated query generator.
+    :param max_buffered: Maximum number of items fetched but not yet consumed.
+    :param name: Name of the producer thread, used in logs.
+    """
+    buffer = queue.Queue(maxsize=max(1, max_buffered))
+    stopped = threading.Event()
+
+    def put(item):
+        # Poll so the producer notices a consumer that stopped early instead of blocking forever
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END)
+        except Exception as e:
+            logger.warning(f"Producer {name} failed: {str(e)}")
+            put(_ProducerError(e))
+
+    producer = threading.Thread(target=produce, name=name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def prefetch_many(iterables, max_workers, max_buffered, name="prefetch"):
+    """
+    Iterate over several iterables concurrently, on up to `max_workers` producer threads, yielding items
+    in the order they arrive. Each iterable is consumed by a single thread. At most `max_buffered` items
+    are fetched but not yet consumed; an exception raised by any producer stops the others and is
+    re-raised in the consumer.
+    :param iterables: Source iterables, typically independent paginated query generators.
+    :param max_workers: Maximum number of iterables consumed at the same time.
+    :param max_buffered: Maximum number of items fetched but not yet consumed.
+    :param name: Prefix of the producer thread names, used in logs.
+    """
+    sources = iter(list(iterables))
+    sources_lock = threading.Lock()
+    buffer = queue.Queue(maxsize=max(1, max_buffered))
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            while not stopped.is_set():
+                with sources_lock:
+                    iterable = next(sources, None)
+                if iterable is None:
+                    break
+                for item in iterable:
+                    if not put(item):
+                        return
+            put(_END)
+        except Exception as e:
+            logger.warning(f"Producer {threading.current_thread().name} failed: {str(e)}")
+            put(_ProducerError(e))
+
+    producers = [threading.Thread(target=produce, name=f"{name}-{i}", daemon=True) for i in range(max(1, max_workers))]
+    for producer in producers:
+        producer.start()
+    try:
+        running = len(producers)
+        while running:
+            item = buffer.get()
+            if item is _END:
+                running -= 1
+                continue
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        for producer in producers:
+            producer.join()
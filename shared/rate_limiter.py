@@ -0,0 +1,214 @@
+import asyncio
+import random
+import threading
+import time
+
+from azure.core.pipeline.policies import AsyncHTTPPolicy, SansIOHTTPPolicy
+
+from config.config import AzureConfig
+from shared.metrics import increment, span
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="RateLimiter")
+
+QUOTA_REMAINING_HEADER = "x-ms-user-quota-remaining"
+QUOTA_RESETS_AFTER_HEADER = "x-ms-user-quota-resets-after"
+
+
+def _parse_resets_after(value):
+    """
+    Parse an "hh:mm:ss" quota reset interval into seconds; None when missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        hours, minutes, seconds = value.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Process-wide token bucket shared by every Resource Graph client and worker thread or task.
+    The bucket refills at requests_per_window / window_seconds. Quota headers returned by the service
+    take precedence: the bucket never holds more tokens than the reported remaining quota, and once the
+    quota is used up every caller waits for the reported reset instead of running into 429s.
+    """
+    _instance = None
+    _initialized = False
+    _instance_lock = threading.Lock()
+
+    def __init__(self, requests_per_window=15, window_seconds=5, jitter_seconds=0.25):
+        self.capacity = requests_per_window
+        self.refill_rate = requests_per_window / window_seconds
+        self.jitter_seconds = jitter_seconds
+        self._tokens = float(requests_per_window)
+        self._updated_at = time.monotonic()
+        self._quota_resets_at = None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Return the process-wide limiter configured from the "rate_limit" section of settings.json,
+        or None when rate limiting is disabled. The section is read once per process, and the
+        Resource Graph clients in the ResourceRegistry keep the limiter they were built with, so
+        changes to it take effect on the next cold start of the host.
+        """
+        with cls._instance_lock:
+            if not cls._initialized:
+                cls._initialized = True
+                rate_limit_config = AzureConfig().get_config().get("rate_limit", {})
+                if not rate_limit_config.get("enabled", False):
+                    return None
+                cls._instance = cls(
+                    requests_per_window=rate_limit_config.get("requests_per_window", 15),
+                    window_seconds=rate_limit_config.get("window_seconds", 5),
+                    jitter_seconds=rate_limit_config.get("jitter_seconds", 0.25),
+                )
+                logger.info("RateLimiter initialized successfully.")
+            return cls._instance
+
+    def _refill(self, now):
+        if self._quota_resets_at is not None:
+            # The service told us when its window resets; don't guess in between
+            if now >= self._quota_resets_at:
+                self._tokens = float(self.capacity)
+                self._quota_resets_at = None
+        else:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+    def _reserve(self):
+        """
+        Take a token if one is available.
+        :return: 0 when a token was taken, otherwise the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now + random.uniform(0, self.jitter_seconds)
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            if self._quota_resets_at is not None:
+                wait = self._quota_resets_at - now
+            else:
+                wait = (1 - self._tokens) / self.refill_rate
+            # Spread waiting callers so they don't all wake up at the same instant
+            return wait + random.uniform(0, self.jitter_seconds)
+
+    def acquire(self):
+        """
+        Block the calling thread until a request may be sent.
+        """
+        wait = self._reserve()
+        if not wait:
+            return
+        with span("rate_limiter.wait"):
+            while wait:
+                time.sleep(wait)
+                wait = self._reserve()
+
+    async def acquire_async(self):
+        """
+        Wait without blocking the event loop until a request may be sent.
+        """
+        wait = self._reserve()
+        if not wait:
+            return
+        with span("rate_limiter.wait"):
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._reserve()
+
+    def update_from_headers(self, headers):
+        """
+        Align the bucket with the x-ms-user-quota-remaining and x-ms-user-quota-resets-after headers.
+        """
+        remaining = headers.get(QUOTA_REMAINING_HEADER)
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return
+        resets_after = _parse_resets_after(headers.get(QUOTA_RESETS_AFTER_HEADER))
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, remaining)
+            if resets_after is not None:
+                self._quota_resets_at = now + resets_after
+        if remaining == 0:
+            logger.warning(f"Resource Graph quota exhausted; pausing requests for {resets_after} seconds.")
+
+    def throttle(self, seconds):
+        """
+        Pause all callers for the given number of seconds, e.g. after a 429 with Retry-After.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._updated_at = now
+            self._paused_until = max(self._paused_until, now + seconds)
+
+
+def _retry_after_seconds(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitPolicy(SansIOHTTPPolicy):
+    """
+    Pipeline policy pacing every request sent through a synchronous client.
+    """
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+
+    def on_request(self, request):
+        self.rate_limiter.acquire()
+
+    def on_response(self, request, response):
+        headers = response.http_response.headers
+        self.rate_limiter.update_from_headers(headers)
+        if response.http_response.status_code == 429:
+            increment("resource_graph.throttled")
+            self.rate_limiter.throttle(_retry_after_seconds(headers) or 1)
+
+
+class AsyncRateLimitPolicy(AsyncHTTPPolicy):
+    """
+    Pipeline policy pacing every request sent through an aio client.
+    """
+    def __init__(self, rate_limiter):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    async def send(self, request):
+        await self.rate_limiter.acquire_async()
+        response = await self.next.send(request)
+        headers = response.http_response.headers
+        self.rate_limiter.update_from_headers(headers)
+        if response.http_response.status_code == 429:
+            increment("resource_graph.throttled")
+            self.rate_limiter.throttle(_retry_after_seconds(headers) or 1)
+        return response
+
+
+def rate_limited_client_kwargs(async_client=False):
+    """
+    Keyword arguments for a Resource Graph client so its requests go through the shared limiter, when enabled.
+    Pipeline-level retries are always disabled: retry_with_backoff is the single place where failed calls are retried.
+    """
+    rate_limiter = RateLimiter.get_instance()
+    if rate_limiter is None:
+        return {"retry_total": 0}
+    policy = AsyncRateLimitPolicy(rate_limiter) if async_client else RateLimitPolicy(rate_limiter)
+    return {"per_retry_policies": [policy], "retry_total": 0}
@@ -0,0 +1,219 @@
+import asyncio
+import atexit
+import threading
+import time
+
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from urllib3.util.retry import Retry
+
+from config.config import AzureConfig
+from shared.rate_limiter import rate_limited_client_kwargs
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="ResourceRegistry")
+
+
+class ResourceRegistry:
+    """
+    Process-wide cache of objects that are expensive to build and safe to share between invocations on a
+    warm Functions host: the credential with its token cache, the management clients, one pooled HTTP
+    transport, the set of containers known to exist and, per event loop, the aio clients. Entries older than max_age_seconds are closed
+    and rebuilt on next use; tokens are refreshed by the credential itself when they expire.
+    The identity and management SDKs are imported on first use to keep cold starts short.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, pool_connections=10, pool_maxsize=32, max_age_seconds=None):
+        """
+        :param pool_maxsize: Connections kept open per host; should cover the worker threads sending requests.
+        :param max_age_seconds: Age after which clients are rebuilt; None keeps them for the life of the process.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_age_seconds = max_age_seconds
+        self._entries = {}
+        self._containers = set()
+        # aio clients are bound to the event loop they were created on: name -> client, for _async_loop
+        self._async_entries = {}
+        self._async_loop = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Return the process-wide registry configured from the "resource_registry" section of settings.json.
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                registry_config = AzureConfig().get_config().get("resource_registry", {})
+                cls._instance = cls(
+                    pool_connections=registry_config.get("pool_connections", 10),
+                    pool_maxsize=registry_config.get("pool_maxsize", 32),
+                    max_age_seconds=registry_config.get("max_age_seconds"),
+                )
+                atexit.register(cls._instance.close)
+                logger.info("ResourceRegistry initialized successfully.")
+            return cls._instance
+
+    def get_or_create(self, name, factory, max_age_seconds=None):
+        """
+        Return the cached entry, building it with factory() when missing or older than max_age_seconds.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                value, created_at = entry
+                if max_age_seconds is None or time.monotonic() - created_at < max_age_seconds:
+                    return value
+                logger.info(f"Refreshing {name} after {max_age_seconds} seconds.")
+                self._close(name, value)
+            value = factory()
+            self._entries[name] = (value, time.monotonic())
+            return value
+
+    def invalidate(self, name):
+        """
+        Drop an entry, e.g. after it failed in a way that a fresh instance may not.
+        """
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self._close(name, entry[0])
+
+    def close(self):
+        with self._lock:
+            for name, (value, _) in list(self._entries.items()):
+                self._close(name, value)
+            self._entries.clear()
+            self._containers.clear()
+            loop, self._async_loop = self._async_loop, None
+            async_entries, self._async_entries = self._async_entries, {}
+        if async_entries and loop is not None and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(self._aclose_entries(async_entries))
+
+    async def aclose(self):
+        """
+        Close every aio client of the running event loop. Callers that own their loop, e.g. asyncio.run,
+        call this before the loop ends; on the Functions host the clients live as long as its loop.
+        """
+        with self._lock:
+            if self._async_loop is not asyncio.get_running_loop():
+                return
+            async_entries, self._async_entries = self._async_entries, {}
+        await self._aclose_entries(async_entries)
+
+    @staticmethod
+    async def _aclose_entries(async_entries):
+        # Clients first, the credential they authenticate with last
+        for name, value in reversed(list(async_entries.items())):
+            try:
+                await value.close()
+            except Exception as e:
+                logger.warning(f"Error while closing {name}: {e}")
+
+    @staticmethod
+    def _close(name, value):
+        close = getattr(value, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"Error while closing {name}: {e}")
+
+    def get_session(self):
+        """
+        requests session shared by every client using the pooled transport.
+        """
+        def create():
+            session = requests.Session()
+            # Retries are left to the pipeline, as in the transport's own default session
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                    pool_maxsize=self.pool_maxsize,
+                                                    max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            return session
+
+        return self.get_or_create("session", create)
+
+    def get_transport(self):
+        """
+        Transport over the shared session. Clients closing it leave the session and its connections open.
+        """
+        return self.get_or_create("transport", lambda: RequestsTransport(session=self.get_session(), session_owner=False))
+
+    def get_credential(self):
+        from azure.identity import DefaultAzureCredential
+
+        return self.get_or_create("credential", DefaultAzureCredential)
+
+    def get_async_client(self, name, factory):
+        """
+        Return the aio entry for the running event loop, building it with factory() when missing. HTTP
+        sessions of aio clients are bound to their loop, so every entry is replaced when called from a
+        different loop. Callers must not close the entries; see aclose.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_loop is not loop:
+                if self._async_entries:
+                    # Their sessions can only be closed on the loop they belong to, which is no longer ours
+                    logger.info(f"Event loop changed; dropping {len(self._async_entries)} aio clients of the previous one.")
+                self._async_entries = {}
+                self._async_loop = loop
+            value = self._async_entries.get(name)
+            if value is None:
+                value = factory()
+                self._async_entries[name] = value
+            return value
+
+    def get_async_credential(self):
+        from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+
+        return self.get_async_client("async_credential", AsyncDefaultAzureCredential)
+
+    def get_async_subscription_client(self):
+        from azure.mgmt.resource.subscriptions.aio import SubscriptionClient as AsyncSubscriptionClient
+
+        credential = self.get_async_credential()
+        # Failed calls are retried by retry_with_backoff only, as for the Resource Graph clients
+        return self.get_async_client("async_subscription_client",
+                                     lambda: AsyncSubscriptionClient(credential, retry_total=0))
+
+    def get_async_resource_graph_client(self):
+        from azure.mgmt.resourcegraph.aio import ResourceGraphClient as AsyncResourceGraphClient
+
+        credential = self.get_async_credential()
+        return self.get_async_client(
+            "async_resource_graph_client",
+            lambda: AsyncResourceGraphClient(credential, **rate_limited_client_kwargs(async_client=True)))
+
+    def get_subscription_client(self):
+        from azure.mgmt.resource import SubscriptionClient
+
+        # Failed calls are retried by retry_with_backoff only, as for the Resource Graph clients
+        return self.get_or_create(
+            "subscription_client",
+            lambda: SubscriptionClient(self.get_credential(), transport=self.get_transport(), retry_total=0),
+            self.max_age_seconds)
+
+    def get_resource_graph_client(self):
+        from azure.mgmt.resourcegraph import ResourceGraphClient
+
+        # Requests are paced by the process-wide rate limiter shared with every other Resource Graph client
+        return self.get_or_create(
+            "resource_graph_client",
+            lambda: ResourceGraphClient(self.get_credential(), transport=self.get_transport(),
+                                        **rate_limited_client_kwargs()),
+            self.max_age_seconds)
+
+    def container_initialized(self, container_name):
+        with self._lock:
+            return container_name in self._containers
+
+    def mark_container_initialized(self, container_name):
+        with self._lock:
+            self._containers.add(container_name)
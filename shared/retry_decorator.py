@@ -1,10 +1,63 @@
 from utils.logger_setup import setup_logger
-from azure.core.exceptions import HttpResponseError
+from shared.metrics import increment, span
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+import asyncio
 import functools
+import inspect
+import random
 from time import sleep
 
 logger = setup_logger(name="retry_with_backoff")
 
+def _is_retryable(e):
+    """
+    :return: True for throttling (429), server errors (5xx) and transport errors. Anything else, e.g. a
+             400, 401, 403 or 404 response or a ValueError, would fail the same way again.
+    """
+    if isinstance(e, (ServiceRequestError, ServiceResponseError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(e, HttpResponseError):
+        return e.status_code is not None and (e.status_code == 429 or e.status_code >= 500)
+    return False
+
+def _get_wait_time(func, e, retry_count, wait_time):
+    """
+    Log a failed attempt and work out how long to wait before the next one.
+    :return: Seconds to wait; honours 'Retry-After' on 429 responses.
+    """
+    if isinstance(e, HttpResponseError):
+        if e.status_code == 429:
+            # Extract 'Retry-After' from headers, if available
+            if e.response and hasattr(e.response, "headers"):
+                retry_after = e.response.headers.get("Retry-After")
+            else:
+                retry_after = None
+            if retry_after:
+                wait_time = int(retry_after)
+                logger.warning(
+                    f"Received 429 Too Many Requests. Retrying after {wait_time} seconds..."
+                )
+            else:
+                logger.warning(
+                    f"Received 429 Too Many Requests but no 'Retry-After' header. "
+                    f"Using default backoff time of {wait_time} seconds."
+                )
+        else:
+            logger.warning(
+                f"Attempt {retry_count} failed for {func.__name__}: {e.message}. "
+                f"Retrying in {wait_time} seconds..."
+            )
+    else:
+        logger.warning(
+            f"Attempt {retry_count} failed for {func.__name__}: {str(e)}. "
+            f"Retrying in {wait_time} seconds..."
+        )
+    return wait_time
+
+def _with_jitter(wait_time):
+    # Never wait less than asked (Retry-After), but spread concurrent retries apart
+    return wait_time + random.uniform(0, wait_time / 2)
+
 def retry_with_backoff(retries=3, backoff_in_seconds=1):
     def decorator(func):
         @functools.wraps(func)
@@ -15,50 +68,44 @@ def retry_with_backoff(retries=3, backoff_in_seconds=1):
             while retry_count < retries:
                 try:
                     return func(*args, **kwargs)
-                except HttpResponseError as e:
-                    if e.status_code == 429:
-                        # Extract 'Retry-After' from headers, if available
-                        if e.response and hasattr(e.response, "headers"):
-                            retry_after = e.response.headers.get("Retry-After")
-                        else:
-                            retry_after = None
-                        if retry_after:
-                            wait_time = int(retry_after)
-                            logger.warning(
-                                f"Received 429 Too Many Requests. Retrying after {wait_time} seconds..."
-                            )
-                        else:
-                            logger.warning(
-                                f"Received 429 Too Many Requests but no 'Retry-After' header. "
-                                f"Using default backoff time of {wait_time} seconds."
-                            )
-                    else:
-                        logger.warning(
-                            f"Attempt {retry_count + 1} failed for {func.__name__}: {e.message}. "
-                            f"Retrying in {wait_time} seconds..."
-                        )
-
+                except Exception as e:
+                    if not _is_retryable(e):
+                        raise
                     retry_count += 1
                     if retry_count == retries:
                         logger.error(f"All {retries} attempts failed for {func.__name__}. Final error: {str(e)}")
                         raise
 
-                    sleep(wait_time)
-                    wait_time *= 2  # Exponential backoff for non-429 errors
+                    wait_time = _get_wait_time(func, e, retry_count, wait_time)
+                    increment("retry.retries", function=func.__name__)
+                    with span("retry.wait", function=func.__name__):
+                        sleep(_with_jitter(wait_time))
+                    wait_time *= 2  # Exponential backoff
 
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            retry_count = 0
+            wait_time = backoff_in_seconds
+
+            while retry_count < retries:
+                try:
+                    return await func(*args, **kwargs)
                 except Exception as e:
+                    if not _is_retryable(e):
+                        raise
                     retry_count += 1
                     if retry_count == retries:
                         logger.error(f"All {retries} attempts failed for {func.__name__}. Final error: {str(e)}")
                         raise
 
-                    logger.warning(
-                        f"Attempt {retry_count} failed for {func.__name__}: {str(e)}. "
-                        f"Retrying in {wait_time} seconds..."
-                    )
-                    sleep(wait_time)
-                    wait_time *= 2  # Exponential backoff for unexpected exceptions
+                    wait_time = _get_wait_time(func, e, retry_count, wait_time)
+                    increment("retry.retries", function=func.__name__)
+                    with span("retry.wait", function=func.__name__):
+                        await asyncio.sleep(_with_jitter(wait_time))  # Back off without blocking the event loop
+                    wait_time *= 2  # Exponential backoff
 
+        if inspect.iscoroutinefunction(func):
+            return async_wrapper
         return sync_wrapper
 
     return decorator
@@ -0,0 +1,124 @@
+"""
+Offline fixtures: the workflow's blob and Resource Graph clients run against the in-memory clients of
+benchmarks/simulated_azure.py, with latency and throttling turned off.
+"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import config.config
+from benchmarks.simulated_azure import (AsyncSimulatedBlobServiceClient, AsyncSimulatedResourceGraphClient,
+                                        AsyncSimulatedSubscriptionClient, SimulatedBlobServiceClient,
+                                        SimulatedResourceGraphClient, SimulatedSubscriptionClient, SimulatedTenant)
+from config.config import AzureConfig
+from shared.resource_registry import ResourceRegistry
+from utils.azure_blob_service import AzureBlobService
+from utils.blob_cache import BlobCache
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+config.config.CONFIG_PATH = os.path.join(REPO_ROOT, "config", "settings.json")
+
+CONTAINER = "azure-greenfield"
+RESOURCE_FOLDER = f"{CONTAINER}/raw_data/resource"
+
+
+def stored_resources(blob_client, blob_service, subscription_id):
+    """
+    :return: Resources of the subscription's pages, later pages overriding earlier ones, minus journal deletes.
+    """
+    prefix = f"{RESOURCE_FOLDER}/resource_{subscription_id}_"
+    resources, deleted = {}, set()
+    for path in sorted(blob_service.blobs, key=lambda path: (len(path), path)):
+        name = path[len(RESOURCE_FOLDER) + 1:]
+        if not path.startswith(prefix) or "/" in name:
+            continue
+        if "_page_" in name:
+            for resource in blob_client.read_blob_file(RESOURCE_FOLDER, name)["value"]:
+                resources[resource["id"].lower()] = resource
+                deleted.discard(resource["id"].lower())
+        elif name.endswith("_journal.json"):
+            deleted.update(resource_id.lower() for resource_id in
+                           blob_client.read_blob_file(RESOURCE_FOLDER, name)["deleted"])
+    return {resource_id: resource for resource_id, resource in resources.items() if resource_id not in deleted}
+
+
+@pytest.fixture
+def settings():
+    """
+    The parsed settings.json; override keys with monkeypatch.setitem so they are restored afterwards.
+    """
+    return AzureConfig().get_config()
+
+
+@pytest.fixture
+def blob_service(monkeypatch):
+    service = SimulatedBlobServiceClient(latency_ms=0)
+    monkeypatch.setattr(AzureBlobService, "_instance", service)
+    monkeypatch.setattr(BlobCache, "_instance", BlobCache(max_memory_bytes=16 * 1024 * 1024))
+    monkeypatch.setattr(BlobCache, "_initialized", True)
+    return service
+
+
+@pytest.fixture
+def blob_client(blob_service):
+    from utils.azure_blob_client import AzureBlobClient
+
+    return AzureBlobClient()
+
+
+@pytest.fixture
+def upload_settings(monkeypatch):
+    """
+    The blob upload settings with skip_unchanged on; change keys in place for a single test.
+    """
+    settings = dict(AzureBlobService.get_upload_settings(), skip_unchanged=True)
+    monkeypatch.setattr(AzureBlobService, "_upload_settings", settings)
+    return settings
+
+
+@pytest.fixture
+def tenant():
+    return SimulatedTenant(subscription_count=3, resources_per_subscription=40, seed=1)
+
+
+@pytest.fixture
+def resource_graph_client(tenant):
+    return SimulatedResourceGraphClient(tenant, latency_ms=0, seed=1)
+
+
+@pytest.fixture
+def registry(monkeypatch, tenant, resource_graph_client):
+    registry = ResourceRegistry()
+    registry.get_or_create("credential", lambda: SimpleNamespace())
+    registry.get_or_create("subscription_client", lambda: SimulatedSubscriptionClient(tenant))
+    registry.get_or_create("resource_graph_client", lambda: resource_graph_client)
+    monkeypatch.setattr(ResourceRegistry, "_instance", registry)
+    return registry
+
+
+@pytest.fixture
+def subscription_client(registry):
+    from utils.azure_subscription_client import AzureSubscriptionClient
+
+    return AzureSubscriptionClient()
+
+
+class _AsyncCredential:
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def async_clients(registry, blob_service, tenant, resource_graph_client):
+    """
+    Call the returned function from inside the test's event loop: it registers aio adapters of the
+    simulated clients for that loop, sharing their state with the sync fixtures.
+    """
+    def install():
+        registry.get_async_client("async_credential", _AsyncCredential)
+        registry.get_async_client("async_subscription_client", lambda: AsyncSimulatedSubscriptionClient(tenant))
+        registry.get_async_client("async_resource_graph_client",
+                                  lambda: AsyncSimulatedResourceGraphClient(resource_graph_client))
+        registry.get_async_client("async_blob_service_client", lambda: AsyncSimulatedBlobServiceClient(blob_service))
+    return install
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from tests.conftest import RESOURCE_FOLDER
+from utils.async_azure_blob_client import AsyncAzureBlobClient
+from utils.serializers import get_serializer
+
+BLOB_NAME = "resource_s_2024_01_01_page_1.json"
+
+RECORDS = [{"id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/site{i}", "name": f"site{i}",
+            "properties": {"state": "Running"}} for i in range(20)]
+
+
+def run(async_clients, steps):
+    """
+    Run steps(client) with an AsyncAzureBlobClient created inside the event loop.
+    """
+    async def main():
+        async_clients()
+        return await steps(AsyncAzureBlobClient())
+    return asyncio.run(main())
+
+
+def test_reads_revalidate_the_cached_copy(async_clients, blob_service, blob_client):
+    path = f"{RESOURCE_FOLDER}/{BLOB_NAME}"
+
+    async def steps(client):
+        await client.upload_data_to_blob(RESOURCE_FOLDER, BLOB_NAME, {"value": RECORDS})
+        # Same ETag, so the read is answered with 304 and served from the cache
+        blob_service.blobs[path]["data"] = b"not served"
+        cached = await client.read_blob_file(RESOURCE_FOLDER, BLOB_NAME)
+        blob_client.upload_data_to_blob(RESOURCE_FOLDER, BLOB_NAME, {"value": RECORDS[:1]})
+        return cached, await client.read_blob_file(RESOURCE_FOLDER, BLOB_NAME)
+
+    cached, changed = run(async_clients, steps)
+
+    assert cached == {"value": RECORDS}
+    assert changed == {"value": RECORDS[:1]}
+
+
+def test_missing_blobs_read_as_none(async_clients):
+    async def steps(client):
+        return await client.read_blob_file(RESOURCE_FOLDER, "missing.json")
+
+    assert run(async_clients, steps) is None
+
+
+def test_unchanged_uploads_are_skipped(async_clients, blob_service, upload_settings):
+    upload_settings["max_single_put_size"] = 256
+
+    async def steps(client):
+        results = []
+        for serializer in (None, get_serializer("ndjson_gzip")):
+            name = BLOB_NAME if serializer is None else BLOB_NAME.replace(".json", ".ndjson.gz")
+            for records in (RECORDS, RECORDS, RECORDS[1:]):
+                results.append(await client.upload_data_to_blob(RESOURCE_FOLDER, name, {"value": iter(records)},
+                                                                serializer=serializer))
+        return results, client.upload_counts
+
+    results, upload_counts = run(async_clients, steps)
+
+    assert results == [True, False, True] * 2
+    assert upload_counts == {"written": 4, "skipped": 2}
+
+
+def test_upload_many_reports_every_failed_blob(async_clients, blob_service):
+    async def steps(client):
+        await client.upload_many(RESOURCE_FOLDER, [(f"page_{number}.json", {"value": RECORDS[number:]})
+                                                   for number in range(5)], max_workers=2)
+        with pytest.raises(RuntimeError, match=r"2 of 3 blobs.*bad_1.json.*bad_2.json"):
+            await client.upload_many(RESOURCE_FOLDER, [("bad_1.json", {"value": {1}}), ("good.json", {"value": []}),
+                                                       ("bad_2.json", {"value": {2}})])
+
+    run(async_clients, steps)
+
+    assert {path.rsplit("/", 1)[-1] for path in blob_service.blobs} == \
+        {f"page_{number}.json" for number in range(5)} | {"good.json"}
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from tests.conftest import RESOURCE_FOLDER, stored_resources
+from utils.azure_resource_store import journal_blob_name
+from workflow.async_azure_workflow import AsyncAzureWorkflow
+
+
+def run_workflow(async_clients):
+    async def run():
+        async_clients()
+        workflow = AsyncAzureWorkflow()
+        try:
+            await workflow.on_start()
+        finally:
+            await workflow.close(release_clients=True)
+        return workflow
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def settings(settings, monkeypatch):
+    monkeypatch.setitem(settings, "records_per_page", 10)
+    return settings
+
+
+def test_full_scan_stores_every_resource(async_clients, blob_service, blob_client, tenant):
+    workflow = run_workflow(async_clients)
+
+    assert workflow.state == "end"
+    for subscription_id in tenant.subscription_ids:
+        expected = {resource["id"].lower() for resource in tenant.subscription_resources([subscription_id])}
+        assert set(stored_resources(blob_client, blob_service, subscription_id)) == expected
+        journal = blob_client.read_blob_file(RESOURCE_FOLDER, journal_blob_name(subscription_id, workflow.date_label))
+        assert journal["full_scan"] is True
+
+
+def test_change_runs_apply_changes_instead_of_merging_change_records(settings, async_clients, blob_service,
+                                                                     blob_client, tenant):
+    run_workflow(async_clients)
+    tenant.mutate(0.2)
+
+    run_workflow(async_clients)
+
+    for subscription_id in tenant.subscription_ids:
+        stored = stored_resources(blob_client, blob_service, subscription_id)
+        assert stored == {resource["id"].lower(): resource
+                          for resource in tenant.subscription_resources([subscription_id])}
+        assert not any(resource["type"] == "microsoft.resources/changes" for resource in stored.values())
+
+
+def test_change_runs_of_the_indexed_layout_update_the_store(settings, async_clients, blob_client, tenant,
+                                                            monkeypatch):
+    from utils.azure_resource_store import AzureResourceStore
+
+    monkeypatch.setitem(settings, "storage_layout", "indexed")
+    run_workflow(async_clients)
+    tenant.mutate(0.2)
+
+    run_workflow(async_clients)
+
+    for subscription_id in tenant.subscription_ids:
+        store = AzureResourceStore(blob_client, RESOURCE_FOLDER, subscription_id)
+        assert store.get(list(store.resources)) == {resource["id"]: resource for resource in
+                                                    tenant.subscription_resources([subscription_id])}
+
+
+@pytest.mark.parametrize("name, value", [("compaction", {"enabled": True}), ("scheduling", {"enabled": True}),
+                                         ("partitioned_snapshot", {"enabled": True}), ("page_merge", "table")])
+def test_settings_only_the_threaded_workflow_implements_are_rejected(settings, async_clients, monkeypatch, name,
+                                                                     value):
+    monkeypatch.setitem(settings, name, value)
+
+    with pytest.raises(ValueError, match=name):
+        run_workflow(async_clients)
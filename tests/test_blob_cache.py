@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from utils.blob_cache import DISK_EVICTION_TARGET, BlobCache
+
+
+def test_memory_tier_evicts_the_least_recently_used_entry():
+    cache = BlobCache(max_memory_bytes=30)
+    for key in "abc":
+        cache.put(key, f'"{key}"', key.encode() * 10)
+
+    cache.get("a")
+    cache.put("d", '"d"', b"d" * 10)
+
+    assert cache.get("b") is None
+    assert [cache.get(key)[0] for key in "acd"] == ['"a"', '"c"', '"d"']
+
+
+def test_entries_without_an_etag_or_larger_than_the_memory_tier_are_not_kept():
+    cache = BlobCache(max_memory_bytes=10)
+
+    cache.put("no-etag", None, b"data")
+    cache.put("large", '"large"', b"x" * 11)
+
+    assert cache.get("no-etag") is None
+    assert cache.get("large") is None
+
+
+def test_disk_tier_is_shared_with_later_instances(tmp_path):
+    BlobCache(disk_path=str(tmp_path)).put("container/blob.json", '"1"', b"{}", {"content_type": "application/json"})
+
+    cache = BlobCache(max_memory_bytes=0, disk_path=str(tmp_path))
+
+    assert cache.get("container/blob.json") == ('"1"', b"{}", {"content_type": "application/json"})
+
+
+def test_invalidate_removes_both_tiers(tmp_path):
+    cache = BlobCache(disk_path=str(tmp_path))
+    cache.put("container/blob.json", '"1"', b"{}")
+
+    cache.invalidate("container/blob.json")
+
+    assert cache.get("container/blob.json") is None
+    assert BlobCache(disk_path=str(tmp_path)).get("container/blob.json") is None
+    assert cache._disk_bytes == 0
+
+
+def test_disk_tier_evicts_the_least_recently_used_entries_below_the_target(tmp_path):
+    writer = BlobCache(max_memory_bytes=0, disk_path=str(tmp_path))
+    writer.put("container/a", '"a"', b"a" * 1000)
+    entry_size = os.path.getsize(writer._disk_path("container/a"))
+    cache = BlobCache(max_memory_bytes=0, disk_path=str(tmp_path), max_disk_bytes=entry_size * 7 // 2)
+    for age, key in enumerate("abc"):
+        cache.put(f"container/{key}", f'"{key}"', key.encode() * 1000)
+        os.utime(cache._disk_path(f"container/{key}"), (1_000_000 + age, 1_000_000 + age))
+
+    # Reading "a" makes it the most recently used, so "b" is the first to go
+    assert cache.get("container/a") is not None
+    cache.put("container/d", '"d"', b"d" * 1000)
+
+    remaining = {key for key in "abcd" if os.path.exists(cache._disk_path(f"container/{key}"))}
+    assert remaining == {"a", "c", "d"}
+    assert cache._disk_bytes <= cache.max_disk_bytes * DISK_EVICTION_TARGET
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_get_instance_follows_the_settings(settings, monkeypatch, tmp_path, enabled):
+    monkeypatch.setitem(settings, "blob_cache", {"enabled": enabled, "max_memory_bytes": 1024,
+                                                 "disk_path": str(tmp_path / "cache")})
+    monkeypatch.setattr(BlobCache, "_instance", None)
+    monkeypatch.setattr(BlobCache, "_initialized", False)
+
+    cache = BlobCache.get_instance()
+
+    if enabled:
+        assert (cache.max_memory_bytes, cache.disk_path) == (1024, str(tmp_path / "cache"))
+        assert BlobCache.get_instance() is cache
+    else:
+        assert cache is None
@@ -0,0 +1,84 @@
+import pytest
+
+from benchmarks.simulated_azure import SimulatedBlobClient
+from tests.conftest import RESOURCE_FOLDER
+from utils.azure_blob_service import DEFAULT_UPLOAD_SETTINGS, AzureBlobService
+from utils.serializers import get_serializer
+
+RECORDS = [{"id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/site{i}", "name": f"site{i}",
+            "properties": {"state": "Running"}} for i in range(200)]
+
+
+@pytest.fixture
+def upload_calls(monkeypatch):
+    """
+    Record the payload type and keyword arguments of every upload to the simulated service.
+    """
+    calls = []
+    upload_blob = SimulatedBlobClient.upload_blob
+
+    def recording_upload_blob(self, data, **kwargs):
+        calls.append((self.blob_name, type(data), kwargs))
+        return upload_blob(self, data, **kwargs)
+
+    monkeypatch.setattr(SimulatedBlobClient, "upload_blob", recording_upload_blob)
+    return calls
+
+
+@pytest.fixture
+def upload_settings(upload_settings):
+    upload_settings.update(skip_unchanged=False, max_single_put_size=1024, max_concurrency=3)
+    return upload_settings
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson_gzip"])
+def test_large_payloads_are_streamed_into_a_parallel_block_upload(blob_client, upload_settings, upload_calls,
+                                                                  output_format):
+    serializer = get_serializer(output_format)
+
+    blob_client.upload_data_to_blob(RESOURCE_FOLDER, "large", {"value": iter(RECORDS)}, serializer=serializer)
+
+    (_, data_type, kwargs), = upload_calls
+    assert data_type not in (bytes, str)
+    assert kwargs["max_concurrency"] == 3
+    assert kwargs["content_settings"].content_type == serializer.content_type
+    # Streamed uploads are not kept in the blob cache
+    assert blob_client.blob_cache.get(f"{RESOURCE_FOLDER}/large") is None
+    assert blob_client.read_blob_file(RESOURCE_FOLDER, "large") == {"value": RECORDS}
+
+
+def test_small_payloads_are_one_put_and_cached(blob_client, upload_settings, upload_calls):
+    blob_client.upload_data_to_blob(RESOURCE_FOLDER, "small", {"value": RECORDS[:2]})
+
+    (_, data_type, kwargs), = upload_calls
+    assert data_type is bytes and "max_concurrency" not in kwargs
+    assert blob_client.blob_cache.get(f"{RESOURCE_FOLDER}/small") is not None
+
+
+def test_upload_many_uploads_every_blob_and_lists_the_failures(blob_service, blob_client, upload_settings):
+    items = [(f"page_{number}.json", {"value": RECORDS[number:number + 5]}) for number in range(10)]
+    blob_client.upload_many(RESOURCE_FOLDER, items, max_workers=4)
+
+    with pytest.raises(RuntimeError, match=r"1 of 2 blobs.*bad.json"):
+        blob_client.upload_many(RESOURCE_FOLDER, [("bad.json", {"value": {1}}), ("good.json", {"value": []})])
+
+    for name, payload in items:
+        assert blob_client.read_blob_file(RESOURCE_FOLDER, name) == payload
+    assert f"{RESOURCE_FOLDER}/good.json" in blob_service.blobs
+    assert f"{RESOURCE_FOLDER}/bad.json" not in blob_service.blobs
+
+
+def test_delete_blobs_ignores_blobs_that_are_gone(blob_service, blob_client):
+    blob_client.upload_many(RESOURCE_FOLDER, [("a.json", {}), ("b.json", {})])
+
+    blob_client.delete_blobs(RESOURCE_FOLDER, ["a.json", "b.json", "missing.json"])
+
+    assert not any(path.startswith(RESOURCE_FOLDER) for path in blob_service.blobs)
+    assert blob_client.read_blob_file(RESOURCE_FOLDER, "a.json") is None
+
+
+def test_upload_settings_fill_in_defaults_for_missing_keys(settings, monkeypatch):
+    monkeypatch.setitem(settings, "blob_upload", {"max_concurrency": 16})
+    monkeypatch.setattr(AzureBlobService, "_upload_settings", None)
+
+    assert AzureBlobService.get_upload_settings() == {**DEFAULT_UPLOAD_SETTINGS, "max_concurrency": 16}
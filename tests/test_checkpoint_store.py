@@ -0,0 +1,234 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_checkpoint_store import AzureCheckpointStore
+
+LAST_EXECUTION_TIME = "2024-01-01T00:00:00"
+CURRENT_EXECUTION_TIME = "2024-01-02T00:00:00"
+
+
+def stored_checkpoint(blob_service):
+    blob = blob_service.get_blob_client(CONTAINER, "azure_checkpoint.json")
+    return json.loads(blob.download_blob().readall()) if blob.exists() else None
+
+
+def backdate(blob_service, subscription_id, seconds):
+    """
+    Make a subscription look as if its owner last wrote progress the given number of seconds ago.
+    """
+    checkpoint = stored_checkpoint(blob_service)
+    updated_at = datetime.utcnow() - timedelta(seconds=seconds)
+    checkpoint["subscriptions"][subscription_id]["updated_at"] = updated_at.isoformat()
+    blob_service.get_blob_client(CONTAINER, "azure_checkpoint.json").upload_blob(json.dumps(checkpoint), overwrite=True)
+
+
+@pytest.fixture
+def make_store(blob_service):
+    def make_store(**kwargs):
+        store = AzureCheckpointStore(container_name=CONTAINER, **kwargs)
+        store.start_run(LAST_EXECUTION_TIME, CURRENT_EXECUTION_TIME)
+        return store
+    return make_store
+
+
+def test_resumed_run_keeps_its_window_and_skips_completed_subscriptions(blob_service, make_store):
+    store = make_store()
+    store.claim(["a", "b"])
+    store.record_page("b", 3, "token-4")
+    store.flush()
+    store.mark_completed(["a"])
+
+    resumed = AzureCheckpointStore(container_name=CONTAINER, lease_seconds=0)
+    run = resumed.start_run("2024-01-02T00:00:00", "2024-01-03T00:00:00")
+
+    assert (run["last_execution_time"], run["current_execution_time"]) == (LAST_EXECUTION_TIME, CURRENT_EXECUTION_TIME)
+    assert resumed.pending(["a", "b", "c"]) == ["b", "c"]
+    assert resumed.get("b")["last_page"] == 3
+    assert resumed.get("b")["skip_token"] == "token-4"
+
+
+def test_resumed_run_keeps_the_date_label_it_started_with(blob_service):
+    AzureCheckpointStore(container_name=CONTAINER).start_run(LAST_EXECUTION_TIME, CURRENT_EXECUTION_TIME, "2024_01_01")
+
+    # Resumed after midnight
+    run = AzureCheckpointStore(container_name=CONTAINER).start_run(LAST_EXECUTION_TIME, "2024-01-02T01:00:00",
+                                                                   "2024_01_02")
+
+    assert run["date_label"] == "2024_01_01"
+
+
+def test_page_progress_is_not_carried_to_a_run_with_another_date_label(blob_service):
+    first = AzureCheckpointStore(container_name=CONTAINER, flush_pages=1)
+    first.start_run(LAST_EXECUTION_TIME, CURRENT_EXECUTION_TIME, "2024_01_01")
+    first.claim(["a"])
+    first.record_page("a", 4, "token-5")
+    first.mark_failed({"a": "boom"})
+
+    run = AzureCheckpointStore(container_name=CONTAINER, max_run_attempts=1).start_run(
+        CURRENT_EXECUTION_TIME, "2024-01-03T00:00:00", "2024_01_03")
+
+    # The earlier pages are stored under the closed run's date, so the new run scans from the first page
+    assert run["date_label"] == "2024_01_03"
+    assert (run["subscriptions"]["a"]["last_page"], run["subscriptions"]["a"]["skip_token"]) == (0, None)
+
+
+def test_page_progress_is_flushed_in_batches(blob_service, make_store):
+    store = make_store(flush_pages=3, flush_seconds=3600)
+    store.claim(["a"])
+
+    store.record_page("a", 1, "token-2")
+    store.record_page("a", 2, "token-3")
+    assert stored_checkpoint(blob_service)["subscriptions"]["a"]["last_page"] == 0
+
+    store.record_page("a", 3, "token-4")
+    entry = stored_checkpoint(blob_service)["subscriptions"]["a"]
+    assert (entry["last_page"], entry["skip_token"]) == (3, "token-4")
+
+
+def test_failed_subscriptions_keep_unflushed_progress(blob_service, make_store):
+    store = make_store(flush_pages=100, flush_seconds=3600)
+    store.claim(["a"])
+    store.record_page("a", 5, "token-6")
+
+    store.mark_failed({"a": "boom"})
+
+    entry = stored_checkpoint(blob_service)["subscriptions"]["a"]
+    assert (entry["status"], entry["last_page"], entry["skip_token"], entry["error"]) == ("failed", 5, "token-6", "boom")
+
+
+def test_claimed_subscriptions_are_not_claimed_twice(make_store):
+    first = make_store()
+    second = make_store()
+
+    assert first.claim(["a", "b"]) == ["a", "b"]
+    assert second.claim(["a", "b", "c"]) == ["c"]
+    assert second.pending(["a", "b", "c"]) == ["c"]
+
+
+def test_flush_renews_the_leases_of_subscriptions_in_progress(blob_service, make_store):
+    first = make_store(flush_seconds=3600)
+    first.claim(["a", "b"])
+    backdate(blob_service, "a", 120)
+    backdate(blob_service, "b", 120)
+    first.record_page("a", 1, "token-2")
+    first.flush()
+
+    # Only the subscriptions this invocation still holds are renewed; their leases outlast the stall
+    second = make_store(lease_seconds=60)
+    assert second.claim(["a", "b"]) == []
+    backdate(blob_service, "b", 120)
+    assert second.claim(["a", "b"]) == ["b"]
+
+
+def test_stalled_claims_are_taken_over_and_left_alone_on_failure(blob_service, make_store):
+    first = make_store()
+    first.claim(["a"])
+    backdate(blob_service, "a", 120)
+
+    second = make_store(lease_seconds=60)
+    assert second.claim(["a"]) == ["a"]
+    first.mark_failed({"a": "timed out"})
+
+    entry = stored_checkpoint(blob_service)["subscriptions"]["a"]
+    assert (entry["status"], entry["owner"]) == ("in_progress", second.owner)
+
+
+def test_concurrent_updates_are_merged(blob_service, make_store):
+    first = make_store()
+    second = make_store()
+    first.claim(["a"])
+    second.claim(["b"])
+
+    first.mark_completed(["a"])
+    second.mark_completed(["b"])
+
+    statuses = {subscription_id: entry["status"]
+                for subscription_id, entry in stored_checkpoint(blob_service)["subscriptions"].items()}
+    assert statuses == {"a": "completed", "b": "completed"}
+    assert first.run_completed(["a", "b"])
+
+
+def test_updates_stop_once_another_invocation_cleared_the_run(blob_service, make_store):
+    first = make_store(flush_pages=1)
+    second = make_store()
+    first.claim(["a"])
+    second.claim(["b"])
+    second.mark_completed(["b"])
+    second.clear()
+    assert stored_checkpoint(blob_service) is None
+
+    first.record_page("a", 1, "token-2")
+    first.mark_completed(["a"])
+
+    assert first.claim(["c"]) == []
+    assert stored_checkpoint(blob_service) is None
+    assert first.run_completed(["a"])
+
+
+def test_updates_without_a_run_fail(blob_service):
+    store = AzureCheckpointStore(container_name=CONTAINER)
+
+    with pytest.raises(RuntimeError):
+        store.mark_completed(["a"])
+
+
+def run_once(store, subscription_ids, failing, current_execution_time):
+    """
+    One timer invocation: start or resume the run, process its pending subscriptions, fail the failing ones.
+    :return: (run window, subscriptions processed)
+    """
+    run = store.start_run(LAST_EXECUTION_TIME, current_execution_time)
+    processed = store.claim(store.pending(subscription_ids))
+    store.mark_completed([subscription_id for subscription_id in processed if subscription_id not in failing])
+    store.mark_failed({subscription_id: "boom" for subscription_id in processed if subscription_id in failing})
+    if store.run_completed(subscription_ids):
+        store.clear()
+    return run["current_execution_time"], processed
+
+
+def test_a_subscription_that_keeps_failing_does_not_freeze_the_others(blob_service):
+    store = AzureCheckpointStore(container_name=CONTAINER, max_run_attempts=2)
+    invocations = [run_once(store, ["a", "b"], {"b"}, f"2024-01-0{day}T00:00:00") for day in range(2, 7)]
+
+    # Every second invocation closes the run; "a" is scanned again on the new window, "b" keeps being retried
+    assert invocations == [
+        ("2024-01-02T00:00:00", ["a", "b"]),
+        ("2024-01-02T00:00:00", ["b"]),
+        ("2024-01-04T00:00:00", ["a", "b"]),
+        ("2024-01-04T00:00:00", ["b"]),
+        ("2024-01-06T00:00:00", ["a", "b"]),
+    ]
+
+
+def test_a_closed_run_carries_over_the_progress_of_unfinished_subscriptions(blob_service, make_store):
+    first = make_store(flush_pages=1)
+    first.claim(["a", "b", "c"])
+    first.mark_completed(["a"])
+    first.record_page("b", 4, "token-5")
+    first.mark_failed({"b": "boom"})
+    first.enqueue(["d"])
+
+    second = AzureCheckpointStore(container_name=CONTAINER, max_run_attempts=1)
+    run = second.start_run(CURRENT_EXECUTION_TIME, "2024-01-03T00:00:00")
+
+    assert (run["last_execution_time"], run["current_execution_time"], run["attempts"]) == \
+        (CURRENT_EXECUTION_TIME, "2024-01-03T00:00:00", 1)
+    assert set(run["subscriptions"]) == {"b", "c", "d"}
+    assert (run["subscriptions"]["b"]["last_page"], run["subscriptions"]["b"]["skip_token"]) == (4, "token-5")
+    # "c" is still leased by the first invocation, the queued "d" is released
+    assert second.pending(["a", "b", "c", "d"]) == ["a", "b", "d"]
+
+
+def test_old_runs_are_closed(blob_service, make_store):
+    make_store().claim(["a"])
+    checkpoint = stored_checkpoint(blob_service)
+    checkpoint["started_at"] = (datetime.utcnow() - timedelta(hours=7)).isoformat()
+    blob_service.get_blob_client(CONTAINER, "azure_checkpoint.json").upload_blob(json.dumps(checkpoint), overwrite=True)
+
+    run = AzureCheckpointStore(container_name=CONTAINER, max_run_age_seconds=6 * 3600).start_run(
+        CURRENT_EXECUTION_TIME, "2024-01-03T00:00:00")
+
+    assert run["current_execution_time"] == "2024-01-03T00:00:00"
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+from tests.conftest import CONTAINER
+from utils.conditional_save import save_with_retries, write_if_unchanged
+
+
+@pytest.fixture
+def blob(blob_service):
+    return blob_service.get_container_client(CONTAINER).get_blob_client("document.json")
+
+
+def stored(blob):
+    return json.loads(blob.download_blob().readall())
+
+
+def test_write_if_unchanged_requires_the_etag_last_read(blob):
+    etag = write_if_unchanged(blob, {"version": 1}, None)
+
+    with pytest.raises(ResourceExistsError):
+        write_if_unchanged(blob, {"version": 0}, None)
+    write_if_unchanged(blob, {"version": 2}, etag)
+    with pytest.raises(ResourceModifiedError):
+        write_if_unchanged(blob, {"version": 3}, etag)
+    assert stored(blob) == {"version": 2}
+
+
+def test_a_conflicting_save_is_reapplied_to_the_reloaded_copy(blob):
+    write_if_unchanged(blob, {"counts": {"other": 1}}, None)
+    copy = {"data": {"counts": {}}, "etag": None}
+
+    def prepare():
+        copy["data"]["counts"]["mine"] = 1
+        return copy["data"], copy["etag"]
+
+    def reload():
+        downloader = blob.download_blob()
+        copy["data"], copy["etag"] = json.loads(downloader.readall()), downloader.properties.etag
+
+    etag = save_with_retries(blob, prepare, reload, max_attempts=3)
+
+    assert etag is not None
+    assert stored(blob) == {"counts": {"other": 1, "mine": 1}}
+
+
+def test_save_gives_up_when_reload_says_so_or_the_attempts_run_out(blob):
+    write_if_unchanged(blob, {}, None)
+    reloads = []
+
+    assert save_with_retries(blob, lambda: ({}, None), lambda: False, max_attempts=3) is None
+    assert save_with_retries(blob, lambda: ({}, None), lambda: reloads.append(1), max_attempts=3) is None
+    assert len(reloads) == 3
@@ -0,0 +1,115 @@
+from tests.conftest import CONTAINER
+from utils.content_hash import CONTENT_HASH_METADATA_KEY, ContentHasher
+from utils.serializers import JsonSerializer, NdjsonSerializer, get_serializer
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+BLOB_NAME = "resource_s_2024_01_01_page_1.json"
+
+RECORDS = [{"id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/site{i}", "name": f"site{i}",
+            "properties": {"state": "Running", "httpsOnly": True}} for i in range(20)]
+
+
+def reordered(record):
+    return {key: reordered(value) if isinstance(value, dict) else value for key, value in reversed(record.items())}
+
+
+def content_hash(payload, serializer):
+    hasher = ContentHasher(serializer)
+    wrapped = hasher.wrap(payload)
+    if isinstance(wrapped, dict) and "value" in wrapped:
+        list(wrapped["value"])
+    return hasher.hexdigest()
+
+
+def test_hash_ignores_key_order():
+    assert content_hash({"value": RECORDS}, JsonSerializer()) == \
+        content_hash({"value": [reordered(record) for record in RECORDS]}, JsonSerializer())
+
+
+def test_hash_depends_on_content_and_format():
+    changed = [dict(RECORDS[0], name="renamed")] + RECORDS[1:]
+
+    assert content_hash({"value": RECORDS}, JsonSerializer()) != content_hash({"value": changed}, JsonSerializer())
+    assert content_hash({"value": RECORDS}, JsonSerializer()) != content_hash({"value": RECORDS}, NdjsonSerializer())
+    assert content_hash({"value": RECORDS}, NdjsonSerializer()) != \
+        content_hash({"value": RECORDS}, NdjsonSerializer(compression="gzip"))
+
+
+def test_wrapped_records_are_passed_through_once():
+    hasher = ContentHasher(JsonSerializer())
+
+    wrapped = hasher.wrap({"value": iter(RECORDS)})
+
+    assert list(wrapped["value"]) == RECORDS
+    assert hasher.hexdigest() == content_hash({"value": RECORDS}, JsonSerializer())
+
+
+def test_unchanged_upload_is_skipped(blob_service, blob_client, upload_settings):
+    assert blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    etag = blob_service.blobs[f"{RESOURCE_CONTAINER}/{BLOB_NAME}"]["etag"]
+
+    assert not blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME,
+                                               {"value": [reordered(record) for record in RECORDS]})
+
+    assert blob_service.blobs[f"{RESOURCE_CONTAINER}/{BLOB_NAME}"]["etag"] == etag
+    assert blob_client.upload_counts == {"written": 1, "skipped": 1}
+
+
+def test_changed_upload_is_written_with_its_hash(blob_service, blob_client, upload_settings):
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    changed = RECORDS[:-1]
+
+    assert blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": changed})
+
+    metadata = blob_service.blobs[f"{RESOURCE_CONTAINER}/{BLOB_NAME}"]["metadata"]
+    assert metadata[CONTENT_HASH_METADATA_KEY] == content_hash({"value": changed}, JsonSerializer())
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, BLOB_NAME) == {"value": changed}
+
+
+def test_a_change_after_a_read_is_written_without_a_properties_request(blob_service, blob_client, upload_settings):
+    from utils.azure_blob_client import AzureBlobClient
+
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    other_client = AzureBlobClient()
+    other_client.blob_cache = None
+
+    # A page merge reads the page first; the different hash in its metadata spares the properties request
+    assert list(other_client.iter_blob_records(RESOURCE_CONTAINER, BLOB_NAME)) == RECORDS
+    properties_requests = blob_service.stats.get("properties", 0)
+    assert other_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": iter(RECORDS[1:])})
+    assert blob_service.stats.get("properties", 0) == properties_requests
+
+
+def test_a_skip_after_a_read_is_confirmed_against_the_stored_blob(blob_service, blob_client, upload_settings):
+    from utils.azure_blob_client import AzureBlobClient
+
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    other_client = AzureBlobClient()
+    other_client.blob_cache = None
+    other_client.read_blob_file(RESOURCE_CONTAINER, BLOB_NAME)
+
+    # Someone else writes the blob after the read
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS[:5]})
+
+    assert other_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, BLOB_NAME) == {"value": RECORDS}
+    assert not other_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+
+
+def test_large_payloads_are_spooled_and_skipped(blob_service, blob_client, upload_settings):
+    upload_settings["max_single_put_size"] = 256
+    serializer = get_serializer("ndjson_gzip")
+
+    assert blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": iter(RECORDS)}, serializer=serializer)
+    assert not blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": iter(RECORDS)},
+                                               serializer=serializer)
+    assert list(blob_client.iter_blob_records(RESOURCE_CONTAINER, BLOB_NAME)) == RECORDS
+
+
+def test_every_upload_is_written_without_skip_unchanged(blob_client, upload_settings):
+    upload_settings["skip_unchanged"] = False
+
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, BLOB_NAME, {"value": RECORDS})
+
+    assert blob_client.upload_counts == {"written": 2, "skipped": 0}
@@ -0,0 +1,189 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import shared.metrics
+from shared.metrics import InMemoryExporter, Metrics, OpenTelemetryExporter, increment, measure_run, span, timed
+
+
+class Clock:
+    """
+    Stand-in for the time module of shared.metrics that only moves when told to.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return 1_700_000_000 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(shared.metrics, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def exporter(settings, monkeypatch):
+    """
+    Enable metrics with the in-memory exporter and return that exporter.
+    """
+    monkeypatch.setitem(settings, "metrics", {"enabled": True, "exporters": ["memory"]})
+    monkeypatch.setattr(Metrics, "_instance", None)
+    monkeypatch.setattr(Metrics, "_initialized", False)
+    (exporter,) = Metrics.get_instance().exporters
+    return exporter
+
+
+def test_self_seconds_exclude_the_time_spent_in_child_spans(exporter, clock):
+    with span("state.fetch"):
+        clock.now += 1
+        with span("blob.read", blob="a.json"):
+            clock.now += 3
+        clock.now += 0.5
+
+    child, parent = exporter.spans
+    assert (child.name, child.attributes, child.seconds) == ("blob.read", {"blob": "a.json"}, 3)
+    assert (parent.name, parent.seconds, parent.self_seconds) == ("state.fetch", 4.5, 1.5)
+
+
+def test_errors_are_recorded_on_the_span_and_raised(exporter):
+    with pytest.raises(KeyError):
+        with span("blob.read"):
+            raise KeyError("a.json")
+
+    (recorded,) = exporter.spans
+    assert recorded.error == "KeyError: 'a.json'"
+    assert Metrics.get_instance().summary()["spans"]["blob.read"]["errors"] == 1
+
+
+def test_summary_since_a_snapshot_only_covers_what_came_after_it(exporter, clock):
+    metrics = Metrics.get_instance()
+    with span("blob.read"):
+        clock.now += 10
+    increment("bytes", 100)
+    since = metrics.snapshot()
+
+    for milliseconds in range(1, 101):
+        with span("blob.read"):
+            clock.now += milliseconds / 1000
+    increment("bytes", 5, blob="a.json")
+    increment("records")
+
+    summary = metrics.summary(since=since)
+
+    assert summary["counters"] == {"bytes": 5, "records": 1}
+    stats = summary["spans"]["blob.read"]
+    assert stats["count"] == 100 and stats["errors"] == 0
+    assert (stats["p50_ms"], stats["p99_ms"], stats["max_ms"]) == (50, 99, 100)
+    assert metrics.summary()["spans"]["blob.read"]["count"] == 101
+    assert exporter.counters[-2] == ("bytes", 5, {"blob": "a.json"})
+
+
+def test_measure_run_exports_the_summary_of_the_run(exporter, clock):
+    with measure_run("workflow.run", mode="full") as run_summary:
+        with span("blob.read"):
+            clock.now += 2
+
+    assert exporter.summaries == [run_summary]
+    assert set(run_summary["spans"]) == {"blob.read", "workflow.run"}
+    assert exporter.spans[-1].attributes == {"mode": "full"}
+
+
+def test_timed_wraps_functions_and_coroutines(exporter):
+    @timed()
+    def fetch():
+        return "page"
+
+    @timed("resources.fetch_async")
+    async def fetch_async():
+        return "page"
+
+    assert fetch() == "page"
+    assert asyncio.run(fetch_async()) == "page"
+    assert [recorded.name for recorded in exporter.spans] == [fetch.__qualname__, "resources.fetch_async"]
+
+
+def test_disabled_metrics_record_nothing(settings, monkeypatch):
+    monkeypatch.setitem(settings, "metrics", {"enabled": False})
+    monkeypatch.setattr(Metrics, "_instance", None)
+    monkeypatch.setattr(Metrics, "_initialized", False)
+
+    with measure_run("workflow.run") as run_summary:
+        with span("blob.read"):
+            increment("bytes", 10)
+
+    assert Metrics.get_instance() is None
+    assert run_summary == {}
+
+
+def test_unknown_exporters_are_rejected(settings, monkeypatch):
+    monkeypatch.setitem(settings, "metrics", {"enabled": True, "exporters": ["memory", "statsd"]})
+    monkeypatch.setattr(Metrics, "_instance", None)
+    monkeypatch.setattr(Metrics, "_initialized", False)
+
+    with pytest.raises(ValueError, match="statsd"):
+        Metrics.get_instance()
+
+
+def test_the_opentelemetry_exporter_needs_the_opentelemetry_api(monkeypatch):
+    monkeypatch.setitem(sys.modules, "opentelemetry", None)
+
+    with pytest.raises(ValueError, match="opentelemetry-api"):
+        OpenTelemetryExporter()
+
+
+def test_the_opentelemetry_exporter_forwards_spans_and_counters(monkeypatch, clock):
+    calls = []
+
+    class Recorder:
+        def __init__(self, kind):
+            self.kind = kind
+
+        def __getattr__(self, method):
+            def record(*args, **kwargs):
+                calls.append((self.kind, method, args, kwargs))
+                return self
+            return record
+
+    trace = SimpleNamespace(get_tracer=lambda name: Recorder("tracer"), Status=lambda code, message: message,
+                            StatusCode=SimpleNamespace(ERROR="error"))
+    meter = SimpleNamespace(get_meter=lambda name: Recorder("meter"))
+    monkeypatch.setitem(sys.modules, "opentelemetry", SimpleNamespace(trace=trace, metrics=meter))
+
+    metrics = Metrics([OpenTelemetryExporter()])
+    with pytest.raises(RuntimeError):
+        with metrics.span("blob.read", blob="a.json", size=None, tags=["x"]):
+            clock.now += 2
+            raise RuntimeError("boom")
+    metrics.increment("bytes", 10, blob="a.json")
+    metrics.increment("bytes", 5)
+
+    start, status, end = calls[:3]
+    start_ns = int(1_700_000_000 * 1e9)
+    assert start[1:] == ("start_span", ("blob.read",), {"start_time": start_ns,
+                                                         "attributes": {"blob": "a.json", "tags": "['x']"}})
+    assert status[1:3] == ("set_status", ("RuntimeError: boom",))
+    assert end[3] == {"end_time": start_ns + int(2e9)}
+    # One counter instrument per name, reused for later increments
+    assert [call[1] for call in calls[3:]] == ["create_counter", "add", "add"]
+    assert calls[4][2:] == ((10,), {"attributes": {"blob": "a.json"}})
+
+
+def test_the_in_memory_exporter_keeps_everything_handed_to_it():
+    exporter = InMemoryExporter()
+    metrics = Metrics([exporter])
+
+    with metrics.span("blob.read"):
+        metrics.increment("records", 3)
+    metrics.export_summary(metrics.summary())
+
+    assert [recorded.name for recorded in exporter.spans] == ["blob.read"]
+    assert exporter.counters == [("records", 3, {})]
+    assert exporter.summaries[0]["counters"] == {"records": 3}
@@ -0,0 +1,67 @@
+import pytest
+
+import utils.azure_subscription_client
+from utils.azure_subscription_client import balance_partitions
+
+
+def all_rows(pages):
+    return [row for page in pages for row in page]
+
+
+def test_balance_partitions_spreads_groups_evenly():
+    counts = {"vm": 50, "disk": 30, "nic": 20, "ip": 20, "vnet": 10, "nsg": 10}
+
+    bins = balance_partitions(counts, 3)
+
+    assert sorted(group for groups in bins for group in groups) == sorted(counts)
+    assert sorted(sum(counts[group] for group in groups) for groups in bins) == [40, 50, 50]
+
+
+def test_balance_partitions_never_returns_empty_bins():
+    assert balance_partitions({"vm": 5, "disk": 1}, 8) == [["vm"], ["disk"]]
+    assert balance_partitions({}, 4) == []
+
+
+@pytest.mark.parametrize("partition_by", ["type", "resourceGroup", "id_hash"])
+def test_partition_queries_cover_every_resource_once(tenant, resource_graph_client, subscription_client,
+                                                     partition_by):
+    subscription_id = tenant.subscription_ids[0]
+
+    queries = subscription_client._partition_queries(subscription_id, partition_by, 4)
+
+    assert len(queries) > 1
+    ids = [row["id"] for query in queries for row in all_rows(subscription_client._query_pages([subscription_id], query, 1000))]
+    assert sorted(ids) == sorted(resource["id"] for resource in tenant.subscription_resources([subscription_id]))
+
+
+def test_partition_queries_fall_back_to_id_hash_for_many_groups(monkeypatch, tenant, subscription_client):
+    monkeypatch.setattr(utils.azure_subscription_client, "MAX_PARTITION_GROUPS", 3)
+
+    queries = subscription_client._partition_queries(tenant.subscription_ids[0], "resourceGroup", 4)
+
+    assert queries == [f"resources | where hash(tolower(id), 4) == {i}" for i in range(4)]
+
+
+def test_partitioned_snapshot_keeps_the_first_page(tenant, resource_graph_client, subscription_client):
+    subscription_id = tenant.subscription_ids[0]
+
+    pages = list(subscription_client.get_resources_snapshot_partitioned(subscription_id, 5, partition_by="type",
+                                                                        partitions=4, min_resources=10))
+
+    ids = [row["id"] for row in all_rows(pages)]
+    first_page_ids = [row["id"] for row in tenant.subscription_resources([subscription_id])[:5]]
+    assert [row["id"] for row in pages[0]] == first_page_ids
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(resource["id"] for resource in tenant.subscription_resources([subscription_id]))
+    assert all(page.skip_token is None for page in pages)
+
+
+def test_small_subscriptions_follow_one_skip_token_chain(tenant, resource_graph_client, subscription_client):
+    subscription_id = tenant.subscription_ids[0]
+
+    pages = list(subscription_client.get_resources_snapshot_partitioned(subscription_id, 15, partitions=4,
+                                                                        min_resources=1000))
+
+    assert [len(page) for page in pages] == [15, 15, 10]
+    assert [page.skip_token is None for page in pages] == [False, False, True]
+    assert resource_graph_client.stats["requests"] == 3
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from shared.prefetch import prefetch, prefetch_many
+
+
+class Source:
+    """
+    Iterable that counts the items handed out and the threads iterating over it at the same time.
+    """
+    active = 0
+    most_active = 0
+    lock = threading.Lock()
+
+    def __init__(self, items, error=None, delay=0.0):
+        self.items = items
+        self.error = error
+        self.delay = delay
+        self.produced = 0
+
+    def __iter__(self):
+        with Source.lock:
+            Source.active += 1
+            Source.most_active = max(Source.most_active, Source.active)
+        try:
+            for item in self.items:
+                time.sleep(self.delay)
+                self.produced += 1
+                yield item
+            if self.error is not None:
+                raise self.error
+        finally:
+            with Source.lock:
+                Source.active -= 1
+
+
+@pytest.fixture(autouse=True)
+def reset_source():
+    Source.active = Source.most_active = 0
+
+
+def wait_until_settled(source, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    produced = -1
+    while produced != source.produced and time.monotonic() < deadline:
+        produced = source.produced
+        time.sleep(0.15)
+    return source.produced
+
+
+def test_items_are_handed_over_in_order():
+    assert list(prefetch(Source(range(50)), max_buffered=3)) == list(range(50))
+
+
+def test_the_producer_runs_at_most_max_buffered_items_ahead():
+    source = Source(range(100))
+    items = prefetch(source, max_buffered=4)
+
+    assert [next(items) for _ in range(2)] == [0, 1]
+
+    # Four items wait in the queue and one more in the producer's hand
+    assert wait_until_settled(source) <= 2 + 4 + 1
+    items.close()
+
+
+def test_producer_errors_are_raised_after_the_items_before_them():
+    items = prefetch(Source(range(3), error=ValueError("page 4 failed")), max_buffered=2)
+
+    assert [next(items) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError, match="page 4 failed"):
+        next(items)
+
+
+def test_a_consumer_that_stops_early_stops_the_producer():
+    items = prefetch(Source(range(1000)), max_buffered=2, name="early-stop")
+    next(items)
+
+    items.close()
+
+    assert not any(thread.name == "early-stop" for thread in threading.enumerate())
+
+
+def test_prefetch_many_yields_every_item_with_at_most_max_workers_sources_at_once():
+    sources = [Source([(number, item) for item in range(10)], delay=0.001) for number in range(6)]
+
+    items = list(prefetch_many(sources, max_workers=2, max_buffered=4))
+
+    assert sorted(items) == [(number, item) for number in range(6) for item in range(10)]
+    assert Source.most_active == 2
+    # Each source is consumed by one thread, so its own items stay in order
+    for number in range(6):
+        assert [item for source, item in items if source == number] == list(range(10))
+
+
+def test_prefetch_many_raises_the_first_producer_error():
+    sources = [Source(range(5)), Source(range(2), error=RuntimeError("partition failed")), Source(range(5))]
+
+    with pytest.raises(RuntimeError, match="partition failed"):
+        list(prefetch_many(sources, max_workers=3, max_buffered=2))
@@ -0,0 +1,69 @@
+import pytest
+
+from utils.query_profiles import DEFAULT_PROFILE, QueryProfile, get_query_profiles
+
+PROFILES = {
+    "inventory": {"project": ["name", "type", "location"], "changes_project": ["properties"]},
+    "compute": {
+        "types": ["microsoft.compute/virtualmachines", "microsoft.compute/disks"],
+        "where": "isnotempty(location)",
+        "project": ["name", "id", "vmSize = tostring(properties.hardwareProfile.vmSize)"],
+    },
+}
+
+
+def test_the_default_profile_runs_the_plain_queries_in_the_resource_folder():
+    (profile,) = get_query_profiles({})
+
+    assert profile is DEFAULT_PROFILE
+    assert profile.resources_query() == "resources"
+    assert profile.resources_query(where="id in~ (\"a\")") == "resources | where id in~ (\"a\")"
+    assert profile.changes_query(0.25) == ("resourcechanges | where "
+                                           "todatetime(properties.changeAttributes.timestamp) > ago(1h)")
+    assert profile.container_name("resources") == "resources"
+    assert profile.stored_columns is None and not profile.has_computed_columns
+
+
+def test_profiles_are_returned_in_the_order_the_run_lists_them():
+    config = {"query_profiles": {"default": {}, **PROFILES}, "run_query_profiles": ["compute", "default", "inventory"]}
+
+    profiles = get_query_profiles(config)
+
+    assert [profile.name for profile in profiles] == ["compute", "default", "inventory"]
+    assert [profile.container_name("resources") for profile in profiles] == [
+        "resources/compute", "resources", "resources/inventory"]
+
+
+def test_filters_are_applied_before_the_projection():
+    (profile,) = get_query_profiles({"query_profiles": PROFILES, "run_query_profiles": ["compute"]})
+
+    assert profile.resources_query(where="hash(tolower(id), 4) == 1") == (
+        'resources | where type in~ ("microsoft.compute/virtualmachines", "microsoft.compute/disks")'
+        " | where isnotempty(location) | where hash(tolower(id), 4) == 1"
+        " | project subscriptionId, name, id, vmSize = tostring(properties.hardwareProfile.vmSize)")
+    assert profile.resources_query(project=False).endswith("| where isnotempty(location)")
+    assert profile.changes_query(6) == (
+        "resourcechanges | where todatetime(properties.changeAttributes.timestamp) > ago(6h)"
+        ' | where tostring(properties.targetResourceType) in~ ("microsoft.compute/virtualmachines",'
+        ' "microsoft.compute/disks")')
+
+
+def test_projections_always_keep_the_id_and_subscription_columns():
+    profile = QueryProfile.from_config("inventory", PROFILES["inventory"])
+
+    assert profile.project == ["id", "subscriptionId", "name", "type", "location"]
+    assert profile.changes_project == ["id", "subscriptionId", "properties"]
+    assert profile.stored_columns == {"id", "subscriptionId", "name", "type", "location"}
+    assert not profile.has_computed_columns
+    assert QueryProfile("computed", project=["id = tolower(id)"]).project == ["subscriptionId", "id = tolower(id)"]
+
+
+@pytest.mark.parametrize("config, message", [
+    ({"run_query_profiles": []}, "at least one"),
+    ({"run_query_profiles": ["storage"]}, "Unknown query profile: storage"),
+    ({"query_profiles": {"storage": {"types": ["x"], "summarize": "count()"}}, "run_query_profiles": ["storage"]},
+     "Unsupported options in query profile storage: summarize"),
+])
+def test_invalid_profile_settings_are_rejected(config, message):
+    with pytest.raises(ValueError, match=message):
+        get_query_profiles(config)
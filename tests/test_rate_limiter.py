@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import shared.rate_limiter
+from shared.rate_limiter import RateLimiter, RateLimitPolicy, rate_limited_client_kwargs
+
+
+class Clock:
+    """
+    Stand-in for the time and asyncio modules of shared.rate_limiter: sleeping advances the clock.
+    """
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(shared.rate_limiter, "time", clock)
+    monkeypatch.setattr(shared.rate_limiter, "asyncio", SimpleNamespace(sleep=clock.async_sleep))
+    return clock
+
+
+@pytest.fixture
+def limiter(clock):
+    return RateLimiter(requests_per_window=3, window_seconds=3, jitter_seconds=0)
+
+
+def quota_headers(remaining, resets_after="00:00:04"):
+    return {"x-ms-user-quota-remaining": str(remaining), "x-ms-user-quota-resets-after": resets_after}
+
+
+def test_a_full_bucket_is_spent_without_waiting_and_then_refills_at_the_window_rate(limiter, clock):
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.slept == []
+
+    limiter.acquire()
+
+    assert clock.slept == [1.0]
+
+
+def test_the_async_acquire_waits_like_the_blocking_one(limiter, clock):
+    async def acquire(count):
+        for _ in range(count):
+            await limiter.acquire_async()
+
+    asyncio.run(acquire(5))
+
+    assert sum(clock.slept) == 2.0
+
+
+def test_reported_remaining_quota_caps_the_bucket_until_the_reported_reset(limiter, clock):
+    limiter.update_from_headers(quota_headers(1))
+
+    limiter.acquire()
+    assert clock.slept == []
+    limiter.acquire()
+
+    # No refill in between: the bucket waits for the reset the service reported, then is full again
+    assert clock.slept == [4.0]
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.slept == [4.0]
+
+
+@pytest.mark.parametrize("headers", [{}, {"x-ms-user-quota-remaining": "many"}])
+def test_missing_or_malformed_quota_headers_are_ignored(limiter, clock, headers):
+    limiter.update_from_headers(headers)
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert clock.slept == []
+
+
+def test_a_throttled_response_pauses_every_caller_for_its_retry_after(limiter, clock):
+    policy = RateLimitPolicy(limiter)
+    response = SimpleNamespace(http_response=SimpleNamespace(status_code=429, headers={"Retry-After": "7"}))
+
+    policy.on_response(None, response)
+    policy.on_request(None)
+
+    # The bucket is emptied and refills during the pause
+    assert clock.slept == [7.0]
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.slept == [7.0]
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_client_kwargs_disable_pipeline_retries_with_or_without_the_limiter(settings, monkeypatch, enabled):
+    monkeypatch.setitem(settings, "rate_limit", {**settings["rate_limit"], "enabled": enabled})
+    monkeypatch.setattr(RateLimiter, "_instance", None)
+    monkeypatch.setattr(RateLimiter, "_initialized", False)
+
+    kwargs = rate_limited_client_kwargs()
+
+    assert kwargs["retry_total"] == 0
+    if enabled:
+        (policy,) = kwargs["per_retry_policies"]
+        assert policy.rate_limiter is RateLimiter.get_instance()
+    else:
+        assert "per_retry_policies" not in kwargs
@@ -0,0 +1,206 @@
+import copy
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_resource_store import AzureResourceStore, DatedPageStore, journal_blob_name
+from utils.query_profiles import QueryProfile
+from utils.resource_delta import ResourceDeltaApplier, apply_property_change
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def make_resource(name, **properties):
+    return {
+        "id": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/{name}",
+        "name": name,
+        "subscriptionId": SUBSCRIPTION_ID,
+        "tags": {"env": "dev"},
+        "properties": {"provisioningState": "Succeeded", "settings": {"size": 1}, **properties},
+    }
+
+
+def make_change(resource, change_type, changes=None, timestamp="2024-01-01T00:00:00Z"):
+    return {
+        "id": f"{resource['id']}/providers/Microsoft.Resources/changes/{change_type}",
+        "properties": {
+            "targetResourceId": resource["id"],
+            "changeType": change_type,
+            "changeAttributes": {"timestamp": timestamp},
+            "changes": changes or {},
+        },
+    }
+
+
+class StubSubscriptionClient:
+    """
+    Answers get_resources_by_ids from a dictionary and records the requested ids.
+    """
+    def __init__(self, resources):
+        self.resources = {resource["id"].lower(): resource for resource in resources}
+        self.requested = []
+
+    def get_resources_by_ids(self, subscription_ids, resource_ids, profile=None):
+        self.requested.extend(resource_ids)
+        return [copy.deepcopy(self.resources[resource_id.lower()]) for resource_id in resource_ids
+                if resource_id.lower() in self.resources]
+
+
+@pytest.fixture
+def stored_resources():
+    return [make_resource("vm-1"), make_resource("vm-2"), make_resource("vm-3")]
+
+
+@pytest.fixture
+def resource_store(blob_client, stored_resources):
+    store = AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, full_scan=True)
+    store.add_page(copy.deepcopy(stored_resources))
+    store.finish()
+    return AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID)
+
+
+def test_apply_property_change_updates_nested_values_and_list_items():
+    resource = make_resource("vm-1", ipConfigurations=[{"name": "ipconfig0"}])
+
+    assert apply_property_change(resource, "properties.settings.size", "Update", 2)
+    assert apply_property_change(resource, "properties.ipConfigurations[0].name", "Update", "primary")
+    assert apply_property_change(resource, "properties.ipConfigurations[1]", "Insert", {"name": "ipconfig1"})
+    assert apply_property_change(resource, "tags.env", "Remove", None)
+
+    assert resource["properties"]["settings"]["size"] == 2
+    assert resource["properties"]["ipConfigurations"] == [{"name": "primary"}, {"name": "ipconfig1"}]
+    assert resource["tags"] == {}
+
+
+def test_apply_property_change_restores_the_stored_type_of_string_values():
+    resource = make_resource("vm-1")
+
+    assert apply_property_change(resource, "properties.settings.size", "Update", "4")
+
+    assert resource["properties"]["settings"]["size"] == 4
+
+
+def test_apply_property_change_does_not_create_missing_intermediate_objects():
+    resource = make_resource("vm-1")
+    original = copy.deepcopy(resource)
+
+    assert not apply_property_change(resource, "properties.networkProfile.primary", "Insert", True)
+    assert not apply_property_change(resource, "properties.settings.missing.value", "Remove", None)
+
+    assert resource == original
+
+
+def test_applier_patches_fetches_and_deletes(blob_client, resource_store, stored_resources):
+    vm_1, vm_2, vm_3 = stored_resources
+    vm_4 = make_resource("vm-4")
+    client = StubSubscriptionClient([vm_4])
+    applier = ResourceDeltaApplier(resource_store, client, SUBSCRIPTION_ID)
+
+    applier.add_page([
+        make_change(vm_1, "Update", {"properties.settings.size": {"propertyChangeType": "Update", "newValue": 8}}),
+        make_change(vm_2, "Delete"),
+        make_change(vm_4, "Create"),
+    ])
+    applier.finish()
+
+    assert client.requested == [vm_4["id"]]
+    assert applier.stats == {"changes": 3, "deleted": 1, "patched": 1, "fetched": 1, "skipped": 0}
+    store = AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID)
+    assert set(store.resources) == {vm_1["id"], vm_3["id"], vm_4["id"]}
+    assert store.get([vm_1["id"]])[vm_1["id"]]["properties"]["settings"]["size"] == 8
+
+
+def test_applier_fetches_changes_that_do_not_resolve_against_the_snapshot(resource_store, stored_resources):
+    vm_1 = stored_resources[0]
+    fetched = make_resource("vm-1", networkProfile={"primary": True})
+    client = StubSubscriptionClient([fetched])
+    applier = ResourceDeltaApplier(resource_store, client, SUBSCRIPTION_ID)
+
+    applier.add_page([make_change(vm_1, "Update", {"properties.networkProfile.primary": {
+        "propertyChangeType": "Insert", "newValue": True}})])
+    applier.finish()
+
+    assert client.requested == [vm_1["id"]]
+    assert resource_store.get([vm_1["id"]])[vm_1["id"]] == fetched
+
+
+def test_applier_deletes_resources_that_no_longer_resolve(resource_store, stored_resources):
+    vm_1 = stored_resources[0]
+    applier = ResourceDeltaApplier(resource_store, StubSubscriptionClient([]), SUBSCRIPTION_ID,
+                                   apply_property_changes=False)
+
+    applier.add_page([make_change(vm_1, "Update", {"properties.settings.size": {"newValue": 3}})])
+    applier.finish()
+
+    assert vm_1["id"] not in resource_store.resources
+
+
+def test_applier_skips_changes_outside_the_projection(resource_store, stored_resources):
+    vm_1, vm_2 = stored_resources[:2]
+    client = StubSubscriptionClient(stored_resources)
+    profile = QueryProfile("tagged", project=["name", "tags"])
+    applier = ResourceDeltaApplier(resource_store, client, SUBSCRIPTION_ID, profile=profile)
+
+    applier.add_page([
+        make_change(vm_1, "Update", {"properties.settings.size": {"newValue": 8}}),
+        make_change(vm_2, "Update", {"properties.settings.size": {"newValue": 8}, "tags.env": {"newValue": "prod"}}),
+    ])
+    applier.finish()
+
+    assert client.requested == []
+    assert applier.stats["skipped"] == 1
+    patched = resource_store.get([vm_2["id"]])[vm_2["id"]]
+    assert patched["tags"]["env"] == "prod"
+    assert patched["properties"]["settings"]["size"] == 1
+
+
+def test_applier_fetches_changes_that_may_feed_computed_columns(resource_store, stored_resources):
+    vm_1 = stored_resources[0]
+    client = StubSubscriptionClient(stored_resources)
+    profile = QueryProfile("state", project=["name", "state = tostring(properties.provisioningState)"])
+    applier = ResourceDeltaApplier(resource_store, client, SUBSCRIPTION_ID, profile=profile)
+
+    applier.add_page([make_change(vm_1, "Update", {"properties.provisioningState": {"newValue": "Failed"}})])
+    applier.finish()
+
+    assert client.requested == [vm_1["id"]]
+
+
+def test_dated_page_store_appends_pages_and_journals_deletes(blob_client, stored_resources):
+    vm_1, vm_2, vm_3 = stored_resources
+    store = DatedPageStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, records_per_page=1)
+    first_page = f"resource_{SUBSCRIPTION_ID}_{store.date_label}_page_1.json"
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, first_page, {"value": [vm_1, vm_2, vm_3]})
+    store.mark_full_scan()
+
+    updated = make_resource("vm-1", settings={"size": 8})
+    client = StubSubscriptionClient([updated])
+    applier = ResourceDeltaApplier(store, client, SUBSCRIPTION_ID)
+    applier.add_page([
+        make_change(vm_1, "Update", {"properties.settings.size": {"newValue": 8}}),
+        make_change(vm_2, "Delete"),
+    ])
+    applier.finish()
+
+    # Without an index of the stored resources, updates are fetched rather than patched
+    assert client.requested == [vm_1["id"]]
+    second_page = f"resource_{SUBSCRIPTION_ID}_{store.date_label}_page_2.json"
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, second_page) == {"value": [updated]}
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, first_page) == {"value": [vm_1, vm_2, vm_3]}
+    journal = blob_client.read_blob_file(RESOURCE_CONTAINER, journal_blob_name(SUBSCRIPTION_ID, store.date_label))
+    assert journal == {"full_scan": True, "deleted": [vm_2["id"]]}
+
+
+def test_dated_page_store_drops_deletes_of_resources_created_again(blob_client, stored_resources):
+    vm_2 = stored_resources[1]
+    store = DatedPageStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, records_per_page=10)
+    store.apply(deletes=[vm_2["id"]])
+    store.finish()
+
+    store = DatedPageStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, records_per_page=10)
+    store.apply(upserts=[vm_2])
+    store.finish()
+
+    journal = blob_client.read_blob_file(RESOURCE_CONTAINER, journal_blob_name(SUBSCRIPTION_ID, store.date_label))
+    assert journal == {"full_scan": False, "deleted": []}
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import shared.resource_registry
+import utils.azure_blob_service
+from benchmarks.simulated_azure import SimulatedContainerClient
+from shared.resource_registry import ResourceRegistry
+from tests.conftest import CONTAINER
+from utils.azure_blob_service import AzureBlobService
+
+
+class Client:
+    """
+    Stand-in for an SDK client that records being closed.
+    """
+    def __init__(self, name, closed, fail_on_close=False):
+        self.name = name
+        self.closed = closed
+        self.fail_on_close = fail_on_close
+
+    def close(self):
+        self.closed.append(self.name)
+        if self.fail_on_close:
+            raise RuntimeError("already closed")
+
+
+class AsyncClient(Client):
+    async def close(self):
+        super().close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(shared.resource_registry.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_are_reused_until_they_are_older_than_max_age(clock):
+    registry, closed, built = ResourceRegistry(), [], []
+
+    def factory():
+        built.append(Client(f"client-{len(built)}", closed))
+        return built[-1]
+
+    first = registry.get_or_create("client", factory, max_age_seconds=60)
+    clock[0] = 59
+    assert registry.get_or_create("client", factory, max_age_seconds=60) is first
+    clock[0] = 61
+    second = registry.get_or_create("client", factory, max_age_seconds=60)
+
+    assert second is not first and closed == ["client-0"]
+    assert registry.get_or_create("client", factory) is second
+
+
+def test_invalidate_and_close_close_the_entries_even_when_closing_fails():
+    registry, closed = ResourceRegistry(), []
+    registry.get_or_create("credential", lambda: Client("credential", closed))
+    registry.get_or_create("client", lambda: Client("client", closed, fail_on_close=True))
+    registry.mark_container_initialized(CONTAINER)
+
+    registry.invalidate("client")
+    registry.get_or_create("client", lambda: Client("new client", closed))
+    registry.close()
+
+    assert closed == ["client", "credential", "new client"]
+    assert not registry.container_initialized(CONTAINER)
+
+
+def test_clients_share_one_pooled_session():
+    registry = ResourceRegistry(pool_maxsize=5)
+
+    transport = registry.get_transport()
+
+    assert registry.get_transport() is transport
+    assert transport.session is registry.get_session()
+    assert transport.session.get_adapter("https://management.azure.com")._pool_maxsize == 5
+    registry.close()
+
+
+def test_async_clients_are_kept_per_event_loop_and_closed_in_reverse_order():
+    registry, closed = ResourceRegistry(), []
+
+    async def run():
+        credential = registry.get_async_client("async_credential", lambda: AsyncClient("credential", closed))
+        client = registry.get_async_client("async_client", lambda: AsyncClient("client", closed))
+        assert registry.get_async_client("async_client", lambda: AsyncClient("other", closed)) is client
+        await registry.aclose()
+        return credential
+
+    first = asyncio.run(run())
+    second = asyncio.run(run())
+
+    assert second is not first
+    assert closed == ["client", "credential"] * 2
+
+
+def test_containers_are_checked_once_per_process(registry, blob_service, monkeypatch):
+    from utils.azure_blob_client import AzureBlobClient
+
+    checks = []
+    exists = SimulatedContainerClient.exists
+    monkeypatch.setattr(SimulatedContainerClient, "exists",
+                        lambda self: checks.append(self.container_name) or exists(self))
+
+    AzureBlobClient().initialize_container(CONTAINER)
+    AzureBlobClient().initialize_container(CONTAINER)
+
+    assert checks == [CONTAINER]
+
+
+def test_concurrent_callers_share_one_blob_service_client(registry, monkeypatch):
+    created = []
+
+    def from_connection_string(connection_string, **kwargs):
+        # Widen the window between the check and the assignment
+        time.sleep(0.01)
+        created.append(threading.get_ident())
+        return object()
+
+    monkeypatch.setattr(AzureBlobService, "_instance", None)
+    monkeypatch.setattr(utils.azure_blob_service.BlobServiceClient, "from_connection_string", from_connection_string)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: AzureBlobService.get_instance(), range(8)))
+
+    assert len(created) == 1
+    assert all(client is clients[0] for client in clients)
@@ -0,0 +1,128 @@
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_resource_store import AzureResourceStore, DatedPageStore, journal_blob_name
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def make_resource(number, version=1):
+    return {"id": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/rg/providers/Microsoft.Web/sites/site{number}",
+            "name": f"site{number}", "properties": {"version": version}}
+
+
+def shard_uploads(upload_counts):
+    return sum(count for path, count in upload_counts.items() if "_shard_" in path)
+
+
+def full_scan(blob_client, resources, records_per_page=5, **kwargs):
+    store = AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, full_scan=True, **kwargs)
+    for start in range(0, len(resources), records_per_page):
+        store.add_page(resources[start:start + records_per_page])
+    store.finish()
+    return store
+
+
+def stored_versions(blob_client):
+    store = AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID)
+    return {resource["name"]: resource["properties"]["version"]
+            for resource in store.get(list(store.resources)).values()}
+
+
+@pytest.fixture
+def upload_counts(blob_service, monkeypatch):
+    """
+    Count uploads per blob path on the simulated service.
+    """
+    counts = {}
+    request = blob_service.request
+
+    def counting_request(operation, path, uploaded_bytes=0):
+        if operation == "upload":
+            counts[path] = counts.get(path, 0) + 1
+        return request(operation, path, uploaded_bytes)
+
+    monkeypatch.setattr(blob_service, "request", counting_request)
+    return counts
+
+
+def test_a_full_scan_writes_each_shard_once(blob_client, upload_counts):
+    store = full_scan(blob_client, [make_resource(number) for number in range(2000)], shard_size=1000)
+
+    assert store.stats["shards_written"] == 2
+    assert shard_uploads(upload_counts) == 2
+    assert sum(count for path, count in upload_counts.items() if path.endswith("_index.json")) == 1
+    assert len(stored_versions(blob_client)) == 2000
+
+
+def test_changes_to_existing_shards_are_written_once_per_scan(blob_client, upload_counts):
+    full_scan(blob_client, [make_resource(number) for number in range(300)], shard_size=100)
+    upload_counts.clear()
+
+    resources = [make_resource(number, version=2 if number % 7 == 0 else 1) for number in range(300) if number != 150]
+    store = full_scan(blob_client, resources + [make_resource(300)], shard_size=100)
+
+    # Three shards have updates and the delete, and a fourth shard is opened for the new resource
+    assert store.stats == {"upserted": 44, "unchanged": 256, "deleted": 1, "shards_written": 4}
+    assert shard_uploads(upload_counts) == 4
+    versions = stored_versions(blob_client)
+    assert len(versions) == 300 and "site150" not in versions
+    assert versions["site7"] == 2 and versions["site8"] == 1 and versions["site300"] == 1
+
+
+def test_buffered_changes_are_bounded(blob_client, upload_counts):
+    store = full_scan(blob_client, [make_resource(number) for number in range(50)], shard_size=10,
+                      max_buffered_resources=15)
+
+    assert store.stats["shards_written"] == 5
+    assert len(stored_versions(blob_client)) == 50
+
+
+def test_get_returns_buffered_changes(blob_client):
+    full_scan(blob_client, [make_resource(number) for number in range(10)], shard_size=100)
+    store = AzureResourceStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, shard_size=100)
+
+    store.apply(upserts=[make_resource(1, version=2), make_resource(20)], deletes=[make_resource(2)["id"]])
+
+    ids = [make_resource(number)["id"] for number in (1, 2, 3, 20)]
+    assert {resource["name"]: resource["properties"]["version"] for resource in store.get(ids).values()} == \
+        {"site1": 2, "site3": 1, "site20": 1}
+    assert store.stats["shards_written"] == 0
+
+
+def dated_page_store(blob_client, date_label="2024_01_01"):
+    return DatedPageStore(blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, records_per_page=5, date_label=date_label)
+
+
+def stored_names(blob_service):
+    return sorted(path[len(RESOURCE_CONTAINER) + 1:] for path in blob_service.blobs
+                  if path.startswith(f"{RESOURCE_CONTAINER}/resource_{SUBSCRIPTION_ID}_"))
+
+
+def test_mark_full_scan_keeps_the_recorded_deletes(blob_client):
+    store = dated_page_store(blob_client)
+    store.apply(upserts=[make_resource(1)], deletes=[make_resource(2)["id"]])
+    store.finish()
+
+    dated_page_store(blob_client).mark_full_scan()
+
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, journal_blob_name(SUBSCRIPTION_ID, "2024_01_01")) == \
+        {"full_scan": True, "deleted": [make_resource(2)["id"]]}
+
+
+def test_start_full_scan_removes_the_pages_and_journal_of_the_date(blob_service, blob_client):
+    for date_label in ("2024_01_01", "2024_01_02"):
+        store = dated_page_store(blob_client, date_label)
+        store.apply(upserts=[make_resource(number) for number in range(12)], deletes=[make_resource(20)["id"]])
+        store.finish()
+
+    store = dated_page_store(blob_client, "2024_01_02")
+    store.start_full_scan()
+    store.apply(upserts=[make_resource(1)])
+
+    assert stored_names(blob_service) == [
+        f"resource_{SUBSCRIPTION_ID}_2024_01_01_journal.json",
+        *(f"resource_{SUBSCRIPTION_ID}_2024_01_01_page_{number}.json" for number in (1, 2, 3)),
+        f"resource_{SUBSCRIPTION_ID}_2024_01_02_page_1.json",
+    ]
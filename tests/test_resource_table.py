@@ -0,0 +1,83 @@
+import copy
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from tests.conftest import CONTAINER
+from utils.azure_watermark_manager import AzureWatermarkManager
+from utils.resource_table import ResourceTable
+
+
+def make_resource(name, timestamp="2024-05-01T10:00:00Z", **fields):
+    return {
+        "id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/{name}",
+        "name": name,
+        "type": "microsoft.web/sites",
+        "location": "westeurope",
+        "tags": {"env": "dev"},
+        "properties": {"state": "Running"},
+        "systemData": {"lastModifiedAt": timestamp},
+        **fields,
+    }
+
+
+def test_records_round_trip():
+    records = [make_resource("a"), make_resource("b", tags=None)]
+
+    assert list(ResourceTable.from_records(copy.deepcopy(records)).to_records()) == records
+
+
+def test_timestamps_are_normalized_to_utc():
+    table = ResourceTable.from_records([
+        make_resource("offset", timestamp="2024-05-01T12:30:00+02:00"),
+        make_resource("zulu", timestamp="2024-05-01T10:30:00.1234560Z"),
+        make_resource("naive", timestamp="2024-05-01T09:30:00"),
+    ])
+
+    stamps = [value.isoformat() for value in table.table.column("timestamp").to_pylist()]
+    assert stamps == ["2024-05-01T10:30:00", "2024-05-01T10:30:00.123456", "2024-05-01T09:30:00"]
+
+
+def test_non_string_tag_values_are_stored_as_json_text():
+    record = make_resource("a", tags={"cost": 12, "shared": True, "owners": ["x"], "empty": None})
+
+    table = ResourceTable.from_records([copy.deepcopy(record)])
+
+    assert dict(table.table.column("tags").to_pylist()[0]) == \
+        {"cost": "12", "shared": "true", "owners": '["x"]', "empty": None}
+    assert list(table.to_records()) == [record]
+
+
+@pytest.mark.parametrize("watermark", ["2024-05-01T10:00:00", "2024-05-01T10:00:00Z", "2024-05-01T12:00:00+02:00"])
+def test_filter_since_compares_in_utc(watermark):
+    table = ResourceTable.from_records([
+        make_resource("before", timestamp="2024-05-01T11:00:00+02:00"),
+        make_resource("after", timestamp="2024-05-01T12:30:00+02:00"),
+        make_resource("undated", systemData={}),
+    ])
+
+    assert [record["name"] for record in table.filter_since(watermark).to_records()] == ["after"]
+    assert len(table.filter_since(None)) == 3
+
+
+def test_diff_reports_added_changed_and_removed_rows():
+    snapshot = ResourceTable.from_records([make_resource("a"), make_resource("b"), make_resource("c")])
+    current = ResourceTable.from_records([make_resource("a"), make_resource("b", location="northeurope"),
+                                          make_resource("d")])
+
+    diff = snapshot.diff(current)
+
+    assert {key: [record["name"] for record in table.to_records()] for key, table in diff.items()} == \
+        {"added": ["d"], "changed": ["b"], "removed": ["c"]}
+
+
+def test_merge_matches_merge_resources(blob_service):
+    existing = [make_resource(name) for name in ("a", "b", "c")]
+    new = [make_resource("b", location="northeurope"), make_resource("d"), make_resource("a"),
+           {"id": make_resource("d")["id"], "tags": {"env": "prod"}}]
+    manager = AzureWatermarkManager(container_name=CONTAINER)
+
+    merged = ResourceTable.from_records(copy.deepcopy(existing)).merge(ResourceTable.from_records(copy.deepcopy(new)))
+
+    assert list(merged.to_records()) == manager.merge_resources(copy.deepcopy(existing), copy.deepcopy(new))
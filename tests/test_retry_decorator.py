@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+
+from shared.rate_limiter import RateLimiter, rate_limited_client_kwargs
+from shared.retry_decorator import retry_with_backoff
+
+
+def http_error(status_code):
+    return HttpResponseError(message=f"HTTP {status_code}",
+                             response=SimpleNamespace(status_code=status_code, reason="", headers={}))
+
+
+def failing(errors):
+    """
+    :return: A function raising the given errors in turn, then returning "done", and the list of its calls.
+    """
+    calls = []
+
+    @retry_with_backoff(retries=3, backoff_in_seconds=0)
+    def call():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "done"
+    return call, calls
+
+
+@pytest.mark.parametrize("error", [http_error(429), http_error(500), http_error(503),
+                                   ServiceRequestError("connection reset"), ConnectionError(), TimeoutError()])
+def test_throttling_server_and_transport_errors_are_retried(error):
+    call, calls = failing([error, error])
+
+    assert call() == "done"
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [http_error(400), http_error(401), http_error(403), http_error(404),
+                                   ValueError("bad query")])
+def test_other_errors_are_raised_without_retrying(error):
+    call, calls = failing([error])
+
+    with pytest.raises(type(error)):
+        call()
+    assert len(calls) == 1
+
+
+def test_the_last_error_is_raised_once_the_retries_are_used_up():
+    call, calls = failing([http_error(500)] * 3)
+
+    with pytest.raises(HttpResponseError):
+        call()
+    assert len(calls) == 3
+
+
+def test_coroutines_are_retried_the_same_way():
+    calls = []
+
+    @retry_with_backoff(retries=3, backoff_in_seconds=0)
+    async def call(error):
+        calls.append(error)
+        if len(calls) == 1:
+            raise error
+        return "done"
+
+    assert asyncio.run(call(http_error(502))) == "done"
+    calls.clear()
+    with pytest.raises(HttpResponseError):
+        asyncio.run(call(http_error(404)))
+    assert len(calls) == 1
+
+
+def test_pipeline_retries_are_disabled_without_the_rate_limiter(monkeypatch):
+    monkeypatch.setattr(RateLimiter, "_instance", None)
+    monkeypatch.setattr(RateLimiter, "_initialized", True)
+
+    assert rate_limited_client_kwargs() == {"retry_total": 0}
@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.serializers import (JsonSerializer, NdjsonSerializer, decode_blob, detect_serializer, get_serializer)
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+
+RECORDS = [
+    {"id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/sa{i}",
+     "name": f"sa{i}", "location": "westeurope", "tags": {"env": "dev"}, "properties": {"size": i, "zones": [1, 2]}}
+    for i in range(5)
+]
+
+FORMATS = ["json", "json_pretty", "ndjson", "ndjson_gzip", "ndjson_zstd", "parquet"]
+
+
+def serializer_for(output_format):
+    if output_format == "ndjson_zstd":
+        pytest.importorskip("zstandard")
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    return get_serializer(output_format)
+
+
+@pytest.mark.parametrize("output_format", FORMATS)
+def test_round_trip(output_format):
+    serializer = serializer_for(output_format)
+
+    data = serializer.dumps({"value": RECORDS})
+
+    assert serializer.loads(data) == {"value": RECORDS}
+    assert decode_blob(data, serializer.content_type, serializer.content_encoding) == {"value": RECORDS}
+
+
+@pytest.mark.parametrize("output_format", FORMATS)
+def test_streamed_output_matches_dumps(output_format):
+    serializer = serializer_for(output_format)
+
+    streamed = b"".join(serializer.iter_dumps({"value": iter(RECORDS)}, chunk_size=64))
+
+    assert serializer.loads(streamed) == {"value": RECORDS}
+    if output_format.startswith("json"):
+        assert streamed == serializer.dumps({"value": RECORDS})
+
+
+@pytest.mark.parametrize("output_format", FORMATS)
+def test_iter_records_across_small_chunks(output_format):
+    serializer = serializer_for(output_format)
+    data = serializer.dumps({"value": RECORDS})
+
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+
+    assert list(serializer.iter_records(chunks)) == RECORDS
+
+
+def test_json_iter_records_of_empty_and_non_ascii_documents():
+    serializer = JsonSerializer()
+    data = serializer.dumps({"value": [{"id": "a", "name": "réseau-ü"}]})
+
+    # Split inside the multi-byte characters
+    assert list(serializer.iter_records([data[i:i + 1] for i in range(len(data))])) == [{"id": "a", "name": "réseau-ü"}]
+    assert list(serializer.iter_records([b'{"value": []}'])) == []
+
+
+def test_json_iter_records_falls_back_for_other_document_shapes():
+    data = json.dumps({"count": 1, "value": RECORDS}).encode("utf-8")
+
+    assert list(JsonSerializer().iter_records([data])) == RECORDS
+
+
+def test_json_iter_records_rejects_truncated_documents():
+    data = JsonSerializer().dumps({"value": RECORDS})
+
+    with pytest.raises(ValueError):
+        list(JsonSerializer().iter_records([data[:-20]]))
+
+
+def test_compact_json_is_smaller_than_indented():
+    compact = get_serializer("json").dumps({"value": RECORDS})
+    indented = get_serializer("json_pretty").dumps({"value": RECORDS})
+
+    assert len(compact) < len(indented)
+    assert b"\n" not in compact
+
+
+@pytest.mark.parametrize("output_format, content_type, content_encoding, extension", [
+    ("json", "application/json", None, ".json"),
+    ("ndjson", "application/x-ndjson", None, ".ndjson"),
+    ("ndjson_gzip", "application/x-ndjson", "gzip", ".ndjson.gz"),
+])
+def test_content_settings(output_format, content_type, content_encoding, extension):
+    serializer = get_serializer(output_format)
+
+    assert (serializer.content_type, serializer.content_encoding, serializer.extension) == \
+        (content_type, content_encoding, extension)
+
+
+@pytest.mark.parametrize("output_format, expected", [
+    ("json", JsonSerializer),
+    ("json_pretty", JsonSerializer),
+    ("ndjson", NdjsonSerializer),
+    ("ndjson_gzip", NdjsonSerializer),
+])
+def test_detect_serializer_without_content_settings(output_format, expected):
+    data = get_serializer(output_format).dumps({"value": RECORDS})
+
+    assert isinstance(detect_serializer(data), expected)
+
+
+def test_detect_serializer_reads_gzip_from_magic_bytes():
+    data = get_serializer("ndjson_gzip").dumps({"value": RECORDS})
+
+    serializer = detect_serializer(data, content_type="application/octet-stream")
+
+    assert serializer.compression == "gzip"
+    assert serializer.loads(data) == {"value": RECORDS}
+
+
+def test_record_formats_reject_other_payloads():
+    with pytest.raises(ValueError):
+        get_serializer("ndjson").dumps({"subscriptions": []})
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        get_serializer("xml")
+
+
+@pytest.mark.parametrize("output_format", ["json", "json_pretty", "ndjson", "ndjson_gzip"])
+def test_blob_round_trip_detects_the_stored_format(blob_client, output_format):
+    serializer = get_serializer(output_format)
+    blob_name = f"page{serializer.extension}"
+
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, blob_name, {"value": RECORDS}, serializer=serializer)
+
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, blob_name) == {"value": RECORDS}
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "ndjson_gzip"])
+def test_blob_records_stream_from_an_iterator_payload(blob_client, output_format):
+    serializer = get_serializer(output_format)
+    blob_name = f"streamed{serializer.extension}"
+
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, blob_name, {"value": iter(RECORDS)}, serializer=serializer)
+
+    assert list(blob_client.iter_blob_records(RESOURCE_CONTAINER, blob_name)) == RECORDS
+    assert list(blob_client.iter_blob_records(RESOURCE_CONTAINER, "missing.json")) == []
@@ -0,0 +1,166 @@
+from datetime import date, timedelta
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_resource_store import DATE_FORMAT, journal_blob_name
+from utils.snapshot_compactor import SnapshotCompactor
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+SNAPSHOT_CONTAINER = f"{RESOURCE_CONTAINER}/snapshot"
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000001"
+DAY_1 = date(2024, 1, 1)
+
+
+def make_resource(name, size=1):
+    return {
+        "id": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/{name}",
+        "name": name,
+        "properties": {"size": size},
+    }
+
+
+def write_page(blob_client, day, page_number, resources):
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER,
+                                    f"resource_{SUBSCRIPTION_ID}_{day.strftime(DATE_FORMAT)}_page_{page_number}.json",
+                                    {"value": resources})
+
+
+def write_journal(blob_client, day, full_scan=False, deleted=()):
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, journal_blob_name(SUBSCRIPTION_ID, day.strftime(DATE_FORMAT)),
+                                    {"full_scan": full_scan, "deleted": [resource["id"] for resource in deleted]})
+
+
+def read_manifest(blob_client, day=None):
+    name = f"{day.strftime(DATE_FORMAT)}_manifest" if day else "manifest"
+    return blob_client.read_blob_file(SNAPSHOT_CONTAINER, f"resource_{SUBSCRIPTION_ID}_{name}.json")
+
+
+def snapshot_resources(blob_client, day=None):
+    manifest = read_manifest(blob_client, day)
+    return {record["name"]: record["properties"]["size"] for part in manifest["parts"]
+            for record in blob_client.iter_blob_records(SNAPSHOT_CONTAINER, part["blob"])}
+
+
+def stored_names(blob_service, folder):
+    prefix = f"{folder}/resource_{SUBSCRIPTION_ID}_"
+    return {path[len(folder) + 1:] for path in blob_service.blobs
+            if path.startswith(prefix) and "/" not in path[len(prefix):]}
+
+
+@pytest.fixture
+def compactor(blob_client):
+    return SnapshotCompactor(blob_client, RESOURCE_CONTAINER, page_retention_days=2, snapshot_retention_days=30)
+
+
+def test_changes_are_applied_on_top_of_the_previous_snapshot(blob_client, compactor):
+    write_page(blob_client, DAY_1, 1, [make_resource("vm-1"), make_resource("vm-2")])
+    write_page(blob_client, DAY_1, 2, [make_resource("vm-3")])
+    write_journal(blob_client, DAY_1, full_scan=True)
+    compactor.compact(SUBSCRIPTION_ID, today=DAY_1)
+
+    day_2 = DAY_1 + timedelta(days=1)
+    write_page(blob_client, day_2, 1, [make_resource("vm-1", size=2), make_resource("vm-4")])
+    write_page(blob_client, day_2, 2, [make_resource("vm-1", size=3), make_resource("vm-5")])
+    write_journal(blob_client, day_2, deleted=[make_resource("vm-2"), make_resource("vm-5")])
+    stats = compactor.compact(SUBSCRIPTION_ID, today=day_2)
+
+    assert stats["dates_compacted"] == 1
+    assert snapshot_resources(blob_client, DAY_1) == {"vm-1": 1, "vm-2": 1, "vm-3": 1}
+    assert snapshot_resources(blob_client) == {"vm-3": 1, "vm-1": 3, "vm-4": 1}
+    manifest = read_manifest(blob_client)
+    assert (manifest["date"], manifest["complete"], manifest["full_scan"], manifest["base"],
+            manifest["full_scan_date"]) == (day_2.isoformat(), True, False, DAY_1.isoformat(), DAY_1.isoformat())
+
+
+def test_a_full_scan_does_not_build_on_the_previous_snapshot(blob_client, compactor):
+    write_page(blob_client, DAY_1, 1, [make_resource("vm-1"), make_resource("vm-2")])
+    write_journal(blob_client, DAY_1, full_scan=True)
+    day_2 = DAY_1 + timedelta(days=1)
+    write_page(blob_client, day_2, 1, [make_resource("vm-2", size=2)])
+    write_journal(blob_client, day_2, full_scan=True)
+
+    compactor.compact(SUBSCRIPTION_ID, today=day_2)
+
+    assert snapshot_resources(blob_client) == {"vm-2": 2}
+    assert read_manifest(blob_client)["full_scan_date"] == day_2.isoformat()
+
+
+def test_changes_without_an_earlier_snapshot_are_left_uncompacted(blob_service, blob_client, compactor):
+    write_page(blob_client, DAY_1, 1, [make_resource("vm-1")])
+    day_10 = DAY_1 + timedelta(days=10)
+
+    stats = compactor.compact(SUBSCRIPTION_ID, today=day_10)
+
+    assert stats == {"dates_compacted": 0, "pages_deleted": 0, "snapshots_deleted": 0}
+    assert read_manifest(blob_client) is None
+    assert f"resource_{SUBSCRIPTION_ID}_2024_01_01_page_1.json" in stored_names(blob_service, RESOURCE_CONTAINER)
+
+
+def test_compacting_an_earlier_date_rebuilds_the_later_ones(blob_client, compactor):
+    day_2 = DAY_1 + timedelta(days=1)
+    write_page(blob_client, DAY_1, 1, [make_resource("vm-1")])
+    write_journal(blob_client, DAY_1, full_scan=True)
+    write_page(blob_client, day_2, 1, [make_resource("vm-2")])
+    compactor.compact(SUBSCRIPTION_ID, today=day_2)
+
+    # Pages of the first date written after it was compacted, e.g. by a run that straddled midnight
+    write_page(blob_client, DAY_1, 2, [make_resource("vm-1", size=2)])
+    blob_client.delete_blobs(SNAPSHOT_CONTAINER, [f"resource_{SUBSCRIPTION_ID}_2024_01_01_manifest.json"])
+    stats = compactor.compact(SUBSCRIPTION_ID, today=day_2 + timedelta(days=1))
+
+    assert stats["dates_compacted"] == 2
+    assert snapshot_resources(blob_client) == {"vm-1": 2, "vm-2": 1}
+
+
+def test_legacy_manifests_are_not_used_as_a_base(blob_client, compactor):
+    blob_client.upload_data_to_blob(SNAPSHOT_CONTAINER, f"resource_{SUBSCRIPTION_ID}_2024_01_01_manifest.json",
+                                    {"date": DAY_1.isoformat(), "parts": []})
+    day_2 = DAY_1 + timedelta(days=1)
+    write_page(blob_client, day_2, 1, [make_resource("vm-1")])
+
+    assert compactor.compact(SUBSCRIPTION_ID, today=day_2)["dates_compacted"] == 0
+    assert read_manifest(blob_client) is None
+
+
+def test_pages_and_journals_of_compacted_dates_expire(blob_service, blob_client, compactor):
+    for offset in range(4):
+        day = DAY_1 + timedelta(days=offset)
+        write_page(blob_client, day, 1, [make_resource(f"vm-{offset}")])
+        write_journal(blob_client, day, full_scan=offset == 0)
+        stats = compactor.compact(SUBSCRIPTION_ID, today=day)
+        assert stats["pages_deleted"] == (1 if offset >= 2 else 0)
+
+    assert stored_names(blob_service, RESOURCE_CONTAINER) == {f"resource_{SUBSCRIPTION_ID}_2024_01_0{day}_{kind}"
+                                                              for day in (3, 4) for kind in ("page_1.json", "journal.json")}
+    assert snapshot_resources(blob_client) == {"vm-0": 1, "vm-1": 1, "vm-2": 1, "vm-3": 1}
+
+
+def test_snapshot_retention_keeps_the_latest_and_its_full_scan(blob_service, blob_client, compactor):
+    for offset in range(3):
+        day = DAY_1 + timedelta(days=offset)
+        write_page(blob_client, day, 1, [make_resource(f"vm-{offset}")])
+        write_journal(blob_client, day, full_scan=offset == 0)
+        compactor.compact(SUBSCRIPTION_ID, today=day)
+
+    compactor.compact(SUBSCRIPTION_ID, today=DAY_1 + timedelta(days=60))
+
+    manifests = {name for name in stored_names(blob_service, SNAPSHOT_CONTAINER) if name.endswith("_manifest.json")}
+    assert manifests == {f"resource_{SUBSCRIPTION_ID}_2024_01_01_manifest.json",
+                         f"resource_{SUBSCRIPTION_ID}_2024_01_03_manifest.json",
+                         f"resource_{SUBSCRIPTION_ID}_manifest.json"}
+    assert stored_names(blob_service, RESOURCE_CONTAINER) == set()
+    assert snapshot_resources(blob_client) == {"vm-0": 1, "vm-1": 1, "vm-2": 1}
+
+
+def test_snapshots_are_split_into_parts_of_the_target_size(blob_client):
+    compactor = SnapshotCompactor(blob_client, RESOURCE_CONTAINER, target_snapshot_bytes=200)
+    write_page(blob_client, DAY_1, 1, [make_resource(f"vm-{i}") for i in range(10)])
+    write_journal(blob_client, DAY_1, full_scan=True)
+
+    compactor.compact(SUBSCRIPTION_ID, today=DAY_1)
+
+    manifest = read_manifest(blob_client)
+    assert len(manifest["parts"]) > 1
+    assert manifest["records"] == 10
+    assert len(snapshot_resources(blob_client)) == 10
@@ -0,0 +1,143 @@
+from datetime import date, timedelta
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_resource_store import DATE_FORMAT, DatedPageStore
+from utils.serializers import get_serializer
+from utils.snapshot_compactor import SnapshotCompactor
+from utils.snapshot_query import SnapshotQuery
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000001"
+DAY_1 = date(2024, 1, 1)
+TYPES = ["Microsoft.Compute/virtualMachines", "Microsoft.Storage/storageAccounts"]
+
+
+def make_resource(number, version=1):
+    resource_type, resource_group = TYPES[number % 2], f"rg-{number % 3}"
+    return {
+        "id": f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{resource_group}/providers/{resource_type}/"
+              f"res-{number}",
+        "name": f"res-{number}",
+        "type": resource_type.lower(),
+        "resourceGroup": resource_group,
+        "location": "westeurope" if number % 4 else "northeurope",
+        "properties": {"version": version},
+    }
+
+
+class History:
+    """
+    Writes daily runs of the pages layout and compacts them, keeping the expected state of the subscription.
+    """
+    def __init__(self, blob_client, serializer):
+        self.blob_client = blob_client
+        self.serializer = serializer
+        self.compactor = SnapshotCompactor(blob_client, RESOURCE_CONTAINER, serializer=serializer,
+                                           target_snapshot_bytes=1024)
+        self.expected = {}
+
+    def store(self, day):
+        store = DatedPageStore(self.blob_client, RESOURCE_CONTAINER, SUBSCRIPTION_ID, records_per_page=10,
+                               serializer=self.serializer)
+        store.date_label = day.strftime(DATE_FORMAT)
+        return store
+
+    def full_scan(self, day, resources):
+        store = self.store(day)
+        pages = [(store._page_blob_name(number + 1), {"value": resources[start:start + 10]})
+                 for number, start in enumerate(range(0, len(resources), 10))]
+        self.blob_client.upload_many(RESOURCE_CONTAINER, pages, serializer=self.serializer)
+        store.mark_full_scan()
+        self.expected = {resource["id"].lower(): resource for resource in resources}
+        self.compactor.compact(SUBSCRIPTION_ID, today=day)
+
+    def change_run(self, day, upserts=(), deletes=()):
+        store = self.store(day)
+        store.apply(upserts=upserts, deletes=[resource["id"] for resource in deletes])
+        store.finish()
+        for resource in upserts:
+            self.expected[resource["id"].lower()] = resource
+        for resource in deletes:
+            self.expected.pop(resource["id"].lower(), None)
+        self.compactor.compact(SUBSCRIPTION_ID, today=day)
+
+
+@pytest.fixture(params=["json", "ndjson", "ndjson_gzip"])
+def history(request, blob_client):
+    history = History(blob_client, get_serializer(request.param))
+    history.full_scan(DAY_1, [make_resource(number) for number in range(30)])
+    history.change_run(DAY_1 + timedelta(days=1), upserts=[make_resource(1, version=2), make_resource(30)],
+                       deletes=[make_resource(2), make_resource(3)])
+    history.change_run(DAY_1 + timedelta(days=2), upserts=[make_resource(2, version=3), make_resource(1, version=3)],
+                       deletes=[make_resource(30)])
+    history.change_run(DAY_1 + timedelta(days=2), upserts=[make_resource(4, version=2)])
+    return history
+
+
+@pytest.fixture
+def query(blob_client):
+    return SnapshotQuery(blob_client, RESOURCE_CONTAINER, max_ranged_reads=2)
+
+
+def test_get_serves_the_state_after_every_run(history, query):
+    for resource_id, resource in history.expected.items():
+        assert query.get(SUBSCRIPTION_ID, resource_id.upper()) == resource
+
+    assert query.get(SUBSCRIPTION_ID, make_resource(1)["id"])["properties"]["version"] == 3
+    assert query.get(SUBSCRIPTION_ID, make_resource(3)["id"]) is None
+    assert query.get(SUBSCRIPTION_ID, make_resource(30)["id"]) is None
+
+
+def test_get_many_returns_the_ids_present(history, query):
+    ids = [make_resource(number)["id"] for number in (1, 2, 3, 4, 30)]
+
+    resources = query.get_many(SUBSCRIPTION_ID, ids)
+
+    assert resources == {resource_id.lower(): history.expected[resource_id.lower()]
+                         for resource_id in ids if resource_id.lower() in history.expected}
+
+
+@pytest.mark.parametrize("filters", [
+    {"type": TYPES[0]},
+    {"resource_group": "RG-1"},
+    {"location": "northeurope"},
+    {"type": TYPES[1].upper(), "resource_group": "rg-2", "location": "westeurope"},
+])
+def test_find_matches_every_filter(history, query, filters):
+    def matches(resource):
+        return all(resource[column].lower() == filters[argument].lower()
+                   for column, argument in (("type", "type"), ("resourceGroup", "resource_group"),
+                                            ("location", "location")) if argument in filters)
+
+    found = query.find(SUBSCRIPTION_ID, **filters)
+
+    assert sorted(resource["id"] for resource in found) == \
+        sorted(resource["id"] for resource in history.expected.values() if matches(resource))
+
+
+def test_find_requires_a_filter(query):
+    with pytest.raises(ValueError):
+        query.find(SUBSCRIPTION_ID)
+
+
+def test_queries_reload_the_index_after_the_snapshot_is_compacted_again(history, query):
+    assert query.get(SUBSCRIPTION_ID, make_resource(5)["id"])["properties"]["version"] == 1
+
+    # Another run of the same day rewrites the parts the cached index points into
+    history.change_run(DAY_1 + timedelta(days=2), upserts=[make_resource(5, version=2)],
+                       deletes=[make_resource(0), make_resource(6)])
+
+    for resource_id, resource in history.expected.items():
+        assert query.get(SUBSCRIPTION_ID, resource_id) == resource
+    assert query.get(SUBSCRIPTION_ID, make_resource(5)["id"])["properties"]["version"] == 2
+    assert query.get(SUBSCRIPTION_ID, make_resource(6)["id"]) is None
+
+
+def test_snapshots_that_are_not_complete_are_not_served(blob_client, query):
+    blob_client.upload_data_to_blob(f"{RESOURCE_CONTAINER}/snapshot", f"resource_{SUBSCRIPTION_ID}_manifest.json",
+                                    {"date": DAY_1.isoformat(), "parts": [], "index": "index.json"})
+
+    assert query.get(SUBSCRIPTION_ID, make_resource(1)["id"]) is None
+    assert query.find(SUBSCRIPTION_ID, type=TYPES[0]) == []
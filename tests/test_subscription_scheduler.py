@@ -0,0 +1,87 @@
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_run_history import AzureRunHistory
+from utils.subscription_scheduler import SubscriptionScheduler
+
+
+def run_stats(duration_seconds, full_scan=False, records=100):
+    return {"full_scan": full_scan, "pages": 1, "records": records, "duration_seconds": duration_seconds,
+            "throttles": 0}
+
+
+@pytest.fixture
+def run_history(blob_service):
+    history = AzureRunHistory(container_name=CONTAINER, smoothing=0.5)
+    history.record({"a": run_stats(10), "b": run_stats(40), "c": run_stats(20), "d": run_stats(5),
+                    "e": run_stats(600, full_scan=True)})
+    return AzureRunHistory(container_name=CONTAINER, smoothing=0.5)
+
+
+def test_run_history_keeps_moving_averages_per_scan_mode(run_history):
+    run_history.record({"a": run_stats(30), "b": run_stats(300, full_scan=True)}, empty_subscription_ids=["a"])
+
+    reloaded = AzureRunHistory(container_name=CONTAINER)
+    assert reloaded.get("a", full_scan=False)["duration_seconds"] == 20
+    assert reloaded.get("a", full_scan=False)["runs"] == 2
+    assert reloaded.get("a", full_scan=True) is None
+    assert reloaded.get("b", full_scan=True)["duration_seconds"] == 300
+    assert reloaded.get("b", full_scan=False)["duration_seconds"] == 40
+    assert (reloaded.consecutive_empty_runs("a"), reloaded.consecutive_empty_runs("b")) == (1, 0)
+
+
+def test_concurrent_run_history_saves_are_merged(run_history):
+    other = AzureRunHistory(container_name=CONTAINER)
+    other.record({"x": run_stats(1)})
+
+    run_history.record({"y": run_stats(2)})
+
+    reloaded = AzureRunHistory(container_name=CONTAINER)
+    assert reloaded.get("x", False)["duration_seconds"] == 1
+    assert reloaded.get("y", False)["duration_seconds"] == 2
+
+
+def test_estimate_adds_up_batches_and_assumes_the_longest_for_unknown_subscriptions(run_history):
+    scheduler = SubscriptionScheduler(run_history)
+
+    estimates = scheduler.estimate([(["a"], 24), (["a", "d"], 24), (["b"], 24), (["new"], 24),
+                                    (["e"], None), (["a"], None)])
+
+    # Unknown durations are the longest of the same scan mode
+    assert estimates == [10, 15, 40, 40, 600, 600]
+
+
+def test_order_puts_the_longest_first_and_inactive_or_empty_subscriptions_last(run_history):
+    run_history.record({"c": run_stats(20)}, empty_subscription_ids=["c"])
+    subscriptions_data = [{"subscription_id": "b", "state": "Disabled"}, {"subscription_id": "a", "state": "Enabled"}]
+    scheduler = SubscriptionScheduler(run_history, subscriptions_data)
+
+    ordered = scheduler.order([(["a"], 24), (["b"], 24), (["c"], 24), (["d"], 24), (["new"], 24), (["b", "a"], 24)])
+
+    assert ordered == [(["b", "a"], 24), (["new"], 24), (["a"], 24), (["d"], 24), (["b"], 24), (["c"], 24)]
+
+
+def test_pack_assigns_each_item_to_the_worker_that_frees_up_first(blob_service):
+    history = AzureRunHistory(container_name=CONTAINER)
+    history.record({name: run_stats(duration) for name, duration in zip("uvwxyz", (7, 6, 5, 4, 3, 2))})
+    work_items = [([name], 24) for name in "zyxwvu"]
+
+    bins, makespan = SubscriptionScheduler(history).pack(work_items, 2)
+
+    assert bins == [[(["u"], 24), (["x"], 24), (["y"], 24)], [(["v"], 24), (["w"], 24), (["z"], 24)]]
+    assert makespan == 14
+
+
+def test_pack_uses_one_worker_at_least(run_history):
+    bins, makespan = SubscriptionScheduler(run_history).pack([(["a"], 24), (["b"], 24)], 0)
+
+    assert bins == [[(["b"], 24), (["a"], 24)]]
+    assert makespan == 50
+
+
+def test_without_history_the_order_is_kept(blob_service):
+    scheduler = SubscriptionScheduler(AzureRunHistory(container_name=CONTAINER))
+    work_items = [(["a"], None), (["b"], None), (["c"], None)]
+
+    assert scheduler.order(work_items) == work_items
+    assert scheduler.pack(work_items, 2) == ([[(["a"], None), (["c"], None)], [(["b"], None)]], 0.0)
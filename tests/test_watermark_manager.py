@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_watermark_manager import AzureWatermarkManager
+
+RESOURCE_CONTAINER = f"{CONTAINER}/raw_data/resource"
+
+
+def resource(name, **fields):
+    return {"id": f"/subscriptions/s/resourceGroups/rg/providers/Microsoft.Web/sites/{name}", "name": name, **fields}
+
+
+@pytest.fixture
+def watermark_manager(blob_service):
+    return AzureWatermarkManager(container_name=CONTAINER)
+
+
+def test_iter_merged_resources_matches_merge_resources(watermark_manager):
+    existing = [resource("a", sku="S1"), resource("b", sku="S1"), resource("c", sku="S1")]
+    new = [resource("b", sku="P1"), resource("d", sku="S1"), resource("b", tier="Premium")]
+
+    merged = list(watermark_manager.iter_merged_resources(iter(existing), new))
+
+    assert merged == watermark_manager.merge_resources([dict(r) for r in existing], new)
+    assert merged == [resource("a", sku="S1"), resource("b", sku="P1", tier="Premium"), resource("c", sku="S1"),
+                      resource("d", sku="S1")]
+
+
+def test_iter_merged_resources_consumes_existing_resources_lazily(watermark_manager):
+    consumed = []
+
+    def existing():
+        for name in "abc":
+            consumed.append(name)
+            yield resource(name)
+
+    merged = watermark_manager.iter_merged_resources(existing(), [resource("c", sku="P1")])
+
+    assert next(merged) == resource("a")
+    assert consumed == ["a"]
+    assert list(merged) == [resource("b"), resource("c", sku="P1")]
+
+
+def test_streamed_page_merge_rewrites_the_page_it_reads(blob_client, watermark_manager):
+    blob_name = "resource_s_2024_01_01_page_1.json"
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, blob_name, {"value": [resource("a"), resource("b")]})
+
+    merged = watermark_manager.iter_merged_resources(blob_client.iter_blob_records(RESOURCE_CONTAINER, blob_name),
+                                                     [resource("b", sku="P1"), resource("c")])
+    blob_client.upload_data_to_blob(RESOURCE_CONTAINER, blob_name, {"value": merged})
+
+    assert blob_client.read_blob_file(RESOURCE_CONTAINER, blob_name) == {
+        "value": [resource("a"), resource("b", sku="P1"), resource("c")]}
+
+
+def stored_watermarks(blob_service):
+    return json.loads(blob_service.get_blob_client(CONTAINER, "azure_watermarks.json").download_blob().readall())
+
+
+def test_subscription_watermarks_are_saved_and_reloaded(blob_service, watermark_manager):
+    watermark_manager.update_subscription_watermarks({"a": "2024-01-02T00:00:00"}, run_watermark="2024-01-02T00:00:00")
+
+    reloaded = AzureWatermarkManager(container_name=CONTAINER)
+
+    assert reloaded.get_watermark() == "2024-01-02T00:00:00"
+    assert reloaded.get_watermark("a") == "2024-01-02T00:00:00"
+    # Once the map exists, a subscription missing from it is new
+    assert reloaded.get_watermark("b") is None
+
+
+def test_watermarks_written_before_the_map_apply_to_every_subscription(blob_service):
+    blob_service.get_blob_client(CONTAINER, "azure_watermarks.json").upload_blob(
+        json.dumps({"resource_last_execution": "2024-01-01T00:00:00"}, indent=4))
+
+    manager = AzureWatermarkManager(container_name=CONTAINER)
+
+    assert manager.get_watermark("a") == "2024-01-01T00:00:00"
+
+
+def test_watermarks_only_move_forward(blob_service, watermark_manager):
+    watermark_manager.update_subscription_watermarks({"a": "2024-01-03T00:00:00"}, run_watermark="2024-01-03T00:00:00")
+    watermark_manager.update_subscription_watermarks({"a": "2024-01-02T00:00:00", "b": "2024-01-02T00:00:00"},
+                                                     run_watermark="2024-01-02T00:00:00")
+
+    assert stored_watermarks(blob_service) == {
+        "resource_last_execution": "2024-01-03T00:00:00",
+        "subscriptions": {"a": "2024-01-03T00:00:00", "b": "2024-01-02T00:00:00"},
+    }
+
+
+def test_overlapping_invocations_keep_each_others_watermarks(blob_service):
+    first = AzureWatermarkManager(container_name=CONTAINER)
+    second = AzureWatermarkManager(container_name=CONTAINER)
+
+    # Both start from a missing blob; the second save loses the race, reloads and re-applies its update
+    first.update_subscription_watermarks({"a": "2024-01-02T00:00:00"})
+    second.update_subscription_watermarks({"b": "2024-01-02T00:00:00"})
+    first.update_subscription_watermarks({"c": "2024-01-02T00:00:00"}, run_watermark="2024-01-02T00:00:00")
+
+    assert stored_watermarks(blob_service)["subscriptions"] == {
+        "a": "2024-01-02T00:00:00", "b": "2024-01-02T00:00:00", "c": "2024-01-02T00:00:00"}
+
+
+def test_filter_changes_keeps_changes_after_the_run_watermark(watermark_manager):
+    watermark_manager.update_watermark("2024-01-02T00:00:00")
+    changes = [{"timestamp": "2024-01-01T12:00:00Z"}, {"timestamp": "2024-01-02T12:00:00Z"}]
+
+    assert watermark_manager.filter_changes(changes) == [{"timestamp": "2024-01-02T12:00:00Z"}]
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from workflow.azure_workflow import build_work_items, time_diff_hours_since
+
+
+def _hours_ago(hours):
+    return (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+
+
+def test_full_scans_are_batched_in_order():
+    work_items = build_work_items(["a", "b", "c"], {}, batch_size=2)
+    assert work_items == [(["a", "b"], None), (["c"], None)]
+
+
+def test_full_scans_and_change_queries_are_never_mixed():
+    watermarks = {"a": None, "b": _hours_ago(1), "c": None, "d": _hours_ago(2)}
+    work_items = build_work_items(["a", "b", "c", "d"], watermarks, batch_size=10)
+
+    assert [batch for batch, _ in work_items] == [["a", "c"], ["d", "b"]]
+    assert work_items[0][1] is None
+    assert work_items[1][1] is not None
+
+
+def test_change_batches_group_similar_watermarks_and_start_at_the_oldest():
+    watermarks = {"a": _hours_ago(1), "b": _hours_ago(30), "c": _hours_ago(2), "d": _hours_ago(29)}
+    work_items = build_work_items(list(watermarks), watermarks, batch_size=2)
+
+    assert [batch for batch, _ in work_items] == [["b", "d"], ["c", "a"]]
+    assert work_items[0][1] == pytest.approx(30, abs=0.01)
+    assert work_items[1][1] == pytest.approx(2, abs=0.01)
+
+
+def test_single_subscription_batches():
+    work_items = build_work_items(["a", "b"], {"b": _hours_ago(5)}, batch_size=1)
+    assert [batch for batch, _ in work_items] == [["a"], ["b"]]
+
+
+def test_no_subscriptions():
+    assert build_work_items([], {}, batch_size=4) == []
+
+
+def test_time_diff_hours_since():
+    assert time_diff_hours_since(None) is None
+    assert time_diff_hours_since(_hours_ago(3)) == pytest.approx(3, abs=0.01)
@@ -0,0 +1,73 @@
+import pytest
+
+from tests.conftest import CONTAINER
+from utils.azure_watermark_manager import AzureWatermarkManager
+from utils.work_queue import LocalWorkQueue, drain_work_queue, get_work_queue
+from workflow.azure_workflow import AzureWorkflow
+
+
+@pytest.fixture(autouse=True)
+def local_queues(monkeypatch):
+    monkeypatch.setattr(LocalWorkQueue, "_queues", {})
+
+
+@pytest.fixture
+def distributed(settings, monkeypatch):
+    monkeypatch.setitem(settings, "records_per_page", 10)
+    monkeypatch.setitem(settings, "distributed", {**settings["distributed"], "enabled": True, "queue_backend": "local"})
+
+
+def test_local_queues_are_shared_by_name_and_round_trip_payloads_as_json():
+    get_work_queue({"queue_backend": "local", "queue_name": "items"}).send({"subscription_ids": ("a", "b")})
+
+    received = LocalWorkQueue("items").receive(max_messages=5)
+
+    assert [payload for _, payload in received] == [{"subscription_ids": ["a", "b"]}]
+    assert LocalWorkQueue("other").receive() == []
+
+
+def test_unknown_queue_backends_are_rejected():
+    with pytest.raises(ValueError, match="servicebus"):
+        get_work_queue({"queue_backend": "servicebus"})
+
+
+def test_drain_retries_failed_items_and_drops_them_after_max_attempts():
+    work_queue = LocalWorkQueue("items")
+    for number in range(10):
+        work_queue.send({"number": number})
+    attempts = {}
+
+    def handler(payload):
+        attempts[payload["number"]] = attempts.get(payload["number"], 0) + 1
+        if payload["number"] == 3 or (payload["number"] == 5 and attempts[5] == 1):
+            raise RuntimeError("boom")
+
+    processed = drain_work_queue(work_queue, handler, max_workers=3, max_attempts=4)
+
+    assert processed == 9
+    assert attempts[3] == 4 and attempts[5] == 2
+    assert work_queue.receive() == []
+
+
+def test_distributed_runs_fan_in_once_every_work_item_is_done(distributed, registry, blob_service, tenant):
+    workflow = AzureWorkflow()
+    workflow.on_start()
+
+    manager = AzureWatermarkManager(container_name=CONTAINER)
+    assert manager.watermark is not None
+    assert manager.subscription_watermarks == {subscription_id: manager.watermark
+                                               for subscription_id in tenant.subscription_ids}
+    assert f"{CONTAINER}/azure_checkpoint.json" not in blob_service.blobs
+
+
+def test_a_failing_work_item_leaves_the_run_open(distributed, registry, blob_service, tenant, resource_graph_client):
+    failing = tenant.subscription_ids[0]
+    resource_graph_client.failing_subscriptions[failing] = 0
+
+    with pytest.raises(RuntimeError, match="1 of 3 work items failed"):
+        AzureWorkflow().on_start()
+
+    manager = AzureWatermarkManager(container_name=CONTAINER)
+    assert manager.watermark is None
+    assert set(manager.subscription_watermarks) == set(tenant.subscription_ids) - {failing}
+    assert f"{CONTAINER}/azure_checkpoint.json" in blob_service.blobs
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+
+import pytest
+
+from tests.conftest import CONTAINER, RESOURCE_FOLDER, stored_resources
+from utils.azure_watermark_manager import AzureWatermarkManager
+from workflow.async_azure_workflow import AsyncAzureWorkflow
+from workflow.azure_workflow import AzureWorkflow
+
+
+def run_workflow():
+    workflow = AzureWorkflow()
+    workflow.on_start()
+    return workflow
+
+
+def watermarks():
+    manager = AzureWatermarkManager(container_name=CONTAINER)
+    return manager.watermark, dict(manager.subscription_watermarks)
+
+
+def expected_resources(tenant, subscription_id):
+    return {resource["id"].lower(): resource for resource in tenant.subscription_resources([subscription_id])}
+
+
+@pytest.fixture
+def settings(settings, monkeypatch):
+    monkeypatch.setitem(settings, "records_per_page", 10)
+    return settings
+
+
+@pytest.fixture
+def checkpointed(settings, monkeypatch):
+    monkeypatch.setitem(settings, "checkpoint", {**settings["checkpoint"], "enabled": True})
+
+
+@pytest.fixture
+def queries(resource_graph_client, monkeypatch):
+    """
+    Record the subscriptions, options and calling thread of every Resource Graph request.
+    """
+    recorded = []
+    resources = resource_graph_client.resources
+
+    def recording_resources(query_request):
+        recorded.append((tuple(query_request.subscriptions), dict(query_request.options or {}),
+                         threading.current_thread().name))
+        return resources(query_request)
+
+    monkeypatch.setattr(resource_graph_client, "resources", recording_resources)
+    return recorded
+
+
+def test_every_subscription_is_scanned_and_its_watermark_advanced(settings, registry, blob_service, blob_client,
+                                                                  tenant, queries):
+    workflow = run_workflow()
+
+    assert workflow.state == "end"
+    assert {subscriptions for subscriptions, *_ in queries} == {(subscription_id,)
+                                                               for subscription_id in tenant.subscription_ids}
+    # Each subscription is a work item of its own on the worker pool
+    assert len({thread for *_, thread in queries if thread.startswith("subscription")}) == 3
+    for subscription_id in tenant.subscription_ids:
+        assert stored_resources(blob_client, blob_service, subscription_id) == \
+            expected_resources(tenant, subscription_id)
+    run_watermark, subscription_watermarks = watermarks()
+    assert run_watermark is not None
+    assert subscription_watermarks == {subscription_id: run_watermark for subscription_id in tenant.subscription_ids}
+
+
+def test_a_failing_subscription_keeps_its_watermark_while_the_others_advance(settings, registry, blob_service,
+                                                                             blob_client, tenant,
+                                                                             resource_graph_client):
+    healthy, failing = tenant.subscription_ids[0], tenant.subscription_ids[1]
+    run_workflow()
+    first_watermark, _ = watermarks()
+    tenant.mutate(0.2)
+    resource_graph_client.failing_subscriptions[failing] = 0
+
+    with pytest.raises(RuntimeError, match=failing):
+        run_workflow()
+
+    run_watermark, subscription_watermarks = watermarks()
+    assert run_watermark == first_watermark
+    assert subscription_watermarks[failing] == first_watermark
+    assert subscription_watermarks[healthy] > first_watermark
+    assert stored_resources(blob_client, blob_service, healthy) == expected_resources(tenant, healthy)
+
+
+def test_a_checkpointed_run_is_completed_by_the_invocation_that_retries_the_failed_subscription(
+        checkpointed, registry, blob_service, tenant, resource_graph_client, queries):
+    failing = tenant.subscription_ids[2]
+    resource_graph_client.failing_subscriptions[failing] = 0
+
+    with pytest.raises(RuntimeError, match=failing):
+        run_workflow()
+
+    run_watermark, subscription_watermarks = watermarks()
+    assert run_watermark is None and failing not in subscription_watermarks
+    assert len(subscription_watermarks) == 2
+    assert f"{CONTAINER}/azure_checkpoint.json" in blob_service.blobs
+
+    del resource_graph_client.failing_subscriptions[failing]
+    queries.clear()
+    run_workflow()
+
+    # Only the failed subscription is scanned again; the run then closes on its original window
+    assert {subscriptions for subscriptions, *_ in queries} == {(failing,)}
+    run_watermark, subscription_watermarks = watermarks()
+    assert subscription_watermarks == {subscription_id: run_watermark for subscription_id in tenant.subscription_ids}
+    assert f"{CONTAINER}/azure_checkpoint.json" not in blob_service.blobs
+
+
+def test_a_full_scan_resumes_after_the_last_recorded_page(checkpointed, registry, blob_service, blob_client, tenant,
+                                                          resource_graph_client, queries):
+    interrupted = tenant.subscription_ids[0]
+    resource_graph_client.failing_subscriptions[interrupted] = 2
+
+    with pytest.raises(RuntimeError, match=interrupted):
+        run_workflow()
+
+    del resource_graph_client.failing_subscriptions[interrupted]
+    queries.clear()
+    workflow = run_workflow()
+
+    # Pages 1 and 2 were written before the failure; the scan continues with page 3
+    assert len(queries) == 2 and "$skipToken" in queries[0][1]
+    prefix = f"{RESOURCE_FOLDER}/resource_{interrupted}_{workflow.date_label}_page_"
+    assert sorted(path[len(prefix):] for path in blob_service.blobs if path.startswith(prefix)) == \
+        ["1.json", "2.json", "3.json", "4.json"]
+    assert stored_resources(blob_client, blob_service, interrupted) == expected_resources(tenant, interrupted)
+
+
+def test_the_async_workflow_isolates_a_failing_subscription(settings, async_clients, blob_service, blob_client,
+                                                            tenant, resource_graph_client):
+    failing = tenant.subscription_ids[1]
+    resource_graph_client.failing_subscriptions[failing] = 0
+
+    async def run():
+        async_clients()
+        workflow = AsyncAzureWorkflow()
+        try:
+            await workflow.on_start()
+        finally:
+            await workflow.close(release_clients=True)
+
+    with pytest.raises(RuntimeError, match=failing):
+        asyncio.run(run())
+
+    run_watermark, subscription_watermarks = watermarks()
+    assert run_watermark is None
+    assert set(subscription_watermarks) == set(tenant.subscription_ids) - {failing}
+    for subscription_id in subscription_watermarks:
+        assert stored_resources(blob_client, blob_service, subscription_id) == \
+            expected_resources(tenant, subscription_id)
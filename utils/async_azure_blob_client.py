@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+
+from azure.core.exceptions import AzureError, HttpResponseError, ResourceNotFoundError
+
+from shared.metrics import increment, span, timed
+from utils.azure_blob_client import _UNKNOWN, _BlobClientBase, _content_hash, _count_bytes, _spool
+from utils.azure_blob_service import AzureBlobService
+from utils.content_hash import CONTENT_HASH_METADATA_KEY
+from utils.logger_setup import setup_logger
+from utils.serializers import JsonSerializer, decode_blob
+
+logger = setup_logger(name="AsyncAzureBlobClient")
+
+class AsyncAzureBlobClient(_BlobClientBase):
+    """
+    asyncio counterpart of AzureBlobClient built on the aio BlobServiceClient.
+    Must be created from inside the event loop that will use it.
+    """
+    def __init__(self):
+        try:
+
+            self.blob_service_client = AzureBlobService.get_async_instance()
+
+        except Exception as e:
+            logger.error(f"Error during async blob service client: {e}")
+
+        super().__init__()
+
+    async def initialize_container(self, container_name):
+        try:
+
+            container_client = self.blob_service_client.get_container_client(container_name)
+
+            # Check if the container exists
+
+            if not await container_client.exists():
+                await self.blob_service_client.create_container(container_name)
+
+        except Exception as e:
+            logger.error(f"Error during container initialization: {e}")
+
+    @timed("blob.write")
+    async def upload_data_to_blob(self, container_name: str, blob_name: str, json_data, serializer=None):
+        """
+        Serialize and upload a payload; large payloads are streamed into a parallel block upload.
+        Writes whose content hash matches the stored blob are skipped, as in AzureBlobClient.
+        :return: True if the blob was written, False if the write was skipped as unchanged.
+        """
+        serializer = serializer or JsonSerializer()
+        upload_settings = AzureBlobService.get_upload_settings()
+        try:
+            container_client = self.blob_service_client.get_container_client(container_name)
+
+            blob_client = container_client.get_blob_client(blob=blob_name)
+
+            hasher, head, chunks, content_settings = self._serialize(json_data, serializer, upload_settings)
+
+            if chunks is not None and hasher is not None:
+                with span("serialize", format=serializer.name):
+                    spooled = _spool(head, chunks, upload_settings["max_single_put_size"])
+                with spooled:
+                    return await self._upload_if_changed(blob_client, container_name, blob_name, spooled, hasher,
+                                                         content_settings, upload_settings)
+
+            if chunks is None:
+                json_bytes = b"".join(head)
+                if hasher is not None:
+                    return await self._upload_if_changed(blob_client, container_name, blob_name, json_bytes, hasher,
+                                                         content_settings, upload_settings)
+                response = await blob_client.upload_blob(json_bytes, overwrite=True, content_settings=content_settings)
+                increment("blob.bytes_written", len(json_bytes))
+                return self._record_written(container_name, blob_name, json_bytes, response.get("etag"),
+                                            content_settings)
+
+            await blob_client.upload_blob(
+                _count_bytes(itertools.chain(head, chunks), "blob.bytes_written"),
+                overwrite=True,
+                content_settings=content_settings,
+                max_concurrency=upload_settings["max_concurrency"]
+            )
+            return self._record_written(container_name, blob_name, None, None, content_settings)
+
+        except AzureError as e:
+
+            logger.error(f"Failed to upload JSON data to {container_client.container_name}/{blob_name}: {e}")
+            raise
+
+        except Exception as e:
+
+            logger.error(f"An error occurred while uploading to Blob Storage: {e}")
+            raise
+
+    async def _upload_if_changed(self, blob_client, container_name, blob_name, data, hasher, content_settings,
+                                 upload_settings):
+        """
+        Upload bytes or a spooled file unless the blob's stored content hash matches; see
+        AzureBlobClient._upload_if_changed.
+        """
+        content_hash = hasher.hexdigest()
+        properties = None
+        stored_hash = self._remembered_hash(f"{container_name}/{blob_name}", content_hash)
+        if stored_hash is _UNKNOWN:
+            try:
+                properties = await blob_client.get_blob_properties()
+                stored_hash = _content_hash(properties)
+            except ResourceNotFoundError:
+                stored_hash = None
+
+        if stored_hash == content_hash:
+            return self._record_skipped(container_name, blob_name, data, properties, content_settings, content_hash)
+
+        metadata = {CONTENT_HASH_METADATA_KEY: content_hash}
+        if isinstance(data, bytes):
+            response = await blob_client.upload_blob(data, overwrite=True, metadata=metadata,
+                                                     content_settings=content_settings)
+            increment("blob.bytes_written", len(data))
+            etag = response.get("etag")
+        else:
+            length = data.seek(0, 2)
+            data.seek(0)
+            await blob_client.upload_blob(data, length=length, overwrite=True, metadata=metadata,
+                                          content_settings=content_settings,
+                                          max_concurrency=upload_settings["max_concurrency"])
+            increment("blob.bytes_written", length)
+            etag = None
+        return self._record_written(container_name, blob_name, data, etag, content_settings, content_hash)
+
+    async def upload_many(self, container_name: str, items, serializer=None, max_workers=None):
+        """
+        Upload several payloads concurrently, at most max_workers (default bulk_max_workers) at a time.
+        :param items: Iterable of (blob name, payload) pairs.
+        :raises RuntimeError: Listing the blobs that failed, after all uploads have been attempted.
+        """
+        items = list(items)
+        semaphore = asyncio.Semaphore(max_workers or AzureBlobService.get_upload_settings()["bulk_max_workers"])
+
+        async def upload(blob_name, payload):
+            async with semaphore:
+                await self.upload_data_to_blob(container_name, blob_name, payload, serializer)
+
+        results = await asyncio.gather(*(upload(blob_name, payload) for blob_name, payload in items),
+                                       return_exceptions=True)
+        failed_blobs = []
+        for (blob_name, _), result in zip(items, results):
+            if isinstance(result, Exception):
+                logger.error(f"Bulk upload of {blob_name} failed: {result}")
+                failed_blobs.append(blob_name)
+
+        if failed_blobs:
+            raise RuntimeError(f"Failed to upload {len(failed_blobs)} of {len(items)} blobs to {container_name}: {failed_blobs}")
+
+    @timed("blob.read")
+    async def read_blob_file(self, container_name, blob_name):
+        """
+        Read a JSON, NDJSON or Parquet file from Azure Blob Storage, revalidating cached copies with If-None-Match.
+        """
+        cache_key = f"{container_name}/{blob_name}"
+        cached = self._cached(cache_key)
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+
+            # Read the blob data; a missing blob surfaces as ResourceNotFoundError
+            downloader = await blob_client.download_blob(**self._download_kwargs(cached))
+            blob_data = await downloader.readall()
+            increment("blob.bytes_read", len(blob_data))
+            return self._record_read(cache_key, blob_data, downloader.properties)
+
+        except ResourceNotFoundError:
+            self._record_missing(container_name, blob_name)
+            return None
+
+        except HttpResponseError as e:
+            if e.status_code == 304 and cached is not None:
+                # Not modified since we cached it
+                _, blob_data, properties = self._record_not_modified(cache_key, cached)
+                return decode_blob(blob_data, properties.get("content_type"), properties.get("content_encoding"))
+            logger.error(f"Error reading blob file {blob_name}: {str(e)}")
+            raise
+
+        except Exception as e:
+            logger.error(f"Error reading blob file {blob_name}: {str(e)}")
+            raise
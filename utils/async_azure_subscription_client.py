@@ -0,0 +1,99 @@
+from typing import Any
+
+from azure.core.exceptions import AzureError
+from azure.mgmt.resourcegraph.models import QueryRequest, QueryResponse
+
+from shared.metrics import increment, span
+from shared.resource_registry import ResourceRegistry
+from shared.retry_decorator import retry_with_backoff
+from utils.azure_subscription_client import MAX_SUBSCRIPTIONS_PER_QUERY, ResourcePage
+from utils.logger_setup import setup_logger
+from utils.query_profiles import DEFAULT_PROFILE
+
+logger = setup_logger(name="AsyncAzureSubscriptionClient")
+
+class AsyncAzureSubscriptionClient:
+    """
+    asyncio counterpart of AzureSubscriptionClient built on the aio management clients.
+    The credential and clients come from the ResourceRegistry and are shared with later invocations on
+    the same event loop, so tokens and connections are reused; the registry closes them.
+    """
+    def __init__(self):
+        registry = ResourceRegistry.get_instance()
+        self.credential = registry.get_async_credential()
+        self.subscription_client = registry.get_async_subscription_client()
+        logger.info("Initializing async SubscriptionClient.")
+        self.resource_graph_client = registry.get_async_resource_graph_client()
+
+    @retry_with_backoff(retries=3, backoff_in_seconds=1)
+    async def fetch_subscriptions(self) -> list[Any]:
+        try:
+            logger.info("Fetching subscription list.")
+            subscriptions_data = [sub.as_dict() async for sub in self.subscription_client.subscriptions.list()]
+            logger.info("Successfully retrieved Azure subscriptions.")
+            return subscriptions_data
+        except AzureError as e:
+            logger.error(f"AzureError encountered: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"An unexpected error occurred: {str(e)}")
+            raise
+
+    @retry_with_backoff(retries=3, backoff_in_seconds=1)
+    async def _query_resources(self, query_request: QueryRequest) -> QueryResponse:
+        return await self.resource_graph_client.resources(query_request)
+
+    async def get_resources_for_subscriptions_paginated(self, subscription_ids, records_per_page, time_hour, skip_token=None,
+                                                        profile=DEFAULT_PROFILE):
+        """
+        Async generator over the pages of a resources (or resourcechanges) query.
+        Each page request is retried with backoff; a page that still fails is raised to the caller.
+        :param subscription_ids: Subscriptions to scope the query to (at most MAX_SUBSCRIPTIONS_PER_QUERY).
+        :param records_per_page: Number of records requested per page.
+        :param time_hour: Hours since the last execution, or None for a full query.
+        :param skip_token: Resume an identical query from this skip token instead of the first page.
+        :param profile: QueryProfile shaping the query.
+        """
+        if not subscription_ids:
+            raise ValueError("Subscription ID is required but was not provided.")
+        if len(subscription_ids) > MAX_SUBSCRIPTIONS_PER_QUERY:
+            raise ValueError(f"At most {MAX_SUBSCRIPTIONS_PER_QUERY} subscriptions can be queried at once, got {len(subscription_ids)}.")
+
+        subscription_label = subscription_ids[0] if len(subscription_ids) == 1 else f"batch of {len(subscription_ids)}"
+        try:
+            logger.info(f"<<<< Per page : {records_per_page} with subscription id: {subscription_label}")
+
+            if time_hour is None:
+                # Normal query
+                query = profile.resources_query()
+            else:
+                # Change query
+                query = profile.changes_query(time_hour)
+
+            if skip_token is None:
+                options = {"resultFormat": "objectArray", "$top": records_per_page}  # Set records per page
+            else:
+                options = {"resultFormat": "objectArray", "$skipToken": skip_token}
+            while True:
+                with span("resource_graph.query", subscriptions=len(subscription_ids)):
+                    result = await self._query_resources(QueryRequest(
+                        subscriptions=list(subscription_ids),
+                        query=query,
+                        options=options
+                    ))
+                increment("resource_graph.pages")
+                if hasattr(result, 'data') and isinstance(result.data, list):
+                    increment("resource_graph.records", len(result.data))
+                    yield ResourcePage(result.data, result.skip_token)
+
+                if result.skip_token is None:
+                    break
+                options = {"resultFormat": "objectArray", "$skipToken": result.skip_token}
+
+        except AzureError as e:
+            logger.error(f"Azure error occurred while fetching resources for subscription {subscription_label}: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(
+                f"Unexpected error occurred while fetching resources for subscription {subscription_label}: {str(e)}")
+            raise
@@ -1,13 +1,160 @@
-from azure.core.exceptions import AzureError
-from azure.storage.blob import BlobServiceClient
-import json
+import itertools
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from azure.core import MatchConditions
+from azure.core.exceptions import AzureError, HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+from shared.metrics import increment, span, timed
+from shared.resource_registry import ResourceRegistry
 from utils.azure_blob_service import AzureBlobService
+from utils.blob_cache import BlobCache
+from utils.content_hash import CONTENT_HASH_METADATA_KEY, ContentHasher
 from utils.logger_setup import setup_logger
+from utils.serializers import JsonSerializer, decode_blob, detect_serializer
 
 logger = setup_logger(name="AzureBlobClient")
 
-class AzureBlobClient:
+# No read of the blob has told us its content hash
+_UNKNOWN = object()
+
+
+class _BlobClientBase:
+    """
+    Blob cache, content hash and upload count bookkeeping shared by AzureBlobClient and
+    AsyncAzureBlobClient, which only differ in how they call the service.
+    """
+    def __init__(self):
+        self.blob_cache = BlobCache.get_instance()
+        self.upload_counts = {"written": 0, "skipped": 0}
+        self._upload_counts_lock = threading.Lock()
+        # Content hash seen by the last read of a blob (None: missing or unhashed); a write that follows
+        # with different content needs no properties request
+        self._stored_hashes = {}
+
+    @staticmethod
+    def _serialize(json_data, serializer, upload_settings):
+        """
+        Start serializing a payload, up to max_single_put_size bytes.
+        :return: (hasher, head, chunks, content_settings); hasher is None without skip_unchanged, and
+                 head and chunks are as returned by _split_head.
+        """
+        hasher = ContentHasher(serializer) if upload_settings["skip_unchanged"] else None
+        if hasher is not None:
+            json_data = hasher.wrap(json_data)
+        # Serialization of streamed payloads continues inside the block upload
+        with span("serialize", format=serializer.name):
+            head, chunks = _split_head(serializer.iter_dumps(json_data), upload_settings["max_single_put_size"])
+        content_settings = ContentSettings(content_type=serializer.content_type,
+                                           content_encoding=serializer.content_encoding)
+        return hasher, head, chunks, content_settings
+
+    def _remembered_hash(self, cache_key, content_hash):
+        """
+        :return: The content hash seen by the last read of the blob when that alone decides on a write,
+                 otherwise _UNKNOWN and the hash has to come from the blob's properties.
+        """
+        stored_hash = self._stored_hashes.pop(cache_key, _UNKNOWN)
+        # A hash remembered from an earlier read is out of date once someone else writes the blob, so it
+        # only decides writes; a skip is confirmed against the blob's current hash
+        return _UNKNOWN if stored_hash == content_hash else stored_hash
+
+    def _cache_put(self, cache_key, etag, data, content_settings, content_hash=None):
+        if self.blob_cache is None:
+            return
+        properties = {
+            "content_type": content_settings.content_type,
+            "content_encoding": content_settings.content_encoding,
+        }
+        if content_hash is not None:
+            properties["content_hash"] = content_hash
+        self.blob_cache.put(cache_key, etag, data, properties)
+
+    def _forget(self, cache_key, stored_hash=_UNKNOWN):
+        """
+        Drop the cached copy of a blob and remember stored_hash as its content hash, if given.
+        """
+        if stored_hash is _UNKNOWN:
+            self._stored_hashes.pop(cache_key, None)
+        else:
+            self._stored_hashes[cache_key] = stored_hash
+        if self.blob_cache is not None:
+            self.blob_cache.invalidate(cache_key)
+
+    def _record_written(self, container_name, blob_name, data, etag, content_settings, content_hash=None):
+        """
+        Bookkeeping after a write: bytes are kept in the blob cache so the next read of the blob can be a
+        conditional GET, streamed or spooled uploads are not kept and drop any older copy.
+        :return: True
+        """
+        cache_key = f"{container_name}/{blob_name}"
+        if isinstance(data, bytes):
+            self._cache_put(cache_key, etag, data, content_settings, content_hash)
+        elif self.blob_cache is not None:
+            self.blob_cache.invalidate(cache_key)
+        self._count_upload(written=True)
+        logger.info(f"Successfully uploaded JSON data to {blob_name} in container {container_name}")
+        return True
+
+    def _record_skipped(self, container_name, blob_name, data, properties, content_settings, content_hash):
+        """
+        Bookkeeping after a write was skipped as unchanged; the stored content is what we would have
+        written, so it can seed the cache as well.
+        :return: False
+        """
+        if properties is not None and isinstance(data, bytes):
+            self._cache_put(f"{container_name}/{blob_name}", properties.etag, data, content_settings, content_hash)
+        self._count_upload(written=False)
+        logger.info(f"Skipped upload of unchanged {blob_name} in container {container_name}")
+        return False
+
+    def _count_upload(self, written):
+        with self._upload_counts_lock:
+            self.upload_counts["written" if written else "skipped"] += 1
+        increment("blob.writes" if written else "blob.writes_skipped")
+
+    def _cached(self, cache_key):
+        """
+        :return: (etag, data, properties) of the cached copy of a blob, or None.
+        """
+        return self.blob_cache.get(cache_key) if self.blob_cache is not None else None
+
+    @staticmethod
+    def _download_kwargs(cached):
+        # Content-Encoding is decoded by the serializer, so the transport must hand over raw bytes
+        if cached is None:
+            return {"decompress": False}
+        return {"etag": cached[0], "match_condition": MatchConditions.IfModified, "decompress": False}
+
+    def _record_read(self, cache_key, blob_data, properties):
+        """
+        Remember the content hash and cache a downloaded blob.
+        :return: The decoded payload.
+        """
+        content_settings = properties.content_settings
+        content_hash = _content_hash(properties)
+        self._stored_hashes[cache_key] = content_hash
+        self._cache_put(cache_key, properties.etag, blob_data, content_settings, content_hash)
+        return decode_blob(blob_data, content_settings.content_type, content_settings.content_encoding)
+
+    def _record_missing(self, container_name, blob_name):
+        logger.info(f"Blob {blob_name} does not exist in container {container_name}.")
+        self._forget(f"{container_name}/{blob_name}", None)
+
+    def _record_not_modified(self, cache_key, cached):
+        """
+        Bookkeeping for a 304 answer to a conditional read of the cached copy.
+        :return: The cached (etag, data, properties).
+        """
+        increment("blob.not_modified")
+        if "content_hash" in cached[2]:
+            self._stored_hashes[cache_key] = cached[2]["content_hash"]
+        return cached
+
+
+class AzureBlobClient(_BlobClientBase):
     def __init__(self):
         try:
 
@@ -16,7 +163,13 @@ class AzureBlobClient:
         except Exception as e:
             logger.error(f"Error during blob service client: {e}")
 
+        super().__init__()
+
     def initialize_container(self, container_name):
+        # Containers checked by an earlier invocation in this process are not checked again
+        registry = ResourceRegistry.get_instance()
+        if registry.container_initialized(container_name):
+            return
         try:
 
             container_client = self.blob_service_client.get_container_client(container_name)
@@ -26,20 +179,57 @@ class AzureBlobClient:
             if not container_client.exists():
                 self.blob_service_client.create_container(container_name)
 
+            registry.mark_container_initialized(container_name)
+
         except Exception as e:
             logger.error(f"Error during container initialization: {e}")
 
-    def upload_data_to_blob(self, container_name: str, blob_name: str, json_data):
+    @timed("blob.write")
+    def upload_data_to_blob(self, container_name: str, blob_name: str, json_data, serializer=None):
+        """
+        Serialize and upload a payload.
+        Payloads up to the configured max_single_put_size are uploaded in one request; larger ones are
+        serialized as a stream straight into a block upload with max_concurrency parallel blocks, so the
+        whole document is never materialized.
+        With skip_unchanged, the content hash of the payload is stored as blob metadata and the write is
+        skipped when the blob already holds the same content; large payloads are then spooled to a
+        temporary file until their hash is known.
+        :param serializer: Output format from utils.serializers; defaults to compact JSON.
+        :return: True if the blob was written, False if the write was skipped as unchanged.
+        """
+        serializer = serializer or JsonSerializer()
+        upload_settings = AzureBlobService.get_upload_settings()
         try:
             container_client = self.blob_service_client.get_container_client(container_name)
 
             blob_client = container_client.get_blob_client(blob=blob_name)
 
-            json_string = json.dumps(json_data, indent=4)
+            hasher, head, chunks, content_settings = self._serialize(json_data, serializer, upload_settings)
 
-            blob_client.upload_blob(json_string, overwrite=True)
+            if chunks is not None and hasher is not None:
+                with span("serialize", format=serializer.name):
+                    spooled = _spool(head, chunks, upload_settings["max_single_put_size"])
+                with spooled:
+                    return self._upload_if_changed(blob_client, container_name, blob_name, spooled, hasher,
+                                                   content_settings, upload_settings)
 
-            logger.info(f"Successfully uploaded JSON data to {blob_name} in container {container_client.container_name}")
+            if chunks is None:
+                json_bytes = b"".join(head)
+                if hasher is not None:
+                    return self._upload_if_changed(blob_client, container_name, blob_name, json_bytes, hasher,
+                                                   content_settings, upload_settings)
+                response = blob_client.upload_blob(json_bytes, overwrite=True, content_settings=content_settings)
+                increment("blob.bytes_written", len(json_bytes))
+                return self._record_written(container_name, blob_name, json_bytes, response.get("etag"),
+                                            content_settings)
+
+            blob_client.upload_blob(
+                _count_bytes(itertools.chain(head, chunks), "blob.bytes_written"),
+                overwrite=True,
+                content_settings=content_settings,
+                max_concurrency=upload_settings["max_concurrency"]
+            )
+            return self._record_written(container_name, blob_name, None, None, content_settings)
 
         except AzureError as e:
 
@@ -51,22 +241,252 @@ class AzureBlobClient:
             logger.error(f"An error occurred while uploading to Blob Storage: {e}")
             raise
 
+    def _upload_if_changed(self, blob_client, container_name, blob_name, data, hasher, content_settings,
+                           upload_settings):
+        """
+        Upload bytes or a spooled file unless the blob's stored content hash matches. A different hash
+        seen by a read of the blob just before (the merge of a page reads it anyway) is enough to write;
+        otherwise, and before every skip, the hash is taken from the blob's properties.
+        """
+        content_hash = hasher.hexdigest()
+        properties = None
+        stored_hash = self._remembered_hash(f"{container_name}/{blob_name}", content_hash)
+        if stored_hash is _UNKNOWN:
+            try:
+                properties = blob_client.get_blob_properties()
+                stored_hash = _content_hash(properties)
+            except ResourceNotFoundError:
+                stored_hash = None
+
+        if stored_hash == content_hash:
+            return self._record_skipped(container_name, blob_name, data, properties, content_settings, content_hash)
+
+        metadata = {CONTENT_HASH_METADATA_KEY: content_hash}
+        if isinstance(data, bytes):
+            response = blob_client.upload_blob(data, overwrite=True, metadata=metadata, content_settings=content_settings)
+            increment("blob.bytes_written", len(data))
+            etag = response.get("etag")
+        else:
+            length = data.seek(0, 2)
+            data.seek(0)
+            blob_client.upload_blob(data, length=length, overwrite=True, metadata=metadata,
+                                    content_settings=content_settings, max_concurrency=upload_settings["max_concurrency"])
+            increment("blob.bytes_written", length)
+            etag = None
+        return self._record_written(container_name, blob_name, data, etag, content_settings, content_hash)
+
+    def upload_many(self, container_name: str, items, serializer=None, max_workers=None):
+        """
+        Upload several payloads concurrently through the shared service client.
+        :param items: Iterable of (blob name, payload) pairs.
+        :param max_workers: Blobs in flight at once; defaults to the configured bulk_max_workers.
+        :raises RuntimeError: Listing the blobs that failed, after all uploads have been attempted.
+        """
+        items = list(items)
+        if not items:
+            return
+        max_workers = max_workers or AzureBlobService.get_upload_settings()["bulk_max_workers"]
+
+        failed_blobs = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            futures = {
+                executor.submit(self.upload_data_to_blob, container_name, blob_name, payload, serializer): blob_name
+                for blob_name, payload in items
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Bulk upload of {futures[future]} failed: {e}")
+                    failed_blobs.append(futures[future])
+
+        if failed_blobs:
+            raise RuntimeError(f"Failed to upload {len(failed_blobs)} of {len(items)} blobs to {container_name}: {failed_blobs}")
+
+    def list_blobs(self, container_name, name_starts_with=None):
+        """
+        :param container_name: Container, optionally followed by a virtual folder path such as
+                               "azure-greenfield/raw_data/resource"; the listing runs on the real container
+                               with the folder as part of the name prefix.
+        :return: List of blob properties (name, size, last_modified, ...) whose names, relative to the folder,
+                 start with name_starts_with. Names are returned relative to the folder too.
+        """
+        container, _, folder = container_name.partition("/")
+        folder_prefix = f"{folder.strip('/')}/" if folder.strip("/") else ""
+        try:
+            container_client = self.blob_service_client.get_container_client(container)
+            with span("blob.list"):
+                blobs = list(container_client.list_blobs(name_starts_with=f"{folder_prefix}{name_starts_with or ''}"))
+            for blob in blobs:
+                blob.name = blob.name[len(folder_prefix):]
+            return blobs
+        except AzureError as e:
+            logger.error(f"Failed to list blobs in {container_name} starting with {name_starts_with}: {e}")
+            raise
+
+    def delete_blobs(self, container_name, blob_names, max_workers=None):
+        """
+        Delete several blobs concurrently; blobs that are already gone are ignored.
+        :param max_workers: Deletes in flight at once; defaults to the configured bulk_max_workers.
+        :raises RuntimeError: Listing the blobs that could not be deleted, after all deletes have been attempted.
+        """
+        blob_names = list(blob_names)
+        if not blob_names:
+            return
+        max_workers = max_workers or AzureBlobService.get_upload_settings()["bulk_max_workers"]
+        container_client = self.blob_service_client.get_container_client(container_name)
+
+        def delete(blob_name):
+            try:
+                container_client.get_blob_client(blob_name).delete_blob()
+            except ResourceNotFoundError:
+                pass
+            self._forget(f"{container_name}/{blob_name}")
+            increment("blob.deletes")
+
+        failed_blobs = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(blob_names))) as executor:
+            futures = {executor.submit(delete, blob_name): blob_name for blob_name in blob_names}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Delete of {futures[future]} failed: {e}")
+                    failed_blobs.append(futures[future])
+
+        if failed_blobs:
+            raise RuntimeError(f"Failed to delete {len(failed_blobs)} of {len(blob_names)} blobs from {container_name}: {failed_blobs}")
+
     def read_blob_file(self, container_name, blob_name):
         """
-        Read a JSON file from Azure Blob Storage.
+        Read a JSON, NDJSON (optionally gzip/zstd compressed) or Parquet file from Azure Blob Storage.
+        The format is detected from the blob's content settings, falling back to magic bytes.
+        When the blob cache is enabled, a cached copy is revalidated with If-None-Match and only
+        downloaded again if its ETag changed.
+        """
+        return self.read_blob_file_with_etag(container_name, blob_name)[0]
+
+    @timed("blob.read")
+    def read_blob_file_with_etag(self, container_name, blob_name):
+        """
+        Same as read_blob_file, for callers that write the blob back conditionally.
+        :return: (payload, etag), or (None, None) when the blob does not exist.
         """
+        cache_key = f"{container_name}/{blob_name}"
+        cached = self._cached(cache_key)
         try:
             blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
 
-            # Check if the blob exists
-            if not blob_client.exists():
-                logger.info(f"Blob {blob_name} does not exist in container {container_name}.")
-                return None
+            # Read the blob data; a missing blob surfaces as ResourceNotFoundError
+            downloader = blob_client.download_blob(**self._download_kwargs(cached))
+            blob_data = downloader.readall()
+            increment("blob.bytes_read", len(blob_data))
+            return self._record_read(cache_key, blob_data, downloader.properties), downloader.properties.etag
 
-            # Read the blob data
-            blob_data = blob_client.download_blob().readall()
-            return json.loads(blob_data)
+        except ResourceNotFoundError:
+            self._record_missing(container_name, blob_name)
+            return None, None
+
+        except HttpResponseError as e:
+            if e.status_code == 304 and cached is not None:
+                # Not modified since we cached it
+                etag, blob_data, properties = self._record_not_modified(cache_key, cached)
+                return decode_blob(blob_data, properties.get("content_type"), properties.get("content_encoding")), etag
+            logger.error(f"Error reading blob file {blob_name}: {str(e)}")
+            raise
 
         except Exception as e:
             logger.error(f"Error reading blob file {blob_name}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    @timed("blob.read_range")
+    def read_blob_range(self, container_name, blob_name, offset, length):
+        """
+        Download length bytes of a blob starting at offset, bypassing the blob cache.
+        :return: The raw bytes, or None when the blob does not exist.
+        """
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+            blob_data = blob_client.download_blob(offset=offset, length=length, decompress=False).readall()
+            increment("blob.bytes_read", len(blob_data))
+            return blob_data
+        except ResourceNotFoundError:
+            logger.info(f"Blob {blob_name} does not exist in container {container_name}.")
+            return None
+        except Exception as e:
+            logger.error(f"Error reading range of blob file {blob_name}: {str(e)}")
+            raise
+
+    def iter_blob_records(self, container_name, blob_name):
+        """
+        Stream the records of a {"value": [...]} blob. JSON and NDJSON blobs are decoded record by record
+        as chunks arrive, so a whole page is never held in memory; Parquet is decoded in one go.
+        A cached copy is revalidated with If-None-Match like in read_blob_file. Yields nothing when the
+        blob does not exist.
+        """
+        cache_key = f"{container_name}/{blob_name}"
+        cached = self._cached(cache_key)
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+            downloader = blob_client.download_blob(**self._download_kwargs(cached))
+        except ResourceNotFoundError:
+            self._record_missing(container_name, blob_name)
+            return
+        except HttpResponseError as e:
+            if e.status_code != 304 or cached is None:
+                logger.error(f"Error reading blob file {blob_name}: {str(e)}")
+                raise
+            # Not modified since we cached it
+            _, blob_data, properties = self._record_not_modified(cache_key, cached)
+            serializer = detect_serializer(blob_data, properties.get("content_type"), properties.get("content_encoding"))
+            yield from serializer.iter_records([blob_data])
+            return
+
+        # A streamed copy is not kept, so the cached one is out of date
+        self._forget(cache_key, _content_hash(downloader.properties))
+
+        content_settings = downloader.properties.content_settings
+        chunks = _count_bytes(downloader.chunks(), "blob.bytes_read")
+        first_chunk = next(chunks, b"")
+        serializer = detect_serializer(first_chunk, content_settings.content_type, content_settings.content_encoding)
+
+        yield from serializer.iter_records(itertools.chain([first_chunk], chunks))
+
+
+def _content_hash(properties):
+    """
+    :return: The content hash stored in a blob's metadata, or None.
+    """
+    return (properties.metadata or {}).get(CONTENT_HASH_METADATA_KEY)
+
+
+def _count_bytes(chunks, counter):
+    for chunk in chunks:
+        increment(counter, len(chunk))
+        yield chunk
+
+
+def _spool(head, chunks, max_memory_size):
+    """
+    Write serialized chunks to a temporary file that moves to disk past max_memory_size.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+    for chunk in itertools.chain(head, chunks):
+        spooled.write(chunk)
+    return spooled
+
+
+def _split_head(chunks, limit):
+    """
+    Read chunks until more than limit bytes are buffered.
+    :return: (buffered chunks, None) when the stream ended within the limit, otherwise
+             (buffered chunks, iterator over the remaining chunks).
+    """
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return head, chunks
+    return head, None
@@ -1,22 +1,87 @@
-import os
+import threading
+from typing import TYPE_CHECKING
+
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import AzureError
+from config.config import AzureConfig
+from shared.resource_registry import ResourceRegistry
 from utils.logger_setup import setup_logger
 
+if TYPE_CHECKING:
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
 logger = setup_logger(name="AzureBlobService")
 
+DEFAULT_UPLOAD_SETTINGS = {
+    "max_concurrency": 4,                       # Parallel block uploads per blob
+    "max_block_size": 4 * 1024 * 1024,          # Size of each staged block
+    "max_single_put_size": 8 * 1024 * 1024,     # Payloads up to this size are uploaded in a single request
+    "bulk_max_workers": 8,                      # Blobs uploaded concurrently by upload_many
+    "skip_unchanged": False,                    # Skip writes whose content hash matches the stored blob
+}
+
 class AzureBlobService:
     _instance = None
+    _instance_lock = threading.Lock()
+    _upload_settings = None
+
+    @staticmethod
+    def _get_connection_string():
+        #connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+        connection_string = "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+        if not connection_string:
+            raise ValueError("Environment variable AZURE_STORAGE_CONNECTION_STRING is not set.")
+        return connection_string
+
+    @classmethod
+    def get_upload_settings(cls) -> dict:
+        """
+        Upload tuning from the "blob_upload" section of settings.json, with defaults for missing keys.
+        """
+        if cls._upload_settings is None:
+            configured = AzureConfig().get_config().get("blob_upload", {})
+            cls._upload_settings = {key: configured.get(key, default) for key, default in DEFAULT_UPLOAD_SETTINGS.items()}
+        return cls._upload_settings
+
+    @classmethod
+    def _client_kwargs(cls):
+        upload_settings = cls.get_upload_settings()
+        return {
+            "max_block_size": upload_settings["max_block_size"],
+            "max_single_put_size": upload_settings["max_single_put_size"],
+        }
+
     @classmethod
     def get_instance(cls) -> BlobServiceClient:
-        if cls._instance is None:
-            #connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-            connection_string = "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
-            if not connection_string:
-                raise ValueError("Environment variable AZURE_STORAGE_CONNECTION_STRING is not set.")
+        # Worker threads of one invocation may ask for the client at the same time; build it once
+        with cls._instance_lock:
+            if cls._instance is None:
+                connection_string = cls._get_connection_string()
+                try:
+                    # Connections come from the process-wide pool shared with the management clients
+                    cls._instance = BlobServiceClient.from_connection_string(
+                        connection_string, session=ResourceRegistry.get_instance().get_session(), session_owner=False,
+                        **cls._client_kwargs())
+                    logger.info("BlobServiceClient initialized successfully.")
+                except AzureError as e:
+                    raise Exception(f"Failed to initialize BlobServiceClient: {e}")
+            return cls._instance
+
+    @classmethod
+    def get_async_instance(cls) -> "AsyncBlobServiceClient":
+        """
+        Return the shared aio BlobServiceClient of the running event loop. It is kept in the
+        ResourceRegistry with the other aio clients, which replaces it on a different loop and closes it.
+        """
+        # The aio stack (aiohttp) is only loaded by the async entry point
+        from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+        def create():
             try:
-                cls._instance = BlobServiceClient.from_connection_string(connection_string)
-                logger.info("BlobServiceClient initialized successfully.")
+                client = AsyncBlobServiceClient.from_connection_string(cls._get_connection_string(), **cls._client_kwargs())
             except AzureError as e:
-                raise Exception(f"Failed to initialize BlobServiceClient: {e}")
-        return cls._instance
\ No newline at end of file
+                raise Exception(f"Failed to initialize async BlobServiceClient: {e}")
+            logger.info("Async BlobServiceClient initialized successfully.")
+            return client
+
+        return ResourceRegistry.get_instance().get_async_client("async_blob_service_client", create)
\ No newline at end of file
@@ -0,0 +1,411 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+
+from utils.azure_blob_client import AzureBlobClient
+from utils.conditional_save import save_with_retries
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="AzureCheckpointStore")
+
+# Conditional writes that lose to another invocation are re-applied on a fresh copy this many times
+MAX_WRITE_ATTEMPTS = 10
+
+
+class AzureCheckpointStore:
+    """
+    Progress of the current run, kept in a blob next to the watermark:
+
+        {"run_id", "started_at", "attempts", "last_execution_time", "current_execution_time", "date_label",
+         "subscriptions": {id: {"status", "last_page", "skip_token", "owner", "updated_at", "error"}}}
+
+    The blob exists from the start of a run until its watermark has been advanced, so a run that crashed
+    or timed out is resumed by the next invocation with the same time window, skipping completed
+    subscriptions. A run that has been started max_run_attempts times or is older than max_run_age_seconds
+    is closed instead: a new run with a new window replaces it and only the subscriptions it did not
+    complete are carried over, with their progress, so one subscription that keeps failing does not hold
+    the others back on the old window. Every write is conditioned on the ETag last read; when another invocation wrote in
+    between, the change is re-applied to its copy. Subscriptions are claimed by an invocation right before
+    it processes them and stay claimed while it keeps flushing, so concurrent invocations split the work
+    instead of repeating it. Page progress is kept in memory and flushed every flush_pages pages or
+    flush_seconds, together with a renewal of the leases of the subscriptions in progress; a resumed run
+    repeats at most the pages recorded since the last flush, which are merged by id.
+    In distributed mode the orchestrator marks subscriptions "queued" when it hands them to workers; any
+    worker may claim a queued subscription, other orchestrators leave it alone.
+    Once another invocation has finished the run and removed the checkpoint, further updates are dropped.
+    """
+
+    def __init__(self, container_name, blob_name="azure_checkpoint.json", lease_seconds=300, queued_lease_seconds=3600,
+                 flush_pages=10, flush_seconds=30, max_run_attempts=3, max_run_age_seconds=6 * 3600):
+        """
+        :param lease_seconds: How long a claimed subscription without progress stays reserved for its owner.
+        :param queued_lease_seconds: How long a queued subscription waits for a worker before it is queued again.
+        :param flush_pages: Recorded pages after which the progress is written.
+        :param flush_seconds: Seconds after which the progress is written and the leases renewed; keep it well
+                              below lease_seconds.
+        :param max_run_attempts: Invocations that may start the same run before it is closed.
+        :param max_run_age_seconds: Age after which a run is closed rather than resumed.
+        """
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.lease_seconds = lease_seconds
+        self.queued_lease_seconds = queued_lease_seconds
+        self.owner = uuid.uuid4().hex
+        self.blob_client = AzureBlobClient()
+        self.blob_service_client = self.blob_client.blob_service_client
+        self.container_client = self.blob_service_client.get_container_client(container_name)
+        self.flush_pages = max(1, flush_pages)
+        self.flush_seconds = flush_seconds
+        self.max_run_attempts = max(1, max_run_attempts)
+        self.max_run_age_seconds = max_run_age_seconds
+        self.checkpoint = None
+        self._etag = None
+        self._run_finished = False
+        # Subscriptions this invocation is processing, and their page progress not written yet
+        self._leases = set()
+        self._progress = {}
+        self._pages_since_flush = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _read(self):
+        """
+        :return: (checkpoint, etag), or (None, None) when no run is in progress.
+        """
+        try:
+            downloader = self.container_client.get_blob_client(self.blob_name).download_blob()
+            return json.loads(downloader.readall()), downloader.properties.etag
+        except ResourceNotFoundError:
+            return None, None
+
+    def _update(self, mutate):
+        """
+        Apply mutate(checkpoint) and write the result, re-reading and re-applying on ETag conflicts.
+        :return: True when written; False when the run has finished and its checkpoint is gone.
+        """
+        def prepare():
+            if self.checkpoint is None:
+                raise RuntimeError("No checkpointed run in progress; call start_run first.")
+            mutate(self.checkpoint)
+            return self.checkpoint, self._etag
+
+        def reload():
+            logger.info("Checkpoint was updated by another invocation; re-applying changes.")
+            checkpoint, etag = self._read()
+            if checkpoint is None:
+                # The last copy is kept for reads such as get(); updates are dropped from now on
+                logger.info("Another invocation finished the run and removed its checkpoint; "
+                            "no further progress is recorded.")
+                self._run_finished = True
+                return False
+            self.checkpoint, self._etag = checkpoint, etag
+
+        with self._lock:
+            if self._run_finished:
+                return False
+            etag = save_with_retries(self.container_client.get_blob_client(self.blob_name), prepare, reload,
+                                     MAX_WRITE_ATTEMPTS)
+            if etag is not None:
+                self._etag = etag
+                return True
+            if self._run_finished:
+                return False
+            raise RuntimeError(f"Could not update checkpoint after {MAX_WRITE_ATTEMPTS} attempts.")
+
+    @staticmethod
+    def _now():
+        return datetime.utcnow().isoformat()
+
+    def start_run(self, last_execution_time, current_execution_time, date_label=None):
+        """
+        Resume the checkpointed run, or start a new one for the given time window; a run past its attempts
+        or age is closed and replaced by a new one (see the class docstring).
+        :param date_label: Date the pages of a new run are written under; a resumed run keeps its own, so
+                           pages written after midnight still belong to the date the run started on.
+        :return: The run checkpoint; its last_execution_time and current_execution_time define the window.
+        """
+        checkpoint, new_run, previous = None, False, None
+
+        def prepare():
+            nonlocal checkpoint, new_run, previous
+            checkpoint, etag = self._read()
+            if checkpoint is not None and not self._expired(checkpoint):
+                checkpoint["attempts"] = checkpoint.get("attempts", 1) + 1
+                new_run = False
+            else:
+                new_run, previous = True, checkpoint
+                checkpoint = {
+                    "run_id": self.owner,
+                    "started_at": self._now(),
+                    "attempts": 1,
+                    "last_execution_time": last_execution_time,
+                    "current_execution_time": current_execution_time,
+                    "date_label": date_label,
+                    "subscriptions": self._carried_subscriptions(previous, date_label),
+                }
+            return checkpoint, etag
+
+        def reload():
+            # Another invocation started or resumed the run at the same moment; prepare looks again
+            logger.info("Checkpoint was updated by another invocation while starting the run; retrying.")
+
+        with self._lock:
+            etag = save_with_retries(self.container_client.get_blob_client(self.blob_name), prepare, reload,
+                                     MAX_WRITE_ATTEMPTS)
+            if etag is None:
+                raise RuntimeError(f"Could not start a checkpointed run after {MAX_WRITE_ATTEMPTS} attempts.")
+
+            if new_run:
+                logger.info(f"Started checkpointed run {checkpoint['run_id']}"
+                            + (f", carrying over {len(checkpoint['subscriptions'])} unfinished subscriptions "
+                               f"from run {previous['run_id']}." if previous is not None else "."))
+            else:
+                completed = sum(1 for entry in checkpoint["subscriptions"].values() if entry["status"] == "completed")
+                logger.info(f"Resuming run {checkpoint['run_id']} started at {checkpoint['started_at']}, attempt "
+                            f"{checkpoint['attempts']} ({completed} subscriptions already completed).")
+            self._load(checkpoint, etag)
+            return checkpoint
+
+    def _expired(self, checkpoint):
+        age = datetime.utcnow() - datetime.fromisoformat(checkpoint["started_at"])
+        if checkpoint.get("attempts", 1) >= self.max_run_attempts or age > timedelta(seconds=self.max_run_age_seconds):
+            logger.warning(f"Closing run {checkpoint['run_id']} started at {checkpoint['started_at']} after "
+                           f"{checkpoint.get('attempts', 1)} attempts; its unfinished subscriptions move to a new run.")
+            return True
+        return False
+
+    @staticmethod
+    def _carried_subscriptions(checkpoint, date_label):
+        """
+        :return: The entries of the closed run's subscriptions that did not complete. Their watermarks were
+                 not advanced, so the new run scans them from where they stand. Subscriptions still in
+                 progress keep their owner and lease; queued ones belong to queue messages of the closed
+                 run, which workers drop, so they are released. Page progress is only kept when the new
+                 run writes under the same date label, since the earlier pages are stored under it.
+        """
+        if checkpoint is None:
+            return {}
+        carried = {}
+        for subscription_id, entry in checkpoint["subscriptions"].items():
+            if entry["status"] == "completed":
+                continue
+            entry = dict(entry)
+            if entry["status"] == "queued":
+                entry.update(status="failed", error="Run closed before a worker picked the subscription up.")
+            if checkpoint.get("date_label") != date_label:
+                entry.update(last_page=0, skip_token=None)
+            carried[subscription_id] = entry
+        return carried
+
+    def _load(self, checkpoint, etag):
+        self.checkpoint, self._etag = checkpoint, etag
+        self._run_finished = False
+        self._leases.clear()
+        self._progress.clear()
+
+    def join_run(self, run_id):
+        """
+        Load the checkpoint of a run started by another invocation.
+        :return: The run checkpoint, or None when that run has already finished.
+        """
+        with self._lock:
+            checkpoint, etag = self._read()
+            if checkpoint is None or checkpoint["run_id"] != run_id:
+                return None
+            self._load(checkpoint, etag)
+            return checkpoint
+
+    def get(self, subscription_id):
+        with self._lock:
+            entry = self.checkpoint["subscriptions"].get(subscription_id)
+            return dict(entry) if entry is not None else None
+
+    def _claimable(self, entry, status):
+        if entry is None:
+            return True
+        if entry["status"] == "completed":
+            return False
+        if entry.get("owner") == self.owner:
+            return True
+        if entry["status"] == "in_progress":
+            lease_seconds = self.lease_seconds
+        elif entry["status"] == "queued" and status == "queued":
+            lease_seconds = self.queued_lease_seconds
+        else:
+            return True
+        # Claimed by another invocation: only take it over once that invocation stopped making progress
+        last_update = datetime.fromisoformat(entry["updated_at"])
+        return datetime.utcnow() - last_update > timedelta(seconds=lease_seconds)
+
+    def pending(self, subscription_ids):
+        """
+        :return: The subscriptions that are neither completed nor being processed by another invocation, going
+                 by the checkpoint last read, in the given order. Nothing is claimed; claim each work item right
+                 before processing it, so its lease does not run out while it waits for a worker.
+        """
+        with self._lock:
+            if self.checkpoint is None:
+                return []
+            return [subscription_id for subscription_id in subscription_ids
+                    if self._claimable(self.checkpoint["subscriptions"].get(subscription_id), "in_progress")]
+
+    def claim(self, subscription_ids):
+        """
+        Claim the subscriptions that are neither completed nor being processed by another invocation.
+        :return: The claimed subscription ids, in the given order.
+        """
+        claimed = self._claim(subscription_ids, "in_progress")
+        with self._lock:
+            self._leases.update(claimed)
+        return claimed
+
+    def enqueue(self, subscription_ids):
+        """
+        Mark the subscriptions that are neither completed, queued nor being processed as queued for workers.
+        :return: The queued subscription ids, in the given order.
+        """
+        return self._claim(subscription_ids, "queued")
+
+    def _claim(self, subscription_ids, status):
+        claimed = []
+
+        def mutate(checkpoint):
+            claimed.clear()
+            now = self._now()
+            for subscription_id in subscription_ids:
+                entry = checkpoint["subscriptions"].get(subscription_id)
+                if not self._claimable(entry, status):
+                    continue
+                entry = dict(entry or {"last_page": 0, "skip_token": None})
+                entry.update(status=status, owner=self.owner, updated_at=now)
+                entry.pop("error", None)
+                checkpoint["subscriptions"][subscription_id] = entry
+                claimed.append(subscription_id)
+
+        if not self._update(mutate):
+            return []
+        return list(claimed)
+
+    def record_page(self, subscription_id, page_number, skip_token):
+        """
+        Record that a page has been written; skip_token is the token of the following page.
+        The progress is written with the next flush.
+        """
+        with self._lock:
+            self._progress[subscription_id] = (page_number, skip_token)
+            self._pages_since_flush += 1
+        self.heartbeat()
+
+    def heartbeat(self):
+        """
+        Flush when flush_pages pages have been recorded or flush_seconds have passed since the last flush.
+        Call it regularly while processing subscriptions that record no pages, to keep their leases.
+        """
+        if self.flush_due():
+            self.flush()
+
+    def flush_due(self):
+        with self._lock:
+            return (self.checkpoint is not None and not self._run_finished
+                    and (self._pages_since_flush >= self.flush_pages
+                         or time.monotonic() - self._last_flush >= self.flush_seconds))
+
+    def flush(self):
+        """
+        Write the recorded page progress and renew the leases of the subscriptions this invocation is processing.
+        """
+        with self._lock:
+            progress, self._progress = self._progress, {}
+            leases = set(self._leases)
+            self._pages_since_flush, self._last_flush = 0, time.monotonic()
+
+        def mutate(checkpoint):
+            now = self._now()
+            for subscription_id in leases:
+                entry = checkpoint["subscriptions"].get(subscription_id)
+                # Taken over by another invocation after this one stalled; its progress is no longer ours to record
+                if entry is None or entry["status"] != "in_progress" or entry.get("owner") != self.owner:
+                    continue
+                entry["updated_at"] = now
+                if subscription_id in progress:
+                    entry["last_page"], entry["skip_token"] = progress[subscription_id]
+
+        self._update(mutate)
+
+    def _release(self, subscription_ids):
+        """
+        :return: The unwritten page progress of the subscriptions, which are no longer leased.
+        """
+        with self._lock:
+            self._leases.difference_update(subscription_ids)
+            return {subscription_id: self._progress.pop(subscription_id) for subscription_id in subscription_ids
+                    if subscription_id in self._progress}
+
+    def mark_completed(self, subscription_ids):
+        self._release(subscription_ids)
+
+        def mutate(checkpoint):
+            now = self._now()
+            for subscription_id in subscription_ids:
+                entry = checkpoint["subscriptions"].setdefault(subscription_id, {"last_page": 0})
+                entry.update(status="completed", skip_token=None, owner=self.owner, updated_at=now)
+
+        self._update(mutate)
+
+    def mark_failed(self, errors):
+        """
+        :param errors: Dictionary of subscription id to error message. Progress is kept for the retry.
+                       Subscriptions claimed by another invocation in the meantime are left to it.
+        """
+        progress = self._release(errors)
+
+        def mutate(checkpoint):
+            now = self._now()
+            for subscription_id, error in errors.items():
+                entry = checkpoint["subscriptions"].setdefault(subscription_id, {"last_page": 0, "skip_token": None})
+                if entry.get("status") == "in_progress" and entry.get("owner") not in (None, self.owner):
+                    continue
+                if subscription_id in progress:
+                    entry["last_page"], entry["skip_token"] = progress[subscription_id]
+                entry.update(status="failed", error=error, owner=self.owner, updated_at=now)
+
+        self._update(mutate)
+
+    def run_completed(self, subscription_ids=None):
+        """
+        Check the latest checkpoint, including progress made by other invocations.
+        :param subscription_ids: Subscriptions to check; all subscriptions in the checkpoint when None.
+        :return: True when every given subscription has completed.
+        """
+        with self._lock:
+            checkpoint, etag = self._read()
+            if checkpoint is None:
+                # Another invocation already finished the run and removed the checkpoint
+                return True
+            self.checkpoint, self._etag = checkpoint, etag
+            if subscription_ids is None:
+                subscription_ids = list(checkpoint["subscriptions"])
+            return all(checkpoint["subscriptions"].get(subscription_id, {}).get("status") == "completed"
+                       for subscription_id in subscription_ids)
+
+    def clear(self):
+        """
+        Remove the checkpoint once the run's watermark has been saved.
+        """
+        with self._lock:
+            if self.checkpoint is None:
+                return
+            try:
+                self.container_client.get_blob_client(self.blob_name).delete_blob(
+                    etag=self._etag, match_condition=MatchConditions.IfNotModified)
+                logger.info(f"Checkpointed run {self.checkpoint['run_id']} finished.")
+            except ResourceNotFoundError:
+                pass
+            except ResourceModifiedError:
+                logger.info("Checkpoint was updated by another invocation; leaving it in place.")
+            self.checkpoint, self._etag = None, None
@@ -0,0 +1,369 @@
+import hashlib
+import json
+import re
+from datetime import datetime
+
+from utils.logger_setup import setup_logger
+from utils.serializers import JsonSerializer
+
+logger = setup_logger(name="AzureResourceStore")
+
+# Date stamp of the pages layout, as written by utils.save_response.generate_filename
+DATE_FORMAT = "%Y_%m_%d"
+
+
+def journal_blob_name(subscription_id, date_label):
+    """
+    :return: Name of the journal blob of one date of the pages layout.
+    """
+    return f"resource_{subscription_id}_{date_label}_journal.json"
+
+
+def resource_content_hash(resource) -> str:
+    """
+    Stable hash of a resource's content, independent of key order.
+    """
+    canonical = json.dumps(resource, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AzureResourceStore:
+    """
+    Per-subscription resource store indexed by resource id.
+    Resources live in shard blobs (resource_<sub>_shard_<n>.json, same {"value": [...]} shape as pages)
+    and a sidecar index blob maps every resource id to its shard and content hash. Only the shards that
+    hold changed ids are read and rewritten; unchanged resources and untouched shards cost nothing.
+    Changes are buffered per shard and a shard is written once it has received shard_size changes, when
+    more than max_buffered_resources changes are buffered in total (the shard with the most goes first),
+    and in finish(), so a scan writes each shard about once rather than once per page. The index is
+    written once, in commit().
+    """
+
+    def __init__(self, blob_client, container_name, subscription_id, shard_size=1000, full_scan=False, serializer=None,
+                 max_buffered_resources=None):
+        """
+        :param blob_client: AzureBlobClient used for shard and index reads/writes.
+        :param container_name: Container path holding the resource blobs.
+        :param subscription_id: Subscription the store belongs to.
+        :param shard_size: Maximum number of resources per shard.
+        :param full_scan: Whether the pages added make up a complete snapshot of the subscription.
+        :param serializer: Output format for shard blobs; the index is always JSON.
+        :param max_buffered_resources: Most changes held in memory across shards; defaults to 4 shards' worth.
+        """
+        self.blob_client = blob_client
+        self.container_name = container_name
+        self.subscription_id = subscription_id
+        self.shard_size = shard_size
+        self.full_scan = full_scan
+        self.serializer = serializer or JsonSerializer()
+        self.index_blob_name = f"resource_{subscription_id}_index.json"
+        self.max_buffered_resources = max_buffered_resources or 4 * shard_size
+        self.seen_ids = set()
+        self.stats = {"upserted": 0, "unchanged": 0, "deleted": 0, "shards_written": 0}
+        # shard -> ({resource id: resource} upserts, {resource id} deletes) not yet written
+        self._buffered = {}
+        self._buffered_count = 0
+        # Shards opened by this store, which have no blob to merge into yet
+        self._new_shards = set()
+
+        index = self.blob_client.read_blob_file(self.container_name, self.index_blob_name) or {}
+        # resource id -> [shard name, content hash]
+        self.resources = index.get("resources", {})
+        self.shard_counts = {shard: 0 for shard in index.get("shards", [])}
+        for shard, _ in self.resources.values():
+            self.shard_counts[shard] = self.shard_counts.get(shard, 0) + 1
+
+    def _shard_blob_name(self, shard_number):
+        return f"resource_{self.subscription_id}_shard_{shard_number}{self.serializer.extension}"
+
+    @staticmethod
+    def _shard_number(shard):
+        return int(shard.rsplit("_", 1)[1].split(".")[0])
+
+    def _assign_shard(self):
+        # Fill the most recent shard before opening a new one
+        if self.shard_counts:
+            last_shard = max(self.shard_counts, key=self._shard_number)
+            if self.shard_counts[last_shard] < self.shard_size:
+                return last_shard
+            shard_number = self._shard_number(last_shard) + 1
+        else:
+            shard_number = 1
+        shard = self._shard_blob_name(shard_number)
+        self.shard_counts[shard] = 0
+        self._new_shards.add(shard)
+        return shard
+
+    def apply(self, upserts=(), deletes=()):
+        """
+        Apply upserted resources and deleted resource ids to the shards that hold them. The changes are
+        buffered; see the class docstring for when shards are written.
+        :param upserts: Resource dictionaries; each must carry an "id".
+        :param deletes: Resource ids to remove.
+        """
+        for resource in upserts:
+            resource_id = resource["id"]
+            self.seen_ids.add(resource_id)
+            content_hash = resource_content_hash(resource)
+            entry = self.resources.get(resource_id)
+            if entry is not None and entry[1] == content_hash:
+                self.stats["unchanged"] += 1
+                continue
+            if entry is None:
+                shard = self._assign_shard()
+                self.shard_counts[shard] += 1
+                self.resources[resource_id] = [shard, content_hash]
+            else:
+                shard = entry[0]
+                entry[1] = content_hash
+            shard_upserts, shard_deletes = self._buffer(shard)
+            shard_deletes.discard(resource_id)
+            shard_upserts[resource_id] = resource
+            self.stats["upserted"] += 1
+
+        for resource_id in deletes:
+            entry = self.resources.pop(resource_id, None)
+            if entry is None:
+                continue
+            shard = entry[0]
+            self.shard_counts[shard] -= 1
+            shard_upserts, shard_deletes = self._buffer(shard)
+            shard_upserts.pop(resource_id, None)
+            shard_deletes.add(resource_id)
+            self.stats["deleted"] += 1
+
+        self._buffered_count = sum(len(shard_upserts) + len(shard_deletes)
+                                   for shard_upserts, shard_deletes in self._buffered.values())
+        full_shards = [shard for shard, (shard_upserts, shard_deletes) in self._buffered.items()
+                       if len(shard_upserts) + len(shard_deletes) >= self.shard_size]
+        self.flush(full_shards)
+        while self._buffered_count > self.max_buffered_resources:
+            self.flush([max(self._buffered, key=lambda shard: sum(map(len, self._buffered[shard])))])
+
+    def _buffer(self, shard):
+        return self._buffered.setdefault(shard, ({}, set()))
+
+    def flush(self, shards=None):
+        """
+        Write the buffered changes of the given shards, or of every shard.
+        """
+        shards = sorted(self._buffered if shards is None else shards, key=self._shard_number)
+        if not shards:
+            return
+        changes = {shard: self._buffered.pop(shard) for shard in shards}
+        self._buffered_count -= sum(len(shard_upserts) + len(shard_deletes)
+                                    for shard_upserts, shard_deletes in changes.values())
+        self.blob_client.upload_many(
+            self.container_name,
+            ((shard, self._merge_shard(shard, *changes[shard])) for shard in shards),
+            serializer=self.serializer
+        )
+        self._new_shards.difference_update(shards)
+        self.stats["shards_written"] += len(shards)
+
+    def get(self, resource_ids):
+        """
+        Look up stored resources by id, reading only the shards that hold them.
+        :return: Dictionary of resource id to resource for the ids present in the store.
+        """
+        wanted_by_shard = {}
+        for resource_id in resource_ids:
+            entry = self.resources.get(resource_id)
+            if entry is not None:
+                wanted_by_shard.setdefault(entry[0], set()).add(resource_id)
+
+        found = {}
+        for shard, wanted_ids in wanted_by_shard.items():
+            # Buffered upserts are the latest copies; only the rest are read from the shard
+            shard_upserts = self._buffered.get(shard, ({}, set()))[0]
+            for resource_id in wanted_ids & shard_upserts.keys():
+                found[resource_id] = shard_upserts[resource_id]
+            wanted_ids = wanted_ids - shard_upserts.keys()
+            if not wanted_ids or shard in self._new_shards:
+                continue
+            shard_data = self.blob_client.read_blob_file(self.container_name, shard) or {"value": []}
+            for resource in shard_data["value"]:
+                if resource["id"] in wanted_ids:
+                    found[resource["id"]] = resource
+        return found
+
+    def add_page(self, resources_page_data):
+        self.apply(upserts=resources_page_data)
+
+    def finish(self):
+        if self.full_scan:
+            # A completed full scan is authoritative: anything it did not return has been deleted
+            self.remove_missing()
+        self.flush()
+        self.commit()
+
+    def remove_missing(self):
+        """
+        After a full scan, delete every indexed resource that the scan did not return.
+        """
+        missing_ids = [resource_id for resource_id in self.resources if resource_id not in self.seen_ids]
+        if missing_ids:
+            logger.info(f"Removing {len(missing_ids)} resources no longer present in subscription {self.subscription_id}.")
+            self.apply(deletes=missing_ids)
+
+    def _merge_shard(self, shard, upserts, deletes):
+        """
+        :return: The shard payload with deletes removed and upserts replaced or appended.
+        """
+        existing_blob_data = None
+        if shard not in self._new_shards:
+            existing_blob_data = self.blob_client.read_blob_file(self.container_name, shard)
+        existing_resources = existing_blob_data["value"] if existing_blob_data is not None else []
+
+        merged_resources = []
+        for resource in existing_resources:
+            resource_id = resource["id"]
+            if resource_id in deletes:
+                continue
+            merged_resources.append(upserts.pop(resource_id, resource))
+        merged_resources.extend(upserts.values())
+        return {"value": merged_resources}
+
+    def commit(self):
+        """
+        Persist the index. Called once the subscription's pages have been applied and flushed.
+        """
+        self.blob_client.upload_data_to_blob(
+            container_name=self.container_name,
+            blob_name=self.index_blob_name,
+            json_data={
+                "subscription_id": self.subscription_id,
+                "shards": sorted(shard for shard, count in self.shard_counts.items() if count > 0),
+                "resources": self.resources,
+            }
+        )
+        logger.info(f"Resource store for subscription {self.subscription_id} committed: {self.stats}")
+
+
+class DatedPageStore:
+    """
+    Change runs of the "pages" layout. Resources fetched for the changes are appended as new pages of the
+    current date, after the pages already written that day, and the date's journal blob records the
+    deletes and whether the date's pages hold a full scan:
+
+        resource_<sub>_<YYYY_MM_DD>_journal.json: {"full_scan": bool, "deleted": [id, ...]}
+
+    Pages only ever hold whole resources, so the state of a date is the snapshot before it overlaid with
+    the date's pages, minus its deletes; utils.snapshot_compactor builds the snapshots that way.
+    The store keeps no index of the stored resources, so every changed resource is fetched, not patched.
+    """
+
+    def __init__(self, blob_client, container_name, subscription_id, records_per_page, serializer=None,
+                 date_label=None):
+        """
+        :param blob_client: AzureBlobClient used for page and journal reads/writes.
+        :param container_name: Container path holding the resource pages.
+        :param subscription_id: Subscription the store belongs to.
+        :param records_per_page: Maximum number of resources per page.
+        :param serializer: Output format for pages; the journal is always JSON.
+        :param date_label: Date the pages are written under, in DATE_FORMAT; defaults to the current date.
+        """
+        self.blob_client = blob_client
+        self.container_name = container_name
+        self.subscription_id = subscription_id
+        self.records_per_page = max(1, records_per_page)
+        self.serializer = serializer or JsonSerializer()
+        self.date_label = date_label or datetime.now().strftime(DATE_FORMAT)
+        self.resources = {}
+        self.upserted_ids = set()
+        self.deleted_ids = {}
+        self._last_page = None
+        self.stats = {"upserted": 0, "deleted": 0, "pages_written": 0}
+
+    def _page_blob_name(self, page_number):
+        return f"resource_{self.subscription_id}_{self.date_label}_page_{page_number}{self.serializer.extension}"
+
+    def _page_numbers(self):
+        """
+        :return: Dictionary of page number to blob name of the pages stored for the current date.
+        """
+        prefix = f"resource_{self.subscription_id}_{self.date_label}_page_"
+        pattern = re.compile(rf"{re.escape(prefix)}(\d+)\.")
+        return {int(match.group(1)): match.string for match in
+                (pattern.match(blob.name) for blob in self.blob_client.list_blobs(
+                    self.container_name, name_starts_with=prefix))
+                if match}
+
+    def _last_page_number(self):
+        if self._last_page is None:
+            self._last_page = max(self._page_numbers(), default=0)
+        return self._last_page
+
+    def get(self, resource_ids):
+        # Nothing is patched in place; see the class docstring
+        return {}
+
+    def apply(self, upserts=(), deletes=()):
+        """
+        Append upserted resources as new pages of the current date and remember the deleted ids for the journal.
+        :param upserts: Resource dictionaries; each must carry an "id".
+        :param deletes: Resource ids to remove.
+        """
+        upserts = list(upserts)
+        for resource in upserts:
+            self.upserted_ids.add(resource["id"].lower())
+            self.deleted_ids.pop(resource["id"].lower(), None)
+        for resource_id in deletes:
+            self.upserted_ids.discard(resource_id.lower())
+            self.deleted_ids[resource_id.lower()] = resource_id
+        self.stats["upserted"] += len(upserts)
+        self.stats["deleted"] = len(self.deleted_ids)
+
+        pages = []
+        for start in range(0, len(upserts), self.records_per_page):
+            page_number = self._last_page_number() + 1
+            self._last_page = page_number
+            pages.append((self._page_blob_name(page_number), {"value": upserts[start:start + self.records_per_page]}))
+        self.blob_client.upload_many(self.container_name, pages, serializer=self.serializer)
+        self.stats["pages_written"] += len(pages)
+
+    def add_page(self, resources_page_data):
+        self.apply(upserts=resources_page_data)
+
+    def finish(self):
+        self.commit()
+
+    def commit(self):
+        """
+        Fold the deletes and upserts of this run into the journal of the current date.
+        """
+        if not self.upserted_ids and not self.deleted_ids:
+            return
+        blob_name = journal_blob_name(self.subscription_id, self.date_label)
+        journal = self.blob_client.read_blob_file(self.container_name, blob_name) or {}
+        deleted = {resource_id.lower(): resource_id for resource_id in journal.get("deleted", [])
+                   if resource_id.lower() not in self.upserted_ids}
+        deleted.update(self.deleted_ids)
+        self.blob_client.upload_data_to_blob(
+            container_name=self.container_name,
+            blob_name=blob_name,
+            json_data={"full_scan": journal.get("full_scan", False), "deleted": sorted(deleted.values())}
+        )
+        logger.info(f"Dated pages of subscription {self.subscription_id} committed: {self.stats}")
+
+    def start_full_scan(self):
+        """
+        Remove the pages and journal of the current date before a full scan writes its pages from page 1,
+        so pages and deletes of earlier runs that day do not outlive the scan.
+        """
+        self.blob_client.delete_blobs(self.container_name, list(self._page_numbers().values()) +
+                                      [journal_blob_name(self.subscription_id, self.date_label)])
+        self._last_page = 0
+
+    def mark_full_scan(self):
+        """
+        Record in the journal of the current date that its pages hold a full scan, keeping the deletes
+        already recorded; called once the scan has completed.
+        """
+        blob_name = journal_blob_name(self.subscription_id, self.date_label)
+        journal = self.blob_client.read_blob_file(self.container_name, blob_name) or {}
+        self.blob_client.upload_data_to_blob(
+            container_name=self.container_name,
+            blob_name=blob_name,
+            json_data={"full_scan": True, "deleted": journal.get("deleted", [])}
+        )
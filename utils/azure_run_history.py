@@ -0,0 +1,107 @@
+from datetime import datetime
+
+from utils.azure_blob_client import AzureBlobClient
+from utils.conditional_save import save_with_retries
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="AzureRunHistory")
+
+# Conditional saves that lose to another invocation are re-applied on a fresh copy this many times
+MAX_SAVE_ATTEMPTS = 10
+
+# Averaged separately for full scans and change queries, which differ by orders of magnitude
+STATISTICS = ("pages", "records", "duration_seconds", "throttles")
+
+
+class AzureRunHistory:
+    """
+    Run history blob, next to the watermarks:
+
+        {"subscriptions": {id: {"full": {"runs", "pages", "records", "duration_seconds", "throttles"},
+                                "incremental": {...}, "consecutive_empty_runs", "last_run"}}}
+
+    Statistics are exponential moving averages over the successful runs of each scan mode, so one
+    unusual run moves the estimate without replacing it. Saves are conditioned on the blob's ETag, as
+    for the watermarks, so invocations working off the same run do not drop each other's statistics.
+    """
+    def __init__(self, container_name, blob_name="azure_run_history.json", smoothing=0.5):
+        """
+        :param container_name: Container holding the watermarks blob.
+        :param smoothing: Weight of the latest run in the moving averages, between 0 and 1.
+        """
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.smoothing = min(max(smoothing, 0.0), 1.0)
+        self.blob_client = AzureBlobClient()
+        self.container_client = self.blob_client.blob_service_client.get_container_client(container_name)
+        self.subscriptions = {}
+        self._etag = None
+        self._load_history()
+
+    def _load_history(self):
+        try:
+            history_data, self._etag = self.blob_client.read_blob_file_with_etag(self.container_name, self.blob_name)
+            if history_data is None:
+                logger.info(f"Run history blob {self.blob_name} does not exist yet.")
+                history_data = {}
+        except Exception as e:
+            logger.warning(f"Error loading run history: {e}. Scheduling without it.")
+            history_data = {}
+        self.subscriptions = history_data.get("subscriptions", {})
+
+    def get(self, subscription_id, full_scan):
+        """
+        :return: Dictionary of the averaged statistics of the subscription's full scans or change
+                 queries, or None when it has not completed one yet.
+        """
+        entry = self.subscriptions.get(subscription_id, {})
+        return entry.get("full" if full_scan else "incremental")
+
+    def consecutive_empty_runs(self, subscription_id):
+        return self.subscriptions.get(subscription_id, {}).get("consecutive_empty_runs", 0)
+
+    def record(self, run_stats, empty_subscription_ids=()):
+        """
+        Fold the statistics of a run into the history and save it.
+        :param run_stats: Dictionary of subscription id to {"full_scan", "pages", "records", "duration_seconds",
+                          "throttles"}, for the subscriptions that completed.
+        :param empty_subscription_ids: Subscriptions of the run that returned no resources.
+        """
+        if not run_stats:
+            return
+        empty_subscription_ids = set(empty_subscription_ids)
+        run_time = datetime.utcnow().isoformat()
+
+        def prepare():
+            for subscription_id, stats in run_stats.items():
+                self._fold(subscription_id, stats, subscription_id in empty_subscription_ids, run_time)
+            return {"subscriptions": self.subscriptions}, self._etag
+
+        def reload():
+            logger.info("Run history blob was updated by another invocation; reloading before saving again.")
+            self._load_history()
+
+        try:
+            etag = save_with_retries(self.container_client.get_blob_client(self.blob_name), prepare, reload,
+                                     MAX_SAVE_ATTEMPTS)
+            if etag is None:
+                logger.error(f"Error saving run history: gave up after {MAX_SAVE_ATTEMPTS} conflicting attempts.")
+            else:
+                self._etag = etag
+        except Exception as e:
+            logger.error(f"Error saving run history: {e}")
+
+    def _fold(self, subscription_id, stats, empty, run_time):
+        entry = self.subscriptions.setdefault(subscription_id, {})
+        mode = "full" if stats.get("full_scan") else "incremental"
+        averages = entry.get(mode)
+        if averages is None:
+            averages = {"runs": 0, **{name: round(float(stats.get(name, 0)), 3) for name in STATISTICS}}
+        else:
+            for name in STATISTICS:
+                averages[name] = round(self.smoothing * stats.get(name, 0)
+                                       + (1 - self.smoothing) * averages.get(name, 0), 3)
+        averages["runs"] += 1
+        entry[mode] = averages
+        entry["consecutive_empty_runs"] = entry.get("consecutive_empty_runs", 0) + 1 if empty else 0
+        entry["last_run"] = run_time
@@ -1,26 +1,58 @@
-import time
+import json
+import threading
 from typing import Any
 
-from azure.core.exceptions import AzureError
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.resource import SubscriptionClient
-from azure.mgmt.resourcegraph import ResourceGraphClient
+from azure.core.exceptions import AzureError, HttpResponseError
 from azure.mgmt.resourcegraph.models import QueryRequest, QueryResponse
 
+from shared.metrics import increment, span
+from shared.prefetch import prefetch_many
+from shared.resource_registry import ResourceRegistry
 from shared.retry_decorator import retry_with_backoff
+from utils.query_profiles import DEFAULT_PROFILE
 from utils.logger_setup import setup_logger
 
 logger = setup_logger(name="AzureSubscriptionClient")
 
+# Resource Graph rejects requests scoped to more subscriptions than this
+MAX_SUBSCRIPTIONS_PER_QUERY = 1000
+
+# Ways a full snapshot can be split into independent queries
+PARTITION_STRATEGIES = ("type", "resourceGroup", "id_hash")
+
+# Most group names listed in the partition queries of a snapshot, keeping the query text within service
+# limits; subscriptions with more groups are partitioned by id hash instead
+MAX_PARTITION_GROUPS = 500
+
+
+class ResourcePage(list):
+    """
+    One page of query results. Behaves as the list of rows and carries the skip token of the
+    following page (None on the last page), so callers can checkpoint their position, and the number
+    of throttled (429) attempts it took.
+    """
+    def __init__(self, rows, skip_token=None, total_records=None, throttled=0):
+        super().__init__(rows)
+        self.skip_token = skip_token
+        self.total_records = total_records
+        self.throttled = throttled
+
+
 class AzureSubscriptionClient:
     credential = None
     resource_graph_client = None
+    # Throttled attempts of the page request in flight, per thread: pages are fetched on worker,
+    # prefetch and partition threads alike
+    _throttles = threading.local()
 
     def __init__(self):
-        self.credential = DefaultAzureCredential()
-        self.subscription_client = SubscriptionClient(self.credential)
+        # Credential and clients are shared across invocations on a warm host, so tokens and
+        # connections are reused
+        registry = ResourceRegistry.get_instance()
+        self.credential = registry.get_credential()
+        self.subscription_client = registry.get_subscription_client()
         logger.info("Initializing SubscriptionClient.")
-        self.resource_graph_client = ResourceGraphClient(self.credential)
+        self.resource_graph_client = registry.get_resource_graph_client()
 
     @retry_with_backoff(retries=3, backoff_in_seconds=1)
     def fetch_subscriptions(self) -> list[Any]:
@@ -37,70 +69,206 @@ class AzureSubscriptionClient:
             logger.error(f"An unexpected error occurred: {str(e)}")
             raise
 
-    @retry_with_backoff(retries=3, backoff_in_seconds=1)
-    def get_resources_for_subscription_paginated(self, subscription_id, records_per_page, time_hour, max_retries=3, retry_delay=5):
+    def get_resources_for_subscription_paginated(self, subscription_id, records_per_page, time_hour, skip_token=None,
+                                                 profile=DEFAULT_PROFILE):
         if not subscription_id:
             raise ValueError("Subscription ID is required but was not provided.")
+        yield from self.get_resources_for_subscriptions_paginated([subscription_id], records_per_page, time_hour,
+                                                                  skip_token=skip_token, profile=profile)
+
+    def get_resources_for_subscriptions_paginated(self, subscription_ids, records_per_page, time_hour, skip_token=None,
+                                                  profile=DEFAULT_PROFILE):
+        """
+        Page through a resources (or resourcechanges) query scoped to one or more subscriptions.
+        Rows of a multi-subscription query carry their own subscriptionId, so callers can split them back out.
+        :param subscription_ids: Subscriptions to scope the query to (at most MAX_SUBSCRIPTIONS_PER_QUERY).
+        :param records_per_page: Number of records requested per page.
+        :param time_hour: Hours since the last execution, or None for a full query.
+        :param skip_token: Resume an identical query from this skip token instead of the first page.
+        :param profile: QueryProfile shaping the query.
+        :return: Generator of ResourcePage.
+        """
+        if time_hour is None:
+            # Normal query
+            query = profile.resources_query()
+        else:
+            # Change query
+            query = profile.changes_query(time_hour)
+
+        yield from self._query_pages(subscription_ids, query, records_per_page, skip_token=skip_token)
+
+    def get_resources_snapshot_partitioned(self, subscription_id, records_per_page, partition_by="type", partitions=8,
+                                           max_concurrent_partitions=4, min_resources=10000, profile=DEFAULT_PROFILE):
+        """
+        Full `resources` snapshot of one subscription. Subscriptions with fewer than min_resources resources
+        follow the usual single skip-token chain; larger ones are split by type, resourceGroup or a hash of
+        the resource id into independent queries whose pages are fetched concurrently. Resources returned
+        by more than one partition (e.g. moved during the scan), or already by the first page, are only
+        yielded once. Partitioned pages carry no skip token, so an interrupted scan restarts from the first page.
+        :param partition_by: One of PARTITION_STRATEGIES.
+        :param partitions: Number of sub-queries to split the snapshot into.
+        :param max_concurrent_partitions: Sub-queries paged at the same time.
+        :param min_resources: Smallest subscription, by total_records of its first page, that is partitioned.
+        :param profile: QueryProfile shaping the snapshot and partition queries.
+        :return: Generator of ResourcePage.
+        """
+        if partition_by not in PARTITION_STRATEGIES:
+            raise ValueError(f"Unsupported snapshot partitioning: {partition_by}")
+
+        # The first page tells whether the subscription is large enough to be worth splitting
+        pages = self._query_pages([subscription_id], profile.resources_query(), records_per_page)
+        first_page = next(pages, None)
+        if first_page is None:
+            return
+        if partitions < 2 or first_page.skip_token is None or (first_page.total_records or 0) < min_resources:
+            yield first_page
+            yield from pages
+            return
+        pages.close()
+        # The first page is part of the snapshot; the partitions return its rows again and skip them
+        seen_ids = {row["id"].lower() for row in first_page}
+        yield ResourcePage(first_page, throttled=first_page.throttled)
+
+        queries = self._partition_queries(subscription_id, partition_by, partitions, profile)
+        logger.info(f"Scanning {first_page.total_records} resources of subscription {subscription_id} "
+                    f"as {len(queries)} partitions.")
+        partition_pages = [self._query_pages([subscription_id], query, records_per_page) for query in queries]
+
+        throttled = 0
+        for page in prefetch_many(partition_pages, max_concurrent_partitions,
+                                  max_buffered=max_concurrent_partitions * 2, name=f"partition-{subscription_id}"):
+            rows = []
+            throttled += page.throttled
+            for row in page:
+                resource_id = row["id"].lower()
+                if resource_id not in seen_ids:
+                    seen_ids.add(resource_id)
+                    rows.append(row)
+            if rows:
+                yield ResourcePage(rows, throttled=throttled)
+                throttled = 0
+
+    def _partition_queries(self, subscription_id, partition_by, partitions, profile=DEFAULT_PROFILE):
+        """
+        :return: Queries that together return every resource of the subscription. Groups of the partition
+                 column are balanced over the partitions by resource count; the last partition matches
+                 everything not assigned to the others, so groups created after the count are not missed.
+                 With more than MAX_PARTITION_GROUPS groups, the queries partition by id hash.
+        """
+        if partition_by == "id_hash":
+            return self._id_hash_queries(partitions, profile)
+
+        counts = {}
+        count_query = f"{profile.resources_query(project=False)} | summarize records = count() by {partition_by}"
+        for page in self._query_pages([subscription_id], count_query, 1000):
+            for row in page:
+                counts[row.get(partition_by) or ""] = row.get("records", 0)
+        if len(counts) > MAX_PARTITION_GROUPS:
+            logger.info(f"Subscription {subscription_id} has {len(counts)} groups by {partition_by}; "
+                        f"partitioning by id hash instead.")
+            return self._id_hash_queries(partitions, profile)
+        bins = balance_partitions(counts, partitions)
+        if len(bins) < 2:
+            return [profile.resources_query()]
+
+        def values(groups):
+            # Group names never contain double quotes; json.dumps yields valid KQL string literals
+            return ", ".join(json.dumps(group) for group in groups)
+
+        queries = [profile.resources_query(where=f"{partition_by} in~ ({values(groups)})") for groups in bins[:-1]]
+        assigned = [group for groups in bins[:-1] for group in groups]
+        queries.append(profile.resources_query(where=f"{partition_by} !in~ ({values(assigned)})"))
+        return queries
+
+    @staticmethod
+    def _id_hash_queries(partitions, profile=DEFAULT_PROFILE):
+        return [profile.resources_query(where=f"hash(tolower(id), {partitions}) == {i}") for i in range(partitions)]
+
+    def get_resources_by_ids(self, subscription_ids, resource_ids, chunk_size=500, profile=DEFAULT_PROFILE):
+        """
+        Fetch the full bodies of specific resources with batched `resources | where id in~ (...)` queries.
+        :param subscription_ids: Subscriptions the resources belong to.
+        :param resource_ids: Resource ids to fetch; ids that no longer exist are simply absent from the result.
+        :param chunk_size: Maximum number of ids per query, keeping the query text within service limits.
+        :param profile: QueryProfile whose projection the returned resources get.
+        :return: List of resource dictionaries.
+        """
+        resource_ids = list(resource_ids)
+        resources = []
+        for i in range(0, len(resource_ids), chunk_size):
+            # Resource ids never contain double quotes; json.dumps yields valid KQL string literals
+            id_list = ", ".join(json.dumps(resource_id) for resource_id in resource_ids[i:i + chunk_size])
+            query = profile.resources_query(where=f"id in~ ({id_list})")
+            for page in self._query_pages(subscription_ids, query, 1000):
+                resources.extend(page)
+        return resources
+
+    @retry_with_backoff(retries=3, backoff_in_seconds=1)
+    def _query_resources(self, query_request: QueryRequest) -> QueryResponse:
         try:
-            logger.info(f"<<<< Per page : {records_per_page} with subscription id: {subscription_id}")
+            return self.resource_graph_client.resources(query_request)
+        except HttpResponseError as e:
+            if e.status_code == 429:
+                self._throttles.count = getattr(self._throttles, "count", 0) + 1
+            raise
+
+    def _query_pages(self, subscription_ids, query, records_per_page, skip_token=None):
+        """
+        Page through a query. Each page request is retried with backoff; a page that still fails is raised
+        so callers never treat a truncated page chain as complete.
+        """
+        if not subscription_ids:
+            raise ValueError("Subscription ID is required but was not provided.")
+        if len(subscription_ids) > MAX_SUBSCRIPTIONS_PER_QUERY:
+            raise ValueError(f"At most {MAX_SUBSCRIPTIONS_PER_QUERY} subscriptions can be queried at once, got {len(subscription_ids)}.")
 
-            if time_hour is None:
-                # Normal query
-                query = "resources"
+        subscription_label = subscription_ids[0] if len(subscription_ids) == 1 else f"batch of {len(subscription_ids)}"
+        try:
+            logger.info(f"<<<< Per page : {records_per_page} with subscription id: {subscription_label}")
+
+            if skip_token is None:
+                options = {"resultFormat": "objectArray", "$top": records_per_page}  # Set records per page
             else:
-                # Change query
-                if time_hour < 1:
-                    time_hour = 1 # Override time_hour for testing purpose
-                time_hour = str(time_hour) + "h"
-                query = f"resourcechanges | where todatetime(properties.changeAttributes.timestamp) > ago({time_hour})"
-
-            query_request = QueryRequest(
-                subscriptions=[subscription_id],
-                query=query,
-                options={"resultFormat": "objectArray", "$top": records_per_page}  # Set records per page
-            )
-
-            # Initial query
-            result: QueryResponse = self.resource_graph_client.resources(query_request)
-            if hasattr(result, 'data') and isinstance(result.data, list):
-                yield result.data  # Yield the first page of data
-
-            # Handle pagination with skipToken
-            while result.skip_token is not None:
-                # Create a new QueryRequest with updated options
-                re_query = QueryRequest(
-                    subscriptions=[subscription_id],
-                    query=query,
-                    options={
-                        "resultFormat": "objectArray",
-                        "$skipToken": result.skip_token  # Add skipToken here
-                    }
-                )
-                retries = 0
-                while retries < max_retries:
-                    try:
-                        result = self.resource_graph_client.resources(re_query)
-                        if hasattr(result, 'data') and isinstance(result.data, list):
-                            yield result.data  # Yield each subsequent page
-                        break  # Exit retry loop on success
-                    except AzureError as e:
-                        retries += 1
-                        logger.warning(
-                            f"Retry {retries}/{max_retries} for subscription {subscription_id} due to Azure error: {str(e)}")
-                        time.sleep(retry_delay * retries)  # Exponential backoff
-                    except Exception as e:
-                        retries += 1
-                        logger.warning(
-                            f"Retry {retries}/{max_retries} for subscription {subscription_id} due to unexpected error: {str(e)}")
-                        time.sleep(retry_delay * retries)
-
-                if retries == max_retries:
-                    logger.error(
-                        f"Failed to fetch page after {max_retries} retries for subscription {subscription_id}. Skipping remaining pages.")
-                    break  # Skip to the next subscription if retries are exhausted
+                options = {"resultFormat": "objectArray", "$skipToken": skip_token}
+            while True:
+                self._throttles.count = 0
+                with span("resource_graph.query", subscriptions=len(subscription_ids)):
+                    result: QueryResponse = self._query_resources(QueryRequest(
+                        subscriptions=list(subscription_ids),
+                        query=query,
+                        options=options
+                    ))
+                increment("resource_graph.pages")
+                if hasattr(result, 'data') and isinstance(result.data, list):
+                    increment("resource_graph.records", len(result.data))
+                    yield ResourcePage(result.data, result.skip_token, getattr(result, "total_records", None),
+                                       self._throttles.count)
+
+                # Handle pagination with skipToken
+                if result.skip_token is None:
+                    break
+                options = {"resultFormat": "objectArray", "$skipToken": result.skip_token}
 
         except AzureError as e:
-            logger.error(f"Azure error occurred while fetching resources for subscription {subscription_id}: {str(e)}")
+            logger.error(f"Azure error occurred while fetching resources for subscription {subscription_label}: {str(e)}")
+            raise
         except Exception as e:
             logger.error(
-                f"Unexpected error occurred while fetching resources for subscription {subscription_id}: {str(e)}")
+                f"Unexpected error occurred while fetching resources for subscription {subscription_label}: {str(e)}")
+            raise
+
+
+def balance_partitions(counts, partitions):
+    """
+    Spread groups over at most `partitions` bins so the bins hold similar numbers of resources:
+    largest group first, each into the currently smallest bin.
+    :param counts: Resource count per group.
+    :return: List of non-empty lists of groups.
+    """
+    bins = [[] for _ in range(min(partitions, len(counts)))]
+    totals = [0] * len(bins)
+    for group, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        smallest = totals.index(min(totals))
+        bins[smallest].append(group)
+        totals[smallest] += count
+    return [groups for groups in bins if groups]
@@ -1,60 +1,109 @@
-from azure.functions import HttpResponse
-from transitions import Machine, State
-
-from config.config import AzureConfig
 from utils.azure_blob_client import AzureBlobClient
-from utils.azure_subscription_client import AzureSubscriptionClient
+from utils.conditional_save import save_with_retries
 from utils.logger_setup import setup_logger
-from utils.save_response import generate_filename, get_subscription_path_container_name, \
-    get_resource_path_container_name
+from utils.resource_table import ResourceTable
 from datetime import datetime
-import json
 
 logger = setup_logger(name="AzureWatermarkManager")
 
+# Conditional saves that lose to another invocation are re-applied on a fresh copy this many times
+MAX_SAVE_ATTEMPTS = 10
+
 class AzureWatermarkManager:
+    """
+    Watermarks blob: {"resource_last_execution": <run watermark>, "subscriptions": {id: <watermark>}}.
+    Every subscription advances its own watermark, so a failing subscription does not hold back the
+    others. Saves are conditioned on the blob's ETag and watermarks only ever move forward, so
+    overlapping invocations cannot overwrite each other's progress.
+    """
     def __init__(self, container_name, blob_name="azure_watermarks.json"):
         self.container_name = container_name
         self.blob_name = blob_name
-        self.blob_service_client = AzureBlobClient().blob_service_client
+        self.blob_client = AzureBlobClient()
+        self.blob_service_client = self.blob_client.blob_service_client
         self.container_client = self.blob_service_client.get_container_client(container_name)
-        self.watermark = self._load_watermark()
+        self.watermark = None
+        self.subscription_watermarks = {}
+        self._etag = None
+        self._load_watermark()
 
     def _load_watermark(self):
         try:
-            blob_client = self.container_client.get_blob_client(self.blob_name)
-            # Check if the blob exists
-            if not blob_client.exists():
+            # Goes through the blob cache, so an unchanged watermark costs a 304
+            watermark_data, self._etag = self.blob_client.read_blob_file_with_etag(self.container_name, self.blob_name)
+            if watermark_data is None:
                 logger.warning(f"Watermark blob {self.blob_name} does not exist. Defaulting to None.")
-                return None
-
-            # Read the blob data
-            blob_data = blob_client.download_blob().readall()
-            return json.loads(blob_data).get("resource_last_execution")
+                watermark_data = {}
 
         except Exception as e:
             logger.warning(f"Error loading watermark: {e}. Defaulting to None.")
-            return None
+            watermark_data = {}
+
+        self.watermark = watermark_data.get("resource_last_execution")
+        self.subscription_watermarks = watermark_data.get("subscriptions", {})
+        return self.watermark
+
+    def _save_watermark(self, run_watermark=None, subscription_watermarks=None):
+        """
+        Advance watermarks with optimistic concurrency: write only if the blob is unchanged since it was
+        read, otherwise reload it and apply the updates again.
+        """
+        subscription_watermarks = subscription_watermarks or {}
+
+        def prepare():
+            self.watermark = _latest(self.watermark, run_watermark)
+            for subscription_id, watermark in subscription_watermarks.items():
+                self.subscription_watermarks[subscription_id] = _latest(
+                    self.subscription_watermarks.get(subscription_id), watermark)
+            return {"resource_last_execution": self.watermark, "subscriptions": self.subscription_watermarks}, self._etag
+
+        def reload():
+            logger.info("Watermark blob was updated by another invocation; reloading before saving again.")
+            self._load_watermark()
 
-    def _save_watermark(self):
         try:
-            blob_client = self.container_client.get_blob_client(self.blob_name)
-            data = {"resource_last_execution": self.watermark}
-            blob_client.upload_blob(json.dumps(data, indent=4), overwrite=True)
+            etag = save_with_retries(self.container_client.get_blob_client(self.blob_name), prepare, reload,
+                                     MAX_SAVE_ATTEMPTS)
+            if etag is None:
+                logger.error(f"Error saving watermark: gave up after {MAX_SAVE_ATTEMPTS} conflicting attempts.")
+            else:
+                self._etag = etag
         except Exception as e:
             logger.error(f"Error saving watermark: {e}")
 
-    def get_watermark(self):
-        return self.watermark
+    def get_watermark(self, subscription_id=None):
+        """
+        :param subscription_id: Return this subscription's own watermark. Blobs written before per-subscription
+                                watermarks existed fall back to the run watermark; once the map exists, a
+                                subscription missing from it is new and gets None (a full scan).
+        """
+        if subscription_id is None:
+            return self.watermark
+        if subscription_id in self.subscription_watermarks:
+            return self.subscription_watermarks[subscription_id]
+        return None if self.subscription_watermarks else self.watermark
 
     def update_watermark(self, new_watermark):
-        self.watermark = new_watermark
-        self._save_watermark()
+        self._save_watermark(run_watermark=new_watermark)
+
+    def update_subscription_watermarks(self, subscription_watermarks, run_watermark=None):
+        """
+        Advance subscription watermarks in a single conditional write.
+        :param subscription_watermarks: Dictionary of subscription id to its new watermark.
+        :param run_watermark: Also advance the run watermark, once every subscription has been processed.
+        """
+        self._save_watermark(run_watermark=run_watermark, subscription_watermarks=subscription_watermarks)
 
     def filter_changes(self, changes):
+        """
+        Keep the change records newer than the run watermark.
+        :param changes: List of change dictionaries, or a ResourceTable, which is filtered as one column.
+        """
         watermark = self.get_watermark()
         if not watermark:
             return changes
+        if isinstance(changes, ResourceTable):
+            return changes.filter_since(watermark)
         watermark_time = datetime.fromisoformat(watermark)
         filtered_changes = [
             change for change in changes
@@ -67,8 +116,10 @@ class AzureWatermarkManager:
         Compare and merge existing resources with new resources.
         :param existing_resources: List of existing resource dictionaries.
         :param new_resources: List of new resource dictionaries.
-        :return: Merged list of resources.
+        :return: Merged list of resources. When both arguments are ResourceTables, the merged ResourceTable.
         """
+        if isinstance(existing_resources, ResourceTable) and isinstance(new_resources, ResourceTable):
+            return existing_resources.merge(new_resources)
         existing_resources_dict = {res["id"]: res for res in existing_resources}
         for new_res in new_resources:
             resource_id = new_res["id"]
@@ -80,4 +131,38 @@ class AzureWatermarkManager:
                 existing_resources_dict[resource_id] = new_res
 
         # Return the merged resources as a list
-        return list(existing_resources_dict.values())
\ No newline at end of file
+        return list(existing_resources_dict.values())
+
+    def iter_merged_resources(self, existing_resources, new_resources):
+        """
+        Streaming form of merge_resources for pages too large to hold twice in memory. Only the new
+        resources are indexed by ID; existing resources are consumed one at a time and yielded with
+        their update applied, followed by the new resources that were not there yet.
+        Existing resources are expected to have unique IDs, as every page written by this merge does.
+        :param existing_resources: Iterable of existing resource dictionaries, e.g. a blob record stream.
+        :param new_resources: List of new resource dictionaries.
+        :return: Generator over the merged resources, in the order merge_resources returns them.
+        """
+        new_resources_dict = {}
+        for new_res in new_resources:
+            resource_id = new_res["id"]
+            if resource_id in new_resources_dict:
+                new_resources_dict[resource_id] = {**new_resources_dict[resource_id], **new_res}
+            else:
+                new_resources_dict[resource_id] = new_res
+
+        for existing_res in existing_resources:
+            new_res = new_resources_dict.pop(existing_res["id"], None)
+            yield existing_res if new_res is None else {**existing_res, **new_res}
+
+        yield from new_resources_dict.values()
+
+def _latest(current, new):
+    """
+    :return: The later of two ISO timestamps, ignoring None.
+    """
+    if current is None:
+        return new
+    if new is None:
+        return current
+    return max(current, new, key=datetime.fromisoformat)
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from config.config import AzureConfig
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="BlobCache")
+
+# Share of max_disk_bytes the disk tier is trimmed to once it goes over the limit
+DISK_EVICTION_TARGET = 0.9
+
+
+class BlobCache:
+    """
+    Read-through cache of blob contents keyed by ETag.
+    Entries live in an in-memory LRU tier and, when a disk path is configured, in a local
+    on-disk tier evicted least-recently-used first once it grows past max_disk_bytes, down to
+    DISK_EVICTION_TARGET of it so the directory is not scanned again on the next write.
+    A cached entry is only served after the service confirms its ETag is current (HTTP 304).
+    """
+    _instance = None
+    _initialized = False
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_path=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # Size of every entry file in the disk tier and their total, kept up to date by our own writes;
+        # the directory is only scanned at start-up and when the total goes over max_disk_bytes
+        self._disk_sizes = {}
+        self._disk_bytes = 0
+        if self.disk_path:
+            os.makedirs(self.disk_path, exist_ok=True)
+            self._scan_disk()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Return the process-wide cache configured from the "blob_cache" section of settings.json,
+        or None when caching is disabled.
+        """
+        with cls._instance_lock:
+            if not cls._initialized:
+                cls._initialized = True
+                cache_config = AzureConfig().get_config().get("blob_cache", {})
+                if not cache_config.get("enabled", False):
+                    return None
+                cls._instance = cls(
+                    max_memory_bytes=cache_config.get("max_memory_bytes", 64 * 1024 * 1024),
+                    disk_path=cache_config.get("disk_path"),
+                    max_disk_bytes=cache_config.get("max_disk_bytes", 512 * 1024 * 1024),
+                )
+                logger.info("BlobCache initialized successfully.")
+            return cls._instance
+
+    def get(self, key):
+        """
+        :return: (etag, data, properties) for the cached blob, or None.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._put_memory(key, *entry)
+        return entry
+
+    def put(self, key, etag, data: bytes, properties=None):
+        """
+        :param properties: Small JSON-serializable dictionary stored with the entry (content settings, metadata).
+        """
+        if not etag or data is None:
+            return
+        properties = properties or {}
+        self._put_memory(key, etag, data, properties)
+        self._write_disk(key, etag, data, properties)
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_bytes -= len(entry[1])
+        if self.disk_path:
+            path = self._disk_path(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._disk_bytes -= self._disk_sizes.pop(path, 0)
+
+    def _put_memory(self, key, etag, data, properties):
+        if len(data) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous[1])
+            self._memory[key] = (etag, data, properties)
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_path, f"{digest}.blob")
+
+    def _read_disk(self, key):
+        if not self.disk_path:
+            return None
+        path = self._disk_path(key)
+        try:
+            # First line holds the entry metadata, the rest is the blob content
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+            return meta["etag"], data, meta.get("properties", {})
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        except OSError as e:
+            logger.warning(f"Error reading cached blob {key} from disk: {e}")
+            return None
+
+    def _write_disk(self, key, etag, data, properties):
+        if not self.disk_path or len(data) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Write to a temporary file first so readers never see a torn entry
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps({"key": key, "etag": etag, "properties": properties}).encode("utf-8") + b"\n")
+                f.write(data)
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                self._disk_bytes += size - self._disk_sizes.get(path, 0)
+                self._disk_sizes[path] = size
+                over_limit = self._disk_bytes > self.max_disk_bytes
+            if over_limit:
+                self._evict_disk()
+        except OSError as e:
+            logger.warning(f"Error writing cached blob {key} to disk: {e}")
+
+    def _scan_disk(self):
+        """
+        Recount the disk tier from the directory, which other processes may share.
+        :return: List of (last used time, size, path) of the entry files.
+        """
+        entries = []
+        for entry in os.scandir(self.disk_path):
+            if entry.name.endswith(".blob"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        with self._lock:
+            self._disk_sizes = {path: size for _, size, path in entries}
+            self._disk_bytes = sum(self._disk_sizes.values())
+        return entries
+
+    def _evict_disk(self):
+        entries = self._scan_disk()
+        target_bytes = self.max_disk_bytes * DISK_EVICTION_TARGET
+        with self._lock:
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._disk_bytes -= self._disk_sizes.pop(path, 0)
+                if self._disk_bytes <= target_bytes:
+                    break
@@ -0,0 +1,39 @@
+import json
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from azure.storage.blob import ContentSettings
+
+
+def write_if_unchanged(blob_client, data, etag):
+    """
+    Write data as JSON if the blob still has the given ETag, or does not exist yet when etag is None.
+    :return: The new ETag.
+    :raises ResourceModifiedError, ResourceExistsError: When another writer got there first.
+    """
+    if etag is None:
+        conditions = {"match_condition": MatchConditions.IfMissing}
+    else:
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+    response = blob_client.upload_blob(json.dumps(data, indent=4), overwrite=True,
+                                       content_settings=ContentSettings(content_type="application/json"), **conditions)
+    return response.get("etag")
+
+
+def save_with_retries(blob_client, prepare, reload, max_attempts):
+    """
+    Optimistic concurrency loop: write the document returned by prepare() conditioned on the ETag it was
+    read with. When another writer got in between, reload() refreshes the caller's copy and prepare()
+    re-applies the change to it.
+    :param prepare: Callable returning (data, etag) for the next attempt.
+    :param reload: Callable run after a conflicting write; returning False gives up.
+    :return: The new ETag, or None when reload gave up or max_attempts writes conflicted.
+    """
+    for _ in range(max_attempts):
+        data, etag = prepare()
+        try:
+            return write_if_unchanged(blob_client, data, etag)
+        except (ResourceModifiedError, ResourceExistsError):
+            if reload() is False:
+                return None
+    return None
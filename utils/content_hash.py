@@ -0,0 +1,39 @@
+import hashlib
+import json
+
+# Blob metadata key holding the content hash of what was uploaded
+CONTENT_HASH_METADATA_KEY = "content_sha256"
+
+
+class ContentHasher:
+    """
+    SHA-256 over a canonical form of a payload: records are hashed as compact JSON with sorted keys,
+    so a page whose resources come back with their properties in a different order hashes the same.
+    The output format is part of the hash, so switching formats rewrites every blob once.
+    """
+    def __init__(self, serializer):
+        self._hash = hashlib.sha256()
+        self._hash.update(f"{serializer.name}:{sorted(vars(serializer).items())}\n".encode("utf-8"))
+
+    def wrap(self, payload):
+        """
+        :return: The payload to serialize instead of the original. The records of a {"value": [...]}
+                 payload are hashed as the serializer pulls them, so streamed payloads are consumed once.
+        """
+        if isinstance(payload, dict) and set(payload) == {"value"} and not isinstance(payload["value"], (str, bytes, dict)):
+            self._hash.update(b"records\n")
+            return {"value": self._hash_records(payload["value"])}
+        self._update(payload)
+        return payload
+
+    def _hash_records(self, records):
+        for record in records:
+            self._update(record)
+            yield record
+
+    def _update(self, value):
+        self._hash.update(json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+        self._hash.update(b"\n")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
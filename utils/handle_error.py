@@ -1,7 +1,20 @@
+import functools
+import inspect
+
+
 def handle_errors(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                raise RuntimeError(f"Error in {func.__name__}: {str(e)}") from e
+        return async_wrapper
+
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except Exception as e:
             raise RuntimeError(f"Error in {func.__name__}: {str(e)}") from e
-    return wrapper
\ No newline at end of file
+    return wrapper
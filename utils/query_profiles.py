@@ -0,0 +1,129 @@
+import json
+
+# Pages are merged by id and batched rows are split back out by subscriptionId, so both are always projected
+REQUIRED_COLUMNS = ("id", "subscriptionId")
+
+DEFAULT_PROFILE_NAME = "default"
+
+
+class QueryProfile:
+    """
+    Shape of the Resource Graph queries of one scan: an optional type filter, an extra KQL where clause
+    and a project list, applied to the `resources` query and every query derived from it (partitions,
+    lookups by id). A profile without options runs the plain queries and stores its pages where the
+    workflow always has; other profiles store theirs in a folder named after the profile.
+    Profiles are flat `where`/`project` pipelines without mv-expand, so each resource stays one row.
+    """
+
+    def __init__(self, name, types=None, where=None, project=None, changes_project=None):
+        """
+        :param name: Profile name from the "query_profiles" section of settings.json.
+        :param types: Resource types to keep, matched case-insensitively; None keeps every type.
+        :param where: KQL predicate over `resources` columns, e.g. "location startswith 'west'".
+        :param project: Columns or KQL project expressions, e.g. "state = tostring(properties.provisioningState)".
+        :param changes_project: Project list for the `resourcechanges` query; None keeps whole change records.
+        """
+        self.name = name
+        self.types = list(types) if types else None
+        self.where = where
+        self.project = _with_required_columns(project) if project else None
+        self.changes_project = _with_required_columns(changes_project) if changes_project else None
+
+    @classmethod
+    def from_config(cls, name, profile_config):
+        unknown = set(profile_config) - {"types", "where", "project", "changes_project"}
+        if unknown:
+            raise ValueError(f"Unsupported options in query profile {name}: {', '.join(sorted(unknown))}")
+        return cls(name, **profile_config)
+
+    @property
+    def is_default(self):
+        return self.name == DEFAULT_PROFILE_NAME
+
+    @property
+    def stored_columns(self):
+        """
+        :return: Names of the columns projected as they are, or None when the profile keeps whole resources.
+        """
+        if self.project is None:
+            return None
+        return {column.strip() for column in self.project if "=" not in column}
+
+    @property
+    def has_computed_columns(self):
+        return any("=" in column for column in self.project or ())
+
+    def resources_query(self, where=None, project=True):
+        """
+        :param where: Additional KQL predicate, e.g. a partition or id filter.
+        :param project: Apply the project list; off for aggregations over the filtered rows.
+        :return: The `resources` query of this profile.
+        """
+        query = "resources"
+        if self.types:
+            query += f" | where type in~ ({_kql_list(self.types)})"
+        if self.where:
+            query += f" | where {self.where}"
+        if where:
+            query += f" | where {where}"
+        if project and self.project:
+            query += f" | project {', '.join(self.project)}"
+        return query
+
+    def changes_query(self, time_hour):
+        """
+        :param time_hour: Hours since the last execution; the change query looks back at least one hour.
+        :return: The `resourcechanges` query of this profile. The where clause only applies to `resources`
+                 columns and is left out here.
+        """
+        if time_hour < 1:
+            time_hour = 1 # Override time_hour for testing purpose
+        query = f"resourcechanges | where todatetime(properties.changeAttributes.timestamp) > ago({time_hour}h)"
+        if self.types:
+            query += f" | where tostring(properties.targetResourceType) in~ ({_kql_list(self.types)})"
+        if self.changes_project:
+            query += f" | project {', '.join(self.changes_project)}"
+        return query
+
+    def container_name(self, resource_path_container_name):
+        """
+        :return: Where the pages and shards of this profile are stored.
+        """
+        if self.is_default:
+            return resource_path_container_name
+        return f"{resource_path_container_name}/{self.name}"
+
+
+DEFAULT_PROFILE = QueryProfile(DEFAULT_PROFILE_NAME)
+
+
+def get_query_profiles(config):
+    """
+    :param config: Parsed settings.json. "query_profiles" maps profile names to their options and
+                   "run_query_profiles" lists the profiles each run scans, in order.
+    :return: List of QueryProfile; just the default profile when none are configured.
+    """
+    profiles_config = config.get("query_profiles", {})
+    names = config.get("run_query_profiles", [DEFAULT_PROFILE_NAME])
+    if not names:
+        raise ValueError("run_query_profiles must name at least one query profile.")
+
+    profiles = []
+    for name in names:
+        if name in profiles_config:
+            profiles.append(QueryProfile.from_config(name, profiles_config[name]))
+        elif name == DEFAULT_PROFILE_NAME:
+            profiles.append(DEFAULT_PROFILE)
+        else:
+            raise ValueError(f"Unknown query profile: {name}")
+    return profiles
+
+
+def _with_required_columns(columns):
+    names = {column.split("=", 1)[0].strip() for column in columns}
+    return [column for column in REQUIRED_COLUMNS if column not in names] + list(columns)
+
+
+def _kql_list(values):
+    # Types and ids never contain double quotes; json.dumps yields valid KQL string literals
+    return ", ".join(json.dumps(value) for value in values)
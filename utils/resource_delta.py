@@ -0,0 +1,192 @@
+import copy
+import json
+import re
+
+from utils.logger_setup import setup_logger
+from utils.query_profiles import DEFAULT_PROFILE
+
+logger = setup_logger(name="ResourceDeltaApplier")
+
+_PATH_TOKEN = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+
+def _parse_path(property_path):
+    """
+    Split a property path such as "properties.ipConfigurations[0].name" into keys and list indexes.
+    """
+    return [int(index) if index else key for key, index in _PATH_TOKEN.findall(property_path)]
+
+
+def _root_property(property_path):
+    tokens = _parse_path(property_path or "")
+    return tokens[0] if tokens else None
+
+
+def _coerce_value(new_value, current_value):
+    # resourcechanges reports values as strings; restore the stored type when the string is its JSON form
+    if isinstance(new_value, str) and current_value is not None and not isinstance(current_value, str):
+        try:
+            return json.loads(new_value)
+        except ValueError:
+            return new_value
+    return new_value
+
+
+def apply_property_change(resource, property_path, change_type, new_value):
+    """
+    Apply a single property change to a resource dictionary in place.
+    :return: True when the change was applied, False when the path cannot be resolved against the snapshot.
+    """
+    tokens = _parse_path(property_path)
+    if not tokens:
+        return False
+
+    # Missing intermediate objects are not created: the resource may be stored with a projection that left
+    # them out, and a change that adds a whole object is better fetched than rebuilt from its leaves
+    parent = resource
+    for token in tokens[:-1]:
+        try:
+            parent = parent[token]
+        except (KeyError, IndexError, TypeError):
+            return False
+
+    last = tokens[-1]
+    try:
+        if change_type == "Remove":
+            del parent[last]
+        elif isinstance(parent, list) and isinstance(last, int) and last == len(parent):
+            parent.append(new_value)
+        else:
+            current_value = parent.get(last) if isinstance(parent, dict) else parent[last]
+            parent[last] = _coerce_value(new_value, current_value)
+    except (KeyError, IndexError, TypeError):
+        return False
+    return True
+
+
+def _property_changes(change):
+    """
+    Normalise the property changes of a change record to (path, change type, new value) tuples.
+    Supports both the resourcechanges `properties.changes` map and a `propertyChanges` list.
+    """
+    properties = change.get("properties", {})
+    normalised = []
+    for path, detail in (properties.get("changes") or {}).items():
+        normalised.append((path, detail.get("propertyChangeType", "Update"), detail.get("newValue")))
+    for detail in change.get("propertyChanges") or properties.get("propertyChanges") or []:
+        normalised.append((detail.get("propertyName"), detail.get("changeType", "Update"), detail.get("newValue")))
+    return normalised
+
+
+class ResourceDeltaApplier:
+    """
+    Applies resourcechanges records to an AzureResourceStore or a DatedPageStore.
+    Changes are collected for the whole subscription and collapsed per resource in timestamp order:
+    deletes are removed from the store, updates whose property changes resolve against the stored
+    snapshot are patched locally, updates that only touch properties the profile does not store are
+    skipped, and only the remaining ids are fetched as full bodies in batched
+    `resources | where id in~ (...)` queries.
+    """
+
+    def __init__(self, resource_store, subscription_client, subscription_id, apply_property_changes=True,
+                 profile=DEFAULT_PROFILE):
+        """
+        :param resource_store: AzureResourceStore or DatedPageStore holding the subscription snapshot.
+        :param subscription_client: AzureSubscriptionClient used to fetch full resource bodies.
+        :param subscription_id: Subscription the changes belong to.
+        :param apply_property_changes: Patch updates from propertyChanges instead of always re-fetching.
+        :param profile: QueryProfile of the store, so fetched bodies get the same projection as the snapshot.
+        """
+        self.resource_store = resource_store
+        self.subscription_client = subscription_client
+        self.subscription_id = subscription_id
+        self.apply_property_changes = apply_property_changes
+        self.profile = profile
+        self.changes = []
+        self.stats = {"changes": 0, "deleted": 0, "patched": 0, "fetched": 0, "skipped": 0}
+
+    def add_page(self, changes_page_data):
+        self.changes.extend(changes_page_data)
+
+    def finish(self):
+        self.apply()
+        self.resource_store.finish()
+
+    def _stored_property_changes(self, resource_changes):
+        """
+        :return: The (path, change type, new value) changes of properties the profile stores; None when a
+                 change may feed a computed column of the profile, which only a fetch can recompute.
+        """
+        property_changes = [property_change for change in resource_changes
+                            for property_change in _property_changes(change)]
+        stored_columns = self.profile.stored_columns
+        if stored_columns is None:
+            return property_changes
+        stored = [property_change for property_change in property_changes
+                  if _root_property(property_change[0]) in stored_columns]
+        if len(stored) < len(property_changes) and self.profile.has_computed_columns:
+            return None
+        return stored
+
+    def apply(self):
+        self.stats["changes"] = len(self.changes)
+
+        # Collapse the change records per resource, oldest first
+        changes_by_resource = {}
+        for change in sorted(self.changes, key=lambda c: c.get("properties", {}).get("changeAttributes", {}).get("timestamp") or ""):
+            target_id = change.get("properties", {}).get("targetResourceId")
+            if not target_id:
+                logger.warning(f"Skipping change record without targetResourceId: {change.get('id')}")
+                continue
+            changes_by_resource.setdefault(target_id.lower(), []).append(change)
+
+        # Change records may differ in casing from the stored resource ids
+        stored_ids = {resource_id.lower(): resource_id for resource_id in self.resource_store.resources}
+
+        deletes = []
+        patch_candidates = {}
+        fetch_ids = []
+        for target_key, resource_changes in changes_by_resource.items():
+            last_change_type = resource_changes[-1]["properties"].get("changeType")
+            stored_id = stored_ids.get(target_key)
+            target_id = resource_changes[-1]["properties"]["targetResourceId"]
+
+            if last_change_type == "Delete":
+                # Stores without an index of their resources record the delete by the change's id
+                deletes.append(stored_id or target_id)
+                continue
+
+            if self.apply_property_changes and all(c["properties"].get("changeType") == "Update"
+                                                   and _property_changes(c) for c in resource_changes):
+                property_changes = self._stored_property_changes(resource_changes)
+                if property_changes == []:
+                    self.stats["skipped"] += 1
+                    continue
+                if property_changes is not None and stored_id is not None:
+                    patch_candidates[stored_id] = property_changes
+                    continue
+            fetch_ids.append(stored_id or target_id)
+
+        upserts = []
+        snapshots = self.resource_store.get(patch_candidates) if patch_candidates else {}
+        for stored_id, property_changes in patch_candidates.items():
+            snapshot = snapshots.get(stored_id)
+            patched = copy.deepcopy(snapshot) if snapshot is not None else None
+            if patched is not None and all(apply_property_change(patched, path, change_type, new_value)
+                                           for path, change_type, new_value in property_changes):
+                upserts.append(patched)
+                self.stats["patched"] += 1
+            else:
+                fetch_ids.append(stored_id)
+
+        if fetch_ids:
+            fetched = self.subscription_client.get_resources_by_ids([self.subscription_id], fetch_ids, profile=self.profile)
+            fetched_keys = {resource["id"].lower() for resource in fetched}
+            upserts.extend(fetched)
+            self.stats["fetched"] += len(fetched)
+            # Requested ids that no longer resolve were deleted after the change was recorded
+            deletes.extend(resource_id for resource_id in fetch_ids if resource_id.lower() not in fetched_keys)
+
+        self.stats["deleted"] = len(deletes)
+        self.resource_store.apply(upserts=upserts, deletes=deletes)
+        logger.info(f"Applied changes for subscription {self.subscription_id}: {self.stats}")
@@ -0,0 +1,229 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from shared.metrics import span
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="ResourceTable")
+
+# Columns extracted from every resource; "record" keeps the whole resource so the table round-trips
+COLUMNS = ("id", "type", "location", "tags", "timestamp", "property_hash", "record")
+
+# ISO timestamps ending in a zone designator; the others are taken as UTC
+_ZONE_SUFFIX = r"(Z|[+-]\d{2}:?\d{2})$"
+
+
+class ResourceTable:
+    """
+    Experimental columnar resource table backed by a pyarrow Table with the columns id, type, location,
+    tags (a string map), timestamp (UTC), property_hash and record, the resource as canonical JSON.
+    Once loaded, watermark filtering, diffing and merging run as Arrow kernels over whole columns and
+    only rows that really changed are decoded back into dictionaries. Loading is not columnar: every
+    record is serialized, hashed and split into columns one at a time, so a page merge through a table
+    costs more CPU and memory than the streaming merge, which remains the default.
+    Ids are expected to be unique within a table, as in every page written by the workflow.
+    Requires pyarrow and numpy.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build a table from resource dictionaries; each must carry an "id". Tag values that are not
+        strings are stored as their JSON text, and timestamps with a zone offset are converted to UTC.
+        """
+        pyarrow, compute, _ = _import_pyarrow()
+        with span("resource_table.load"):
+            columns = {name: [] for name in COLUMNS}
+            for record in records:
+                canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+                tags = record.get("tags")
+                columns["id"].append(record["id"])
+                columns["type"].append(record.get("type"))
+                columns["location"].append(record.get("location"))
+                columns["tags"].append([(str(key), _tag_value(value)) for key, value in tags.items()]
+                                       if isinstance(tags, dict) else None)
+                columns["timestamp"].append(_record_timestamp(record))
+                # Same value as resource_content_hash, without serializing the resource twice
+                columns["property_hash"].append(hashlib.sha256(canonical.encode("utf-8")).hexdigest())
+                columns["record"].append(canonical)
+
+            # Timestamps are parsed as one column, not one fromisoformat call per record
+            timestamps = pyarrow.array(columns["timestamp"], pyarrow.string())
+            timestamps = compute.if_else(compute.match_substring_regex(timestamps, _ZONE_SUFFIX), timestamps,
+                                         compute.binary_join_element_wise(timestamps, "Z", ""))
+            columns["timestamp"] = compute.cast(compute.cast(timestamps, pyarrow.timestamp("ns", tz="UTC")),
+                                                pyarrow.timestamp("ns"))
+            columns["tags"] = pyarrow.array(columns["tags"], pyarrow.map_(pyarrow.string(), pyarrow.string()))
+            return cls(pyarrow.table(columns, schema=_schema(pyarrow)))
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        :param payload: A {"value": [...]} document as stored in the resource blobs, or None for an empty table.
+        """
+        return cls.from_records(payload["value"] if payload is not None else [])
+
+    @classmethod
+    def load(cls, blob_client, container_name, blob_name):
+        """
+        Read a stored page or shard into a table; a missing blob gives an empty table.
+        """
+        return cls.from_records(blob_client.iter_blob_records(container_name=container_name, blob_name=blob_name))
+
+    def save(self, blob_client, container_name, blob_name, serializer=None):
+        """
+        Write the table back in the storage format of the given serializer.
+        :return: True if the blob was written, False if the write was skipped as unchanged.
+        """
+        return blob_client.upload_data_to_blob(container_name=container_name, blob_name=blob_name,
+                                               json_data=self.to_payload(), serializer=serializer)
+
+    def to_records(self):
+        """
+        :return: Generator over the resources as dictionaries, in table order.
+        """
+        for record in self.table.column("record").to_pylist():
+            yield json.loads(record)
+
+    def to_payload(self):
+        """
+        :return: {"value": <iterator>} payload that the serializers stream record by record.
+        """
+        return {"value": self.to_records()}
+
+    def filter_since(self, watermark):
+        """
+        :param watermark: ISO timestamp, taken as UTC without a zone offset; None keeps every row.
+        :return: Table of the rows whose timestamp is after the watermark. Rows without a timestamp are dropped.
+        """
+        if not watermark:
+            return self
+        pyarrow, compute, _ = _import_pyarrow()
+        watermark_time = datetime.fromisoformat(watermark.replace("Z", "+00:00"))
+        if watermark_time.tzinfo is not None:
+            watermark_time = watermark_time.astimezone(timezone.utc).replace(tzinfo=None)
+        watermark_time = pyarrow.scalar(watermark_time, pyarrow.timestamp("ns"))
+        return ResourceTable(self.table.filter(compute.greater(self.table.column("timestamp"), watermark_time)))
+
+    def diff(self, current):
+        """
+        Compare this table, the stored snapshot, with the current state of the same resources.
+        :param current: ResourceTable of the current resources.
+        :return: Dictionary with "added" and "changed" rows of current and "removed" rows of this table.
+        """
+        _, compute, _ = _import_pyarrow()
+        with span("resource_table.diff"):
+            snapshot_ids = self.table.column("id")
+            current_ids = current.table.column("id")
+            positions = compute.index_in(current_ids, value_set=snapshot_ids)
+            in_snapshot = compute.is_valid(positions)
+            snapshot_hashes = compute.take(self.table.column("property_hash"), positions)
+            changed = compute.fill_null(compute.not_equal(current.table.column("property_hash"), snapshot_hashes), False)
+            removed = compute.invert(compute.is_in(snapshot_ids, value_set=current_ids))
+            return {
+                "added": ResourceTable(current.table.filter(compute.invert(in_snapshot))),
+                "changed": ResourceTable(current.table.filter(changed)),
+                "removed": ResourceTable(self.table.filter(removed)),
+            }
+
+    def merge(self, new):
+        """
+        Columnar form of AzureWatermarkManager.merge_resources: rows of this table keep their order,
+        rows whose id is also in new get new's fields on top of theirs, and the new ids are appended.
+        Rows with identical content are not decoded at all.
+        :param new: ResourceTable of the new resources.
+        :return: The merged ResourceTable.
+        """
+        pyarrow, compute, numpy = _import_pyarrow()
+        with span("resource_table.merge"):
+            new = new._collapse_duplicates()
+            if not self.table.num_rows:
+                return new
+            if not new.table.num_rows:
+                return self
+            existing_ids = self.table.column("id")
+            new_ids = new.table.column("id")
+
+            positions = compute.index_in(existing_ids, value_set=new_ids)
+            new_hashes = compute.take(new.table.column("property_hash"), positions)
+            differs = compute.fill_null(compute.not_equal(self.table.column("property_hash"), new_hashes), False)
+            updated_rows = compute.indices_nonzero(differs)
+
+            # Only rows whose content differs need the shallow update of merge_resources
+            existing_records = compute.take(self.table.column("record"), updated_rows).to_pylist()
+            new_records = compute.take(new.table.column("record"),
+                                       compute.take(positions, updated_rows)).to_pylist()
+            updated = ResourceTable.from_records(
+                {**json.loads(existing), **json.loads(record)} for existing, record in zip(existing_records, new_records))
+
+            appended = new.table.filter(compute.invert(compute.is_in(new_ids, value_set=existing_ids)))
+
+            row_count = self.table.num_rows
+            order = numpy.arange(row_count + len(updated_rows) + appended.num_rows)
+            order[updated_rows.to_numpy()] = row_count + numpy.arange(len(updated_rows))
+            order = order[:row_count].tolist() + order[row_count + len(updated_rows):].tolist()
+            combined = pyarrow.concat_tables([self.table, updated.table, appended])
+            return ResourceTable(combined.take(pyarrow.array(order, pyarrow.int64())))
+
+    def _collapse_duplicates(self):
+        """
+        :return: This table, or when an id repeats, a table where each id's rows are merged into one as
+                 merge_resources would.
+        """
+        _, compute, _ = _import_pyarrow()
+        if compute.count_distinct(self.table.column("id")).as_py() == self.table.num_rows:
+            return self
+        collapsed = {}
+        for record in self.to_records():
+            collapsed[record["id"]] = {**collapsed.get(record["id"], {}), **record}
+        return ResourceTable.from_records(collapsed.values())
+
+
+def _tag_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _record_timestamp(record):
+    """
+    :return: Timestamp of a change record, or the last modification time of a resource, as an ISO string.
+    """
+    timestamp = record.get("timestamp")
+    if timestamp:
+        return timestamp
+    properties = record.get("properties")
+    if isinstance(properties, dict):
+        timestamp = (properties.get("changeAttributes") or {}).get("timestamp")
+        if timestamp:
+            return timestamp
+    return (record.get("systemData") or {}).get("lastModifiedAt")
+
+
+def _schema(pyarrow):
+    return pyarrow.schema([
+        ("id", pyarrow.string()),
+        ("type", pyarrow.string()),
+        ("location", pyarrow.string()),
+        ("tags", pyarrow.map_(pyarrow.string(), pyarrow.string())),
+        ("timestamp", pyarrow.timestamp("ns")),
+        ("property_hash", pyarrow.string()),
+        ("record", pyarrow.string()),
+    ])
+
+
+def _import_pyarrow():
+    try:
+        import numpy
+        import pyarrow
+        import pyarrow.compute as compute
+    except ImportError as e:
+        raise ValueError("The resource table requires the 'pyarrow' and 'numpy' packages.") from e
+    return pyarrow, compute, numpy
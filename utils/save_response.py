@@ -1,29 +1,33 @@
 from datetime import datetime
-import json
 
+from utils.serializers import get_serializer
 
-def write_json_data(file_prefix, new_data):
+
+def write_json_data(file_prefix, new_data, output_format="json"):
     current_date_timestamp = datetime.now().strftime('%Y_%m_%d_%H%M%S')
-    file_name = f"{file_prefix}_{current_date_timestamp}.json"
-    data = new_data
-    with open(file_name, 'w') as file:
-        json.dump(data, file, indent=4)
+    serializer = get_serializer(output_format)
+    file_name = f"{file_prefix}_{current_date_timestamp}{serializer.extension}"
+    with open(file_name, 'wb') as file:
+        file.write(serializer.dumps(new_data))
     return file_name
 
 
-def generate_filename(file_prefix: str, page_number: int = None) -> str:
+def generate_filename(file_prefix: str, page_number: int = None, extension: str = ".json",
+                      date_label: str = None) -> str:
     """
         Generate a filename with an optional page number.
 
         :param file_prefix: Prefix for the filename.
         :param page_number: Optional page number to include in the filename.
+        :param extension: File extension of the output format, e.g. ".json" or ".ndjson.gz".
+        :param date_label: Date part of the filename, e.g. "2024_01_31"; defaults to the current date.
         :return: Generated filename string.
         """
-    current_date_timestamp = datetime.now().strftime('%Y_%m_%d')
+    current_date_timestamp = date_label or datetime.now().strftime('%Y_%m_%d')
     if page_number is not None:
-        file_name = f"{file_prefix}_{current_date_timestamp}_page_{page_number}.json"
+        file_name = f"{file_prefix}_{current_date_timestamp}_page_{page_number}{extension}"
     else:
-        file_name = f"{file_prefix}_{current_date_timestamp}.json"
+        file_name = f"{file_prefix}_{current_date_timestamp}{extension}"
     return file_name
 
 def get_subscription_path_container_name(root_folder_name:str, container_name):
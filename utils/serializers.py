@@ -0,0 +1,355 @@
+import codecs
+import io
+import json
+import re
+import zlib
+from collections.abc import Iterator
+
+from shared.metrics import span
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+PARQUET_MAGIC = b"PAR1"
+
+# Size of the byte chunks produced by streamed serialization
+CHUNK_SIZE = 64 * 1024
+
+# Opening of a {"value": [...]} document, up to the first record
+_VALUE_ARRAY_START = re.compile(r'\s*\{\s*"value"\s*:\s*\[')
+
+
+class JsonSerializer:
+    """
+    Single JSON document, compact by default. Accepts any JSON payload.
+    """
+    name = "json"
+    extension = ".json"
+    content_type = "application/json"
+    content_encoding = None
+
+    def __init__(self, indent=None):
+        self.indent = indent
+
+    def dumps(self, payload) -> bytes:
+        if self.indent is not None:
+            return json.dumps(payload, indent=self.indent).encode("utf-8")
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    def iter_dumps(self, payload, chunk_size=CHUNK_SIZE):
+        """
+        Serialize incrementally, yielding byte chunks of roughly chunk_size.
+        The records of a {"value": <iterator>} payload are pulled one at a time, so they never all
+        have to be in memory.
+        """
+        separators = None if self.indent is not None else (",", ":")
+        encoder = json.JSONEncoder(indent=self.indent, separators=separators)
+        if isinstance(payload, dict) and set(payload) == {"value"} and isinstance(payload["value"], Iterator):
+            parts = self._iter_value_array(encoder, payload["value"])
+        else:
+            parts = encoder.iterencode(payload)
+        yield from _rechunk((part.encode("utf-8") for part in parts), chunk_size)
+
+    def _iter_value_array(self, encoder, records):
+        # Same bytes as encoding {"value": list(records)} in one go
+        if self.indent is None:
+            yield '{"value":['
+            for i, record in enumerate(records):
+                yield "," if i else ""
+                yield from encoder.iterencode(record)
+            yield "]}"
+            return
+
+        indent = " " * self.indent if isinstance(self.indent, int) else self.indent
+        yield "{\n" + indent + '"value": ['
+        empty = True
+        for record in records:
+            # Encoded strings never contain raw newlines, so every newline is a line of the record
+            yield ("\n" if empty else ",\n") + indent * 2 + encoder.encode(record).replace("\n", "\n" + indent * 2)
+            empty = False
+        yield "]\n}" if empty else "\n" + indent + "]\n}"
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+    def iter_records(self, chunks):
+        """
+        Decode the records of a {"value": [...]} document from an iterable of raw blob chunks, one record
+        at a time. Documents of any other shape are decoded in one go.
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        chunks = iter(chunks)
+        buffer = ""
+        position = None
+        for chunk in chunks:
+            buffer += text_decoder.decode(chunk)
+            if position is None:
+                start = _VALUE_ARRAY_START.match(buffer)
+                if start is None:
+                    if len(buffer) < 64:
+                        # Not enough of the document yet to tell its shape
+                        continue
+                    break
+                position = start.end()
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The record continues in the next chunk
+                    break
+                yield record
+            buffer = buffer[position:]
+            position = 0
+        else:
+            buffer += text_decoder.decode(b"", final=True)
+            if position is not None:
+                raise ValueError("Unexpected end of JSON document while reading records.")
+
+        # Unexpected document shape: decode everything that is left in one go
+        rest = "".join(text_decoder.decode(chunk) for chunk in chunks) + text_decoder.decode(b"", final=True)
+        yield from json.loads(buffer + rest)["value"]
+
+
+class NdjsonSerializer:
+    """
+    One JSON record per line for {"value": [...]} payloads, optionally gzip or zstd compressed.
+    Records can be decoded line by line from a chunk stream without loading the whole blob.
+    """
+    name = "ndjson"
+    content_type = "application/x-ndjson"
+
+    def __init__(self, compression=None, level=None):
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unsupported NDJSON compression: {compression}")
+        self.compression = compression
+        self.level = level
+        self.content_encoding = compression
+        self.extension = {None: ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}[compression]
+        if compression == "zstd":
+            _import_zstandard()
+
+    def dumps(self, payload) -> bytes:
+        return b"".join(self.iter_dumps(payload))
+
+    def iter_dumps(self, payload, chunk_size=CHUNK_SIZE):
+        """
+        Serialize a {"value": [...]} payload as a stream of (compressed) byte chunks of roughly chunk_size.
+        """
+        records = _payload_records(payload)
+        compressor = self._compressor()
+
+        def parts():
+            for record in records:
+                line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+                yield compressor.compress(line) if compressor else line
+            if compressor:
+                yield compressor.flush()
+
+        yield from _rechunk(parts(), chunk_size)
+
+    def loads(self, data: bytes):
+        return {"value": list(self.iter_records([data]))}
+
+    def iter_records(self, chunks):
+        """
+        Decode records from an iterable of raw blob chunks, one line at a time.
+        """
+        decompressor = self._decompressor()
+        pending = b""
+        for chunk in chunks:
+            for data in self._decompress(decompressor, chunk):
+                pending += data
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+
+    def _decompress(self, decompressor, chunk):
+        if decompressor is None:
+            yield chunk
+        elif self.compression == "gzip":
+            # A downloaded chunk can inflate to many times its size; hand it over in bounded pieces
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE)
+        else:
+            yield decompressor.decompress(chunk)
+
+    def _compressor(self):
+        if self.compression == "gzip":
+            return zlib.compressobj(self.level if self.level is not None else 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        if self.compression == "zstd":
+            zstandard = _import_zstandard()
+            return zstandard.ZstdCompressor(level=self.level if self.level is not None else 3).compressobj()
+        return None
+
+    def _decompressor(self):
+        if self.compression == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.compression == "zstd":
+            zstandard = _import_zstandard()
+            return zstandard.ZstdDecompressor().decompressobj()
+        return None
+
+
+class ParquetSerializer:
+    """
+    Columnar Parquet for {"value": [...]} payloads. Top-level scalar fields become columns; nested
+    objects and arrays (properties, tags, ...) are stored as JSON strings and restored on read.
+    Requires pyarrow.
+    """
+    name = "parquet"
+    extension = ".parquet"
+    content_type = "application/vnd.apache.parquet"
+    content_encoding = None
+
+    def __init__(self, compression="zstd"):
+        self.compression = compression
+        _import_pyarrow()
+
+    def dumps(self, payload) -> bytes:
+        pyarrow, parquet = _import_pyarrow()
+        records = list(_payload_records(payload))
+        columns = {}
+        for record in records:
+            for key in record:
+                columns.setdefault(key, None)
+        json_columns = [key for key in columns if any(isinstance(record.get(key), (dict, list)) for record in records)]
+        table = pyarrow.table({
+            key: [
+                json.dumps(record[key]) if key in json_columns and key in record else record.get(key)
+                for record in records
+            ]
+            for key in columns
+        })
+        table = table.replace_schema_metadata({"json_columns": json.dumps(json_columns)})
+        buffer = io.BytesIO()
+        parquet.write_table(table, buffer, compression=self.compression)
+        return buffer.getvalue()
+
+    def iter_dumps(self, payload, chunk_size=CHUNK_SIZE):
+        # Parquet footers are written last, so the file is built in memory before streaming it out
+        data = self.dumps(payload)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    def loads(self, data: bytes):
+        _, parquet = _import_pyarrow()
+        table = parquet.read_table(io.BytesIO(data))
+        metadata = table.schema.metadata or {}
+        json_columns = set(json.loads(metadata.get(b"json_columns", b"[]")))
+        records = []
+        for row in table.to_pylist():
+            record = {}
+            for key, value in row.items():
+                if value is None:
+                    continue
+                record[key] = json.loads(value) if key in json_columns else value
+            records.append(record)
+        return {"value": records}
+
+    def iter_records(self, chunks):
+        yield from self.loads(b"".join(chunks))["value"]
+
+
+def _rechunk(parts, chunk_size):
+    """
+    Coalesce small byte fragments into chunks of at least chunk_size bytes (except the last one).
+    """
+    buffer = []
+    buffered = 0
+    for part in parts:
+        if not part:
+            continue
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _payload_records(payload):
+    if not isinstance(payload, dict) or set(payload) != {"value"}:
+        raise ValueError("Record-oriented formats only support {\"value\": [...]} payloads.")
+    return payload["value"]
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ValueError("The zstd output format requires the 'zstandard' package.") from e
+    return zstandard
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet as parquet
+    except ImportError as e:
+        raise ValueError("The parquet output format requires the 'pyarrow' package.") from e
+    return pyarrow, parquet
+
+
+_FORMATS = {
+    "json": lambda: JsonSerializer(),
+    "json_pretty": lambda: JsonSerializer(indent=4),
+    "ndjson": lambda: NdjsonSerializer(),
+    "ndjson_gzip": lambda: NdjsonSerializer(compression="gzip"),
+    "ndjson_zstd": lambda: NdjsonSerializer(compression="zstd"),
+    "parquet": lambda: ParquetSerializer(),
+}
+
+
+def get_serializer(output_format="json"):
+    """
+    :param output_format: One of json, json_pretty, ndjson, ndjson_gzip, ndjson_zstd, parquet.
+    """
+    try:
+        return _FORMATS[output_format]()
+    except KeyError:
+        raise ValueError(f"Unsupported output format: {output_format}") from None
+
+
+def detect_serializer(data: bytes = b"", content_type=None, content_encoding=None):
+    """
+    Work out how a stored blob was serialized from its content settings, falling back to magic bytes.
+    """
+    if content_encoding in ("gzip", "zstd") or data[:2] == GZIP_MAGIC or data[:4] == ZSTD_MAGIC:
+        compression = content_encoding if content_encoding in ("gzip", "zstd") else \
+            ("gzip" if data[:2] == GZIP_MAGIC else "zstd")
+        return NdjsonSerializer(compression=compression)
+    if content_type == ParquetSerializer.content_type or data[:4] == PARQUET_MAGIC:
+        return ParquetSerializer()
+    if content_type == NdjsonSerializer.content_type:
+        return NdjsonSerializer()
+    if content_type == JsonSerializer.content_type:
+        return JsonSerializer()
+
+    # Unknown content type (e.g. blobs written before content settings were set): NDJSON starts with a
+    # complete record on its first line, a JSON document either spans lines or is a single {"value": ...}
+    first_line = data.lstrip().split(b"\n", 1)[0]
+    try:
+        first_record = json.loads(first_line)
+    except ValueError:
+        return JsonSerializer()
+    if isinstance(first_record, dict) and set(first_record) != {"value"}:
+        return NdjsonSerializer()
+    return JsonSerializer()
+
+
+def decode_blob(data: bytes, content_type=None, content_encoding=None):
+    serializer = detect_serializer(data, content_type, content_encoding)
+    with span("deserialize", format=serializer.name):
+        return serializer.loads(data)
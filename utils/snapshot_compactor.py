@@ -0,0 +1,268 @@
+import json
+import re
+from datetime import datetime
+
+from shared.metrics import increment, span
+from utils.azure_resource_store import DATE_FORMAT
+from utils.logger_setup import setup_logger
+from utils.serializers import JsonSerializer
+from utils.snapshot_query import SnapshotIndexBuilder
+
+logger = setup_logger(name="SnapshotCompactor")
+
+
+class SnapshotCompactor:
+    """
+    Consolidates the dated page blobs of a subscription (resource_<sub>_<YYYY_MM_DD>_page_<n>.<ext>) into a
+    few size-targeted snapshot parts under the "snapshot" folder of the same container, with a manifest per
+    date and a resource_<sub>_manifest.json copy of the latest one, so readers open one manifest and a
+    handful of large blobs instead of listing every page:
+
+        {"subscription_id", "date", "created_at", "format", "records", "bytes", "complete": true,
+         "full_scan", "base", "full_scan_date",
+         "parts": [{"blob", "records", "bytes"}], "source_pages": [...], "index": <index blob>}
+
+    The pages of a date only hold what the runs of that day fetched, so each date's snapshot is the state
+    of the whole subscription: the date's journal (see utils.azure_resource_store.DatedPageStore) says
+    whether its pages hold a full scan; if not, they are applied on top of the snapshot of the previous
+    compacted date ("base"), and the journal's deletes are dropped. A date without a full scan and
+    without an earlier snapshot is left uncompacted. When a date is compacted, every later date is
+    compacted again, since its base changed.
+
+    Retention: pages and journals of a compacted date expire after page_retention_days (the current
+    date's are always kept, since later runs of the day add to them); snapshots expire after
+    snapshot_retention_days, except the latest one, the one the current date builds on and the one
+    holding the full scan the latest snapshot descends from.
+    Each snapshot also gets a sidecar index, which utils.snapshot_query uses for point lookups and
+    filtered scans.
+    """
+
+    def __init__(self, blob_client, container_name, serializer=None, target_snapshot_bytes=64 * 1024 * 1024,
+                 page_retention_days=2, snapshot_retention_days=30):
+        """
+        :param blob_client: AzureBlobClient used to list, read, write and delete blobs.
+        :param container_name: Container path holding the resource pages.
+        :param serializer: Output format of the snapshot parts; manifests are always JSON.
+        :param target_snapshot_bytes: Size of a snapshot part, measured on the compact JSON of its records.
+        :param page_retention_days: Age in days after which the pages of a compacted date are deleted.
+        :param snapshot_retention_days: Age in days after which a snapshot no longer needed is deleted.
+        """
+        self.blob_client = blob_client
+        self.container_name = container_name
+        self.snapshot_container_name = f"{container_name}/snapshot"
+        self.serializer = serializer or JsonSerializer()
+        self.target_snapshot_bytes = target_snapshot_bytes
+        self.page_retention_days = page_retention_days
+        self.snapshot_retention_days = snapshot_retention_days
+
+    def compact(self, subscription_id, today=None):
+        """
+        Compact, in date order, every date of the subscription that has pages and either is the current
+        date, has no complete snapshot yet or follows a date compacted in this call, then apply the
+        retention policy.
+        :param today: Current date; defaults to the local date used by generate_filename.
+        :return: Dictionary of counts: dates compacted, pages and snapshot parts deleted.
+        """
+        today = today or datetime.now().date()
+        stats = {"dates_compacted": 0, "pages_deleted": 0, "snapshots_deleted": 0}
+
+        pages_by_date, journals = self._list_dated_blobs(subscription_id)
+        manifests = {date: self._read_manifest(blob_name)
+                     for date, blob_name in self._list_manifests(subscription_id).items()}
+        manifests = {date: manifest for date, manifest in manifests.items() if manifest is not None}
+
+        # A snapshot whose pages have expired cannot be rebuilt, so neither can the dates before it
+        frozen_date = max((date for date in manifests if date not in pages_by_date and date not in journals),
+                          default=None)
+        rebuild = False
+        for date in sorted(set(pages_by_date) | set(journals)):
+            needs_compaction = rebuild or date == today or not manifests.get(date, {}).get("complete")
+            if not needs_compaction:
+                continue
+            if frozen_date is not None and date <= frozen_date:
+                logger.warning(f"Pages of subscription {subscription_id} for {date} are older than the snapshot "
+                               f"of {frozen_date}, whose pages have expired; they are left uncompacted.")
+                continue
+            journal = self.blob_client.read_blob_file(self.container_name, journals[date]) if date in journals else {}
+            base = None
+            if not (journal or {}).get("full_scan"):
+                base_date = max((earlier for earlier, manifest in manifests.items()
+                                 if earlier < date and manifest.get("complete")), default=None)
+                if base_date is None:
+                    logger.warning(f"Pages of subscription {subscription_id} for {date} hold changes but there is "
+                                   f"no earlier snapshot to apply them to; they are left uncompacted.")
+                    continue
+                base = manifests[base_date]
+            manifests[date] = self._compact_date(subscription_id, date, pages_by_date.get(date, []),
+                                                 journal or {}, base)
+            stats["dates_compacted"] += 1
+            rebuild = True
+
+        complete_dates = [date for date, manifest in manifests.items() if manifest.get("complete")]
+        if complete_dates:
+            self.blob_client.upload_data_to_blob(self.snapshot_container_name,
+                                                 f"resource_{subscription_id}_manifest.json",
+                                                 manifests[max(complete_dates)])
+
+        expired_dates = [date for date in set(pages_by_date) | set(journals)
+                         if manifests.get(date, {}).get("complete") and date < today
+                         and (today - date).days >= self.page_retention_days]
+        expired_pages = [page for date in expired_dates for _, page in pages_by_date.get(date, [])]
+        stats["pages_deleted"] = len(expired_pages)
+        self.blob_client.delete_blobs(self.container_name,
+                                      expired_pages + [journals[date] for date in expired_dates if date in journals])
+
+        stats["snapshots_deleted"] = self._expire_snapshots(subscription_id, manifests, today)
+        increment("compaction.pages_deleted", stats["pages_deleted"])
+        logger.info(f"Compacted subscription {subscription_id}: {stats}")
+        return stats
+
+    def _list_dated_blobs(self, subscription_id):
+        """
+        :return: Dictionary of date to a list of (page number, blob name), in page order, and dictionary of
+                 date to the blob name of its journal.
+        """
+        prefix = re.escape(f"resource_{subscription_id}_")
+        page_pattern = re.compile(rf"{prefix}(\d{{4}}_\d{{2}}_\d{{2}})_page_(\d+)\.")
+        journal_pattern = re.compile(rf"{prefix}(\d{{4}}_\d{{2}}_\d{{2}})_journal\.json$")
+        pages_by_date = {}
+        journals = {}
+        for blob in self.blob_client.list_blobs(self.container_name, name_starts_with=f"resource_{subscription_id}_"):
+            match = page_pattern.match(blob.name)
+            if match:
+                date = datetime.strptime(match.group(1), DATE_FORMAT).date()
+                pages_by_date.setdefault(date, []).append((int(match.group(2)), blob.name))
+                continue
+            match = journal_pattern.match(blob.name)
+            if match:
+                journals[datetime.strptime(match.group(1), DATE_FORMAT).date()] = blob.name
+        for pages in pages_by_date.values():
+            pages.sort()
+        return pages_by_date, journals
+
+    def _list_manifests(self, subscription_id):
+        """
+        :return: Dictionary of date to the blob name of its manifest.
+        """
+        pattern = re.compile(rf"resource_{re.escape(subscription_id)}_(\d{{4}}_\d{{2}}_\d{{2}})_manifest\.json$")
+        manifests = {}
+        for blob in self.blob_client.list_blobs(self.snapshot_container_name,
+                                                name_starts_with=f"resource_{subscription_id}_"):
+            match = pattern.match(blob.name)
+            if match:
+                manifests[datetime.strptime(match.group(1), DATE_FORMAT).date()] = blob.name
+        return manifests
+
+    def _read_manifest(self, blob_name):
+        manifest = self.blob_client.read_blob_file(self.snapshot_container_name, blob_name)
+        return manifest if isinstance(manifest, dict) else None
+
+    def _iter_date_records(self, pages, journal, base):
+        """
+        Yield the resources of a date: those of the base snapshot that the date's pages neither replace nor
+        delete, in snapshot order, then the last copy of every resource on the pages that was not deleted.
+        Only the ids of the pages are held in memory; the pages are read twice.
+        """
+        deleted_ids = {resource_id.lower() for resource_id in journal.get("deleted", [])}
+        last_copies = {}
+        for page_position, (_, page) in enumerate(pages):
+            for record_position, record in enumerate(self.blob_client.iter_blob_records(self.container_name, page)):
+                last_copies[record["id"].lower()] = (page_position, record_position)
+
+        if base is not None:
+            for part in base["parts"]:
+                for record in self.blob_client.iter_blob_records(self.snapshot_container_name, part["blob"]):
+                    resource_id = record["id"].lower()
+                    if resource_id not in last_copies and resource_id not in deleted_ids:
+                        yield record
+        for page_position, (_, page) in enumerate(pages):
+            for record_position, record in enumerate(self.blob_client.iter_blob_records(self.container_name, page)):
+                resource_id = record["id"].lower()
+                if last_copies.get(resource_id) == (page_position, record_position) and resource_id not in deleted_ids:
+                    yield record
+
+    def _compact_date(self, subscription_id, date, pages, journal, base):
+        """
+        Stream the resources of one date into snapshot parts of about target_snapshot_bytes and write the
+        date's manifest.
+        :param journal: The date's journal, {} when it has none.
+        :param base: Manifest of the snapshot the date's pages apply to; None when they hold a full scan.
+        :return: The manifest.
+        """
+        date_label = date.strftime(DATE_FORMAT)
+        parts = []
+        part_records = []
+        part_bytes = 0
+        index_builder = SnapshotIndexBuilder(subscription_id, date.isoformat(), self.serializer)
+
+        def write_part():
+            blob_name = f"resource_{subscription_id}_{date_label}_snapshot_{len(parts) + 1}{self.serializer.extension}"
+            self.blob_client.upload_data_to_blob(self.snapshot_container_name, blob_name, {"value": part_records},
+                                                 serializer=self.serializer)
+            parts.append({"blob": blob_name, "records": len(part_records), "bytes": part_bytes})
+
+        with span("compaction.compact", subscription=subscription_id):
+            for record in self._iter_date_records(pages, journal, base):
+                part_records.append(record)
+                encoded_length = len(json.dumps(record, separators=(",", ":")))
+                index_builder.add(record, len(parts), encoded_length)
+                part_bytes += encoded_length
+                if part_bytes >= self.target_snapshot_bytes:
+                    write_part()
+                    part_records, part_bytes = [], 0
+            if part_records or not parts:
+                write_part()
+
+        # Parts left over from an earlier compaction of the same date that produced more of them
+        stale_parts = [blob.name for blob in self.blob_client.list_blobs(
+            self.snapshot_container_name, name_starts_with=f"resource_{subscription_id}_{date_label}_snapshot_")
+            if blob.name not in {part["blob"] for part in parts}]
+        self.blob_client.delete_blobs(self.snapshot_container_name, stale_parts)
+
+        index_builder.index["parts"] = [part["blob"] for part in parts]
+        index_blob_name = f"resource_{subscription_id}_{date_label}_index.json"
+        self.blob_client.upload_data_to_blob(self.snapshot_container_name, index_blob_name, index_builder.index)
+
+        manifest = {
+            "subscription_id": subscription_id,
+            "date": date.isoformat(),
+            "created_at": datetime.utcnow().isoformat(),
+            "format": self.serializer.name,
+            "records": sum(part["records"] for part in parts),
+            "bytes": sum(part["bytes"] for part in parts),
+            "complete": True,
+            "full_scan": base is None,
+            "base": None if base is None else base["date"],
+            "full_scan_date": date.isoformat() if base is None else base["full_scan_date"],
+            "parts": parts,
+            "source_pages": [page for _, page in pages],
+            "index": index_blob_name,
+        }
+        self.blob_client.upload_data_to_blob(self.snapshot_container_name,
+                                             f"resource_{subscription_id}_{date_label}_manifest.json", manifest)
+        increment("compaction.parts_written", len(parts))
+        return manifest
+
+    def _expire_snapshots(self, subscription_id, manifests, today):
+        """
+        Delete the manifests and parts of snapshots older than snapshot_retention_days, keeping the latest
+        complete snapshot, the latest one before today, which today's snapshot is rebuilt on, and the full
+        scan the latest one descends from.
+        :return: Number of blobs deleted.
+        """
+        complete_dates = [date for date, manifest in manifests.items() if manifest.get("complete")]
+        if not complete_dates:
+            return 0
+        latest_date = max(complete_dates)
+        protected_dates = {latest_date,
+                           datetime.fromisoformat(manifests[latest_date]["full_scan_date"]).date()}
+        protected_dates.add(max((date for date in complete_dates if date < today), default=latest_date))
+        expired_dates = [date for date in manifests
+                         if date not in protected_dates and (today - date).days > self.snapshot_retention_days]
+        expired_blobs = []
+        for date in expired_dates:
+            date_label = date.strftime(DATE_FORMAT)
+            expired_blobs.extend(blob.name for blob in self.blob_client.list_blobs(
+                self.snapshot_container_name, name_starts_with=f"resource_{subscription_id}_{date_label}_"))
+        self.blob_client.delete_blobs(self.snapshot_container_name, expired_blobs)
+        return len(expired_blobs)
@@ -0,0 +1,204 @@
+import json
+
+from shared.metrics import increment, span
+from utils.logger_setup import setup_logger
+from utils.serializers import JsonSerializer, NdjsonSerializer
+
+logger = setup_logger(name="SnapshotQuery")
+
+# Columns with a secondary index, and the query argument each one is filtered by
+INDEXED_COLUMNS = {"type": "type", "resourceGroup": "resource_group", "location": "location"}
+
+
+def record_layout(serializer):
+    """
+    :return: (bytes before the first record, separator bytes before every record but the first, bytes
+             after every record) when the serializer writes each record as its compact JSON, so record
+             offsets can be computed while writing; None otherwise.
+    """
+    if isinstance(serializer, JsonSerializer) and serializer.indent is None:
+        return len('{"value":['), len(","), 0
+    if isinstance(serializer, NdjsonSerializer) and serializer.compression is None:
+        return 0, 0, len("\n")
+    return None
+
+
+class SnapshotIndexBuilder:
+    """
+    Builds the sidecar index of one compacted snapshot while its parts are written:
+
+        {"subscription_id", "date", "parts": [blob, ...],
+         "rows": [[id, part, offset, length], ...],
+         "type": {value: [row, ...]}, "resourceGroup": {...}, "location": {...}}
+
+    Offsets and lengths locate a record inside its part for ranged reads; they are null when the
+    output format is compressed or columnar. Ids and indexed values are stored lower-cased, as Azure
+    compares them case-insensitively.
+    """
+
+    def __init__(self, subscription_id, date, serializer):
+        self.layout = record_layout(serializer)
+        self.index = {"subscription_id": subscription_id, "date": date, "parts": [], "rows": []}
+        for column in INDEXED_COLUMNS:
+            self.index[column] = {}
+        self._part = None
+        self._part_offset = 0
+        self._part_records = 0
+
+    def add(self, record, part, encoded_length):
+        """
+        :param part: Position of the snapshot part the record is written to; parts are filled one after another.
+        :param encoded_length: Length of the record's compact JSON encoding.
+        """
+        if part != self._part:
+            self._part, self._part_offset, self._part_records = part, 0, 0
+        offset = length = None
+        if self.layout is not None:
+            prefix, separator, terminator = self.layout
+            if self._part_records:
+                self._part_offset += separator
+            offset, length = prefix + self._part_offset, encoded_length
+            self._part_offset += encoded_length + terminator
+        self._part_records += 1
+
+        row = len(self.index["rows"])
+        self.index["rows"].append([record["id"].lower(), part, offset, length])
+        for column in INDEXED_COLUMNS:
+            value = record.get(column)
+            if value:
+                self.index[column].setdefault(str(value).lower(), []).append(row)
+
+
+class SnapshotQuery:
+    """
+    Read side of the compacted snapshots: point lookups by id and filtered scans by type, resourceGroup
+    and location that only read the snapshot parts holding matching rows. Rows are fetched with ranged
+    reads when the format allows it and a part has at most max_ranged_reads of them; otherwise the part
+    is streamed and filtered.
+    The latest manifest and its index are loaded once per subscription and reloaded when a part does not
+    hold the indexed rows, e.g. because the snapshot was compacted again since.
+    Only complete snapshots, which hold the whole subscription as of their date, are served; manifests
+    written before snapshots were built on the previous one only cover the pages of their own date.
+    """
+
+    def __init__(self, blob_client, container_name, max_ranged_reads=32):
+        """
+        :param blob_client: AzureBlobClient used for the manifest, index and part reads.
+        :param container_name: Container path holding the resource pages; snapshots live in its "snapshot" folder.
+        :param max_ranged_reads: Most ranged reads issued against one part before reading it whole instead.
+        """
+        self.blob_client = blob_client
+        self.snapshot_container_name = f"{container_name}/snapshot"
+        self.max_ranged_reads = max_ranged_reads
+        self._indexes = {}
+
+    def get(self, subscription_id, resource_id):
+        """
+        :return: The stored resource, or None when the latest snapshot does not hold it.
+        """
+        return self.get_many(subscription_id, [resource_id]).get(resource_id.lower())
+
+    def get_many(self, subscription_id, resource_ids):
+        """
+        :return: Dictionary of lower-cased resource id to resource for the ids present in the snapshot.
+        """
+        index = self._index(subscription_id)
+        if index is None:
+            return {}
+        rows = [index["row_by_id"][key] for key in {resource_id.lower() for resource_id in resource_ids}
+                if key in index["row_by_id"]]
+        return {resource["id"].lower(): resource for resource in self._fetch_rows(subscription_id, rows)}
+
+    def find(self, subscription_id, type=None, resource_group=None, location=None):
+        """
+        Resources of the latest snapshot matching every given filter, compared case-insensitively.
+        At least one filter is required.
+        :return: List of resources.
+        """
+        filters = {"type": type, "resource_group": resource_group, "location": location}
+        if not any(filters.values()):
+            raise ValueError("At least one of type, resource_group or location is required.")
+        index = self._index(subscription_id)
+        if index is None:
+            return []
+
+        rows = None
+        for column, argument in INDEXED_COLUMNS.items():
+            if filters[argument]:
+                matches = set(index[column].get(filters[argument].lower(), ()))
+                rows = matches if rows is None else rows & matches
+        return self._fetch_rows(subscription_id, sorted(rows))
+
+    def refresh(self, subscription_id):
+        """
+        Drop the cached index, so the next query reads the latest manifest again.
+        """
+        self._indexes.pop(subscription_id, None)
+
+    def _index(self, subscription_id):
+        index = self._indexes.get(subscription_id)
+        if index is not None:
+            return index
+        manifest = self.blob_client.read_blob_file(self.snapshot_container_name,
+                                                   f"resource_{subscription_id}_manifest.json")
+        if manifest is None or not manifest.get("index") or not manifest.get("complete"):
+            logger.info(f"No complete indexed snapshot for subscription {subscription_id}.")
+            return None
+        index = self.blob_client.read_blob_file(self.snapshot_container_name, manifest["index"])
+        if index is None:
+            return None
+        index["row_by_id"] = {row[0]: row_number for row_number, row in enumerate(index["rows"])}
+        self._indexes[subscription_id] = index
+        return index
+
+    def _fetch_rows(self, subscription_id, rows, retry=True):
+        """
+        Read the given index rows from their parts.
+        :return: List of resources.
+        """
+        index = self._indexes[subscription_id]
+        rows_by_part = {}
+        for row_number in rows:
+            resource_id, part, offset, length = index["rows"][row_number]
+            rows_by_part.setdefault(part, []).append((resource_id, offset, length))
+
+        resources = []
+        with span("snapshot_query.fetch", subscription=subscription_id):
+            for part, part_rows in sorted(rows_by_part.items()):
+                blob_name = index["parts"][part]
+                rangeable = all(offset is not None for _, offset, _ in part_rows)
+                if not rangeable or len(part_rows) > self.max_ranged_reads:
+                    wanted_ids = {resource_id for resource_id, _, _ in part_rows}
+                    increment("snapshot_query.part_reads")
+                    part_resources = [record for record in self.blob_client.iter_blob_records(
+                        self.snapshot_container_name, blob_name) if record["id"].lower() in wanted_ids]
+                    if len(part_resources) != len(wanted_ids):
+                        return self._refetch_rows(subscription_id, rows, blob_name, retry)
+                    resources.extend(part_resources)
+                    continue
+
+                for resource_id, offset, length in part_rows:
+                    increment("snapshot_query.ranged_reads")
+                    data = self.blob_client.read_blob_range(self.snapshot_container_name, blob_name, offset, length)
+                    record = json.loads(data) if data else None
+                    if record is None or record.get("id", "").lower() != resource_id:
+                        return self._refetch_rows(subscription_id, rows, blob_name, retry)
+                    resources.append(record)
+        return resources
+
+    def _refetch_rows(self, subscription_id, rows, blob_name, retry):
+        """
+        The part did not hold the indexed rows, so the snapshot was rewritten since the index was loaded;
+        start over on the new one.
+        """
+        if not retry:
+            raise RuntimeError(f"Snapshot index of subscription {subscription_id} does not match its part {blob_name}.")
+        logger.info(f"Snapshot of subscription {subscription_id} changed; reloading its index.")
+        index = self._indexes[subscription_id]
+        self.refresh(subscription_id)
+        new_index = self._index(subscription_id)
+        if new_index is None:
+            return []
+        wanted_ids = [index["rows"][row_number][0] for row_number in rows]
+        return self._fetch_rows(subscription_id, [new_index["row_by_id"][key] for key in wanted_ids
+                                                  if key in new_index["row_by_id"]], retry=False)
@@ -0,0 +1,83 @@
+import heapq
+
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="SubscriptionScheduler")
+
+# Subscription states (subscriptions.list) whose scans are expected to find little or nothing
+INACTIVE_STATES = ("Disabled", "Deleted")
+
+
+class SubscriptionScheduler:
+    """
+    Orders work items by their expected duration from the run history, longest first: a worker pool
+    taking items in that order is the longest-processing-time-first schedule, so one large subscription
+    no longer starts last and stretches the run. Work items made only of disabled subscriptions or of
+    subscriptions whose last runs came back empty go after all others.
+    A subscription without history for the scan mode is assumed to take as long as the longest known
+    one of that mode, so new subscriptions start early rather than late.
+    """
+
+    def __init__(self, run_history, subscriptions_data=None):
+        """
+        :param run_history: AzureRunHistory with the statistics of earlier runs.
+        :param subscriptions_data: Subscriptions as fetched by fetch_subscriptions, for their state.
+        """
+        self.run_history = run_history
+        self.states = {subscription.get("subscription_id"): subscription.get("state")
+                       for subscription in subscriptions_data or []}
+
+    def order(self, work_items):
+        """
+        :param work_items: List of (subscription id list, time_diff_hours) from build_work_items.
+        :return: The work items, longest expected duration first and deprioritised ones last.
+        """
+        estimates = self.estimate(work_items)
+        positions = range(len(work_items))
+        order = sorted(positions, key=lambda i: (self.is_deprioritised(work_items[i][0]), -estimates[i]))
+        return [work_items[i] for i in order]
+
+    def estimate(self, work_items):
+        """
+        :return: List of expected durations in seconds, one per work item; a batch takes as long as its
+                 subscriptions together.
+        """
+        known = [[self._duration(subscription_id, time_diff_hours is None) for subscription_id in subscription_ids]
+                 for subscription_ids, time_diff_hours in work_items]
+        # Full scans take far longer than change queries, so unknown durations are filled in per scan mode
+        longest = {}
+        for durations, (_, time_diff_hours) in zip(known, work_items):
+            for duration in durations:
+                if duration is not None:
+                    full_scan = time_diff_hours is None
+                    longest[full_scan] = max(longest.get(full_scan, 0.0), duration)
+        return [sum(longest.get(time_diff_hours is None, 0.0) if duration is None else duration
+                    for duration in durations)
+                for durations, (_, time_diff_hours) in zip(known, work_items)]
+
+    def pack(self, work_items, workers):
+        """
+        Assign work items to workers longest first, each going to the worker that frees up first, or of
+        those, the one with the fewest items.
+        :return: (list of work item lists, one per worker, expected makespan in seconds).
+        """
+        estimates = self.estimate(work_items)
+        bins = [[] for _ in range(max(1, workers))]
+        loads = [(0.0, 0, worker) for worker in range(len(bins))]
+        for i in sorted(range(len(work_items)), key=lambda i: -estimates[i]):
+            load, items, worker = heapq.heappop(loads)
+            bins[worker].append(work_items[i])
+            heapq.heappush(loads, (load + estimates[i], items + 1, worker))
+        return bins, max(load for load, _, _ in loads)
+
+    def is_deprioritised(self, subscription_ids):
+        """
+        :return: True when every subscription is disabled or returned no resources in its last run.
+        """
+        return all(self.states.get(subscription_id) in INACTIVE_STATES
+                   or self.run_history.consecutive_empty_runs(subscription_id) > 0
+                   for subscription_id in subscription_ids)
+
+    def _duration(self, subscription_id, full_scan):
+        stats = self.run_history.get(subscription_id, full_scan)
+        return None if stats is None else stats.get("duration_seconds", 0.0)
@@ -0,0 +1,145 @@
+import json
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import ResourceExistsError
+
+from utils.logger_setup import setup_logger
+
+logger = setup_logger(name="WorkQueue")
+
+
+class AzureWorkQueue:
+    """
+    Work items on an Azure Storage queue (or Azurite). Messages are base64 encoded, as expected by the
+    Functions queue trigger.
+    """
+    def __init__(self, queue_name, connection_string="UseDevelopmentStorage=true", visibility_timeout=600):
+        """
+        :param visibility_timeout: Seconds a received message stays hidden before another worker may retry it.
+        """
+        # Only needed in distributed mode, so not imported with the workflow
+        from azure.storage.queue import QueueClient, TextBase64DecodePolicy, TextBase64EncodePolicy
+
+        self.queue_name = queue_name
+        self.visibility_timeout = visibility_timeout
+        self.queue_client = QueueClient.from_connection_string(
+            connection_string, queue_name,
+            message_encode_policy=TextBase64EncodePolicy(),
+            message_decode_policy=TextBase64DecodePolicy()
+        )
+
+    def create(self):
+        try:
+            self.queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+
+    def send(self, payload):
+        self.queue_client.send_message(json.dumps(payload))
+
+    def receive(self, max_messages=1):
+        """
+        :return: List of (message, payload); pass the message to delete() once it has been processed.
+        """
+        messages = self.queue_client.receive_messages(max_messages=max_messages, visibility_timeout=self.visibility_timeout)
+        return [(message, json.loads(message.content)) for message in messages]
+
+    def delete(self, message):
+        self.queue_client.delete_message(message)
+
+
+class LocalWorkQueue:
+    """
+    In-process queue with the same interface as AzureWorkQueue, for running distributed mode on one
+    machine without a storage emulator. Queues are shared by name within the process.
+    """
+    _queues = {}
+    _queues_lock = threading.Lock()
+
+    def __init__(self, queue_name, **kwargs):
+        self.queue_name = queue_name
+        with LocalWorkQueue._queues_lock:
+            self._queue = LocalWorkQueue._queues.setdefault(queue_name, queue.Queue())
+
+    def create(self):
+        pass
+
+    def send(self, payload):
+        # Round-trip through JSON so payloads look exactly like the ones received from a real queue
+        self._queue.put((uuid.uuid4().hex, json.dumps(payload)))
+
+    def receive(self, max_messages=1):
+        received = []
+        while len(received) < max_messages:
+            try:
+                message_id, content = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            received.append(((message_id, content), json.loads(content)))
+        return received
+
+    def delete(self, message):
+        pass
+
+    def release(self, message):
+        # Failed messages become visible again, like an expired visibility timeout
+        self._queue.put(message)
+
+
+def get_work_queue(distributed_config):
+    """
+    :param distributed_config: The "distributed" section of settings.json.
+    """
+    queue_name = distributed_config.get("queue_name", "azure-workflow-work-items")
+    backend = distributed_config.get("queue_backend", "azure")
+    if backend == "local":
+        return LocalWorkQueue(queue_name)
+    if backend == "azure":
+        return AzureWorkQueue(queue_name,
+                              connection_string=distributed_config.get("queue_connection_string", "UseDevelopmentStorage=true"),
+                              visibility_timeout=distributed_config.get("visibility_timeout", 600))
+    raise ValueError(f"Unsupported queue backend: {backend}")
+
+
+def drain_work_queue(work_queue, handler, max_workers=1, max_attempts=5):
+    """
+    Process queued work items until the queue is empty, without the Functions host; used with Azurite
+    or the local backend. Messages whose handler fails are left for a retry (after the visibility timeout
+    on Azure queues) and dropped after max_attempts.
+    :param handler: Called with each payload.
+    :return: Number of work items processed successfully.
+    """
+    attempts = {}
+    processed = 0
+    lock = threading.Lock()
+
+    def work():
+        nonlocal processed
+        while True:
+            received = work_queue.receive(max_messages=1)
+            if not received:
+                return
+            message, payload = received[0]
+            try:
+                handler(payload)
+                work_queue.delete(message)
+                with lock:
+                    processed += 1
+            except Exception as e:
+                key = json.dumps(payload, sort_keys=True)
+                with lock:
+                    attempts[key] = attempts.get(key, 0) + 1
+                    give_up = attempts[key] >= max_attempts
+                logger.error(f"Work item {payload} failed (attempt {attempts[key]}): {e}")
+                if give_up:
+                    work_queue.delete(message)
+                elif isinstance(work_queue, LocalWorkQueue):
+                    work_queue.release(message)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="queue-worker") as executor:
+        for future in [executor.submit(work) for _ in range(max_workers)]:
+            future.result()
+    return processed
@@ -0,0 +1,460 @@
+import asyncio
+from datetime import datetime
+
+from transitions.extensions.asyncio import AsyncMachine, AsyncState
+
+from config.config import AzureConfig
+from utils.async_azure_blob_client import AsyncAzureBlobClient
+from utils.async_azure_subscription_client import AsyncAzureSubscriptionClient
+from utils.azure_blob_client import AzureBlobClient
+from utils.azure_checkpoint_store import AzureCheckpointStore
+from utils.azure_resource_store import DATE_FORMAT, AzureResourceStore, DatedPageStore
+from utils.azure_subscription_client import AzureSubscriptionClient, MAX_SUBSCRIPTIONS_PER_QUERY
+from utils.azure_watermark_manager import AzureWatermarkManager
+from shared.metrics import measure_run, timed
+from shared.resource_registry import ResourceRegistry
+from utils.handle_error import handle_errors
+from utils.logger_setup import setup_logger
+from utils.query_profiles import DEFAULT_PROFILE, get_query_profiles
+from utils.resource_delta import ResourceDeltaApplier
+from utils.serializers import get_serializer
+from utils.save_response import generate_filename, get_subscription_path_container_name, \
+    get_resource_path_container_name
+from workflow.azure_workflow import build_work_items
+
+logger = setup_logger(name="AsyncAzureWorkflow")
+
+# Settings sections whose behaviour only AzureWorkflow implements; enabling one fails the async run at start
+SYNC_ONLY_SETTINGS = ("partitioned_snapshot", "compaction", "scheduling", "distributed")
+
+class AsyncAzureWorkflow:
+    """
+    asyncio execution mode of AzureWorkflow. Subscriptions run as concurrent tasks and page uploads are
+    scheduled as tasks too, so the next Resource Graph page is requested while earlier pages are still
+    being merged and uploaded. Must be created from inside a running event loop.
+    Change runs, and full scans of the "indexed" storage layout, go through the same resource stores and
+    ResourceDeltaApplier as AzureWorkflow, on worker threads with the sync clients. Settings in
+    SYNC_ONLY_SETTINGS are rejected when the workflow starts.
+    """
+    states = [
+        AsyncState(name="start", on_enter="on_start"),
+        AsyncState(name="fetch_subscriptions", on_enter="on_fetch_subscriptions"),
+        AsyncState(name="upload_subscriptions", on_enter="on_upload_subscriptions"),
+        AsyncState(name="fetch_resources", on_enter="on_fetch_resources"),
+        AsyncState(name="upload_resources", on_enter="on_upload_resources"),
+        AsyncState(name="end", on_enter="on_end"),
+    ]
+
+    def __init__(self):
+        self.subscriptions_data = None
+        self.machine = None
+        self.run_summary = {}
+        self.config = AzureConfig().get_config()
+
+        self.blob_client = AsyncAzureBlobClient()
+        # The resource stores and the delta applier run on worker threads with the sync clients
+        self.store_blob_client = AzureBlobClient()
+        self.store_subscription_client = AzureSubscriptionClient()
+        self.container_name = self.config["container_name_azure"]
+        root_folder_name = self.config["folder_raw_data"]
+        self.subscription_path_container_name = get_subscription_path_container_name(root_folder_name=root_folder_name, container_name=self.container_name)
+        self.resource_path_container_name = get_resource_path_container_name(root_folder_name=root_folder_name, container_name=self.container_name)
+        self.subscription_client = AsyncAzureSubscriptionClient()
+        self.empty_resource_subscriptions = []
+        self.records_per_page = self.config["records_per_page"]
+        self.serializer = get_serializer(self.config.get("output_format", "json"))
+        self.max_concurrent_subscriptions = max(1, self.config.get("max_concurrent_subscriptions", 1))
+        self.max_concurrent_uploads = max(1, self.config.get("max_concurrent_uploads", 8))
+        self.subscriptions_per_query = min(max(1, self.config.get("subscriptions_per_query", 1)),
+                                           MAX_SUBSCRIPTIONS_PER_QUERY)
+        self.batch_records_per_page = self.config.get("batch_records_per_page", 1000)
+        self.storage_layout = self.config.get("storage_layout", "pages")
+        self.shard_size = self.config.get("shard_size", 1000)
+        self.delta_apply_property_changes = self.config.get("delta_apply_property_changes", True)
+        self.query_profiles = get_query_profiles(self.config)
+        # Date the resource pages of the run are written under; a resumed run keeps the one it started with
+        self.date_label = datetime.now().strftime(DATE_FORMAT)
+        self.watermark_manager = None
+        self.checkpoint_store = None
+
+        # Initialize the state machine
+        self.machine = AsyncMachine(
+            model=self,
+            states=AsyncAzureWorkflow.states,
+            initial="start",
+            transitions=[
+                {"trigger": "start_workflow", "source": "start", "dest": "fetch_subscriptions"},
+                {"trigger": "fetch_subscriptions_done", "source": "fetch_subscriptions",
+                 "dest": "upload_subscriptions"},
+                {"trigger": "upload_subscriptions_done", "source": "upload_subscriptions", "dest": "fetch_resources"},
+                {"trigger": "fetch_resources_done", "source": "fetch_resources", "dest": "upload_resources"},
+                {"trigger": "upload_resources_done", "source": "upload_resources", "dest": "end"},
+            ],
+        )
+
+    async def close(self, release_clients=False):
+        """
+        The aio clients are shared with later invocations on this event loop and stay open; release them
+        when the loop is about to end, e.g. under asyncio.run.
+        """
+        if release_clients:
+            await ResourceRegistry.get_instance().aclose()
+
+    async def on_start(self):
+
+        logger.info("Async workflow started.")
+
+        self._check_supported_settings()
+
+        # Every later state runs inside this call, so the run summary covers the whole workflow
+        with measure_run("workflow.run") as self.run_summary:
+            await self.blob_client.initialize_container(self.container_name)
+
+            # The watermark is a single small blob read once per run; the sync manager is reused off the loop
+            self.watermark_manager = await asyncio.to_thread(AzureWatermarkManager, container_name=self.container_name)
+
+            checkpoint_config = self.config.get("checkpoint", {})
+            if checkpoint_config.get("enabled", False):
+                self.checkpoint_store = await asyncio.to_thread(AzureCheckpointStore, container_name=self.container_name,
+                                                                lease_seconds=checkpoint_config.get("lease_seconds", 300),
+                                                                flush_seconds=checkpoint_config.get("flush_seconds", 30),
+                                                                max_run_attempts=checkpoint_config.get("max_run_attempts", 3),
+                                                                max_run_age_seconds=checkpoint_config.get(
+                                                                    "max_run_age_seconds", 6 * 3600))
+
+            # noinspection PyUnresolvedReferences
+            await self.start_workflow()  # Trigger the next state event
+
+    def _check_supported_settings(self):
+        """
+        Fail fast on settings the async workflow would otherwise ignore.
+        """
+        unsupported = [name for name in SYNC_ONLY_SETTINGS if self.config.get(name, {}).get("enabled", False)]
+        if self.config.get("page_merge", "stream") != "stream":
+            unsupported.append(f"page_merge \"{self.config['page_merge']}\"")
+        if unsupported:
+            raise ValueError(f"Settings not supported by the async workflow: {', '.join(unsupported)}. "
+                             f"Disable them or use the main entry point.")
+
+    @timed("workflow.fetch_subscriptions")
+    @handle_errors
+    async def on_fetch_subscriptions(self):
+
+        logger.info("Fetching subscriptions...")
+
+        try:
+            self.subscriptions_data = await self.subscription_client.fetch_subscriptions()
+
+            if not self.subscriptions_data:
+
+                logger.warning("No subscription data found or the request failed.")
+
+                raise ValueError("No subscription data found or the request failed.")
+
+            logger.info("Fetched subscription data successfully.")
+
+            # noinspection PyUnresolvedReferences
+            await self.fetch_subscriptions_done()  # Trigger the next state event
+
+        except Exception as e:
+            raise RuntimeError(f"Error in fetch subscriptions: {str(e)}") from e
+
+    @timed("workflow.upload_subscriptions")
+    @handle_errors
+    async def on_upload_subscriptions(self):
+
+        logger.info("Uploading subscriptions...")
+
+        formatted_response = {
+            "value": self.subscriptions_data
+        }
+
+        try:
+
+            await self.blob_client.upload_data_to_blob(
+                container_name=self.subscription_path_container_name,
+                blob_name=generate_filename('subscription', extension=self.serializer.extension),
+                json_data=formatted_response,
+                serializer=self.serializer)
+
+            # noinspection PyUnresolvedReferences
+            await self.upload_subscriptions_done()  # Trigger the next state event
+
+        except Exception as e:
+            logger.error(f"Failed to upload subscription data to Blob Storage: {str(e)}")
+            raise RuntimeError(f"Error uploading subscription data: {str(e)}") from e
+
+    @timed("workflow.fetch_resources")
+    @handle_errors
+    async def on_fetch_resources(self):
+
+        logger.info("Fetching resources...")
+
+        current_execution_time = datetime.utcnow().isoformat()
+
+        if self.checkpoint_store is not None:
+            # An unfinished run is resumed with its original end time
+            run = await asyncio.to_thread(self.checkpoint_store.start_run, self.watermark_manager.get_watermark(),
+                                          current_execution_time, self.date_label)
+            current_execution_time = run["current_execution_time"]
+            self.date_label = run.get("date_label") or self.date_label
+
+        subscription_ids = []
+        for subscription in self.subscriptions_data:
+
+            subscription_id = subscription.get("subscription_id")
+
+            if not subscription_id:
+                logger.warning("Subscription ID is null or empty.")
+                continue
+
+            subscription_ids.append(subscription_id)
+
+        # Checkpoints are kept per subscription here; pages are uploaded out of order, so there is no page to resume from
+        pending_subscription_ids = subscription_ids
+        if self.checkpoint_store is not None:
+            # Work items are claimed when a task starts on them
+            pending_subscription_ids = self.checkpoint_store.pending(subscription_ids)
+            skipped = len(subscription_ids) - len(pending_subscription_ids)
+            if skipped:
+                logger.info(f"Skipping {skipped} subscriptions already completed or claimed by another invocation.")
+
+        # Each subscription fetches changes since its own watermark, or everything when it has none
+        watermarks = {subscription_id: self.watermark_manager.get_watermark(subscription_id)
+                      for subscription_id in pending_subscription_ids}
+        full_scans = sum(1 for watermark in watermarks.values() if not watermark)
+        logger.info(f"{len(watermarks) - full_scans} subscriptions fetch changes since their watermark, "
+                    f"{full_scans} have none yet and fetch all resources.")
+
+        work_items = build_work_items(pending_subscription_ids, watermarks, self.subscriptions_per_query)
+        logger.info(f"Processing {len(pending_subscription_ids)} subscriptions in {len(work_items)} work items "
+                    f"with {self.max_concurrent_subscriptions} concurrent tasks.")
+
+        subscription_semaphore = asyncio.Semaphore(self.max_concurrent_subscriptions)
+        upload_semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+
+        async def run_work_item(work_item, time_diff_hours):
+            async with subscription_semaphore:
+                if self.checkpoint_store is not None:
+                    work_item = await asyncio.to_thread(self.checkpoint_store.claim, work_item)
+                    if not work_item:
+                        return []
+                await self._process_work_item(work_item, time_diff_hours, upload_semaphore)
+            if self.checkpoint_store is not None:
+                await asyncio.to_thread(self.checkpoint_store.mark_completed, work_item)
+            return work_item
+
+        # One failing work item must not cancel the others
+        results = await asyncio.gather(*(run_work_item(work_item, time_diff_hours) for work_item, time_diff_hours in work_items),
+                                       return_exceptions=True)
+
+        failed_subscriptions = {}
+        processed_subscription_ids = set()
+        for (work_item, _), result in zip(work_items, results):
+            if isinstance(result, Exception):
+                for subscription_id in work_item:
+                    logger.error(f"Failed to process resources for subscription ID {subscription_id}: {str(result)}")
+                    failed_subscriptions[subscription_id] = str(result)
+            else:
+                processed_subscription_ids.update(result)
+
+        if self.empty_resource_subscriptions:
+            logger.info("subscriptions with empty resource responses")
+            for index, value in enumerate(self.empty_resource_subscriptions, start=1):
+                logger.info(f"{index}: {value}")
+
+        succeeded_subscription_ids = [subscription_id for subscription_id in pending_subscription_ids
+                                      if subscription_id in processed_subscription_ids]
+
+        if failed_subscriptions:
+            if self.checkpoint_store is not None:
+                await asyncio.to_thread(self.checkpoint_store.mark_failed, failed_subscriptions)
+            # Healthy subscriptions move on; the failed ones keep the watermark they started from and are
+            # picked up again next run
+            progress = {subscription_id: watermarks[subscription_id] for subscription_id in failed_subscriptions
+                        if watermarks.get(subscription_id)}
+            progress.update({subscription_id: current_execution_time for subscription_id in succeeded_subscription_ids})
+            await asyncio.to_thread(self.watermark_manager.update_subscription_watermarks, progress)
+            raise RuntimeError(
+                f"Error in fetch resources: {len(failed_subscriptions)} of {len(subscription_ids)} subscriptions failed: "
+                f"{', '.join(failed_subscriptions)}")
+
+        if self.checkpoint_store is None or await asyncio.to_thread(self.checkpoint_store.run_completed, subscription_ids):
+            await asyncio.to_thread(self.watermark_manager.update_subscription_watermarks,
+                                    {subscription_id: current_execution_time for subscription_id in subscription_ids},
+                                    current_execution_time)
+            if self.checkpoint_store is not None:
+                await asyncio.to_thread(self.checkpoint_store.clear)
+        else:
+            if succeeded_subscription_ids:
+                await asyncio.to_thread(self.watermark_manager.update_subscription_watermarks,
+                                        {subscription_id: current_execution_time for subscription_id in succeeded_subscription_ids})
+            logger.info("Other invocations are still processing subscriptions of this run; "
+                        "the last one to finish advances the run watermark.")
+
+        # noinspection PyUnresolvedReferences
+        await self.fetch_resources_done()
+
+    async def _process_work_item(self, subscription_ids, time_diff_hours, upload_semaphore):
+        # Every query profile of the run scans the work item before it counts as completed
+        for profile in self.query_profiles:
+            await self._process_work_item_profile(subscription_ids, time_diff_hours, upload_semaphore, profile)
+
+    async def _process_work_item_profile(self, subscription_ids, time_diff_hours, upload_semaphore, profile):
+        """
+        Fetch pages for one subscription (or one query batch) and upload them as separate tasks, so the
+        next page request overlaps with the merge and upload of the previous ones.
+        """
+        logger.info(f"Fetching resources for subscriptions: {', '.join(subscription_ids)} (query profile {profile.name})")
+        container_name = profile.container_name(self.resource_path_container_name)
+
+        page_numbers = {subscription_id: 0 for subscription_id in subscription_ids}
+        pending_rows = {subscription_id: [] for subscription_id in subscription_ids}
+        records_per_page = self.records_per_page if len(subscription_ids) == 1 else self.batch_records_per_page
+        upload_tasks = []
+        resource_stores = {subscription_id: await asyncio.to_thread(self._open_resource_store, subscription_id,
+                                                                    time_diff_hours, profile)
+                           for subscription_id in subscription_ids}
+        for subscription_id, resource_store in resource_stores.items():
+            if resource_store is None:
+                # Full scans start on a clean date; there is no page progress to resume from here
+                await asyncio.to_thread(self._dated_page_store(subscription_id, profile).start_full_scan)
+
+        async def store_and_release(subscription_id, page_number, page_data):
+            try:
+                await self._store_resource_page(subscription_id, page_number, page_data, container_name)
+            finally:
+                upload_semaphore.release()
+
+        async def schedule(subscription_id, page_data):
+            if resource_stores[subscription_id] is not None:
+                # Changes are collected and applied once the subscription is complete
+                page_numbers[subscription_id] += 1
+                await asyncio.to_thread(resource_stores[subscription_id].add_page, page_data)
+                return
+            # Acquire before creating the task so fetching stalls once max_concurrent_uploads pages are in flight
+            await upload_semaphore.acquire()
+            page_numbers[subscription_id] += 1
+            upload_tasks.append(asyncio.create_task(
+                store_and_release(subscription_id, page_numbers[subscription_id], page_data)))
+
+        async def flush(subscription_id, final=False):
+            rows = pending_rows[subscription_id]
+            while len(rows) >= self.records_per_page or (final and rows):
+                await schedule(subscription_id, rows[:self.records_per_page])
+                rows = rows[self.records_per_page:]
+            pending_rows[subscription_id] = rows
+
+        try:
+            async for resources_page_data in self.subscription_client.get_resources_for_subscriptions_paginated(
+                    subscription_ids, records_per_page, time_diff_hours, profile=profile):
+
+                if self.checkpoint_store is not None and self.checkpoint_store.flush_due():
+                    # No page progress is recorded here; the flush keeps the leases of the work item
+                    await asyncio.to_thread(self.checkpoint_store.flush)
+
+                if len(subscription_ids) == 1:
+                    if resources_page_data:
+                        await schedule(subscription_ids[0], resources_page_data)
+                    continue
+
+                # Split batched rows back out by subscription, keeping the per-subscription page layout
+                for row in resources_page_data:
+                    subscription_id = row.get("subscriptionId")
+                    if subscription_id not in pending_rows:
+                        logger.warning(f"Skipping row for unexpected subscription ID: {subscription_id}.")
+                        continue
+                    pending_rows[subscription_id].append(row)
+
+                for subscription_id in subscription_ids:
+                    await flush(subscription_id)
+
+            for subscription_id in subscription_ids:
+                await flush(subscription_id, final=True)
+
+        finally:
+            # Always wait for scheduled uploads so no task outlives the work item
+            results = await asyncio.gather(*upload_tasks, return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise RuntimeError(f"Error fetching resource data: {str(result)}") from result
+
+        for subscription_id in subscription_ids:
+            await asyncio.to_thread(self._finish_resource_store, subscription_id, resource_stores[subscription_id],
+                                    profile)
+            # Listed once even when several query profiles come back empty
+            if page_numbers[subscription_id] == 0 and subscription_id not in self.empty_resource_subscriptions:
+                logger.warning(f"No resource data found for subscription ID: {subscription_id}. Skipping.")
+                self.empty_resource_subscriptions.append(subscription_id)
+
+    def _open_resource_store(self, subscription_id, time_diff_hours, profile=DEFAULT_PROFILE):
+        """
+        Blocking; see AzureWorkflow._open_resource_store.
+        :return: None when pages are merged in place, otherwise the store the pages are added to.
+        """
+        container_name = profile.container_name(self.resource_path_container_name)
+        if self.storage_layout != "indexed":
+            if time_diff_hours is None:
+                return None
+            resource_store = self._dated_page_store(subscription_id, profile)
+        else:
+            resource_store = AzureResourceStore(self.store_blob_client, container_name, subscription_id,
+                                                shard_size=self.shard_size, full_scan=time_diff_hours is None,
+                                                serializer=self.serializer)
+            if time_diff_hours is None:
+                return resource_store
+        return ResourceDeltaApplier(resource_store, self.store_subscription_client, subscription_id,
+                                    apply_property_changes=self.delta_apply_property_changes, profile=profile)
+
+    def _finish_resource_store(self, subscription_id, resource_store, profile=DEFAULT_PROFILE):
+        # Blocking; see AzureWorkflow._finish_resource_store
+        if resource_store is not None:
+            resource_store.finish()
+            return
+        self._dated_page_store(subscription_id, profile).mark_full_scan()
+
+    def _dated_page_store(self, subscription_id, profile=DEFAULT_PROFILE):
+        return DatedPageStore(self.store_blob_client, profile.container_name(self.resource_path_container_name),
+                              subscription_id, self.records_per_page, serializer=self.serializer,
+                              date_label=self.date_label)
+
+    @timed("workflow.write_page")
+    async def _store_resource_page(self, subscription_id, page_number, resources_page_data, container_name):
+        blob_name = generate_filename(f'resource_{subscription_id}', page_number=page_number,
+                                      extension=self.serializer.extension, date_label=self.date_label)
+
+        try:
+            existing_blob_data = await self.blob_client.read_blob_file(
+                container_name=container_name,
+                blob_name=blob_name
+            )
+
+            if existing_blob_data is not None:
+                merged_resources = self.watermark_manager.merge_resources(existing_blob_data['value'], resources_page_data)
+            else:
+                logger.info("Blob file does not exist or could not be read; replace merged_resources with recent data.")
+                merged_resources = resources_page_data
+
+        except Exception as e:
+            logger.info(f"Error while fetching existing resource data for blob: {blob_name}. Starting fresh.")
+            raise RuntimeError(f"Error while fetching existing resource data: {str(e)}") from e
+
+        await self.blob_client.upload_data_to_blob(
+            container_name=container_name,
+            blob_name=blob_name,
+            json_data={"value": merged_resources},
+            serializer=self.serializer
+        )
+        logger.info(f"Page {page_number} uploaded successfully for subscription ID {subscription_id}.")
+
+    @timed("workflow.upload_resources")
+    @handle_errors
+    async def on_upload_resources(self):
+        # noinspection PyUnresolvedReferences
+        await self.upload_resources_done()  # Trigger the next state event
+
+    async def on_end(self):
+        upload_counts = self.blob_client.upload_counts
+        logger.info(f"Blob uploads: {upload_counts['written']} written, {upload_counts['skipped']} skipped as unchanged.")
+        logger.info("Workflow completed successfully!")
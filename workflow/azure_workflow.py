@@ -1,20 +1,63 @@
-import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-from azure.functions import HttpResponse
+from azure.core.exceptions import HttpResponseError
 from transitions import Machine, State
 
 from config.config import AzureConfig
+from shared.prefetch import prefetch
 from utils.azure_blob_client import AzureBlobClient
-from utils.azure_subscription_client import AzureSubscriptionClient
+from utils.azure_checkpoint_store import AzureCheckpointStore
+from utils.azure_resource_store import DATE_FORMAT, AzureResourceStore, DatedPageStore
+from utils.azure_run_history import AzureRunHistory
+from utils.azure_subscription_client import AzureSubscriptionClient, MAX_SUBSCRIPTIONS_PER_QUERY
 from utils.azure_watermark_manager import AzureWatermarkManager
+from utils.resource_delta import ResourceDeltaApplier
+from utils.resource_table import ResourceTable
+from shared.metrics import increment, measure_run, timed
 from utils.handle_error import handle_errors
 from utils.logger_setup import setup_logger
+from utils.query_profiles import DEFAULT_PROFILE, get_query_profiles
+from utils.serializers import get_serializer
+from utils.snapshot_compactor import SnapshotCompactor
+from utils.subscription_scheduler import SubscriptionScheduler
+from utils.work_queue import LocalWorkQueue, drain_work_queue, get_work_queue
 from utils.save_response import generate_filename, get_subscription_path_container_name, \
     get_resource_path_container_name
 
 logger = setup_logger(name="AzureWorkflow")
 
+
+def time_diff_hours_since(watermark):
+    """
+    :return: Hours since the watermark, or None (full scan) when there is none.
+    """
+    if not watermark:
+        return None
+    return (datetime.utcnow() - datetime.fromisoformat(watermark)).total_seconds() / 3600
+
+
+def build_work_items(subscription_ids, watermarks, batch_size):
+    """
+    Group subscriptions into query batches of at most batch_size. Full scans and change queries are never
+    mixed in a batch, and change queries are batched with subscriptions of similar watermarks; a batch
+    fetches changes since its oldest watermark.
+    :param watermarks: Dictionary of subscription id to watermark (None when it has none).
+    :return: List of (subscription id list, time_diff_hours).
+    """
+    full_scan_ids = [subscription_id for subscription_id in subscription_ids if not watermarks.get(subscription_id)]
+    incremental_ids = sorted((subscription_id for subscription_id in subscription_ids if watermarks.get(subscription_id)),
+                             key=lambda subscription_id: datetime.fromisoformat(watermarks[subscription_id]))
+
+    work_items = [(full_scan_ids[i:i + batch_size], None) for i in range(0, len(full_scan_ids), batch_size)]
+    for i in range(0, len(incremental_ids), batch_size):
+        batch = incremental_ids[i:i + batch_size]
+        work_items.append((batch, time_diff_hours_since(watermarks[batch[0]])))
+    return work_items
+
+
 class AzureWorkflow:
     states = [
         State(name="start", on_enter="on_start"),
@@ -22,12 +65,14 @@ class AzureWorkflow:
         State(name="upload_subscriptions", on_enter="on_upload_subscriptions"),
         State(name="fetch_resources", on_enter="on_fetch_resources"),
         State(name="upload_resources", on_enter="on_upload_resources"),
+        State(name="compact_resources", on_enter="on_compact_resources"),
         State(name="end", on_enter="on_end"),
     ]
 
     def __init__(self):
         self.subscriptions_data = None
         self.machine = None
+        self.run_summary = {}
         self.config = AzureConfig().get_config()
 
         self.blob_client = AzureBlobClient()
@@ -41,10 +86,54 @@ class AzureWorkflow:
         self.resources = []
         self.empty_resource_subscriptions = []
         self.records_per_page = self.config["records_per_page"]
+        self.serializer = get_serializer(self.config.get("output_format", "json"))
+        self.max_concurrent_subscriptions = max(1, self.config.get("max_concurrent_subscriptions", 1))
+        self.subscriptions_per_query = min(max(1, self.config.get("subscriptions_per_query", 1)),
+                                           MAX_SUBSCRIPTIONS_PER_QUERY)
+        self.batch_records_per_page = self.config.get("batch_records_per_page", 1000)
+        self.pipeline_prefetch_pages = self.config.get("pipeline_prefetch_pages", 0)
+        self.storage_layout = self.config.get("storage_layout", "pages")
+        self.page_merge = self.config.get("page_merge", "stream")
+        self.shard_size = self.config.get("shard_size", 1000)
+        self.delta_apply_property_changes = self.config.get("delta_apply_property_changes", True)
+        self.partitioned_snapshot = self.config.get("partitioned_snapshot", {})
+        self.query_profiles = get_query_profiles(self.config)
+        self.compaction = self.config.get("compaction", {})
+        # Date the resource pages of the run are written under; a resumed run keeps the one it started with
+        self.date_label = datetime.now().strftime(DATE_FORMAT)
+        self.run_stats = {}
+        self._lock = threading.Lock()
 
         # Initialize watermark manager
         self.watermark_manager = AzureWatermarkManager(container_name=container_name)
 
+        # Statistics of earlier runs, kept next to the watermarks, order the work items longest first
+        scheduling_config = self.config.get("scheduling", {})
+        self.run_history = None
+        if scheduling_config.get("enabled", False):
+            self.run_history = AzureRunHistory(container_name=container_name,
+                                               smoothing=scheduling_config.get("smoothing", 0.5))
+
+        # In distributed mode this invocation only queues work items; workers pick them up from the queue
+        distributed_config = self.config.get("distributed", {})
+        self.work_queue = None
+        if distributed_config.get("enabled", False):
+            self.work_queue = get_work_queue(distributed_config)
+
+        # Initialize the run checkpoint so a crashed or timed-out run can be resumed; distributed runs
+        # also use it to track which subscriptions the workers have completed
+        checkpoint_config = self.config.get("checkpoint", {})
+        self.checkpoint_store = None
+        if checkpoint_config.get("enabled", False) or self.work_queue is not None:
+            self.checkpoint_store = AzureCheckpointStore(container_name=container_name,
+                                                         lease_seconds=checkpoint_config.get("lease_seconds", 300),
+                                                         queued_lease_seconds=checkpoint_config.get("queued_lease_seconds", 3600),
+                                                         flush_pages=checkpoint_config.get("flush_pages", 10),
+                                                         flush_seconds=checkpoint_config.get("flush_seconds", 30),
+                                                         max_run_attempts=checkpoint_config.get("max_run_attempts", 3),
+                                                         max_run_age_seconds=checkpoint_config.get("max_run_age_seconds",
+                                                                                                   6 * 3600))
+
         # Initialize the state machine
         self.machine = Machine(
             model=self,
@@ -56,7 +145,8 @@ class AzureWorkflow:
                  "dest": "upload_subscriptions"},
                 {"trigger": "upload_subscriptions_done", "source": "upload_subscriptions", "dest": "fetch_resources"},
                 {"trigger": "fetch_resources_done", "source": "fetch_resources", "dest": "upload_resources"},
-                {"trigger": "upload_resources_done", "source": "upload_resources", "dest": "end"},
+                {"trigger": "upload_resources_done", "source": "upload_resources", "dest": "compact_resources"},
+                {"trigger": "compact_resources_done", "source": "compact_resources", "dest": "end"},
             ],
         )
 
@@ -64,9 +154,12 @@ class AzureWorkflow:
 
         logger.info("Workflow started.")
 
-        # noinspection PyUnresolvedReferences
-        self.start_workflow()  # Trigger the next state event
+        # Every later state runs inside this call, so the run summary covers the whole workflow
+        with measure_run("workflow.run") as self.run_summary:
+            # noinspection PyUnresolvedReferences
+            self.start_workflow()  # Trigger the next state event
 
+    @timed("workflow.fetch_subscriptions")
     @handle_errors
     def on_fetch_subscriptions(self):
 
@@ -90,6 +183,7 @@ class AzureWorkflow:
         except Exception as e:
             raise RuntimeError(f"Error in fetch subscriptions: {str(e)}") from e
 
+    @timed("workflow.upload_subscriptions")
     @handle_errors
     def on_upload_subscriptions(self):
 
@@ -106,8 +200,9 @@ class AzureWorkflow:
 
             self.blob_client.upload_data_to_blob(
                 container_name=self.subscription_path_container_name,
-                blob_name=generate_filename('subscription'),
-                json_data=formatted_response)
+                blob_name=generate_filename('subscription', extension=self.serializer.extension),
+                json_data=formatted_response,
+                serializer=self.serializer)
 
             # noinspection PyUnresolvedReferences
             self.upload_subscriptions_done()  # Trigger the next state event
@@ -116,29 +211,24 @@ class AzureWorkflow:
             logger.error(f"Failed to upload subscription data to Blob Storage: {str(e)}")
             raise RuntimeError(f"Error uploading subscription data: {str(e)}") from e
 
+    @timed("workflow.fetch_resources")
     @handle_errors
     def on_fetch_resources(self):
 
         logger.info("Fetching resources...")
 
-        # Fetch the last execution time from the watermark
-        last_execution_time = self.watermark_manager.get_watermark()
-
-        time_diff_hours = None
-
-        if last_execution_time:
-            last_execution_time = datetime.fromisoformat(last_execution_time)
-            time_diff_hours = (datetime.utcnow() - last_execution_time).total_seconds() / 3600
-
-            logger.info(f"Last execution time: {last_execution_time}, fetching changes since {time_diff_hours} hours.")
+        # Current execution time, saved as the watermark of every subscription processed successfully
+        current_execution_time = datetime.utcnow().isoformat()
 
-        else:
-            logger.info("No previous execution time found. Fetching all resources.")
-
-        # Update the current execution time in the watermark
-        current_execution_time = datetime.utcnow()
+        run = None
+        if self.checkpoint_store is not None:
+            # An unfinished run is resumed with its original end time
+            run = self.checkpoint_store.start_run(self.watermark_manager.get_watermark(), current_execution_time,
+                                                  self.date_label)
+            current_execution_time = run["current_execution_time"]
+            self.date_label = run.get("date_label") or self.date_label
 
-        # Process resources for each subscription
+        subscription_ids = []
         for subscription in self.subscriptions_data:
 
             subscription_id = subscription.get("subscription_id")
@@ -147,79 +237,542 @@ class AzureWorkflow:
                 logger.warning("Subscription ID is null or empty.")
                 continue
 
-            logger.info(f"Fetching resources for subscription: {subscription_id}")
-
-            try:
-                # Fetch resources for the given subscription with pagination
-                for page_number, resources_page_data in enumerate(
-                        self.subscription_client.get_resources_for_subscription_paginated(subscription_id, self.records_per_page, time_diff_hours), start=1):
-
-                    logger.info(f"Fetched resources for subscription ID: {subscription_id} successfully.")
-
-                    if not resources_page_data:
-                        logger.warning(f"No resource data found for subscription ID: {subscription_id}. Skipping.")
-
-                        self.empty_resource_subscriptions.append(subscription_id)
-                        continue  # Skip to the next iteration if no resources are found
-
-                    try:
-                        # Generate a unique blob name with page number
-                        blob_name = generate_filename(f'resource_{subscription_id}', page_number=page_number)
-
-                        try:
-                            existing_blob_data = self.blob_client.read_blob_file(
-                                container_name=self.resource_path_container_name,
-                                blob_name=blob_name
-                            )
-
-                            if existing_blob_data is not None:
-
-                                existing_resources = existing_blob_data['value']
-
-                                # Compare and merge resources
-                                merged_resources = self.watermark_manager.merge_resources(existing_resources, resources_page_data)
+            subscription_ids.append(subscription_id)
 
-                            else:
-                                logger.info("Blob file does not exist or could not be read; replace merged_resources with recent data.")
-                                merged_resources = resources_page_data
-
-                        except Exception as e:
-                            logger.info(f"Error while fetching existing resource data for blob: {blob_name}. Starting fresh.")
-                            raise RuntimeError(f"Error while fetching existing resource data: {str(e)}") from e
-
-                        formatted_response = {"value": merged_resources}
-
-                        # Upload the current page to Blob Storage
-                        self.blob_client.upload_data_to_blob(
-                            container_name=self.resource_path_container_name,
-                            blob_name=blob_name,
-                            json_data=formatted_response
-                        )
-                        logger.info(f"Page {page_number} uploaded successfully for subscription ID {subscription_id}.")
+        if self.work_queue is not None:
+            self._enqueue_work_items(run, subscription_ids)
+            # noinspection PyUnresolvedReferences
+            self.fetch_resources_done()
+            return
+
+        pending_subscription_ids = subscription_ids
+        if self.checkpoint_store is not None:
+            # Work items are claimed when a worker picks them up
+            pending_subscription_ids = self.checkpoint_store.pending(subscription_ids)
+            skipped = len(subscription_ids) - len(pending_subscription_ids)
+            if skipped:
+                logger.info(f"Skipping {skipped} subscriptions already completed or claimed by another invocation.")
+
+        # Each subscription fetches changes since its own watermark, or everything when it has none
+        watermarks = {subscription_id: self.watermark_manager.get_watermark(subscription_id)
+                      for subscription_id in pending_subscription_ids}
+        full_scans = sum(1 for watermark in watermarks.values() if not watermark)
+        logger.info(f"{len(watermarks) - full_scans} subscriptions fetch changes since their watermark, "
+                    f"{full_scans} have none yet and fetch all resources.")
+
+        # Process subscriptions in parallel; each worker owns one subscription (or one query batch) end to end
+        failed_subscriptions = {}
+        processed_subscription_ids = []
+        work_items = self._build_work_items(pending_subscription_ids, watermarks)
+        logger.info(f"Processing {len(pending_subscription_ids)} subscriptions in {len(work_items)} work items "
+                    f"with {self.max_concurrent_subscriptions} workers.")
+        if self.run_history is not None:
+            _, makespan = self._scheduler().pack(work_items, self.max_concurrent_subscriptions)
+            logger.info(f"Expected duration of the work items from earlier runs: {makespan:.1f} seconds.")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_subscriptions,
+                                thread_name_prefix="subscription") as executor:
+            futures = {
+                executor.submit(self._process_work_item, work_item, time_diff_hours): work_item
+                for work_item, time_diff_hours in work_items
+            }
+            for future in as_completed(futures):
+                work_item = futures[future]
+                try:
+                    processed_subscription_ids.extend(future.result())
+                except Exception as e:
+                    for subscription_id in work_item:
+                        logger.error(f"Failed to process resources for subscription ID {subscription_id}: {str(e)}")
+                        failed_subscriptions[subscription_id] = str(e)
+
+        # Log subscriptions with empty resource responses at the end
+        if self.empty_resource_subscriptions:
+            logger.info("subscriptions with empty resource responses")
+            for index, value in enumerate(self.empty_resource_subscriptions, start=1):
+                logger.info(f"{index}: {value}")
+
+        succeeded_subscription_ids = [subscription_id for subscription_id in pending_subscription_ids
+                                      if subscription_id in processed_subscription_ids]
+        self._record_run_history(succeeded_subscription_ids)
+
+        if failed_subscriptions:
+            self._record_failures(failed_subscriptions, succeeded_subscription_ids, watermarks, current_execution_time)
+            raise RuntimeError(
+                f"Error in fetch resources: {len(failed_subscriptions)} of {len(subscription_ids)} subscriptions failed: "
+                f"{', '.join(failed_subscriptions)}")
+
+        self._record_completion(subscription_ids, succeeded_subscription_ids, current_execution_time)
 
-                    except Exception as e:
-                        logger.error(f"Failed to fetch resource data: {str(e)}")
-                        raise RuntimeError(f"Error fetching resource data: {str(e)}") from e
+        # noinspection PyUnresolvedReferences
+        self.fetch_resources_done()
+
+    def _record_failures(self, failed_subscriptions, succeeded_subscription_ids, watermarks, current_execution_time):
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.mark_failed(failed_subscriptions)
+        # Healthy subscriptions move on; the failed ones keep the watermark they started from and are
+        # picked up again next run
+        progress = {subscription_id: watermarks[subscription_id] for subscription_id in failed_subscriptions
+                    if watermarks.get(subscription_id)}
+        progress.update({subscription_id: current_execution_time for subscription_id in succeeded_subscription_ids})
+        self.watermark_manager.update_subscription_watermarks(progress)
+
+    def _record_completion(self, subscription_ids, succeeded_subscription_ids, current_execution_time):
+        """
+        Fan-in: advance the watermarks of the succeeded subscriptions; whoever finds every subscription of
+        the run completed advances all of them and the run watermark, and removes the checkpoint.
+        :param subscription_ids: Subscriptions of the run; None for every subscription in the checkpoint.
+        """
+        if self.checkpoint_store is None or self.checkpoint_store.run_completed(subscription_ids):
+            if subscription_ids is None:
+                subscription_ids = list(self.checkpoint_store.checkpoint["subscriptions"])
+            # Update the watermarks with the current execution time, including subscriptions completed by
+            # earlier attempts of a resumed run
+            self.watermark_manager.update_subscription_watermarks(
+                {subscription_id: current_execution_time for subscription_id in subscription_ids},
+                run_watermark=current_execution_time)
+            if self.checkpoint_store is not None:
+                self.checkpoint_store.clear()
+        else:
+            if succeeded_subscription_ids:
+                self.watermark_manager.update_subscription_watermarks(
+                    {subscription_id: current_execution_time for subscription_id in succeeded_subscription_ids})
+            logger.info("Other invocations are still processing subscriptions of this run; "
+                        "the last one to finish advances the run watermark.")
+
+    def _enqueue_work_items(self, run, subscription_ids):
+        """
+        Orchestrator step of distributed mode: queue the pending subscriptions of the run in batches; the
+        worker that completes the last batch advances the watermarks.
+        """
+        pending_subscription_ids = self.checkpoint_store.enqueue(subscription_ids)
+        skipped = len(subscription_ids) - len(pending_subscription_ids)
+        if skipped:
+            logger.info(f"Skipping {skipped} subscriptions already completed, queued or claimed by another invocation.")
+
+        # Watermarks only group the batches here; workers read them again when they pick a batch up
+        watermarks = {subscription_id: self.watermark_manager.get_watermark(subscription_id)
+                      for subscription_id in pending_subscription_ids}
+        work_items = self._build_work_items(pending_subscription_ids, watermarks)
+
+        self.work_queue.create()
+        for work_item, _ in work_items:
+            self.work_queue.send({"run_id": run["run_id"], "subscription_ids": work_item})
+        logger.info(f"Queued {len(pending_subscription_ids)} subscriptions in {len(work_items)} work items "
+                    f"for run {run['run_id']}.")
+
+        if not work_items:
+            # Nothing left to hand out; finish the run if the workers are already done with it
+            self._record_completion(subscription_ids, [], run["current_execution_time"])
+        elif isinstance(self.work_queue, LocalWorkQueue):
+            # An in-process queue is invisible to other instances, so work it off here
+            processed = drain_work_queue(self.work_queue, self.process_queued_work_item,
+                                         max_workers=self.max_concurrent_subscriptions)
+            if processed < len(work_items):
+                raise RuntimeError(
+                    f"Error in fetch resources: {len(work_items) - processed} of {len(work_items)} work items failed.")
+
+    @timed("workflow.work_item")
+    def process_queued_work_item(self, work_item):
+        """
+        Worker step of distributed mode: fetch, merge and upload the resources of one queued batch of
+        subscriptions, then fan in. Raises when a subscription fails so the queue retries the message.
+        :param work_item: Queue message payload {"run_id", "subscription_ids"}.
+        """
+        run = self.checkpoint_store.join_run(work_item["run_id"])
+        if run is None:
+            logger.warning(f"Run {work_item['run_id']} has already finished; dropping its work item.")
+            return
+        current_execution_time = run["current_execution_time"]
+        self.date_label = run.get("date_label") or self.date_label
+
+        subscription_ids = self.checkpoint_store.pending(work_item["subscription_ids"])
+        skipped = len(work_item["subscription_ids"]) - len(subscription_ids)
+        if skipped:
+            logger.info(f"Skipping {skipped} subscriptions already completed or claimed by another invocation.")
+
+        watermarks = {subscription_id: self.watermark_manager.get_watermark(subscription_id)
+                      for subscription_id in subscription_ids}
+        failed_subscriptions = {}
+        processed_subscription_ids = []
+        for batch, time_diff_hours in self._build_work_items(subscription_ids, watermarks):
+            try:
+                processed_subscription_ids.extend(self._process_work_item(batch, time_diff_hours))
+            except Exception as e:
+                for subscription_id in batch:
+                    logger.error(f"Failed to process resources for subscription ID {subscription_id}: {str(e)}")
+                    failed_subscriptions[subscription_id] = str(e)
+
+        succeeded_subscription_ids = [subscription_id for subscription_id in subscription_ids
+                                      if subscription_id in processed_subscription_ids]
+        self._record_run_history(succeeded_subscription_ids)
+        if failed_subscriptions:
+            self._record_failures(failed_subscriptions, succeeded_subscription_ids, watermarks, current_execution_time)
+            raise RuntimeError(
+                f"Error in work item: {len(failed_subscriptions)} of {len(subscription_ids)} subscriptions failed: "
+                f"{', '.join(failed_subscriptions)}")
+
+        # Even when nothing was claimed, e.g. a redelivered message, this may be the last batch of the run
+        self._record_completion(None, succeeded_subscription_ids, current_execution_time)
+
+    def _build_work_items(self, subscription_ids, watermarks):
+        """
+        Group subscriptions into the units handed to the worker pool, in the order they should start.
+        :return: List of (subscription id list, time_diff_hours); single-element lists when batching is disabled.
+        """
+        work_items = build_work_items(subscription_ids, watermarks, self.subscriptions_per_query)
+        if self.run_history is None:
+            return work_items
+        return self._scheduler().order(work_items)
+
+    def _scheduler(self):
+        return SubscriptionScheduler(self.run_history, self.subscriptions_data)
+
+    def _process_work_item(self, subscription_ids, time_diff_hours):
+        """
+        Claim the subscriptions of a work item and scan them with every query profile.
+        :return: The subscriptions processed: those this invocation claimed when the run is checkpointed.
+        """
+        if self.checkpoint_store is not None:
+            claimed = self.checkpoint_store.claim(subscription_ids)
+            if len(claimed) < len(subscription_ids):
+                logger.info(f"Skipping {len(subscription_ids) - len(claimed)} subscriptions claimed by another "
+                            f"invocation in the meantime.")
+            subscription_ids = claimed
+            if not subscription_ids:
+                return []
+
+        started = time.monotonic()
+        # Every query profile of the run scans the work item before it counts as completed
+        for profile in self.query_profiles:
+            if len(subscription_ids) == 1:
+                self._process_subscription(subscription_ids[0], time_diff_hours, profile)
+            else:
+                self._process_subscription_batch(subscription_ids, time_diff_hours, profile)
+        self._add_work_item_stats(subscription_ids, time_diff_hours is None,
+                                  duration_seconds=time.monotonic() - started)
+
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.mark_completed(subscription_ids)
+        return subscription_ids
+
+    def _pipeline(self, pages, label):
+        """
+        When pipelining is enabled, fetch pages on a producer thread that runs up to
+        pipeline_prefetch_pages ahead while the calling worker merges and uploads.
+        """
+        if self.pipeline_prefetch_pages <= 0:
+            return pages
+        return prefetch(pages, self.pipeline_prefetch_pages, name=f"fetch-{label}")
+
+    def _process_subscription(self, subscription_id, time_diff_hours, profile=DEFAULT_PROFILE):
+        """
+        Fetch, merge and upload every resource page of a single subscription.
+        Runs on a worker thread; pages of the subscription are handled in order.
+        """
+        logger.info(f"Fetching resources for subscription: {subscription_id} (query profile {profile.name})")
+
+        resource_store = self._open_resource_store(subscription_id, time_diff_hours, profile)
+
+        # Page-level resume needs the identical query and a layout where each page is stored on its own:
+        # full scans in the pages layout with a single query profile. Other runs resume at subscription granularity.
+        skip_token, last_page = None, 0
+        if (self.checkpoint_store is not None and resource_store is None and time_diff_hours is None
+                and len(self.query_profiles) == 1):
+            entry = self.checkpoint_store.get(subscription_id)
+            if entry is not None and entry.get("skip_token"):
+                skip_token, last_page = entry["skip_token"], entry["last_page"]
+                logger.info(f"Resuming subscription {subscription_id} after page {last_page}.")
+        if resource_store is None and skip_token is None:
+            self._dated_page_store(subscription_id, profile).start_full_scan()
 
-                # Update the watermark with the current execution time
-                self.watermark_manager.update_watermark(current_execution_time.isoformat())
+        try:
+            self._process_subscription_pages(subscription_id, time_diff_hours, resource_store, skip_token, last_page,
+                                             profile)
+        except HttpResponseError as e:
+            if skip_token is None or e.status_code != 400:
+                raise
+            # Skip tokens expire; the scan starts over on a clean date
+            logger.warning(f"Saved skip token for subscription {subscription_id} was rejected; restarting from the first page.")
+            self._dated_page_store(subscription_id, profile).start_full_scan()
+            self._process_subscription_pages(subscription_id, time_diff_hours, resource_store, None, 0, profile)
+
+        self._finish_resource_store(subscription_id, resource_store, profile)
+
+    def _process_subscription_pages(self, subscription_id, time_diff_hours, resource_store, skip_token, last_page,
+                                    profile=DEFAULT_PROFILE):
+        # Fetch resources for the given subscription with pagination
+        if time_diff_hours is None and skip_token is None and self.partitioned_snapshot.get("enabled", False):
+            # First sync: large subscriptions are scanned as concurrent partitions instead of one cursor
+            pages = self.subscription_client.get_resources_snapshot_partitioned(
+                subscription_id, self.records_per_page,
+                partition_by=self.partitioned_snapshot.get("partition_by", "type"),
+                partitions=self.partitioned_snapshot.get("partitions", 8),
+                max_concurrent_partitions=self.partitioned_snapshot.get("max_concurrent_partitions", 4),
+                min_resources=self.partitioned_snapshot.get("min_resources", 10000),
+                profile=profile)
+        else:
+            pages = self.subscription_client.get_resources_for_subscription_paginated(
+                subscription_id, self.records_per_page, time_diff_hours, skip_token=skip_token, profile=profile)
+        for page_number, resources_page_data in enumerate(self._pipeline(pages, subscription_id), start=last_page + 1):
+
+            logger.info(f"Fetched resources for subscription ID: {subscription_id} successfully.")
+            self._add_work_item_stats([subscription_id], time_diff_hours is None, pages=1,
+                                      records=len(resources_page_data),
+                                      throttles=getattr(resources_page_data, "throttled", 0))
+
+            if not resources_page_data:
+                logger.warning(f"No resource data found for subscription ID: {subscription_id}. Skipping.")
+                self._record_empty_subscription(subscription_id)
+
+            else:
+                try:
+                    self._write_resource_page(subscription_id, page_number, resources_page_data, resource_store,
+                                              profile)
+
+                except Exception as e:
+                    logger.error(f"Failed to fetch resource data: {str(e)}")
+                    raise RuntimeError(f"Error fetching resource data: {str(e)}") from e
+
+            if self.checkpoint_store is not None:
+                self.checkpoint_store.record_page(subscription_id, page_number, resources_page_data.skip_token)
+
+    def _process_subscription_batch(self, subscription_ids, time_diff_hours, profile=DEFAULT_PROFILE):
+        """
+        Fetch resources for a batch of subscriptions with one Resource Graph query chain, split the rows
+        back out by subscriptionId and store them with the same per-subscription page layout.
+        """
+        logger.info(f"Fetching resources for batch of {len(subscription_ids)} subscriptions: {subscription_ids[0]}...")
+
+        pending_rows = {subscription_id: [] for subscription_id in subscription_ids}
+        page_numbers = {subscription_id: 0 for subscription_id in subscription_ids}
+        record_counts = {subscription_id: 0 for subscription_id in subscription_ids}
+        resource_stores = {subscription_id: self._open_resource_store(subscription_id, time_diff_hours, profile)
+                           for subscription_id in subscription_ids}
+        for subscription_id, resource_store in resource_stores.items():
+            if resource_store is None:
+                self._dated_page_store(subscription_id, profile).start_full_scan()
+
+        def flush(subscription_id, final=False):
+            rows = pending_rows[subscription_id]
+            while len(rows) >= self.records_per_page or (final and rows):
+                page_data, rows = rows[:self.records_per_page], rows[self.records_per_page:]
+                page_numbers[subscription_id] += 1
+                try:
+                    self._write_resource_page(subscription_id, page_numbers[subscription_id], page_data,
+                                              resource_stores[subscription_id], profile)
+                except Exception as e:
+                    logger.error(f"Failed to fetch resource data: {str(e)}")
+                    raise RuntimeError(f"Error fetching resource data: {str(e)}") from e
+            pending_rows[subscription_id] = rows
+
+        pages = self.subscription_client.get_resources_for_subscriptions_paginated(
+            subscription_ids, self.batch_records_per_page, time_diff_hours, profile=profile)
+        throttles = 0
+        for resources_page_data in self._pipeline(pages, subscription_ids[0]):
+            throttles += getattr(resources_page_data, "throttled", 0)
+
+            for row in resources_page_data:
+                subscription_id = row.get("subscriptionId")
+                if subscription_id not in pending_rows:
+                    logger.warning(f"Skipping row for unexpected subscription ID: {subscription_id}.")
+                    continue
+                pending_rows[subscription_id].append(row)
+                record_counts[subscription_id] += 1
+
+            for subscription_id in subscription_ids:
+                flush(subscription_id)
+            if self.checkpoint_store is not None:
+                # Batches record no page progress; keep the leases of their subscriptions
+                self.checkpoint_store.heartbeat()
+
+        for subscription_id in subscription_ids:
+            flush(subscription_id, final=True)
+            self._add_work_item_stats([subscription_id], time_diff_hours is None,
+                                      pages=page_numbers[subscription_id], records=record_counts[subscription_id])
+            self._finish_resource_store(subscription_id, resource_stores[subscription_id], profile)
+            if page_numbers[subscription_id] == 0:
+                logger.warning(f"No resource data found for subscription ID: {subscription_id}. Skipping.")
+                self._record_empty_subscription(subscription_id)
+        # The query chain is shared; its throttles are split by the records each subscription returned
+        self._add_work_item_stats(subscription_ids, time_diff_hours is None, throttles=throttles)
+
+    def _add_work_item_stats(self, subscription_ids, full_scan, **totals):
+        """
+        Add to the run statistics of the subscriptions; totals shared by a batch are split in proportion to
+        the records each subscription returned, evenly while none are known.
+        :param totals: Amounts of the run history statistics, e.g. pages=1, records=250.
+        """
+        with self._lock:
+            entries = [self.run_stats.setdefault(subscription_id, {"full_scan": full_scan, "pages": 0, "records": 0,
+                                                                   "duration_seconds": 0.0, "throttles": 0})
+                       for subscription_id in subscription_ids]
+            records = sum(entry["records"] for entry in entries)
+            for entry in entries:
+                share = entry["records"] / records if records else 1 / len(entries)
+                for name, total in totals.items():
+                    entry[name] += total * share
+
+    def _record_run_history(self, succeeded_subscription_ids):
+        if self.run_history is None:
+            return
+        with self._lock:
+            run_stats = {subscription_id: self.run_stats.pop(subscription_id)
+                         for subscription_id in succeeded_subscription_ids if subscription_id in self.run_stats}
+        self.run_history.record(run_stats, self.empty_resource_subscriptions)
+
+    def _record_empty_subscription(self, subscription_id):
+        # Listed once even when several query profiles come back empty
+        with self._lock:
+            if subscription_id not in self.empty_resource_subscriptions:
+                self.empty_resource_subscriptions.append(subscription_id)
+
+    def _open_resource_store(self, subscription_id, time_diff_hours, profile=DEFAULT_PROFILE):
+        """
+        :return: For the "indexed" storage layout, the subscription's AzureResourceStore on full scans or a
+                 ResourceDeltaApplier over it on change runs. For the "pages" layout, None on full scans, whose
+                 pages are merged in place, or a ResourceDeltaApplier over a DatedPageStore on change runs.
+        """
+        container_name = profile.container_name(self.resource_path_container_name)
+        if self.storage_layout != "indexed":
+            if time_diff_hours is None:
+                return None
+            resource_store = self._dated_page_store(subscription_id, profile)
+        else:
+            resource_store = AzureResourceStore(self.blob_client, container_name, subscription_id,
+                                                shard_size=self.shard_size, full_scan=time_diff_hours is None,
+                                                serializer=self.serializer)
+            if time_diff_hours is None:
+                return resource_store
+        return ResourceDeltaApplier(resource_store, self.subscription_client, subscription_id,
+                                    apply_property_changes=self.delta_apply_property_changes, profile=profile)
+
+    def _finish_resource_store(self, subscription_id, resource_store, profile=DEFAULT_PROFILE):
+        if resource_store is not None:
+            resource_store.finish()
+            return
+        # A completed full scan of the pages layout: the date's pages no longer build on earlier snapshots
+        self._dated_page_store(subscription_id, profile).mark_full_scan()
+
+    def _dated_page_store(self, subscription_id, profile=DEFAULT_PROFILE):
+        return DatedPageStore(self.blob_client, profile.container_name(self.resource_path_container_name),
+                              subscription_id, self.records_per_page, serializer=self.serializer,
+                              date_label=self.date_label)
+
+    @timed("workflow.write_page")
+    def _write_resource_page(self, subscription_id, page_number, resources_page_data, resource_store,
+                             profile=DEFAULT_PROFILE):
+        if resource_store is None:
+            self._store_resource_page(subscription_id, page_number, resources_page_data,
+                                      profile.container_name(self.resource_path_container_name))
+        else:
+            resource_store.add_page(resources_page_data)
+
+    def _store_resource_page(self, subscription_id, page_number, resources_page_data, container_name):
+        # Generate a unique blob name with page number
+        blob_name = generate_filename(f'resource_{subscription_id}', page_number=page_number,
+                                      extension=self.serializer.extension, date_label=self.date_label)
+
+        if self.page_merge == "table":
+            self._store_resource_page_table(subscription_id, page_number, blob_name, resources_page_data,
+                                            container_name)
+            return
+
+        # The existing page is read, merged and written back as one stream, so memory use depends on the
+        # chunk size rather than the page size; a missing page yields no existing resources
+        existing_resources = self.blob_client.iter_blob_records(
+            container_name=container_name,
+            blob_name=blob_name
+        )
+        merged_resources = self.watermark_manager.iter_merged_resources(existing_resources, resources_page_data)
 
-                # Log subscriptions with empty resource responses at the end
-                if self.empty_resource_subscriptions:
-                    logger.info("subscriptions with empty resource responses")
-                    for index, value in enumerate(self.empty_resource_subscriptions, start=1):
-                        logger.info(f"{index}: {value}")
+        formatted_response = {"value": merged_resources}
 
-                # noinspection PyUnresolvedReferences
-                self.fetch_resources_done()
+        # Upload the current page to Blob Storage
+        try:
+            self.blob_client.upload_data_to_blob(
+                container_name=container_name,
+                blob_name=blob_name,
+                json_data=formatted_response,
+                serializer=self.serializer
+            )
+        except Exception as e:
+            raise RuntimeError(f"Error while merging resource data into {blob_name}: {str(e)}") from e
+        logger.info(f"Page {page_number} uploaded successfully for subscription ID {subscription_id}.")
+
+    def _store_resource_page_table(self, subscription_id, page_number, blob_name, resources_page_data, container_name):
+        """
+        Experimental columnar page merge (page_merge "table"): the stored page and the fetched one are loaded
+        as ResourceTables, diffed and merged column-wise, and only rows whose content changed are decoded.
+        """
+        existing_table = ResourceTable.load(self.blob_client, container_name, blob_name)
+        page_table = ResourceTable.from_records(resources_page_data)
+        diff = existing_table.diff(page_table)
+        increment("resource_table.added", len(diff["added"]))
+        increment("resource_table.changed", len(diff["changed"]))
 
-            except Exception as e:
-                raise RuntimeError(f"Error in fetch resources: {str(e)}") from e
+        try:
+            existing_table.merge(page_table).save(self.blob_client, container_name, blob_name,
+                                                  serializer=self.serializer)
+        except Exception as e:
+            raise RuntimeError(f"Error while merging resource data into {blob_name}: {str(e)}") from e
+        logger.info(f"Page {page_number} uploaded successfully for subscription ID {subscription_id}: "
+                    f"{len(diff['added'])} added, {len(diff['changed'])} changed.")
 
+    @timed("workflow.upload_resources")
     @handle_errors
     def on_upload_resources(self):
         # noinspection PyUnresolvedReferences
         self.upload_resources_done()  # Trigger the next state event
 
+    @timed("workflow.compact_resources")
+    @handle_errors
+    def on_compact_resources(self):
+        # Compaction reads the dated pages, so it only applies to the pages layout, and in distributed mode
+        # the workers may still be writing them when the orchestrator gets here
+        if not self.compaction.get("enabled", False) or self.storage_layout != "pages" or self.work_queue is not None:
+            # noinspection PyUnresolvedReferences
+            self.compact_resources_done()
+            return
+
+        logger.info("Compacting resource pages...")
+        subscription_ids = [subscription.get("subscription_id") for subscription in self.subscriptions_data
+                            if subscription.get("subscription_id")]
+        # A run resumed after midnight wrote its pages under the date it started on, which is compacted again
+        today = datetime.strptime(self.date_label, DATE_FORMAT).date()
+        compactors = [
+            SnapshotCompactor(self.blob_client, profile.container_name(self.resource_path_container_name),
+                              serializer=self.serializer,
+                              target_snapshot_bytes=self.compaction.get("target_snapshot_bytes", 64 * 1024 * 1024),
+                              page_retention_days=self.compaction.get("page_retention_days", 2),
+                              snapshot_retention_days=self.compaction.get("snapshot_retention_days", 30))
+            for profile in self.query_profiles
+        ]
+
+        failed_subscriptions = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_subscriptions,
+                                thread_name_prefix="compaction") as executor:
+            futures = {
+                executor.submit(compactor.compact, subscription_id, today): subscription_id
+                for subscription_id in subscription_ids
+                for compactor in compactors
+            }
+            for future in as_completed(futures):
+                subscription_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to compact resources for subscription ID {subscription_id}: {str(e)}")
+                    failed_subscriptions[subscription_id] = str(e)
+
+        if failed_subscriptions:
+            # The pages stay in place, so the next run compacts them again
+            raise RuntimeError(f"Error in compact resources: {len(failed_subscriptions)} subscriptions failed: "
+                               f"{', '.join(failed_subscriptions)}")
+
+        # noinspection PyUnresolvedReferences
+        self.compact_resources_done()
+
     def on_end(self):
+        upload_counts = self.blob_client.upload_counts
+        logger.info(f"Blob uploads: {upload_counts['written']} written, {upload_counts['skipped']} skipped as unchanged.")
         logger.info("Workflow completed successfully!")